@@ -7,7 +7,9 @@ from django.utils.translation import gettext_lazy as _
 
 from calendar import day_name
 
-from dynamic_preferences.types import BooleanPreference, ChoicePreference, StringPreference, Section
+from dynamic_preferences.types import (
+    BooleanPreference, ChoicePreference, StringPreference, IntegerPreference, Section
+)
 from dynamic_preferences.registries import global_preferences_registry
 
 
@@ -76,3 +78,38 @@ class BackupFilePrefix(StringPreference):
     verbose_name = _('Backup File Prefix')
     help_text = _('The date and time of the backup will be appended to this prefix')
     default = 'site_backup_'
+
+
+@global_preferences_registry.register
+class BackupCompression(ChoicePreference):
+    section = backups
+    name = 'compression'
+    choices = [
+        ('gzip', _('gzip')),
+        ('zstd', _('zstd (requires the zstandard package)')),
+    ]
+    verbose_name = _('Backup Compression')
+    default = 'gzip'
+
+
+@global_preferences_registry.register
+class IncrementalBackups(IntegerPreference):
+    section = backups
+    name = 'incrementalBackups'
+    verbose_name = _('Incremental backups between full backups')
+    help_text = _(
+        'Incremental backups only include records that have changed since the ' +
+        'previous backup.  Set to 0 to make every backup a full backup.'
+    )
+    default = 0
+
+
+@global_preferences_registry.register
+class RetainBackups(IntegerPreference):
+    section = backups
+    name = 'retainBackups'
+    verbose_name = _('Number of full backups to keep')
+    help_text = _(
+        'Older backups will be deleted after each backup.  Set to 0 to keep all backups.'
+    )
+    default = 0
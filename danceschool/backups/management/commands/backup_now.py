@@ -1,12 +1,13 @@
 from django.core.management.base import BaseCommand, CommandError
-from django.core.management import call_command
 from django.conf import settings
-from django.utils import timezone
 
 import logging
 import os
 
 from danceschool.core.constants import getConstant
+from danceschool.backups.utils import (
+    create_backup, list_backups, prune_backups, BackupError
+)
 
 # Define logger for this file
 logger = logging.getLogger(__name__)
@@ -15,6 +16,24 @@ logger = logging.getLogger(__name__)
 class Command(BaseCommand):
     help = 'Perform a backup of the site database, using configuration options from site settings.'
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full', action='store_true', dest='full',
+            help='Perform a full backup regardless of the incremental backup setting.',
+        )
+        parser.add_argument(
+            '--incremental', action='store_true', dest='incremental',
+            help='Only back up records that have changed since the most recent backup.',
+        )
+        parser.add_argument(
+            '--compression', choices=['gzip', 'zstd'], dest='compression',
+            help='The compression method to use (defaults to the site setting).',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=1000, dest='batch_size',
+            help='The number of records to read from the database at a time.',
+        )
+
     def handle(self, *args, **options):
         backup_folder = getattr(settings, 'BACKUP_LOCATION', '/backup')
         if not os.path.isdir(backup_folder):
@@ -23,21 +42,44 @@ class Command(BaseCommand):
                 'BACKUP_LOCATION must be updated in project settings.py.'
             )
             return None
-        backup_loc = os.path.join(
-            backup_folder,
-            '%s%s.json' % (
-                getConstant('backups__filePrefix'), timezone.now().strftime('%Y%m%d%H%M%S')
-            )
-        )
 
         if not getConstant('backups__enableDataBackups'):
             logger.info('Aborting backup because backups are not enabled in global settings.')
             return None
 
-        logger.info('Beginning JSON backup to file %s.' % backup_loc)
-        with open(backup_loc, 'w') as f:
-            try:
-                call_command('dumpdata', indent=1, format='json', natural_foreign=True, stdout=f)
-                logger.info('Backup completed.')
-            except CommandError:
-                logger.error('Backup to file %s failed.' % backup_loc)
+        prefix = getConstant('backups__filePrefix')
+
+        # Unless a backup type is specified, the site settings determine how
+        # many incremental backups are made between full backups.
+        incremental = options.get('incremental')
+        if not incremental and not options.get('full'):
+            max_incremental = getConstant('backups__incrementalBackups') or 0
+            since_full = 0
+            for manifest in reversed(list_backups(backup_folder, prefix)):
+                if manifest['type'] == 'full':
+                    break
+                since_full += 1
+            incremental = max_incremental > 0 and since_full < max_incremental
+
+        logger.info('Beginning %s backup to folder %s.' % (
+            'incremental' if incremental else 'full', backup_folder
+        ))
+        try:
+            manifest = create_backup(
+                backup_folder, prefix=prefix, incremental=incremental,
+                compression=options.get('compression') or getConstant('backups__compression'),
+                batch_size=options.get('batch_size'),
+            )
+        except BackupError as e:
+            logger.error('Backup failed: %s' % e)
+            raise CommandError(str(e))
+
+        logger.info('Backup %s completed with %s records.' % (
+            manifest['name'], sum(x['count'] for x in manifest['models'])
+        ))
+
+        removed = prune_backups(
+            backup_folder, prefix, retain=getConstant('backups__retainBackups')
+        )
+        for name in removed:
+            logger.info('Removed old backup %s.' % name)
@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+
+import logging
+
+from danceschool.backups.utils import restore_backup, list_backups, BackupError
+
+# Define logger for this file
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = (
+        'Restore a backup created by backup_now.  Incremental backups are ' +
+        'restored along with the backups on which they are based.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'name', nargs='?',
+            help='The name of the backup to restore (defaults to the most recent backup).',
+        )
+        parser.add_argument(
+            '--folder', dest='folder',
+            help='The folder containing backups (defaults to BACKUP_LOCATION).',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=1000, dest='batch_size',
+            help='The number of records to read from the backup at a time.',
+        )
+
+    def handle(self, *args, **options):
+        backup_folder = options.get('folder') or getattr(settings, 'BACKUP_LOCATION', '/backup')
+        name = options.get('name')
+
+        if not name:
+            backups = list_backups(backup_folder)
+            if not backups:
+                raise CommandError('No backups were found in %s.' % backup_folder)
+            name = backups[-1]['name']
+
+        self.stdout.write('Restoring backup %s.' % name)
+        try:
+            counts = restore_backup(backup_folder, name, batch_size=options.get('batch_size'))
+        except BackupError as e:
+            raise CommandError(str(e))
+
+        for model, count in counts.items():
+            self.stdout.write('%s: %s' % (model, count))
+        self.stdout.write('Restored %s records.' % sum(counts.values()))
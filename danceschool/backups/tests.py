@@ -0,0 +1,117 @@
+from django.core.management import call_command
+from django.utils import timezone
+
+from datetime import timedelta
+from io import StringIO
+import os
+import resource
+import shutil
+import tempfile
+import time
+import tracemalloc
+import unittest
+
+from danceschool.core.models import Customer, Event
+from danceschool.core.utils.tests import DefaultSchoolTestCase
+from .utils import create_backup, list_backups, prune_backups, restore_backup
+
+
+class StreamingBackupTest(DefaultSchoolTestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_backup_and_restore(self):
+        '''
+        Check that a full backup followed by an incremental backup can be
+        restored after the backed up records are changed.
+        '''
+        s = self.create_series()
+        customer = Customer.objects.create(
+            first_name='Frankie', last_name='Manning', email='frankie@example.com'
+        )
+        full = create_backup(self.folder, prefix='test_')
+        self.assertEqual(full['type'], 'full')
+
+        counts = {x['model']: x['count'] for x in full['models']}
+        self.assertEqual(counts['core.customer'], Customer.objects.count())
+        self.assertEqual(counts['core.series'], 1)
+
+        # Only events that have changed are included in an incremental backup.
+        Event.objects.filter(id=s.id).update(
+            capacity=5, modified=timezone.now() + timedelta(minutes=1)
+        )
+        incremental = create_backup(self.folder, prefix='test_', incremental=True)
+        self.assertEqual(incremental['type'], 'incremental')
+        self.assertEqual(incremental['base'], full['name'])
+        counts = {x['model']: x['count'] for x in incremental['models']}
+        self.assertEqual(counts['core.event'], 1)
+
+        customer.delete()
+        Event.objects.filter(id=s.id).update(capacity=None)
+
+        restored = restore_backup(self.folder, incremental['name'])
+        self.assertEqual(restored['core.event'], 2)
+        self.assertTrue(Customer.objects.filter(email='frankie@example.com').exists())
+        self.assertEqual(Event.objects.get(id=s.id).capacity, 5)
+
+    def test_prune_backups(self):
+        create_backup(self.folder, prefix='test_')
+        create_backup(self.folder, prefix='test_', incremental=True)
+        latest = create_backup(self.folder, prefix='test_')
+
+        removed = prune_backups(self.folder, 'test_', retain=1)
+        self.assertEqual(len(removed), 2)
+        self.assertEqual(
+            [x['name'] for x in list_backups(self.folder, 'test_')],
+            [latest['name']]
+        )
+
+    @unittest.skipUnless(
+        os.environ.get('DANCESCHOOL_BENCHMARK'),
+        'Set DANCESCHOOL_BENCHMARK to run backup benchmarks.'
+    )
+    def test_benchmark(self):
+        '''
+        Compare the time and peak memory use of a streaming backup with those
+        of the previous dumpdata backup for a generated set of customers.
+        '''
+        n = int(os.environ.get('DANCESCHOOL_BENCHMARK_SIZE', 50000))
+        Customer.objects.bulk_create([
+            Customer(
+                first_name='First%s' % i, last_name='Last%s' % i,
+                email='customer%s@example.com' % i
+            ) for i in range(n)
+        ], batch_size=1000)
+
+        def measure(func):
+            tracemalloc.start()
+            start = time.perf_counter()
+            func()
+            elapsed = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            return elapsed, peak / 2 ** 20
+
+        def dump():
+            with open(os.path.join(self.folder, 'dump.json'), 'w') as f:
+                call_command(
+                    'dumpdata', indent=1, format='json', natural_foreign=True,
+                    stdout=f
+                )
+
+        results = {
+            'dumpdata': measure(dump),
+            'streaming': measure(lambda: create_backup(self.folder, prefix='bench_')),
+        }
+        out = StringIO()
+        out.write('\nBackup of %s customers:\n' % n)
+        for k, (elapsed, peak) in results.items():
+            out.write('%s: %.2fs, peak allocated %.1f MB\n' % (k, elapsed, peak))
+        out.write('Process peak RSS: %.1f MB\n' % (
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        ))
+        print(out.getvalue())
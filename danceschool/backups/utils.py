@@ -0,0 +1,305 @@
+'''
+This file contains the streaming backup and restore engine.  Each backup is
+a folder containing one compressed JSON Lines file per model and a manifest
+that describes the backup.  Objects are read from the database in chunks and
+written one line at a time, so that the whole database is never held in
+memory at once.
+'''
+from django.apps import apps
+from django.core import serializers
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DEFAULT_DB_ALIAS, connections, router, transaction
+from django.db.models import DateTimeField
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+import gzip
+import json
+import logging
+import os
+import shutil
+from itertools import islice
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# Define logger for this file
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = 'manifest.json'
+MANIFEST_VERSION = 1
+FILE_EXTENSIONS = {
+    'gzip': '.jsonl.gz',
+    'zstd': '.jsonl.zst',
+}
+
+
+class BackupError(Exception):
+    pass
+
+
+def open_backup_file(path, mode, compression):
+    '''
+    Open a compressed JSON Lines file in text mode.
+    '''
+    if compression == 'gzip':
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    elif compression == 'zstd':
+        if not zstandard:
+            raise BackupError(
+                'The zstandard package must be installed to use zstd compression.'
+            )
+        return zstandard.open(path, mode + 't', encoding='utf-8')
+    raise BackupError('Unknown compression method: %s' % compression)
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def get_backup_models(using=DEFAULT_DB_ALIAS):
+    '''
+    Return the models to be backed up, following the same rules as dumpdata.
+    Models are sorted so that dependencies for natural keys are restored
+    first.
+    '''
+    app_list = [
+        (app_config, [
+            m for m in app_config.get_models()
+            if m._meta.managed and not m._meta.proxy and
+            router.allow_migrate_model(using, m)
+        ])
+        for app_config in apps.get_app_configs()
+        if app_config.models_module is not None
+    ]
+    return serializers.sort_dependencies(app_list, allow_cycles=True)
+
+
+def get_modified_field(model):
+    '''
+    Incremental backups are only possible for models with a field that is
+    updated on each save.  Prefer a field named modifiedDate if there is one.
+    '''
+    candidates = [
+        f for f in model._meta.concrete_fields
+        if isinstance(f, DateTimeField) and f.auto_now
+    ]
+    for f in candidates:
+        if f.name == 'modifiedDate':
+            return f.name
+    if candidates:
+        return candidates[0].name
+
+
+def get_model_queryset(model, using=DEFAULT_DB_ALIAS):
+    queryset = model._base_manager.using(using).order_by(model._meta.pk.name)
+
+    # Polymorphic models must be serialized as rows of their own table.
+    if hasattr(queryset, 'non_polymorphic'):
+        queryset = queryset.non_polymorphic()
+    return queryset
+
+
+def read_manifest(path):
+    with open(os.path.join(path, MANIFEST_NAME), 'r') as f:
+        return json.load(f)
+
+
+def list_backups(folder, prefix=''):
+    '''
+    Return the manifests of all completed backups in the passed folder,
+    ordered from oldest to newest.
+    '''
+    manifests = []
+    if not os.path.isdir(folder):
+        return manifests
+    for name in os.listdir(folder):
+        path = os.path.join(folder, name)
+        if (
+            name.startswith(prefix) and
+            os.path.isfile(os.path.join(path, MANIFEST_NAME))
+        ):
+            manifests.append(read_manifest(path))
+    return sorted(manifests, key=lambda x: x['created'])
+
+
+def get_backup_chain(folder, name):
+    '''
+    An incremental backup only contains the objects that changed since the
+    backup on which it is based, so restoring it requires each backup in the
+    chain back to the last full backup.  Returns the manifests oldest first.
+    '''
+    chain = []
+    while name:
+        path = os.path.join(folder, name)
+        if not os.path.isfile(os.path.join(path, MANIFEST_NAME)):
+            raise BackupError('Backup %s was not found in %s.' % (name, folder))
+        manifest = read_manifest(path)
+        chain.insert(0, manifest)
+        name = manifest.get('base')
+    return chain
+
+
+def write_model(model, path, compression, since=None, batch_size=1000, using=DEFAULT_DB_ALIAS):
+    '''
+    Stream all objects of a model (or those modified since the passed time)
+    into a compressed JSON Lines file.  Returns the number of objects written.
+    '''
+    queryset = get_model_queryset(model, using=using)
+    if since:
+        queryset = queryset.filter(**{'%s__gte' % get_modified_field(model): since})
+
+    count = 0
+    with open_backup_file(path, 'w', compression) as f:
+        for chunk in chunked(queryset.iterator(chunk_size=batch_size), batch_size):
+            for obj in serializers.serialize(
+                'python', chunk, use_natural_foreign_keys=True
+            ):
+                f.write(json.dumps(obj, cls=DjangoJSONEncoder) + '\n')
+            count += len(chunk)
+    return count
+
+
+def create_backup(
+    folder, prefix='', incremental=False, compression='gzip', batch_size=1000,
+    using=DEFAULT_DB_ALIAS
+):
+    '''
+    Write a new backup to the passed folder and return its manifest.  If an
+    incremental backup is requested, then models with a modification date
+    field only include the objects changed since the most recent backup.
+    Objects deleted since that backup are not recorded, so a full backup
+    should still be made periodically.
+    '''
+    now = timezone.now()
+    name = '%s%s' % (prefix, now.strftime('%Y%m%d%H%M%S'))
+
+    # Avoid overwriting a backup that was made within the same second.
+    suffix = 1
+    while os.path.exists(os.path.join(folder, name)):
+        name = '%s%s_%s' % (prefix, now.strftime('%Y%m%d%H%M%S'), suffix)
+        suffix += 1
+    path = os.path.join(folder, name)
+    partial_path = path + '.partial'
+
+    base = None
+    if incremental:
+        previous = list_backups(folder, prefix)
+        if previous:
+            base = previous[-1]
+        else:
+            logger.info('No previous backup found, so performing a full backup.')
+
+    base_created = parse_datetime(base['created']) if base else None
+
+    manifest = {
+        'version': MANIFEST_VERSION,
+        'name': name,
+        'created': now.isoformat(),
+        'type': 'incremental' if base else 'full',
+        'base': base['name'] if base else None,
+        'compression': compression,
+        'models': [],
+    }
+
+    if os.path.exists(partial_path):
+        shutil.rmtree(partial_path)
+    os.makedirs(partial_path)
+
+    try:
+        for model in get_backup_models(using=using):
+            since = base_created if get_modified_field(model) else None
+            filename = '%s%s' % (model._meta.label_lower, FILE_EXTENSIONS[compression])
+
+            count = write_model(
+                model, os.path.join(partial_path, filename), compression,
+                since=since, batch_size=batch_size, using=using
+            )
+            manifest['models'].append({
+                'model': model._meta.label_lower,
+                'file': filename,
+                'count': count,
+                'since': since.isoformat() if since else None,
+            })
+            logger.debug('Backed up %s objects of %s.' % (count, model._meta.label))
+
+        with open(os.path.join(partial_path, MANIFEST_NAME), 'w') as f:
+            json.dump(manifest, f, indent=1)
+    except Exception:
+        shutil.rmtree(partial_path, ignore_errors=True)
+        raise
+
+    # Only completed backups are moved into place, so that an interrupted
+    # backup is never used as the base of a later one.
+    os.rename(partial_path, path)
+    return manifest
+
+
+def prune_backups(folder, prefix='', retain=0):
+    '''
+    Keep the most recent full backups (and the incremental backups that
+    depend on them), and remove the rest.  Returns the names of the removed
+    backups.  If retain is zero, then nothing is removed.
+    '''
+    if not retain:
+        return []
+
+    manifests = list_backups(folder, prefix)
+    full = [x for x in manifests if x['type'] == 'full']
+    if len(full) <= retain:
+        return []
+
+    oldest_kept = full[-retain]['created']
+    removed = []
+    for manifest in manifests:
+        if manifest['created'] < oldest_kept:
+            shutil.rmtree(os.path.join(folder, manifest['name']))
+            removed.append(manifest['name'])
+    return removed
+
+
+def restore_backup(folder, name, batch_size=1000, using=DEFAULT_DB_ALIAS):
+    '''
+    Restore the passed backup (along with the backups on which it is based)
+    into the database.  Objects are read and saved in chunks, and existing
+    objects with the same primary key are overwritten.  Returns a dictionary
+    of the number of objects restored for each model.
+    '''
+    chain = get_backup_chain(folder, name)
+    connection = connections[using]
+    counts = {}
+    deferred = []
+    table_names = set()
+
+    with transaction.atomic(using=using):
+        with connection.constraint_checks_disabled():
+            for manifest in chain:
+                path = os.path.join(folder, manifest['name'])
+                for entry in manifest['models']:
+                    with open_backup_file(
+                        os.path.join(path, entry['file']), 'r',
+                        manifest['compression']
+                    ) as f:
+                        for chunk in chunked(f, batch_size):
+                            for obj in serializers.deserialize(
+                                'python', [json.loads(line) for line in chunk],
+                                using=using, ignorenonexistent=True,
+                                handle_forward_references=True,
+                            ):
+                                obj.save(using=using)
+                                if obj.deferred_fields:
+                                    deferred.append(obj)
+                                table_names.add(obj.object._meta.db_table)
+                                counts[entry['model']] = counts.get(entry['model'], 0) + 1
+            for obj in deferred:
+                obj.save_deferred_fields(using=using)
+        connection.check_constraints(table_names=table_names)
+    return counts
@@ -6,13 +6,15 @@ from django.forms import (
     ModelMultipleChoiceField, ModelChoiceField, ChoiceField
 )
 from django.utils.safestring import mark_safe
-from django.urls import reverse
+from django.urls import reverse, path
 from django.utils.translation import gettext, gettext_lazy as _
-from django.template.response import SimpleTemplateResponse
+from django.template.response import SimpleTemplateResponse, TemplateResponse
 from django.contrib.contenttypes.models import ContentType
 from django.http import HttpResponseRedirect
+from django.utils import timezone
 
 from calendar import month_name
+from datetime import timedelta
 from polymorphic.admin import (
     PolymorphicParentModelAdmin, PolymorphicChildModelAdmin,
     PolymorphicChildModelFilter
@@ -28,9 +30,10 @@ from .models import (
     SubstituteTeacher, Registration, EventRegistration, ClassDescription,
     CustomerGroup, Customer, Location, PricingTier, DanceRole, DanceType,
     DanceTypeLevel, EmailTemplate, EventStaffMember, SeriesStaffMember,
-    EventStaffCategory, EventRole, Invoice, InvoiceItem, Room
+    EventStaffCategory, EventRole, Invoice, InvoiceItem, Room, RegistrationProfile
 )
 from .constants import getConstant
+from .profiling import getProfileSummary
 from .forms import LocationWithDataWidget
 from .mixins import ModelTemplateMixin
 
@@ -520,9 +523,9 @@ class RegistrationAdmin(admin.ModelAdmin):
     fields = (
         ('final', 'invoice_expiry'), 'invoice_name', 'invoice_link',
         'total', 'dateTime', 'comments',
-        'howHeardAboutUs', 'submissionUser',
+        'howHeardAboutUs', 'marketingId', 'submissionUser',
     )
-    readonly_fields = ('total', 'invoice_name', 'invoice_link', 'invoice_expiry')
+    readonly_fields = ('total', 'invoice_name', 'invoice_link', 'invoice_expiry', 'marketingId')
 
     def invoice_name(self, obj):
         name = getattr(obj.invoice, 'fullName', _('N/A'))
@@ -542,6 +545,53 @@ class RegistrationAdmin(admin.ModelAdmin):
     invoice_expiry.short_description = _("Expiration Date")
 
 
+@admin.register(RegistrationProfile)
+class RegistrationProfileAdmin(admin.ModelAdmin):
+    '''
+    Profiles are recorded by the RegistrationProfilingMiddleware, so they
+    cannot be added or changed.  The summary view shows percentiles of the
+    recorded times and queries for each step and signal receiver.
+    '''
+    list_display = ['dateTime', 'step', 'method', 'statusCode', 'duration', 'queryCount', 'queryTime']
+    list_filter = ['step', 'dateTime']
+    date_hierarchy = 'dateTime'
+    change_list_template = 'core/admin/registrationprofile_change_list.html'
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def get_urls(self):
+        return [
+            path(
+                'summary/', self.admin_site.admin_view(self.summary_view),
+                name='core_registrationprofile_summary'
+            ),
+        ] + super().get_urls()
+
+    def summary_view(self, request):
+        try:
+            days = int(request.GET.get('days', 7))
+        except ValueError:
+            days = 7
+
+        profiles = RegistrationProfile.objects.filter(
+            dateTime__gte=timezone.now() - timedelta(days=days)
+        )
+        context = dict(
+            self.admin_site.each_context(request),
+            opts=self.model._meta,
+            title=_('Registration profile summary'),
+            days=days,
+            summary=getProfileSummary(profiles),
+        )
+        return TemplateResponse(
+            request, 'core/admin/registrationprofile_summary.html', context
+        )
+
+
 ######################################
 # Miscellaneous Admin classes
 
@@ -626,6 +676,7 @@ class CustomerEventRegistrationInline(admin.StackedInline):
 @admin.register(Customer)
 class CustomerAdmin(admin.ModelAdmin):
     list_display = ('fullName', 'numClassSeries', 'numPublicEvents')
+    list_select_related = ('history', )
     search_fields = ('^first_name', '^last_name', 'email')
     readonly_fields = ('data', 'numClassSeries', 'numPublicEvents')
 
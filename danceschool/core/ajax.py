@@ -11,12 +11,32 @@ from django.db.models.functions import Concat
 from braces.views import PermissionRequiredMixin
 import json
 
+from .invalidation import EVENT, bumpVersions
 from .models import (
     Event, EventOccurrence, SeriesTeacher, EventRegistration, EmailTemplate,
     EventCheckIn
 )
 
 
+def serializeCheckIn(checkin):
+    '''
+    Return the information about a check-in that is passed to the door
+    register, excluding the submission user and JSON data.
+    '''
+    return {
+        'id': checkin.id,
+        'event': checkin.event_id,
+        'occurrence': checkin.occurrence_id,
+        'checkInType': checkin.checkInType,
+        'eventRegistration': checkin.eventRegistration_id,
+        'cancelled': checkin.cancelled,
+        'firstName': checkin.firstName,
+        'lastName': checkin.lastName,
+        'creationDate': checkin.creationDate,
+        'modifiedDate': checkin.modifiedDate,
+    }
+
+
 class UserAccountInfo(View):
     ''' This view just returns the name and email address information for the currently logged in user '''
 
@@ -221,21 +241,7 @@ class ProcessCheckInView(PermissionRequiredMixin, View):
         if requested in ['get', 'get_all']:
             return JsonResponse({
                 'status': 'success',
-                'checkins': [
-                    {
-                        'id': x.id,
-                        'event': x.event.id,
-                        'occurrence': getattr(x.occurrence, 'id', None),
-                        'checkInType': x.checkInType,
-                        'eventRegistration': getattr(x.eventRegistration, 'id', None),
-                        'cancelled': x.cancelled,
-                        'firstName': x.firstName,
-                        'lastName': x.lastName,
-                        'creationDate': x.creationDate,
-                        'modifiedDate': x.modifiedDate,
-                    }
-                    for x in existing_checkins
-                ]
+                'checkins': [serializeCheckIn(x) for x in existing_checkins]
             })
 
         # If we get to here, then this is an update request.
@@ -302,6 +308,10 @@ class ProcessCheckInView(PermissionRequiredMixin, View):
 
         EventCheckIn.objects.bulk_create(new_checkins)
 
+        # Bulk operations do not send signals, so let the door register know
+        # that this event's check-ins have changed.
+        bumpVersions([(EVENT, this_event.id), ])
+
         return JsonResponse({
             'status': 'success',
             'updated': len(existing_checkins),
@@ -7,7 +7,10 @@ from django.utils.translation import gettext_lazy as _
 from dal import autocomplete
 from calendar import month_name
 
-from .models import Customer, StaffMember, Series, PublicEvent, Event, ClassDescription
+from .models import (
+    Customer, StaffMember, Series, PublicEvent, Event, ClassDescription,
+    SearchToken
+)
 
 
 class UserAutoComplete(autocomplete.Select2QuerySetView):
@@ -20,14 +23,7 @@ class UserAutoComplete(autocomplete.Select2QuerySetView):
         qs = User.objects.all()
 
         if self.q:
-            words = self.q.split(' ')
-            lastName = words.pop()
-            firstName = words.pop() if words else lastName
-
-            qs = qs.filter(
-                Q(first_name__istartswith=firstName) | Q(last_name__istartswith=lastName) |
-                Q(email__istartswith=self.q)
-            )
+            qs = SearchToken.objects.search_queryset(qs, self.q)
 
         return qs
 
@@ -45,14 +41,7 @@ class CustomerAutoComplete(autocomplete.Select2QuerySetView):
         qs = Customer.objects.all()
 
         if self.q:
-            words = self.q.split(' ')
-            lastName = words.pop()
-            firstName = words.pop() if words else lastName
-
-            qs = qs.filter(
-                Q(first_name__istartswith=firstName) | Q(last_name__istartswith=lastName) |
-                Q(email__istartswith=self.q)
-            )
+            qs = SearchToken.objects.search_queryset(qs, self.q)
 
         return qs
 
@@ -67,10 +56,7 @@ class ClassDescriptionAutoComplete(autocomplete.Select2QuerySetView):
         qs = ClassDescription.objects.all()
 
         if self.q:
-            qs = qs.filter(
-                Q(title__icontains=self.q) | Q(shortDescription__icontains=self.q) |
-                Q(description__icontains=self.q)
-            )
+            qs = SearchToken.objects.search_queryset(qs, self.q)
 
         return qs
 
@@ -141,14 +127,7 @@ class StaffMemberAutoComplete(autocomplete.Select2QuerySetView):
         qs = StaffMember.objects.all()
 
         if self.q:
-            words = self.q.split(' ')
-            lastName = words.pop()
-            firstName = words.pop() if words else lastName
-
-            qs = qs.filter(
-                Q(firstName__istartswith=firstName) | Q(lastName__istartswith=lastName) |
-                Q(publicEmail__istartswith=self.q)
-            )
+            qs = SearchToken.objects.search_queryset(qs, self.q)
 
         return qs
 
@@ -0,0 +1,737 @@
+'''
+Tools for measuring the performance of the most frequently used parts of the
+project against a large, synthetic school.
+
+generateSchool() populates the database with a deterministic set of series,
+customers, registrations, invoices, vouchers, discounts and expense rules.
+Because it changes site preferences and creates a large number of records,
+it should only ever be run against a dedicated benchmark database.
+
+runBenchmarks() then times each registered operation and counts the queries
+that it issues, and compareResults() compares a set of results with a stored
+baseline so that regressions can be identified.  The baseline that is stored
+in BENCHMARK_BASELINE was recorded against a school generated with the
+default parameters of generate_benchmark_school, using SQLite.  Times depend
+upon the machine, so the query counts and response statuses are the most
+useful part of the comparison; to record a new baseline, pass the stored
+file as the --output of run_benchmarks.
+'''
+from django.apps import apps
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.test import Client, RequestFactory, override_settings
+from django.conf import settings
+from django.urls import reverse
+from django.utils import timezone
+
+from collections import OrderedDict
+from dynamic_preferences.registries import global_preferences_registry
+from datetime import timedelta
+import json
+import logging
+import os
+import random
+import statistics
+import time
+import uuid
+
+from .constants import getConstant, updateConstant
+from .profiling import profileRequest
+from .models import (
+    DanceRole, DanceType, DanceTypeLevel, ClassDescription, PricingTier,
+    Location, StaffMember, Instructor, Event, Series, EventStaffMember,
+    EventOccurrence, Customer, CustomerHistory, Invoice, InvoiceItem,
+    Registration, EventRegistration, SearchToken
+)
+from .staff_stats import invalidateStaffStats
+from .utils.timezone import ensure_localtime
+
+
+# Define logger for this file
+logger = logging.getLogger(__name__)
+
+BENCHMARK_USERNAME = 'benchmark'
+
+# The stored results with which run_benchmarks compares by default.
+BENCHMARK_BASELINE = os.path.join(os.path.dirname(__file__), 'benchmark_baseline.json')
+
+# The registered benchmark operations, in the order in which they are run.
+BENCHMARK_OPERATIONS = OrderedDict()
+
+# The number of events listed by the event listing operations.  Generate a
+# school with at least this many series (e.g. --series-per-month=28) for a
+# full-sized listing.
+EVENT_LISTING_SIZE = 1000
+
+
+def generateSchool(
+    seed=0, years=3, customers=20000, seriesPerMonth=10, occurrences=4,
+    registrationsPerCustomer=3, instructors=12, vouchers=500, discounts=20,
+    batch_size=1000
+):
+    '''
+    Create a synthetic school with the passed number of years of monthly
+    class series, ending with the series that start next month.  Records are
+    generated from a seeded random number generator, so that the same
+    parameters always produce the same school relative to the current month.
+    Returns a dictionary with the number of records of each type created.
+    '''
+    rng = random.Random(seed)
+    summary = OrderedDict()
+
+    # Registration records are created in bulk, so enable the automatic
+    # processes that would otherwise have been triggered by each save().
+    updateConstant('general__enableCronTasks', True)
+    updateConstant('registration__deleteExpiredInvoices', True)
+
+    roles = [
+        DanceRole.objects.get_or_create(name=name, defaults={'order': i})[0]
+        for i, name in enumerate(['Lead', 'Follow'], start=1)
+    ]
+    danceType = DanceType.objects.get_or_create(name='Lindy Hop', defaults={'order': 1})[0]
+    danceType.roles.add(*roles)
+
+    levels = [
+        DanceTypeLevel.objects.get_or_create(
+            name='Level %s' % i, danceType=danceType, defaults={'order': i}
+        )[0] for i in range(1, 5)
+    ]
+    descriptions = [
+        ClassDescription.objects.get_or_create(
+            slug='benchmark-level-%s-%s' % (i, j), defaults={
+                'title': 'Benchmark Level %s Class %s' % (i, j),
+                'description': 'A generated class.', 'danceTypeLevel': level,
+            }
+        )[0] for i, level in enumerate(levels, start=1) for j in range(1, 4)
+    ]
+    pricingTiers = [
+        PricingTier.objects.get_or_create(name=name, defaults={
+            'onlinePrice': price, 'doorPrice': price + 10, 'dropinPrice': 15,
+        })[0] for name, price in [
+            ('Benchmark Regular', 60), ('Benchmark Intensive', 90), ('Benchmark Short', 40)
+        ]
+    ]
+    locations = [
+        Location.objects.get_or_create(name='Benchmark Location %s' % i, defaults={
+            'status': Location.StatusChoices.active, 'address': '%s Main Street' % i,
+            'city': 'Boston', 'state': 'MA', 'zip': '02114', 'defaultCapacity': 50,
+        })[0] for i in range(1, 4)
+    ]
+    staff = []
+    for i in range(1, instructors + 1):
+        staffMember = StaffMember.objects.get_or_create(
+            firstName='Instructor', lastName='Number %s' % i, defaults={
+                'publicEmail': 'instructor%s@example.com' % i,
+                'privateEmail': 'instructor%s@example.com' % i,
+            }
+        )[0]
+        Instructor.objects.get_or_create(
+            staffMember=staffMember, defaults={'status': Instructor.InstructorStatus.roster}
+        )
+        staff.append(staffMember)
+
+    # Create the class series one month at a time.
+    staffCategory = getConstant('general__eventStaffCategoryInstructor')
+    currentMonth = ensure_localtime(timezone.now()).replace(
+        day=1, hour=0, minute=0, second=0, microsecond=0
+    )
+    months = []
+    for i in range(12 * years - 1, -2, -1):
+        year, month = divmod(currentMonth.year * 12 + currentMonth.month - 1 - i, 12)
+        months.append(currentMonth.replace(year=year, month=month + 1))
+
+    seriesByMonth = []
+    for monthStart in months:
+        monthSeries = []
+        for j in range(seriesPerMonth):
+            startTime = monthStart + timedelta(days=j % 7, hours=18 + j % 3)
+            s = Series(
+                classDescription=rng.choice(descriptions),
+                pricingTier=rng.choice(pricingTiers),
+                location=rng.choice(locations),
+                status=Event.RegStatus.enabled,
+            )
+            s.save()
+            EventOccurrence.objects.bulk_create([
+                EventOccurrence(
+                    event=s, startTime=startTime + timedelta(weeks=k),
+                    endTime=startTime + timedelta(weeks=k, hours=1)
+                ) for k in range(occurrences)
+            ])
+            for staffMember in rng.sample(staff, 2):
+                esm = EventStaffMember.objects.create(
+                    event=s, category=staffCategory, staffMember=staffMember,
+                )
+                esm.occurrences.set(s.eventoccurrence_set.all())
+            s.save()
+            monthSeries.append(s)
+        seriesByMonth.append(monthSeries)
+    summary['series'] = sum(len(x) for x in seriesByMonth)
+
+    # Create customers.  Customer activity is skewed, so that a small number
+    # of regular customers account for many registrations.
+    firstCustomer = Customer.objects.count()
+    Customer.objects.bulk_create([
+        Customer(
+            first_name='Student%s' % (firstCustomer + i),
+            last_name=rng.choice(['Manning', 'Miller', 'Minns', 'Powers', 'Lee']),
+            email='student%s@example.com' % (firstCustomer + i),
+        ) for i in range(customers)
+    ], batch_size=batch_size)
+    customerList = list(Customer.objects.order_by('id')[firstCustomer:])
+    summary['customers'] = len(customerList)
+    SearchToken.objects.index(customerList, batch_size=batch_size)
+
+    # Create registrations for each month.  Each registration includes one or
+    # two of that month's series, and a small share of registrations were
+    # never completed, so that their invoices have expired.
+    voucherList = []
+    if apps.is_installed('danceschool.vouchers') and vouchers:
+        voucherList = createVouchers(rng, vouchers, batch_size=batch_size)
+    summary['vouchers'] = len(voucherList)
+
+    perMonth = max(1, (customers * registrationsPerCustomer) // len(months))
+    counts = {'registrations': 0, 'eventRegistrations': 0, 'voucherUses': 0}
+    for monthSeries in seriesByMonth:
+        rows = []
+        for j in range(perMonth):
+            customer = customerList[int(len(customerList) * rng.random() ** 2)]
+            eventList = rng.sample(monthSeries, rng.choice([1, 1, 1, 2]))
+            firstStart = min(x.startTime for x in eventList)
+            rows.append({
+                'customer': customer,
+                'events': eventList,
+                'dateTime': firstStart - timedelta(
+                    days=rng.randint(0, 30), minutes=rng.randint(0, 1440)
+                ),
+                'final': rng.random() > 0.02,
+                'marketingId': rng.choice(
+                    [None] * 9 + ['campaign%s' % rng.randint(1, 5)]
+                ),
+                'role': rng.choice(roles),
+                'voucher': (
+                    rng.choice(voucherList) if voucherList and rng.random() < 0.05
+                    else None
+                ),
+            })
+        for k in range(0, len(rows), batch_size):
+            for key, value in createRegistrations(rows[k:k + batch_size]).items():
+                counts[key] += value
+    summary.update(counts)
+
+    if apps.is_installed('danceschool.discounts') and discounts:
+        summary['discounts'] = createDiscounts(rng, discounts, pricingTiers, levels)
+    if apps.is_installed('danceschool.financial'):
+        summary['expenseRules'] = createExpenseRules(staff, locations)
+
+    CustomerHistory.objects.refresh(batch_size=batch_size)
+    Event.objects.updateRegistrationStatus()
+    return summary
+
+
+def createRegistrations(rows):
+    '''
+    Create invoices, registrations, invoice items, and event registrations
+    in bulk for the passed list of rows produced by generateSchool().
+    '''
+    invoices = []
+    items = []
+    eventRegs = []
+    voucherUses = []
+
+    for row in rows:
+        invoice = Invoice(
+            id=uuid.uuid4(),
+            firstName=row['customer'].first_name,
+            lastName=row['customer'].last_name,
+            email=row['customer'].email,
+            status=(
+                Invoice.PaymentStatus.paid if row['final']
+                else Invoice.PaymentStatus.preliminary
+            ),
+            expirationDate=(
+                None if row['final'] else row['dateTime'] + timedelta(minutes=15)
+            ),
+        )
+        discount = 10 if row['voucher'] else 0
+        for event in row['events']:
+            price = event.pricingTier.onlinePrice
+            item = InvoiceItem(
+                id=uuid.uuid4(), invoice=invoice, description=event.name,
+                grossTotal=price, total=price - discount,
+            )
+            invoice.grossTotal += item.grossTotal
+            invoice.total += item.total
+            discount = 0
+            items.append(item)
+            eventRegs.append((invoice.id, EventRegistration(
+                invoiceItem=item, event=event, customer=row['customer'],
+                role=row['role'],
+            )))
+        if row['final']:
+            invoice.amountPaid = invoice.total
+        if row['voucher']:
+            voucherUses.append((invoice, row['voucher']))
+        invoices.append((invoice, row))
+
+    Invoice.objects.bulk_create([x[0] for x in invoices])
+    Registration.objects.bulk_create([
+        Registration(
+            invoice=invoice, dateTime=row['dateTime'], final=row['final'],
+            marketingId=row['marketingId'],
+            data={'marketing_id': row['marketingId']} if row['marketingId'] else {},
+        ) for invoice, row in invoices
+    ])
+    registrationIds = dict(Registration.objects.filter(
+        invoice__in=[x[0].id for x in invoices]
+    ).values_list('invoice_id', 'id'))
+
+    InvoiceItem.objects.bulk_create(items)
+    for invoiceId, er in eventRegs:
+        er.registration_id = registrationIds[invoiceId]
+    EventRegistration.objects.bulk_create([x[1] for x in eventRegs])
+
+    if voucherUses:
+        from danceschool.vouchers.models import VoucherUse
+        VoucherUse.objects.bulk_create([
+            VoucherUse(voucher=voucher, invoice=invoice, amount=10, applied=True)
+            for invoice, voucher in voucherUses
+        ])
+
+    return {
+        'registrations': len(invoices), 'eventRegistrations': len(eventRegs),
+        'voucherUses': len(voucherUses),
+    }
+
+
+def createVouchers(rng, number, batch_size=1000):
+    from danceschool.vouchers.models import Voucher, VoucherCategory
+
+    category = VoucherCategory.objects.get_or_create(name='Benchmark vouchers')[0]
+    Voucher.objects.bulk_create([
+        Voucher(
+            voucherId='BENCH%s-%s' % (rng.randint(1000, 9999), i),
+            name='Benchmark voucher %s' % i, category=category,
+            originalAmount=rng.choice([25, 50, 100]), maxAmountPerUse=10,
+            singleUse=(i % 2 == 0),
+        ) for i in range(number)
+    ], batch_size=batch_size)
+    return list(Voucher.objects.filter(category=category))
+
+
+def createDiscounts(rng, number, pricingTiers, levels):
+    from danceschool.discounts.models import (
+        PointGroup, PricingTierGroup, DiscountCategory, DiscountCombo,
+        DiscountComboComponent
+    )
+
+    updateConstant('general__discountsEnabled', True)
+    group = PointGroup.objects.get_or_create(name='Benchmark class hours')[0]
+    for tier in pricingTiers:
+        PricingTierGroup.objects.get_or_create(
+            pricingTier=tier, defaults={'group': group, 'points': 4}
+        )
+    categories = list(DiscountCategory.objects.all()) or [
+        DiscountCategory.objects.get_or_create(
+            name='Benchmark discounts', defaults={'order': 1}
+        )[0]
+    ]
+
+    for i in range(number):
+        combo = DiscountCombo.objects.create(
+            name='Benchmark discount %s' % i,
+            category=rng.choice(categories),
+            discountType=rng.choice([
+                DiscountCombo.DiscountType.flatPrice,
+                DiscountCombo.DiscountType.dollarDiscount,
+                DiscountCombo.DiscountType.percentDiscount,
+            ]),
+            onlinePrice=rng.randint(80, 150), doorPrice=rng.randint(90, 160),
+            dollarDiscount=rng.choice([5, 10, 20]),
+            percentDiscount=rng.choice([10, 15, 25]),
+            active=True,
+        )
+        DiscountComboComponent.objects.create(
+            discountCombo=combo, pointGroup=group, quantity=rng.choice([4, 8, 12]),
+            allWithinPointGroup=rng.random() < 0.2,
+            level=rng.choice([None, None] + levels),
+        )
+    return number
+
+
+def createExpenseRules(staff, locations):
+    from danceschool.financial.models import (
+        ExpenseCategory, GenericRepeatedExpense, LocationRentalInfo,
+        StaffMemberWageInfo, RepeatedExpenseRule, TransactionParty
+    )
+
+    for constant in [
+        'financial__autoGenerateExpensesEventStaff',
+        'financial__autoGenerateExpensesVenueRental',
+        'financial__autoGenerateRevenueRegistrations',
+    ]:
+        updateConstant(constant, True)
+
+    for staffMember in staff:
+        StaffMemberWageInfo.objects.get_or_create(
+            staffMember=staffMember, category=None, defaults={'rentalRate': 30}
+        )
+        # Staff members are paid through their transaction party, which is
+        # otherwise only created when their first expense is generated.
+        TransactionParty.objects.get_or_create(
+            staffMember=staffMember, defaults={
+                'name': staffMember.fullName,
+                'user': getattr(staffMember, 'userAccount', None),
+            }
+        )
+    for location in locations:
+        LocationRentalInfo.objects.get_or_create(
+            location=location, defaults={
+                'rentalRate': 40,
+                'applyRateRule': RepeatedExpenseRule.RateRuleChoices.daily,
+            }
+        )
+    GenericRepeatedExpense.objects.get_or_create(
+        name='Benchmark studio overhead', defaults={
+            'rentalRate': 500,
+            'applyRateRule': RepeatedExpenseRule.RateRuleChoices.monthly,
+            'category': ExpenseCategory.objects.get_or_create(
+                name='Benchmark overhead', defaults={'defaultRate': 0}
+            )[0],
+        }
+    )
+    return RepeatedExpenseRule.objects.count()
+
+
+def benchmarkOperation(name, requires=None, inputs=None):
+    '''
+    Register the decorated function as a benchmark operation.  The function
+    is passed a logged in test client and the dictionary returned by
+    getBenchmarkInputs(), and it may return a response whose status code is
+    recorded with the results.  Operations that require an app that is not
+    installed, or any of the listed inputs that the school does not provide
+    (e.g. a series that is open for registration), are skipped.
+    '''
+    def decorator(func):
+        func.requires = requires
+        func.inputs = inputs or []
+        BENCHMARK_OPERATIONS[name] = func
+        return func
+    return decorator
+
+
+def getBenchmarkInputs():
+    '''
+    Choose the series, registrations and dates that benchmark operations use,
+    so that each run of an operation does the same work.
+    '''
+    inputs = {}
+    openSeries = Series.objects.filter(registrationOpen=True).order_by('startTime')
+    inputs['series'] = openSeries.first()
+    if inputs['series']:
+        inputs['role'] = inputs['series'].classDescription.danceTypeLevel.danceType.roles.first()
+
+    inputs['staffMember'] = StaffMember.objects.filter(
+        eventstaffmember__isnull=False
+    ).order_by('id').first()
+
+    inputs['registration'] = Registration.objects.filter(
+        final=True, eventregistration__isnull=False
+    ).order_by('-dateTime').first()
+
+    occurrence = EventOccurrence.objects.filter(
+        startTime__lte=timezone.now(),
+        event__eventregistration__isnull=False,
+    ).order_by('-startTime').first()
+    inputs['doorDate'] = (
+        ensure_localtime(occurrence.startTime).strftime('%Y-%m-%d') if occurrence else None
+    )
+    return inputs
+
+
+@benchmarkOperation('registration_page')
+def registrationPage(client, inputs):
+    return client.get(reverse('registration'))
+
+
+@benchmarkOperation('checkout', inputs=['series', 'role'])
+def checkout(client, inputs):
+    ''' Select a series, enter student information, and view the summary. '''
+    s = inputs['series']
+    response = client.post(reverse('registration'), {
+        'series_%s_role_%s' % (s.id, inputs['role'].id): [1, ]
+    })
+    if response.status_code != 302:
+        return response
+    response = client.post(reverse('getStudentInfo'), {
+        'firstName': 'Benchmark', 'lastName': 'Customer',
+        'email': 'benchmark@example.com', 'agreeToPolicies': True,
+    })
+    if response.status_code != 302:
+        return response
+    return client.get(reverse('showRegSummary'))
+
+
+@benchmarkOperation(
+    'discount_evaluation', requires='danceschool.discounts', inputs=['registration']
+)
+def discountEvaluation(client, inputs):
+    from danceschool.discounts.helpers import getApplicableDiscountCombos
+
+    reg = inputs['registration']
+    eventRegs = reg.eventregistration_set.select_related('customer')
+    combos = getApplicableDiscountCombos(
+        eventRegs, newCustomer=False, customer=eventRegs[0].customer,
+        dateTime=reg.dateTime
+    )
+    return [x.code for x in combos]
+
+
+@benchmarkOperation('autocomplete_customer')
+def autocompleteCustomer(client, inputs):
+    ''' Type a customer's name one letter at a time, as in the admin. '''
+    for k in range(1, len('student1 mi') + 1):
+        response = client.get(reverse('autocompleteCustomer'), {'q': 'student1 mi'[:k]})
+    return response
+
+
+@benchmarkOperation('autocomplete_customer_email')
+def autocompleteCustomerEmail(client, inputs):
+    return client.get(reverse('autocompleteCustomer'), {'q': 'student42@'})
+
+
+@benchmarkOperation('autocomplete_staffmember')
+def autocompleteStaffMember(client, inputs):
+    return client.get(reverse('autocompleteStaffMember'), {'q': 'instructor num'})
+
+
+def getStaffMemberNameKwargs(staffMember):
+    return {
+        'first_name': (staffMember.firstName or '_').replace('-', '_').replace(' ', '+'),
+        'last_name': (staffMember.lastName or '_').replace('-', '_').replace(' ', '+'),
+    }
+
+
+@benchmarkOperation('instructor_stats', inputs=['staffMember'])
+def instructorStats(client, inputs):
+    ''' View an instructor's stats with nothing cached. '''
+    invalidateStaffStats([inputs['staffMember'].id])
+    return client.get(reverse(
+        'staffMemberStats', kwargs=getStaffMemberNameKwargs(inputs['staffMember'])
+    ))
+
+
+@benchmarkOperation(
+    'staff_member_payments', requires='danceschool.financial', inputs=['staffMember']
+)
+def staffMemberPayments(client, inputs):
+    invalidateStaffStats([inputs['staffMember'].id])
+    kwargs = getStaffMemberNameKwargs(inputs['staffMember'])
+    kwargs['year'] = 'all'
+    return client.get(reverse('staffMemberPayments', kwargs=kwargs))
+
+
+def listEvents(queryset):
+    ''' Access the properties that event listing templates commonly use. '''
+    return [
+        (x.name, x.url, x.displayColor, x.location, x.organizer)
+        for x in queryset.order_by('-startTime')[:EVENT_LISTING_SIZE]
+    ]
+
+
+@benchmarkOperation('event_listing_polymorphic')
+def eventListingPolymorphic(client, inputs):
+    return listEvents(Event.objects.all())
+
+
+@benchmarkOperation('event_listing')
+def eventListing(client, inputs):
+    return listEvents(Event.objects.listing())
+
+
+@benchmarkOperation('door_checkin_json', inputs=['doorDate'])
+def doorCheckIn(client, inputs):
+    return client.post(
+        reverse('viewregistrations_json'), json.dumps({'date': inputs['doorDate']}),
+        content_type='application/json'
+    )
+
+
+def getStaffRequest(inputs):
+    '''
+    The stats views are attached to a CMS page rather than to a URL pattern,
+    so they are called directly with a request for the benchmark user.
+    '''
+    request = RequestFactory().get('/')
+    request.user = inputs['user']
+    return request
+
+
+@benchmarkOperation('stats_monthly_performance', requires='danceschool.stats')
+def statsMonthlyPerformance(client, inputs):
+    from danceschool.stats.stats import MonthlyPerformanceJSON
+    return MonthlyPerformanceJSON(getStaffRequest(inputs))
+
+
+@benchmarkOperation('stats_class_count_histogram', requires='danceschool.stats')
+def statsClassCountHistogram(client, inputs):
+    from danceschool.stats.stats import ClassCountHistogramJSON
+    return ClassCountHistogramJSON(getStaffRequest(inputs))
+
+
+@benchmarkOperation('stats_averages_by_class_type', requires='danceschool.stats')
+def statsAveragesByClassType(client, inputs):
+    from danceschool.stats.stats import AveragesByClassTypeJSON
+    return AveragesByClassTypeJSON(getStaffRequest(inputs))
+
+
+@benchmarkOperation('stats_best_customers', requires='danceschool.stats')
+def statsBestCustomers(client, inputs):
+    from danceschool.stats.stats import getBestCustomersJSON
+    return getBestCustomersJSON(getStaffRequest(inputs))
+
+
+@benchmarkOperation('finances_by_month', requires='danceschool.financial')
+def financesByMonth(client, inputs):
+    return client.get(reverse('financesByMonth'))
+
+
+@benchmarkOperation('finances_by_event', requires='danceschool.financial')
+def financesByEvent(client, inputs):
+    return client.get(reverse('financesByEvent'))
+
+
+@benchmarkOperation('task_update_registration_status')
+def taskUpdateRegistrationStatus(client, inputs):
+    from .tasks import updateSeriesRegistrationStatus
+    updateSeriesRegistrationStatus.call_local()
+
+
+@benchmarkOperation('task_clear_expired_invoices')
+def taskClearExpiredInvoices(client, inputs):
+    from .tasks import clearExpiredInvoices
+    clearExpiredInvoices.call_local()
+
+
+@benchmarkOperation('task_update_financial_items', requires='danceschool.financial')
+def taskUpdateFinancialItems(client, inputs):
+    from danceschool.financial.helpers import createRevenueItemsForRegistrations
+    from danceschool.financial.tasks import generateExpenses
+
+    # Run each rule here rather than queueing separate tasks, so that the
+    # work of every rule is timed.
+    generateExpenses(parallel=False)
+    createRevenueItemsForRegistrations()
+
+
+def getBenchmarkUser():
+    user = User.objects.filter(username=BENCHMARK_USERNAME).first()
+    if not user:
+        user = User.objects.create_superuser(
+            BENCHMARK_USERNAME, 'benchmark@example.com', None,
+            first_name='Benchmark', last_name='User',
+        )
+    return user
+
+
+def runBenchmarks(names=None, repeat=5):
+    '''
+    Run each benchmark operation (or those listed in names) once to warm up
+    caches and then the passed number of times, and return a dictionary of
+    results.  Each run takes place in a transaction that is rolled back, so
+    that every run does the same work and the database is left unchanged.
+    Operations that cannot be run against this school are listed as skipped.
+    '''
+    if repeat < 1:
+        raise ValueError('Each operation must be timed at least once.')
+
+    results = OrderedDict([
+        ('created', timezone.now().isoformat()),
+        ('database', connection.vendor),
+        ('records', OrderedDict([
+            ('customers', Customer.objects.count()),
+            ('series', Series.objects.count()),
+            ('registrations', Registration.objects.count()),
+            ('eventRegistrations', EventRegistration.objects.count()),
+        ])),
+        ('operations', OrderedDict()),
+        ('skipped', []),
+    ])
+
+    with override_settings(ALLOWED_HOSTS=list(settings.ALLOWED_HOSTS) + ['testserver']):
+        # Create any preferences that have not yet been saved, so that default
+        # values are not created in a transaction that is rolled back while
+        # they remain in the cache.
+        global_preferences_registry.manager().load_from_db()
+
+        inputs = getBenchmarkInputs()
+        inputs['user'] = getBenchmarkUser()
+        client = Client()
+        client.force_login(inputs['user'])
+
+        for name, func in BENCHMARK_OPERATIONS.items():
+            if names and name not in names:
+                continue
+            if func.requires and not apps.is_installed(func.requires):
+                continue
+            missing = [x for x in func.inputs if inputs.get(x) is None]
+            if missing:
+                logger.warning('Skipping benchmark %s: no %s available.' % (
+                    name, ', '.join(missing)
+                ))
+                results['skipped'].append(name)
+                continue
+
+            timings = []
+            for i in range(repeat + 1):
+                with transaction.atomic():
+                    with profileRequest(name) as profile:
+                        start = time.perf_counter()
+                        response = func(client, inputs)
+                        elapsed = time.perf_counter() - start
+                    transaction.set_rollback(True)
+                if i > 0:
+                    timings.append(elapsed)
+
+            results['operations'][name] = OrderedDict([
+                ('median', statistics.median(timings)),
+                ('min', min(timings)),
+                ('max', max(timings)),
+                ('queries', profile.queryCount),
+                ('queryTime', profile.queryTime),
+                ('status', getattr(response, 'status_code', None)),
+            ])
+            logger.info('Benchmark %s: %.4fs, %s queries' % (
+                name, results['operations'][name]['median'], profile.queryCount
+            ))
+    return results
+
+
+def compareResults(results, baseline, threshold=0.2):
+    '''
+    Compare benchmark results with a baseline, and return a list of
+    dictionaries describing each operation whose median time has increased
+    by more than the passed fraction, or whose query count or response status
+    has changed for the worse.
+    '''
+    regressions = []
+    for name, current in results['operations'].items():
+        previous = baseline.get('operations', {}).get(name)
+        if not previous:
+            continue
+        if current['median'] > previous['median'] * (1 + threshold):
+            regressions.append({
+                'operation': name, 'metric': 'median',
+                'baseline': previous['median'], 'current': current['median'],
+            })
+        if current['queries'] > previous['queries']:
+            regressions.append({
+                'operation': name, 'metric': 'queries',
+                'baseline': previous['queries'], 'current': current['queries'],
+            })
+        if current['status'] != previous['status']:
+            regressions.append({
+                'operation': name, 'metric': 'status',
+                'baseline': previous['status'], 'current': current['status'],
+            })
+    return regressions
@@ -201,7 +201,7 @@ class ClassRegistrationView(FinancialContextMixin, EventOrderMixin, SiteHistoryM
         reg.data = non_event_listing or {}
 
         if regSession.get('marketing_id'):
-            reg.data.update({'marketing_id': regSession.pop('marketing_id', None)})
+            reg.marketingId = regSession.pop('marketing_id', None)
 
         # Reset the list of event registrations (if it's not empty) and build it
         # from the form submission data.
@@ -326,7 +326,7 @@ class ClassRegistrationView(FinancialContextMixin, EventOrderMixin, SiteHistoryM
                 )
 
             # Get the Event listing here to avoid duplicate queries
-            self.allEvents = Event.objects.filter(
+            self.allEvents = Event.objects.listing().filter(
                 **timeFilters
             ).filter(
                 Q(instance_of=PublicEvent) |
@@ -876,6 +876,8 @@ class AjaxClassRegistrationView(PermissionRequiredMixin, RegistrationAdjustments
             for key in reg_nullable_keys + reg_bool_keys:
                 if post_data.get(key, None):
                     setattr(reg, key, post_data[key])
+            if not reg.marketingId:
+                reg.marketingId = invoice.data.get('marketing_id', None)
         except ObjectDoesNotExist:
             # Pass the POST and specify defaults.
             reg_defaults = {key: post_data.get(key, None) for key in reg_nullable_keys}
@@ -886,6 +888,7 @@ class AjaxClassRegistrationView(PermissionRequiredMixin, RegistrationAdjustments
                 'submissionUser': invoice.submissionUser,
                 'dateTime': timezone.now(),
                 'comments': post_data.get('comments', ''),
+                'marketingId': invoice.data.get('marketing_id', None),
                 'data': {},
                 'final': False,
             })
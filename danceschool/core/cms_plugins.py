@@ -1,5 +1,4 @@
 from django.utils.translation import gettext_lazy as _
-from django.utils import timezone
 from django.middleware.csrf import get_token
 
 
@@ -8,28 +7,33 @@ from cms.plugin_pool import plugin_pool
 from cms.models.pluginmodel import CMSPlugin
 
 from datetime import datetime, timedelta
+import random
 
 from .models import (
     StaffMemberListPluginModel, LocationPluginModel, LocationListPluginModel,
     EventListPluginModel, StaffMember, Instructor, Event, Series, PublicEvent,
     Location
 )
+from .invalidation import GLOBAL, LOCATION, STAFF
 from .mixins import PluginTemplateMixin
+from .plugin_cache import PluginCacheMixin, prefetchEventListData
 from .registries import plugin_templates_registry, PluginTemplateBase
 from .forms import CreateInvoiceForm
 
 
-class StaffMemberListPlugin(PluginTemplateMixin, CMSPluginBase):
+class StaffMemberListPlugin(PluginCacheMixin, PluginTemplateMixin, CMSPluginBase):
     model = StaffMemberListPluginModel
     name = _('Set of Staff Images or Bios')
     render_template = 'core/staff_image_set.html'
     cache = True
     module = _('Staff')
+    cache_scopes = [GLOBAL, STAFF]
 
-    def render(self, context, instance, placeholder):
-        context = super().render(context, instance, placeholder)
+    def isTimeRelative(self, instance):
+        return instance.activeUpcomingOnly
 
-        listing = StaffMember.objects.all()
+    def get_listing(self, instance, now):
+        listing = StaffMember.objects.select_related('instructor')
 
         if instance.statusChoices:
             listing = listing.filter(instructor__status__in=list(instance.statusChoices))
@@ -46,16 +50,24 @@ class StaffMemberListPlugin(PluginTemplateMixin, CMSPluginBase):
             listing = listing.filter(bio__isnull=False).exclude(bio__exact='')
 
         if instance.activeUpcomingOnly:
-            listing = listing.filter(eventstaffmember__event__endTime__gte=timezone.now()).distinct()
+            listing = listing.filter(eventstaffmember__event__endTime__gte=now).distinct()
 
         if instance.orderChoice == 'firstName':
             listing = listing.order_by('firstName', 'lastName')
         elif instance.orderChoice == 'status':
             listing = listing.order_by('status', 'lastName', 'firstName')
-        elif instance.orderChoice == 'random':
-            listing = listing.order_by('?')
         else:
             listing = listing.order_by('lastName', 'firstName')
+        return list(listing)
+
+    def render(self, context, instance, placeholder):
+        context = super().render(context, instance, placeholder)
+
+        listing = self.get_cached_listing(instance)
+
+        # Random ordering is applied to the cached listing on each request.
+        if instance.orderChoice == 'random':
+            listing = random.sample(listing, len(listing))
 
         context.update({
             'list_title': instance.title,
@@ -71,16 +83,20 @@ class StaffMemberListPlugin(PluginTemplateMixin, CMSPluginBase):
         return context
 
 
-class LocationListPlugin(PluginTemplateMixin, CMSPluginBase):
+class LocationListPlugin(PluginCacheMixin, PluginTemplateMixin, CMSPluginBase):
     model = LocationListPluginModel
     name = _('Information on All Public Locations')
     render_template = 'core/location_directions.html'
     module = _('Locations')
+    cache_scopes = [(LOCATION, )]
+
+    def get_listing(self, instance, now):
+        return list(Location.objects.filter(status=Location.StatusChoices.active))
 
     def render(self, context, instance, placeholder):
         ''' Allows this plugin to use templates designed for a list of locations. '''
         context = super().render(context, instance, placeholder)
-        context['location_list'] = Location.objects.filter(status=Location.StatusChoices.active)
+        context['location_list'] = self.get_cached_listing(instance)
         return context
 
 
@@ -98,12 +114,13 @@ class LocationPlugin(PluginTemplateMixin, CMSPluginBase):
         return context
 
 
-class EventListPlugin(PluginTemplateMixin, CMSPluginBase):
+class EventListPlugin(PluginCacheMixin, PluginTemplateMixin, CMSPluginBase):
     model = EventListPluginModel
     name = _('List of Events')
     cache = True
     module = _('Events')
     render_template = 'core/events_grouped_list.html'
+    cache_scopes = [GLOBAL, ]
 
     fieldsets = (
         (None, {
@@ -129,14 +146,14 @@ class EventListPlugin(PluginTemplateMixin, CMSPluginBase):
         })
     )
 
-    def render(self, context, instance, placeholder):
-        context = super().render(context, instance, placeholder)
-
-        # Ensure that the CSRF protection cookie is set for all lists of events.
-        # Useful for things like buttons that go directly into the registration process.
-        get_token(context.get('request'))
+    def isTimeRelative(self, instance):
+        return (
+            (instance.daysStart is not None and not instance.startDate) or
+            (instance.daysEnd is not None and not instance.endDate)
+        )
 
-        listing = Event.objects.exclude(
+    def get_listing(self, instance, now):
+        listing = Event.objects.listing().exclude(
             status__in=[Event.RegStatus.hidden, Event.RegStatus.linkOnly]
         )
 
@@ -158,27 +175,31 @@ class EventListPlugin(PluginTemplateMixin, CMSPluginBase):
         if instance.startDate:
             filters[startKey] = datetime.combine(instance.startDate, datetime.min.time())
         elif instance.daysStart is not None:
-            filters[startKey] = timezone.now() + timedelta(days=instance.daysStart)
+            filters[startKey] = now + timedelta(days=instance.daysStart)
 
         if instance.endDate:
             filters[endKey] = datetime.combine(instance.endDate, datetime.max.time())
         elif instance.daysEnd is not None:
-            filters[endKey] = timezone.now() + timedelta(days=instance.daysEnd)
+            filters[endKey] = now + timedelta(days=instance.daysEnd)
 
         if instance.limitToOpenRegistration:
             filters['registrationOpen'] = True
 
-        if instance.location.all():
-            filters['location__in'] = instance.location.all()
+        locations = list(instance.location.all())
+        if locations:
+            filters['location__in'] = locations
 
-        if instance.eventCategories.all():
-            filters['publicevent__category__in'] = instance.eventCategories.all()
+        eventCategories = list(instance.eventCategories.all())
+        if eventCategories:
+            filters['publicevent__category__in'] = eventCategories
 
-        if instance.seriesCategories.all():
-            filters['series__category__in'] = instance.seriesCategories.all()
+        seriesCategories = list(instance.seriesCategories.all())
+        if seriesCategories:
+            filters['series__category__in'] = seriesCategories
 
-        if instance.levels.all():
-            filters['series__classDescription__danceTypeLevel__in'] = instance.levels.all()
+        levels = list(instance.levels.all())
+        if levels:
+            filters['series__classDescription__danceTypeLevel__in'] = levels
 
         # Python calendar module indexes weekday differently from Django
         if instance.weekday is not None:
@@ -186,9 +207,17 @@ class EventListPlugin(PluginTemplateMixin, CMSPluginBase):
 
         order_by = '-startTime' if instance.sortOrder == 'D' else 'startTime'
         listing = listing.filter(**filters).order_by(order_by)[:instance.limitNumber]
+        return prefetchEventListData(listing)
+
+    def render(self, context, instance, placeholder):
+        context = super().render(context, instance, placeholder)
+
+        # Ensure that the CSRF protection cookie is set for all lists of events.
+        # Useful for things like buttons that go directly into the registration process.
+        get_token(context.get('request'))
 
         context.update({
-            'event_list': listing,
+            'event_list': self.get_cached_listing(instance),
         })
         return context
 
@@ -0,0 +1,198 @@
+'''
+The signals defined by the core app are TimedSignals, which time each of
+their receivers and allow independent read-only receivers to be called
+concurrently.
+'''
+from django.conf import settings
+from django.db import close_old_connections, connection, connections
+from django.dispatch import Signal
+from django.dispatch.dispatcher import NO_RECEIVERS
+from django.utils import timezone, translation
+
+from concurrent.futures import ThreadPoolExecutor
+import atexit
+import logging
+import threading
+import time
+
+from .profiling import getCurrentProfile, profileRequest
+
+
+# Define logger for this file
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def getReceiverName(receiver):
+    return '%s.%s' % (
+        getattr(receiver, '__module__', ''),
+        getattr(receiver, '__qualname__', repr(receiver))
+    )
+
+
+def writing_receiver(func):
+    '''
+    Declare that a receiver writes to the database, so that send_concurrent()
+    always calls it in the thread that sent the signal.  Apply this beneath
+    the @receiver decorator.
+    '''
+    func.writes_data = True
+    return func
+
+
+def getExecutor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'SIGNAL_DISPATCH_THREADS', 4),
+                thread_name_prefix='danceschool-signals'
+            )
+    return _executor
+
+
+def shutdownExecutor(timeout=10):
+    '''
+    Close the database connections held by each thread of the pool, and then
+    shut the pool down.  Connections belong to the thread that opened them,
+    so one task is submitted per thread, and each task waits at a barrier so
+    that no thread can take more than one of them.
+    '''
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is None:
+        return
+
+    barrier = threading.Barrier(executor._max_workers)
+
+    def close_connections():
+        try:
+            barrier.wait(timeout)
+        except threading.BrokenBarrierError:
+            pass
+        connections.close_all()
+
+    try:
+        for i in range(executor._max_workers):
+            executor.submit(close_connections)
+    except RuntimeError:
+        # The interpreter is already shutting the pool down.
+        barrier.abort()
+    executor.shutdown(wait=True)
+
+
+# The pool must be shut down before concurrent.futures stops accepting new
+# tasks at exit.  Since Python 3.9, that happens in a threading exit hook,
+# which runs before any atexit function, and hooks run in reverse order of
+# registration.
+if hasattr(threading, '_register_atexit'):
+    threading._register_atexit(shutdownExecutor)
+else:
+    atexit.register(shutdownExecutor)
+
+
+class TimedSignal(Signal):
+    '''
+    A signal that times each receiver.  When the registration profiling
+    middleware is profiling the current request, each receiver's time and
+    queries are added to the profile.  Receivers that take longer than the
+    SIGNAL_RECEIVER_WARNING_MS setting are logged.
+    '''
+    name = None
+
+    def send(self, sender, **named):
+        if not self.receivers or self.sender_receivers_cache.get(sender) is NO_RECEIVERS:
+            return []
+
+        profile = getCurrentProfile()
+        return [
+            (receiver, self.call_receiver(receiver, sender, named, profile))
+            for receiver in self._live_receivers(sender)
+        ]
+
+    def send_concurrent(self, sender, **named):
+        '''
+        Call the receivers in a thread pool and return their responses in the
+        same order as send().  This should only be used for signals whose
+        receivers are independent of one another.  Receivers that write data
+        must be declared with @writing_receiver, and are called in this
+        thread while the others run in the pool.  As with send_robust(), an
+        exception raised by one receiver is logged and returned as its
+        response, so that the other responses are unaffected.
+
+        Other threads cannot see changes that have not been committed, so the
+        receivers are called in this thread inside of a transaction.  The
+        receivers are called with the language and time zone that are active
+        in this thread.  Each thread of the pool keeps its database
+        connections between calls, subject to CONN_MAX_AGE as with requests,
+        and closes them when the pool is shut down.
+        '''
+        if not self.receivers or self.sender_receivers_cache.get(sender) is NO_RECEIVERS:
+            return []
+
+        receivers = self._live_receivers(sender)
+        profile = getCurrentProfile()
+        pooled = [r for r in receivers if not getattr(r, 'writes_data', False)]
+
+        if len(pooled) < 2 or connection.in_atomic_block:
+            return [
+                (receiver, self.call_receiver_robust(receiver, sender, named, profile))
+                for receiver in receivers
+            ]
+
+        language = translation.get_language()
+        current_timezone = timezone.get_current_timezone()
+
+        def call_in_thread(receiver):
+            # Discard connections that have expired or become unusable since
+            # this thread's previous task.
+            close_old_connections()
+            with translation.override(language), timezone.override(current_timezone):
+                if profile is None:
+                    return self.call_receiver_robust(receiver, sender, named)
+                # Queries in this thread use a different connection, so they
+                # are profiled separately and added to the request's profile.
+                with profileRequest(profile.step) as thread_profile:
+                    response = self.call_receiver_robust(receiver, sender, named, thread_profile)
+                profile.receivers.extend(thread_profile.receivers)
+                return response
+
+        futures = [
+            None if getattr(receiver, 'writes_data', False) else
+            getExecutor().submit(call_in_thread, receiver)
+            for receiver in receivers
+        ]
+        responses = [
+            self.call_receiver_robust(receiver, sender, named, profile) if future is None else None
+            for receiver, future in zip(receivers, futures)
+        ]
+        return [
+            (receiver, response if future is None else future.result())
+            for receiver, future, response in zip(receivers, futures, responses)
+        ]
+
+    def call_receiver_robust(self, receiver, sender, named, profile=None):
+        try:
+            return self.call_receiver(receiver, sender, named, profile)
+        except Exception as err:
+            logger.exception(
+                'Error in receiver %s for signal %s' % (getReceiverName(receiver), self.name)
+            )
+            return err
+
+    def call_receiver(self, receiver, sender, named, profile=None):
+        start = time.perf_counter()
+        if profile is not None:
+            response = profile.callReceiver(self, receiver, sender=sender, **named)
+        else:
+            response = receiver(signal=self, sender=sender, **named)
+        duration = 1000 * (time.perf_counter() - start)
+
+        if duration > getattr(settings, 'SIGNAL_RECEIVER_WARNING_MS', 1000):
+            logger.warning('Slow receiver %s for signal %s: %.0f ms' % (
+                getReceiverName(receiver), self.name, duration
+            ))
+        return response
@@ -49,6 +49,19 @@ class EventFeedItem(object):
             self.location = None
 
 
+def getFeedItems(occurrences, **kwargs):
+    '''
+    Return a feed item for each of the passed occurrences.  The events of the
+    occurrences are loaded with a single listing query, rather than one
+    query for each occurrence.
+    '''
+    occurrences = list(occurrences)
+    events = Event.objects.listing().in_bulk(set([x.event_id for x in occurrences]))
+    for occurrence in occurrences:
+        occurrence.event = events[occurrence.event_id]
+    return [EventFeedItem(x, **kwargs) for x in occurrences]
+
+
 class EventFeed(ICalFeed):
     """
     A simple event calender
@@ -91,13 +104,12 @@ class EventFeed(ICalFeed):
 
         if not obj:
             # Public calendar only shows events flagged as available on this calendar
-            return [EventFeedItem(x) for x in item_set.filter(event__calendarEvent=True)[:100]]
+            return getFeedItems(item_set.filter(event__calendarEvent=True)[:100])
         else:
             # Private calendars show all events regardless of the public calendar flag
-            return [
-                EventFeedItem(x) for x in
+            return getFeedItems(
                 item_set.filter(event__eventstaffmember__staffMember__feedKey=obj)[:100]
-            ]
+            )
 
     def item_guid(self, item):
         return item.id + '@' + item.url
@@ -157,5 +169,5 @@ def json_event_feed(request, instructorFeedKey='', locationId=None, roomId=None)
         exclusions = exclusions | Q(event__calendarEvent=False)
 
     item_set = EventOccurrence.objects.exclude(exclusions).filter(filters).order_by('-startTime')
-    eventlist = [EventFeedItem(x, timeZone=timeZone).__dict__ for x in item_set]
+    eventlist = [x.__dict__ for x in getFeedItems(item_set, timeZone=timeZone)]
     return JsonResponse(eventlist, safe=False)
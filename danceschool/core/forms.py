@@ -1,14 +1,16 @@
 from django import forms
 from django.contrib import messages
 from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import ValidationError
-from django.db.models import Q, F, Count
+from django.db.models import Q, F, Count, prefetch_related_objects
 from django.utils.encoding import force_str
 from django.forms.widgets import mark_safe, Select
 from django.utils.html import format_html
 from django.utils.translation import gettext_lazy as _, gettext
 
 from itertools import chain
+from math import ceil
 from crispy_forms.helper import FormHelper
 from crispy_forms.layout import Layout, Div, Field, HTML, Hidden, Submit
 from dal import autocomplete
@@ -20,7 +22,8 @@ from djangocms_text_ckeditor.widgets import TextEditorWidget
 from .models import (
     EventStaffMember, SubstituteTeacher, Event, EventOccurrence,
     Series, SeriesTeacher, Instructor, StaffMember, EmailTemplate, Location,
-    Customer, Invoice, get_defaultEmailName, get_defaultEmailFrom
+    Customer, Invoice, EventRole, DanceType, EventRegistration,
+    get_defaultEmailName, get_defaultEmailFrom
 )
 from .constants import HOW_HEARD_CHOICES, getConstant, REG_VALIDATION_STR
 from .signals import check_student_info
@@ -132,6 +135,83 @@ class EventChoiceMultiWidget(forms.MultiWidget):
         return [None for x in self.choices]
 
 
+def getEventChoiceData(events, interval=None):
+    '''
+    Compute the roles, capacities, registration counts, and drop-in
+    occurrences needed to build an EventChoiceField for each of the passed
+    events, using a fixed number of queries regardless of the number of
+    events.  The results follow the same rules as Event.availableRoles,
+    Event.capacityForRole(), and Event.numRegisteredForRole(), and are
+    returned as a dictionary keyed by event id.
+    '''
+    events = list(events)
+    event_ids = [x.id for x in events]
+
+    data = {
+        x.id: {
+            'roles': [], 'capacities': {}, 'numRegistered': 0,
+            'numRegisteredByRole': {}, 'occurrences': [],
+        } for x in events
+    }
+
+    # Custom roles and capacities specified for each event.
+    event_roles = {}
+    for er in EventRole.objects.filter(
+        event__id__in=event_ids, capacity__gt=0
+    ).select_related('role').order_by('id'):
+        event_roles.setdefault(er.event_id, []).append(er)
+
+    # Default roles from the dance type of each series.
+    series_ids = [x.id for x in events if isinstance(x, Series)]
+    series_dancetypes = dict(Series.objects.filter(id__in=series_ids).values_list(
+        'id', 'classDescription__danceTypeLevel__danceType'
+    ))
+    dancetype_roles = {}
+    for dr in DanceType.roles.through.objects.filter(
+        dancetype__id__in=[x for x in series_dancetypes.values() if x]
+    ).select_related('dancerole').order_by('dancerole__order'):
+        dancetype_roles.setdefault(dr.dancetype_id, []).append(dr.dancerole)
+
+    # Registration counts by event and role.
+    for row in EventRegistration.objects.filter(
+        event__id__in=event_ids, cancelled=False, dropIn=False,
+        registration__final=True
+    ).order_by().values('event', 'role').annotate(count=Count('id')):
+        data[row['event']]['numRegisteredByRole'][row['role']] = row['count']
+        data[row['event']]['numRegistered'] += row['count']
+
+    # Occurrences for drop-in registration.
+    occurrence_filters = {}
+    if interval:
+        occurrence_filters.update({
+            'endTime__gte': interval[0],
+            'startTime__lte': interval[1]
+        })
+    for occurrence in EventOccurrence.objects.filter(
+        event__id__in=series_ids, **occurrence_filters
+    ).order_by('startTime'):
+        data[occurrence.event_id]['occurrences'].append(occurrence)
+
+    for event in events:
+        this_data = data[event.id]
+
+        if event.id in event_roles:
+            this_data['roles'] = [x.role for x in event_roles[event.id]]
+            this_data['capacities'] = {
+                x.role_id: x.capacity for x in event_roles[event.id]
+            }
+        elif event.id in series_ids:
+            roles = dancetype_roles.get(series_dancetypes.get(event.id), [])
+            this_data['roles'] = roles
+            this_data['capacities'] = {
+                x.id: (
+                    ceil(event.capacity / len(roles)) if event.capacity
+                    else event.capacity
+                ) for x in roles
+            }
+    return data
+
+
 class EventChoiceField(forms.MultiValueField):
     '''
     This field type handles the separate checkboxes or quantity inputs associated
@@ -148,14 +228,13 @@ class EventChoiceField(forms.MultiValueField):
         regClosed = kwargs.pop('regClosed', False)
         interval = kwargs.pop('interval', None)
 
-        field_choices = []
+        # Forms with many events should pass choice data computed for all
+        # events at once using getEventChoiceData().
+        choice_data = kwargs.pop('choiceData', None)
+        if choice_data is None:
+            choice_data = getEventChoiceData([self.event, ], interval=interval)[self.event.id]
 
-        occurrence_filters = {}
-        if interval:
-            occurrence_filters.update({
-                'endTime__gte': interval[0],
-                'startTime__lte': interval[1]
-            })
+        field_choices = []
 
         can_override_capacity = user and user.has_perm('core.override_register_soldout')
 
@@ -163,24 +242,27 @@ class EventChoiceField(forms.MultiValueField):
         # are provided, those will be used.  Or, if the DanceType of a Series
         # provides default roles, those will be used.  Otherwise, a single role will
         # be defined as 'Register' .
-        roles = self.event.availableRoles
+        roles = choice_data['roles']
 
         # Add one choice per role
         for role in roles:
+            num_registered = choice_data['numRegisteredByRole'].get(role.id, 0)
+            capacity = choice_data['capacities'].get(role.id)
+
             this_choice = {
                 'value': 'role_%s' % role.id,
                 'data-section': 'primary',
                 'data-type': 'role',
                 'data-role-name': role.name,
                 'data-role-plural-name': role.pluralName,
-                'data-num-registered': self.event.numRegisteredForRole(role),
-                'data-capacity': self.event.capacityForRole(role),
+                'data-num-registered': num_registered,
+                'data-capacity': capacity,
 
                 # This is popped and therefore not sent to client
                 'data-capacity-override': can_override_capacity,
             }
 
-            if self.event.soldOutForRole(role):
+            if num_registered >= (capacity or 0):
                 this_choice.update({'data-sold-out': True, 'disabled': True})
                 if can_override_capacity:
                     this_choice.update({'disabled': False, 'data-override': True})
@@ -194,13 +276,13 @@ class EventChoiceField(forms.MultiValueField):
                 'value': 'general',
                 'data-section': 'primary',
                 'data-type': 'general',
-                'data-num-registered': self.event.numRegistered,
+                'data-num-registered': choice_data['numRegistered'],
                 'data-capacity': self.event.capacity,
 
                 # This is popped and therefore not sent to client
                 'data-capacity-override': can_override_capacity,
             }
-            if self.event.soldOut:
+            if choice_data['numRegistered'] >= (self.event.capacity or 0):
                 this_choice.update({'data-sold-out': True, 'disabled': True})
                 if user and user.has_perm('core.override_register_soldout'):
                     this_choice.update({'disabled': False, 'data-override': True})
@@ -215,14 +297,14 @@ class EventChoiceField(forms.MultiValueField):
             (self.event.allowDropins and user and user.has_perm('core.register_dropins')) or
             (user and user.has_perm('core.override_register_dropins'))
         ):
-            for occurrence in self.event.eventoccurrence_set.filter(**occurrence_filters):
+            for occurrence in choice_data['occurrences']:
                 this_choice = {
                     'value': 'dropin_%s' % occurrence.id,
                     'data-section': 'additional',
                     'data-type': 'dropIn',
                     'data-occurrence': occurrence.id,
                     'data-occurrence-start-time': ensure_localtime(occurrence.startTime),
-                    'data-num-registered': self.event.numRegistered,
+                    'data-num-registered': choice_data['numRegistered'],
                     'data-capacity': self.event.capacity,
 
                     # This is popped and therefore not sent to client
@@ -290,19 +372,29 @@ class ClassChoiceForm(forms.Form):
 
         field_type_rule = getConstant('registration__widgetType')
 
+        # The information needed for every field is retrieved at once.
+        choice_set = list(choice_set)
+        prefetch_related_objects(
+            [x for x in choice_set if isinstance(x, Series)], 'classDescription'
+        )
+        choice_data = getEventChoiceData(choice_set, interval=interval)
+        closed_ids = set(closedEvents.values_list('id', flat=True))
+
         for event in choice_set:
+            model_name = ContentType.objects.get_for_id(event.polymorphic_ctype_id).model
+
             event_field_type = forms.IntegerField
             if (
                 field_type_rule == 'AC' or
-                (field_type_rule == 'SC' and event.polymorphic_ctype.model == 'series') or
-                (field_type_rule == 'SQ' and event.polymorphic_ctype.model != 'series')
+                (field_type_rule == 'SC' and model_name == 'series') or
+                (field_type_rule == 'SQ' and model_name != 'series')
             ):
                 event_field_type = forms.BooleanField
 
-            self.fields[event.polymorphic_ctype.model + '_' + str(event.id)] = EventChoiceField(
+            self.fields[model_name + '_' + str(event.id)] = EventChoiceField(
                 event=event, label=event.name, required=False, user=user,
-                regClosed=(event in closedEvents), interval=interval,
-                field_type=event_field_type
+                regClosed=(event.id in closed_ids), interval=interval,
+                field_type=event_field_type, choiceData=choice_data[event.id]
             )
 
     def clean(self):
@@ -1,12 +1,27 @@
+from django.contrib.auth.models import User
 from django.core.exceptions import ObjectDoesNotExist, MultipleObjectsReturned
+from django.db.models.signals import post_save, post_delete, m2m_changed
 from django.dispatch import receiver
 
 from allauth.account.signals import email_confirmed
 from allauth.account.models import EmailAddress
+from dynamic_preferences.models import GlobalPreferenceModel
 import logging
 
-from .signals import post_registration
-from .models import Registration, EventRegistration
+from .signals import post_registration, invoice_cancelled
+from .models import (
+    Registration, EventRegistration, Customer, CustomerHistory, StaffMember,
+    ClassDescription, SearchToken, Event, Series, PublicEvent, EventOccurrence,
+    EventStaffMember, SeriesTeacher, SubstituteTeacher, EventDJ,
+    SeriesStaffMember, EventSession, Instructor, Location, Room, EventRole,
+    Invoice, EventCheckIn, ReferralStart
+)
+from .invalidation import (
+    GLOBAL, EVENT, STAFF, bumpVersions, bulkDeleteSafe, invalidateEventData,
+    invalidateEvents, invalidateRegistrations
+)
+from .search import getSearchFields
+from .staff_stats import invalidateStaffStats
 
 
 # Define logger for this file
@@ -103,3 +118,225 @@ def linkCustomerToVerifiedUser(sender, **kwargs):
                 This duplicate key value violates unique constraint \"account_emailaddress_email_key\". \
                 The email field should be unique for each account.\n"
             logger.exception(errmsg, customer.email)
+
+
+@receiver(post_registration)
+@receiver(invoice_cancelled)
+def updateCustomerHistory(sender, **kwargs):
+    '''
+    When a Registration is finalized or an Invoice is cancelled, refresh the
+    stored registration history for each customer on the invoice.
+    '''
+    invoice = kwargs.get('invoice', None)
+    if not invoice:
+        return
+
+    customers = Customer.objects.filter(
+        eventregistration__invoiceItem__invoice=invoice
+    )
+    logger.debug('Updating registration history for customers on invoice %s.', invoice.id)
+    CustomerHistory.objects.refresh(customers)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_save, sender=Customer)
+@receiver(post_save, sender=StaffMember)
+@receiver(post_save, sender=ClassDescription)
+def updateSearchTokens(sender, instance, **kwargs):
+    '''
+    Keep the autocomplete search tokens of searchable objects up to date.
+    Saves that only update fields that are not searched are skipped.
+    '''
+    update_fields = kwargs.get('update_fields', None)
+    if update_fields is not None and not (
+        set(update_fields) & {x[0] for x in getSearchFields(sender)}
+    ):
+        return
+    SearchToken.objects.update_instance(instance)
+
+
+@receiver(post_delete, sender=User)
+@receiver(post_delete, sender=Customer)
+@receiver(post_delete, sender=StaffMember)
+@receiver(post_delete, sender=ClassDescription)
+def removeSearchTokens(sender, instance, **kwargs):
+    SearchToken.objects.remove_instance(instance)
+
+
+def invalidateStaffStatsForEvents(**filters):
+    invalidateStaffStats(EventStaffMember.objects.filter(
+        **filters
+    ).values_list('staffMember', flat=True))
+
+
+@receiver(post_save, sender=EventStaffMember)
+@receiver(post_save, sender=SeriesTeacher)
+@receiver(post_save, sender=SubstituteTeacher)
+@receiver(post_save, sender=EventDJ)
+@receiver(post_save, sender=SeriesStaffMember)
+@receiver(post_delete, sender=EventStaffMember)
+@receiver(post_delete, sender=SeriesTeacher)
+@receiver(post_delete, sender=SubstituteTeacher)
+@receiver(post_delete, sender=EventDJ)
+@receiver(post_delete, sender=SeriesStaffMember)
+def invalidateStaffStatsForStaffMember(sender, instance, **kwargs):
+    '''
+    Discard the cached statistics of staff members whose events, hours or
+    registrations have changed.
+    '''
+    invalidateStaffStats([instance.staffMember_id])
+
+
+@receiver(m2m_changed, sender=EventStaffMember.occurrences.through)
+def invalidateStaffStatsForOccurrences(sender, instance, **kwargs):
+    if kwargs.get('action') not in ['post_add', 'post_remove', 'post_clear']:
+        return
+    if isinstance(instance, EventStaffMember):
+        invalidateStaffStats([instance.staffMember_id])
+    else:
+        invalidateStaffStatsForEvents(event=instance.event_id)
+
+
+@receiver(post_save, sender=Event)
+@receiver(post_save, sender=Series)
+@receiver(post_save, sender=PublicEvent)
+@receiver(post_save, sender=EventOccurrence)
+@receiver(post_delete, sender=EventOccurrence)
+def invalidateStaffStatsForEvent(sender, instance, **kwargs):
+    invalidateStaffStatsForEvents(
+        event=getattr(instance, 'event_id', None) or instance.id
+    )
+
+
+@receiver(post_save, sender=EventRegistration)
+def invalidateStaffStatsForEventRegistration(sender, instance, **kwargs):
+    if getattr(instance.registration, 'final', False):
+        invalidateStaffStatsForEvents(event=instance.event_id)
+
+
+@receiver(post_registration)
+@receiver(invoice_cancelled)
+def invalidateStaffStatsForInvoice(sender, **kwargs):
+    invoice = kwargs.get('invoice', None)
+    if invoice:
+        invalidateStaffStatsForEvents(
+            event__eventregistration__invoiceItem__invoice=invoice
+        )
+
+
+@receiver(post_save, sender=Event)
+@receiver(post_save, sender=Series)
+@receiver(post_save, sender=PublicEvent)
+@receiver(post_delete, sender=Event)
+@receiver(post_delete, sender=Series)
+@receiver(post_delete, sender=PublicEvent)
+def invalidateEvent(sender, instance, **kwargs):
+    ''' Bump the invalidation scopes of events whose data has changed. '''
+    invalidateEventData(events=[instance.id], locations=[instance.location_id])
+
+
+@receiver(post_save, sender=EventOccurrence)
+@receiver(post_save, sender=EventStaffMember)
+@receiver(post_save, sender=SeriesTeacher)
+@receiver(post_save, sender=SubstituteTeacher)
+@receiver(post_save, sender=EventDJ)
+@receiver(post_save, sender=SeriesStaffMember)
+@receiver(post_save, sender=EventRole)
+@receiver(post_delete, sender=EventOccurrence)
+@receiver(post_delete, sender=EventStaffMember)
+@receiver(post_delete, sender=SeriesTeacher)
+@receiver(post_delete, sender=SubstituteTeacher)
+@receiver(post_delete, sender=EventDJ)
+@receiver(post_delete, sender=SeriesStaffMember)
+@receiver(post_delete, sender=EventRole)
+def invalidateEventForRelated(sender, instance, **kwargs):
+    invalidateEvents([instance.event_id])
+
+
+@receiver(m2m_changed, sender=EventStaffMember.occurrences.through)
+@receiver(m2m_changed, sender=EventRegistration.occurrences.through)
+def invalidateEventForOccurrences(sender, instance, **kwargs):
+    if kwargs.get('action') not in ['post_add', 'post_remove', 'post_clear']:
+        return
+    invalidateEvents(
+        [instance.event_id], customers=[getattr(instance, 'customer_id', None)]
+    )
+
+
+@receiver(post_save, sender=EventRegistration)
+@receiver(post_delete, sender=EventRegistration)
+@bulkDeleteSafe
+def invalidateEventRegistration(sender, instance, **kwargs):
+    invalidateEvents([instance.event_id], customers=[instance.customer_id])
+
+
+@receiver(post_save, sender=Registration)
+@receiver(post_delete, sender=Registration)
+@bulkDeleteSafe
+def invalidateRegistration(sender, instance, **kwargs):
+    invalidateRegistrations(registration=instance.id)
+
+
+@receiver(post_save, sender=Registration)
+def recordReferralStart(sender, instance, created, raw=False, **kwargs):
+    '''
+    Count each registration begun through a referral URL, so that the number
+    started is still known after unfinished registrations are deleted.
+    '''
+    if created and not raw and instance.marketingId:
+        ReferralStart.objects.record(instance.marketingId, instance.dateTime)
+
+
+@receiver(post_save, sender=Invoice)
+@receiver(post_delete, sender=Invoice)
+@bulkDeleteSafe
+def invalidateInvoice(sender, instance, **kwargs):
+    invalidateRegistrations(registration__invoice=instance.id)
+
+
+@receiver(post_save, sender=EventCheckIn)
+@receiver(post_delete, sender=EventCheckIn)
+def invalidateEventCheckIn(sender, instance, **kwargs):
+    '''
+    Check-ins are only displayed by the door register, so only the event's
+    own scope is bumped.
+    '''
+    bumpVersions([(EVENT, instance.event_id), ])
+
+
+@receiver(post_save, sender=ClassDescription)
+@receiver(post_save, sender=EventSession)
+@receiver(post_delete, sender=ClassDescription)
+@receiver(post_delete, sender=EventSession)
+def invalidateEventDescriptions(sender, instance, **kwargs):
+    bumpVersions([GLOBAL, ])
+
+
+@receiver(post_save, sender=StaffMember)
+@receiver(post_save, sender=Instructor)
+@receiver(post_delete, sender=StaffMember)
+@receiver(post_delete, sender=Instructor)
+def invalidateStaff(sender, instance, **kwargs):
+    bumpVersions([STAFF, ])
+
+
+@receiver(post_save, sender=Location)
+@receiver(post_save, sender=Room)
+@receiver(post_delete, sender=Location)
+@receiver(post_delete, sender=Room)
+def invalidateLocation(sender, instance, **kwargs):
+    invalidateEventData(locations=[getattr(instance, 'location_id', instance.id)])
+
+
+@receiver(post_save, sender=GlobalPreferenceModel)
+def updateEventSortKeys(sender, instance, **kwargs):
+    '''
+    Event sort keys and URLs depend on the rule for organizing events, so
+    recompute the sort keys of all events when it changes.  Cached listings
+    also depend on the rule and on the instructor staff category.
+    '''
+    if instance.section == 'registration' and instance.name == 'orgRule':
+        Event.objects.updateSortKeys(rule=instance.value)
+        bumpVersions([GLOBAL, ])
+    elif instance.section == 'general' and instance.name == 'eventStaffCategoryInstructor':
+        bumpVersions([GLOBAL, ])
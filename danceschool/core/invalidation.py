@@ -0,0 +1,174 @@
+'''
+A shared notion of "event data changed" for cached read paths.  The bus keeps
+a version counter for each scope: the global scope, which changes whenever
+any event data changes, scopes for individual events, locations and
+customers, and scopes for staff member profiles, guest lists and the
+plugins of door registers.  Counters are stored in the Django cache, and they
+are bumped by the signal handlers in handlers.py whenever events,
+occurrences, staff, roles, registrations, invoices or check-ins are saved or
+deleted, and by the handlers of other apps for their own scopes.  Cached data
+opts in by including the versions of the scopes that it depends upon in its
+cache key, using getVersionedKey() or the versionedCache() decorator, so that
+stale entries are simply never read again.
+'''
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+
+from functools import wraps
+import time
+
+from .models import Event, EventRegistration
+
+
+# Scopes are either a name, or a tuple of a name and the id of an object.
+GLOBAL = 'global'
+EVENT = 'event'
+LOCATION = 'location'
+CUSTOMER = 'customer'
+STAFF = 'staff'
+GUESTLIST = 'guestlist'
+REGISTER = 'register'
+
+# The default number of seconds for which versioned data is cached.  This may
+# be overridden with the INVALIDATION_CACHE_TIMEOUT setting.
+INVALIDATION_CACHE_TIMEOUT = 3600
+
+
+def getScopeKey(scope):
+    if isinstance(scope, (tuple, list)):
+        scope = ':'.join(str(x) for x in scope)
+    return 'invalidation:version:%s' % scope
+
+
+def getVersions(scopes):
+    '''
+    Return a list of the current version of each of the passed scopes.
+    Counters start from the current time in milliseconds, so that a counter
+    that has been evicted from the cache never repeats an earlier version.
+    '''
+    keys = [getScopeKey(x) for x in scopes]
+    versions = cache.get_many(keys)
+    result = []
+    for key in keys:
+        version = versions.get(key)
+        if version is None:
+            cache.add(key, int(time.time() * 1000), None)
+            version = cache.get(key)
+        result.append(version)
+    return result
+
+
+def getVersion(scope=GLOBAL):
+    return getVersions([scope, ])[0]
+
+
+def _bump(keys):
+    for key in keys:
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, int(time.time() * 1000), None)
+
+
+def bumpVersions(scopes):
+    '''
+    Increment the counters of the passed scopes.  Within a transaction, the
+    counters are also incremented after the transaction commits, so that data
+    cached by another process from before the commit is not read again.
+    '''
+    keys = list(set(getScopeKey(x) for x in scopes))
+    if not keys:
+        return
+    _bump(keys)
+    if connection.in_atomic_block:
+        transaction.on_commit(lambda: _bump(keys))
+
+
+def invalidateEventData(events=None, locations=None, customers=None):
+    '''
+    Bump the global scope along with the scopes of the passed event,
+    location and customer ids.  Each location also bumps the scope of all
+    locations, so that data about every location may depend on (LOCATION, ).
+    '''
+    scopes = [GLOBAL, ]
+    scopes += [(EVENT, x) for x in set(events or []) if x]
+    scopes += [(LOCATION, x) for x in set(locations or []) if x]
+    if locations:
+        scopes.append((LOCATION, ))
+    scopes += [(CUSTOMER, x) for x in set(customers or []) if x]
+    bumpVersions(scopes)
+
+
+def invalidateEvents(event_ids, customers=None):
+    '''
+    Bump the scopes of the passed events, of their locations, and of the
+    passed customer ids.
+    '''
+    event_ids = [x for x in set(event_ids) if x]
+    locations = list(Event.objects.non_polymorphic().filter(
+        id__in=event_ids
+    ).values_list('location', flat=True)) if event_ids else []
+    invalidateEventData(events=event_ids, locations=locations, customers=customers)
+
+
+def invalidateRegistrations(**filters):
+    '''
+    Bump the scopes of the events, locations and customers of the event
+    registrations that match the passed filters.
+    '''
+    rows = list(EventRegistration.objects.filter(**filters).values_list(
+        'event', 'event__location', 'customer'
+    ))
+    invalidateEventData(
+        events=[x[0] for x in rows], locations=[x[1] for x in rows],
+        customers=[x[2] for x in rows],
+    )
+
+
+def bulkDeleteSafe(receiver):
+    '''
+    Mark a delete signal receiver as one that the invoice purge need not
+    send, because the purge performs the same invalidation itself for each
+    batch that it deletes.  Otherwise, any delete receiver forces the purge
+    to load and delete each row individually.
+    '''
+    receiver.bulkDeleteSafe = True
+    return receiver
+
+
+def getVersionedKey(name, scopes, *args):
+    '''
+    Return a cache key for the passed name and arguments that changes
+    whenever any of the passed scopes is invalidated.
+    '''
+    return '%s:%s:%s' % (
+        name, ':'.join(str(x) for x in args),
+        ':'.join(str(x) for x in getVersions(scopes)),
+    )
+
+
+def versionedCache(name, scopes=(GLOBAL, ), timeout=None):
+    '''
+    Decorator that caches the result of a function under a versioned key.
+    The scopes may be a list, or a function that is passed the same
+    arguments as the decorated function and returns a list.  The positional
+    arguments of the decorated function must be simple values, since they
+    are part of the cache key.  The cached result may be bypassed by calling
+    the uncached attribute of the decorated function.
+    '''
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args):
+            these_scopes = scopes(*args) if callable(scopes) else scopes
+            key = getVersionedKey(name, these_scopes, *args)
+            result = cache.get(key)
+            if result is None:
+                result = func(*args)
+                cache.set(key, result, timeout or getattr(
+                    settings, 'INVALIDATION_CACHE_TIMEOUT', INVALIDATION_CACHE_TIMEOUT
+                ))
+            return result
+        wrapper.uncached = func
+        return wrapper
+    return decorator
@@ -0,0 +1,101 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from danceschool.core.models import (
+    Customer, EventOccurrence, EventRegistration, Invoice, Registration
+)
+
+
+def getHotQuerysets():
+    '''
+    Return (name, queryset) tuples for the lookups that are run most often
+    during registration and by scheduled tasks.  The filter values are
+    placeholders; only the shape of each query matters to the query plan.
+    '''
+    now = timezone.now()
+
+    querysets = [
+        ('Customer by name and email', Customer.objects.filter(
+            first_name='', last_name='', email=''
+        )),
+        ('Customer by email', Customer.objects.filter(email='')),
+        ('Event registrations by event, role and status', EventRegistration.objects.filter(
+            event=0, cancelled=False, dropIn=False, role=0, registration__final=True
+        )),
+        ('Event occurrences by event and start time', EventOccurrence.objects.filter(
+            event=0, startTime__gte=now
+        )),
+        ('Expired preliminary invoices', Invoice.objects.filter(
+            status=Invoice.PaymentStatus.preliminary, expirationDate__lte=now
+        )),
+        ('Registrations by marketing ID', Registration.objects.filter(marketingId='')),
+    ]
+
+    if apps.is_installed('danceschool.private_lessons'):
+        from danceschool.private_lessons.models import InstructorAvailabilitySlot
+        querysets.append(
+            ('Availability slots by instructor and start time',
+             InstructorAvailabilitySlot.objects.filter(instructor=0, startTime__gte=now))
+        )
+
+    return [(name, qs.order_by()) for name, qs in querysets]
+
+
+def findSequentialScans(plan):
+    '''
+    Return the lines of a query plan that indicate a full table scan.  On
+    SQLite a scan that uses a covering index is reported as "SCAN ... USING",
+    which is not a sequential scan.
+    '''
+    if connection.vendor == 'postgresql':
+        return [x.strip() for x in plan.splitlines() if 'Seq Scan' in x]
+    elif connection.vendor == 'sqlite':
+        return [
+            x.strip() for x in plan.splitlines()
+            if ' SCAN ' in ' %s ' % x and 'USING' not in x
+        ]
+    return []
+
+
+class Command(BaseCommand):
+    help = (
+        'Run EXPLAIN on the most frequently used lookups and report any that ' +
+        'require a sequential scan.  Note that the planner may reasonably ' +
+        'choose to scan tables that contain only a few rows.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verbose', action='store_true', dest='verbose',
+            help='Print the full query plan for each lookup'
+        )
+        parser.add_argument(
+            '--fail-on-scan', action='store_true', dest='fail_on_scan',
+            help='Exit with an error if any lookup requires a sequential scan'
+        )
+
+    def handle(self, *args, **options):
+        querysets = getHotQuerysets()
+        flagged = []
+
+        for name, qs in querysets:
+            plan = qs.explain()
+            scans = findSequentialScans(plan)
+            self.stdout.write('%s: %s' % (name, 'SCAN' if scans else 'OK'))
+            if options.get('verbose'):
+                self.stdout.write(plan)
+            if scans:
+                flagged.append(name)
+                for line in scans:
+                    self.stdout.write('    %s' % line)
+
+        self.stdout.write('%s of %s lookups require a sequential scan.' % (
+            len(flagged), len(querysets)
+        ))
+
+        if flagged and options.get('fail_on_scan'):
+            raise CommandError(
+                'Sequential scans found for: %s' % ', '.join(flagged)
+            )
@@ -1,24 +1,43 @@
 from django.core.management.base import BaseCommand
 from django.core.management import call_command
-from django.utils import timezone
 
-from datetime import timedelta
-
-from danceschool.core.models import Registration, Invoice
 from danceschool.core.constants import getConstant
+from danceschool.core.purge import (
+    purgeExpiredInvoices, purgeRegistrationSessions, formatPurgeMetrics
+)
 
 
 class Command(BaseCommand):
     help = 'Clear expired preliminary invoice and session data'
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', dest='batchSize', type=int, default=None,
+            help='The number of invoices to delete in each transaction.',
+        )
+        parser.add_argument(
+            '--max-batches', dest='maxBatches', type=int, default=None,
+            help='Stop after this many batches.',
+        )
+        parser.add_argument(
+            '--registration-sessions-only', dest='registrationSessionsOnly',
+            action='store_true',
+            help='Only clear expired sessions that hold registration data.',
+        )
+
     def handle(self, *args, **options):
 
         if getConstant('registration__deleteExpiredInvoices'):
             self.stdout.write('Clearing expired data.')
-            Invoice.objects.filter(
-                status=Invoice.PaymentStatus.preliminary,
-                expirationDate__lte=timezone.now() - timedelta(minutes=1)
-            ).delete()
-            call_command('clearsessions')
+            metrics = purgeExpiredInvoices(
+                batchSize=options.get('batchSize'),
+                maxBatches=options.get('maxBatches'),
+            )
+            metrics['sessions'] = purgeRegistrationSessions(
+                batchSize=options.get('batchSize')
+            )
+            self.stdout.write(formatPurgeMetrics(metrics))
+            if not options.get('registrationSessionsOnly'):
+                call_command('clearsessions')
         else:
             self.stdout.write('Clearing expired data is disabled.  Nothing was deleted.')
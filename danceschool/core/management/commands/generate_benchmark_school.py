@@ -0,0 +1,63 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from six.moves import input
+
+from danceschool.core.benchmark import generateSchool
+
+
+class Command(BaseCommand):
+    help = (
+        'Populate the database with a large synthetic school for use in ' +
+        'performance benchmarks.  This also changes site preferences, so it ' +
+        'should only be run against a dedicated benchmark database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0, help='Random seed')
+        parser.add_argument(
+            '--years', type=int, default=3,
+            help='Number of years of monthly class series to create'
+        )
+        parser.add_argument(
+            '--customers', type=int, default=20000, help='Number of customers to create'
+        )
+        parser.add_argument(
+            '--series-per-month', type=int, default=10, dest='seriesPerMonth',
+            help='Number of class series that begin each month'
+        )
+        parser.add_argument(
+            '--registrations-per-customer', type=int, default=3,
+            dest='registrationsPerCustomer',
+            help='Average number of registrations for each customer'
+        )
+        parser.add_argument(
+            '--vouchers', type=int, default=500, help='Number of vouchers to create'
+        )
+        parser.add_argument(
+            '--discounts', type=int, default=20, help='Number of discounts to create'
+        )
+        parser.add_argument(
+            '--noinput', '--no-input', action='store_false', dest='interactive',
+            help='Do not ask for confirmation before creating records'
+        )
+
+    def handle(self, *args, **options):
+        if options.get('interactive'):
+            result = input(
+                'This will create a large number of records and change site ' +
+                'preferences.  Continue? [y/N]: '
+            )
+            if not result or result[0].lower() != 'y':
+                raise CommandError('Cancelled.')
+
+        self.stdout.write('Generating synthetic school...')
+        summary = generateSchool(
+            seed=options['seed'], years=options['years'],
+            customers=options['customers'],
+            seriesPerMonth=options['seriesPerMonth'],
+            registrationsPerCustomer=options['registrationsPerCustomer'],
+            vouchers=options['vouchers'], discounts=options['discounts'],
+        )
+        for key, value in summary.items():
+            self.stdout.write('%s: %s' % (key, value))
+        self.stdout.write('done.')
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from danceschool.core.models import Customer, CustomerHistory
+
+
+class Command(BaseCommand):
+    help = 'Recompute the stored registration history summary for all customers'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--customer', action='append', type=int, dest='customers',
+            help='Only rebuild the history of the customer with this id (may be repeated)'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=1000, dest='batch_size',
+            help='Number of records to write per query'
+        )
+
+    def handle(self, *args, **options):
+        customers = options.get('customers')
+        if customers:
+            customers = Customer.objects.filter(id__in=customers)
+
+        self.stdout.write('Rebuilding customer registration history...')
+        count = CustomerHistory.objects.refresh(
+            customers, batch_size=options.get('batch_size')
+        )
+        self.stdout.write('...done. Rebuilt history for %s customers.' % count)
@@ -0,0 +1,35 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+
+from danceschool.core.models import SearchToken
+from danceschool.core.search import SEARCH_FIELDS
+
+
+class Command(BaseCommand):
+    help = 'Recreate the search tokens used by the customer, user, staff member and class autocompletes'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--model', action='append', dest='models',
+            help='Only rebuild tokens for this model, e.g. core.customer (may be repeated)'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=1000, dest='batch_size',
+            help='Number of objects to index per query'
+        )
+
+    def handle(self, *args, **options):
+        labels = [x.lower() for x in (options.get('models') or [])]
+        unknown = [x for x in labels if x not in SEARCH_FIELDS]
+        if unknown:
+            raise CommandError(
+                'Models are not searchable: %s.  Choose from: %s' %
+                (', '.join(unknown), ', '.join(SEARCH_FIELDS.keys()))
+            )
+
+        self.stdout.write('Rebuilding search index...')
+        count = SearchToken.objects.rebuild(
+            [apps.get_model(x) for x in labels] or None,
+            batch_size=options.get('batch_size')
+        )
+        self.stdout.write('...done. Created %s search tokens.' % count)
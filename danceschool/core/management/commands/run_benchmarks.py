@@ -0,0 +1,91 @@
+from django.core.management.base import BaseCommand, CommandError
+
+import json
+import os
+
+from danceschool.core.benchmark import (
+    BENCHMARK_BASELINE, BENCHMARK_OPERATIONS, compareResults, runBenchmarks
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Time the most frequently used operations and count their queries, ' +
+        'and compare the results with a stored baseline.  Use ' +
+        'generate_benchmark_school to create a school to benchmark against.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--operation', action='append', dest='operations',
+            choices=list(BENCHMARK_OPERATIONS.keys()),
+            help='Only run this operation (may be repeated)'
+        )
+        parser.add_argument(
+            '--repeat', type=int, default=5,
+            help='Number of timed runs of each operation'
+        )
+        parser.add_argument('--output', help='Write the results to this JSON file')
+        parser.add_argument(
+            '--baseline', default=BENCHMARK_BASELINE,
+            help='Compare the results with those in this JSON file (by default, the stored baseline)'
+        )
+        parser.add_argument(
+            '--no-baseline', action='store_true', dest='no_baseline',
+            help='Do not compare the results with a baseline'
+        )
+        parser.add_argument(
+            '--threshold', type=float, default=0.2,
+            help='Fractional increase in median time that counts as a regression'
+        )
+        parser.add_argument(
+            '--fail-on-regression', action='store_true', dest='fail_on_regression',
+            help='Exit with an error if any regressions are found'
+        )
+
+    def handle(self, *args, **options):
+        if options['repeat'] < 1:
+            raise CommandError('Each operation must be timed at least once.')
+
+        baseline = None
+        if options.get('baseline') and not options.get('no_baseline'):
+            if not os.path.exists(options['baseline']):
+                raise CommandError('Baseline file %s not found.' % options['baseline'])
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+
+        results = runBenchmarks(
+            names=options.get('operations'), repeat=options['repeat']
+        )
+
+        self.stdout.write('%-36s %10s %10s %8s %8s' % (
+            'Operation', 'Median (s)', 'Baseline', 'Queries', 'Baseline'
+        ))
+        for name, result in results['operations'].items():
+            previous = (baseline or {}).get('operations', {}).get(name, {})
+            self.stdout.write('%-36s %10.4f %10s %8s %8s' % (
+                name, result['median'],
+                '%.4f' % previous['median'] if previous else '-',
+                result['queries'], previous.get('queries', '-'),
+            ))
+
+        for name in results['skipped']:
+            self.stdout.write('%-36s %10s' % (name, 'skipped'))
+
+        if options.get('output'):
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write('Results written to %s.' % options['output'])
+
+        if baseline is None:
+            return
+
+        regressions = compareResults(results, baseline, threshold=options['threshold'])
+        for x in regressions:
+            self.stdout.write(self.style.ERROR(
+                'Regression in %(operation)s %(metric)s: %(baseline)s -> %(current)s' % x
+            ))
+        self.stdout.write('%s regressions found.' % len(regressions))
+
+        if regressions and options.get('fail_on_regression'):
+            raise CommandError('Performance regressions were found.')
@@ -1,16 +1,17 @@
 from django.core.management.base import BaseCommand
 
-from danceschool.core.models import Series
+from danceschool.core.models import Event
 
 
 class Command(BaseCommand):
     help = 'Update the registration status for series and events that should be opened/closed based on the current time'
 
     def handle(self, *args, **options):
-        self.stdout.write('Checking and updating registration status of all opened class series.')
+        self.stdout.write('Checking and updating registration status of all events.')
 
-        open_series = Series.objects.filter(**{'registrationOpen': True})
+        summary = Event.objects.updateRegistrationStatus()
 
-        for series in open_series:
-            series.updateRegistrationStatus()
+        self.stdout.write('Events checked: %s' % summary['checked'])
+        self.stdout.write('Events opened for registration: %s' % len(summary['opened']))
+        self.stdout.write('Events closed for registration: %s' % len(summary['closed']))
         self.stdout.write('done.')
@@ -1,9 +1,28 @@
 '''
 This file contains custom managers and querysets for various core models.
 '''
-from django.db import models
+from django.db import models, transaction, IntegrityError
+from django.db.models import (
+    Q, F, Count, Sum, Max, OuterRef, Subquery, FloatField, Case, When, Value,
+    BooleanField, IntegerField
+)
+from django.db.models.functions import Coalesce
+from django.db.models.query import ModelIterable
+from django.apps import apps
+from django.contrib.contenttypes.models import ContentType
+from django.utils import timezone
+
+from polymorphic.managers import PolymorphicManager
+from polymorphic.query import PolymorphicQuerySet
+from functools import reduce
+from operator import add, or_
 
 from danceschool.core.constants import getConstant
+from danceschool.core.ordering import getSortKeys
+from danceschool.core.search import (
+    SEARCH_FIELDS, getSearchFields, getInstanceTokens, getQueryTerms,
+    getResultLimit
+)
 
 
 class InvoiceQuerySet(models.QuerySet):
@@ -96,3 +115,478 @@ class SeriesStaffManager(models.Manager):
                 getConstant('general__eventStaffCategorySubstitute'),
             ],
         )
+
+
+class CustomerHistoryManager(models.Manager):
+    '''
+    Computes the registration history summaries for a set of customers using a
+    single annotated query, and stores the results in bulk.
+    '''
+
+    history_fields = [
+        'numEventRegistrations', 'numClassSeries', 'numPublicEvents',
+        'numDropIns', 'firstSeries_id', 'firstSeriesDate', 'lastSeries_id',
+        'lastSeriesDate', 'totalSpent', 'lastRegistrationDate',
+    ]
+
+    def get_customers(self, customers=None):
+        '''
+        Customers may be passed as a queryset, as a list of instances or ids,
+        or as None to indicate all customers.
+        '''
+        Customer = apps.get_model('core', 'Customer')
+
+        if customers is None:
+            return Customer.objects.all()
+        elif isinstance(customers, models.QuerySet):
+            # Filtering on the ids avoids reusing any joins from the passed
+            # queryset in the aggregations used to compute history.
+            return Customer.objects.filter(id__in=customers.values('id'))
+        return Customer.objects.filter(
+            id__in=[getattr(x, 'id', x) for x in customers]
+        )
+
+    def get_history_values(self, customers=None):
+        '''
+        Return a values queryset with one row of computed history for each
+        of the passed customers.
+        '''
+        EventRegistration = apps.get_model('core', 'EventRegistration')
+        queryset = self.get_customers(customers)
+
+        final = Q(
+            eventregistration__cancelled=False,
+            eventregistration__registration__final=True
+        )
+        nonDropIn = final & Q(eventregistration__dropIn=False)
+
+        series_regs = EventRegistration.objects.filter(
+            customer=OuterRef('pk'), event__series__isnull=False,
+            dropIn=False, cancelled=False, registration__final=True
+        )
+        first_regs = series_regs.order_by('event__startTime')
+        last_regs = series_regs.order_by('-event__startTime')
+
+        return queryset.order_by().annotate(
+            numEventRegistrations=Count('eventregistration', filter=nonDropIn),
+            numClassSeries=Count('eventregistration', filter=(
+                nonDropIn & Q(eventregistration__event__series__isnull=False)
+            )),
+            numPublicEvents=Count('eventregistration', filter=(
+                nonDropIn & Q(eventregistration__event__publicevent__isnull=False)
+            )),
+            numDropIns=Count('eventregistration', filter=(
+                final & Q(eventregistration__dropIn=True)
+            )),
+            totalSpent=Coalesce(Sum(
+                F('eventregistration__invoiceItem__total') +
+                F('eventregistration__invoiceItem__adjustments'),
+                filter=final, output_field=FloatField()
+            ), 0),
+            lastRegistrationDate=Max(
+                'eventregistration__registration__dateTime', filter=final
+            ),
+            firstSeries_id=Subquery(first_regs.values('event')[:1]),
+            firstSeriesDate=Subquery(first_regs.values('event__startTime')[:1]),
+            lastSeries_id=Subquery(last_regs.values('event')[:1]),
+            lastSeriesDate=Subquery(last_regs.values('event__startTime')[:1]),
+        ).values('id', *self.history_fields)
+
+    def refresh(self, customers=None, batch_size=1000):
+        '''
+        Recompute and store the history summaries for the passed customers (or
+        for all customers if None is passed).  Returns the number of records
+        refreshed.
+        '''
+        customers = self.get_customers(customers)
+        values = self.get_history_values(customers)
+        now = timezone.now()
+
+        existing = set(self.filter(
+            customer__in=customers
+        ).values_list('customer_id', flat=True))
+
+        to_create = []
+        to_update = []
+        for row in values.iterator():
+            this_history = self.model(
+                customer_id=row.pop('id'), modifiedDate=now, **row
+            )
+            if this_history.customer_id in existing:
+                to_update.append(this_history)
+            else:
+                to_create.append(this_history)
+
+        if to_create:
+            self.bulk_create(to_create, batch_size=batch_size)
+        if to_update:
+            self.bulk_update(
+                to_update,
+                fields=[
+                    'numEventRegistrations', 'numClassSeries', 'numPublicEvents',
+                    'numDropIns', 'firstSeries', 'firstSeriesDate', 'lastSeries',
+                    'lastSeriesDate', 'totalSpent', 'lastRegistrationDate',
+                    'modifiedDate',
+                ],
+                batch_size=batch_size
+            )
+        return len(to_create) + len(to_update)
+
+
+class SearchTokenManager(models.Manager):
+    '''
+    Maintains the normalized search tokens of the searchable models listed in
+    core/search.py, and finds the objects that match a query.  Each word of
+    the query is matched as a prefix of the stored tokens, using a range
+    lookup so that the (contentType, token) index is used on every backend.
+    '''
+
+    def get_tokens(self, instance, contentType=None):
+        contentType = contentType or ContentType.objects.get_for_model(instance.__class__)
+        return [
+            self.model(
+                contentType=contentType, objectId=instance.pk, token=token,
+                weight=weight
+            )
+            for token, weight in getInstanceTokens(instance).items()
+        ]
+
+    def update_instance(self, instance):
+        '''
+        Replace the stored tokens of a single instance if they have changed.
+        '''
+        contentType = ContentType.objects.get_for_model(instance.__class__)
+        new_tokens = self.get_tokens(instance, contentType)
+        existing = self.filter(contentType=contentType, objectId=instance.pk)
+
+        if set(existing.values_list('token', 'weight')) == {
+            (x.token, x.weight) for x in new_tokens
+        }:
+            return
+        existing.delete()
+        self.bulk_create(new_tokens)
+
+    def remove_instance(self, instance):
+        self.filter(
+            contentType=ContentType.objects.get_for_model(instance.__class__),
+            objectId=instance.pk
+        ).delete()
+
+    def index(self, instances, batch_size=1000):
+        '''
+        Replace the stored tokens of the passed instances, which must all be
+        of the same model.  Returns the number of tokens created.
+        '''
+        instances = list(instances)
+        if not instances:
+            return 0
+        contentType = ContentType.objects.get_for_model(instances[0].__class__)
+
+        count = 0
+        for k in range(0, len(instances), batch_size):
+            batch = instances[k:k + batch_size]
+            self.filter(
+                contentType=contentType, objectId__in=[x.pk for x in batch]
+            ).delete()
+            tokens = [
+                token for instance in batch
+                for token in self.get_tokens(instance, contentType)
+            ]
+            self.bulk_create(tokens, batch_size=batch_size)
+            count += len(tokens)
+        return count
+
+    def rebuild(self, search_models=None, batch_size=1000):
+        '''
+        Rebuild all stored tokens for the passed searchable models (by default,
+        all of them).  Returns the number of tokens created.
+        '''
+        if search_models is None:
+            search_models = [apps.get_model(x) for x in SEARCH_FIELDS.keys()]
+
+        count = 0
+        for model in search_models:
+            self.filter(contentType=ContentType.objects.get_for_model(model)).delete()
+            fields = [x[0] for x in getSearchFields(model)]
+            queryset = model.objects.order_by('pk').only('pk', *fields)
+
+            last_pk = 0
+            while True:
+                batch = list(queryset.filter(pk__gt=last_pk)[:batch_size])
+                if not batch:
+                    break
+                count += self.index(batch, batch_size=batch_size)
+                last_pk = batch[-1].pk
+        return count
+
+    def search(self, model, q, limit=None):
+        '''
+        Return the ids of up to limit objects of the passed model that match
+        the query, best matches first.  Objects that match more of the words
+        of the query are ranked first, followed by those whose matching
+        fields are more heavily weighted, with a bonus for whole-word matches.
+        '''
+        terms = getQueryTerms(q)
+        if not terms:
+            return []
+
+        matches = [Q(token__gte=x, token__lt=x + '\uffff') for x in terms]
+        results = self.filter(
+            reduce(or_, matches),
+            contentType=ContentType.objects.get_for_model(model),
+        ).values('objectId').annotate(
+            matched=reduce(add, [
+                Max(Case(
+                    When(x, then=Value(1)), default=Value(0),
+                    output_field=IntegerField()
+                )) for x in matches
+            ]),
+            score=Sum('weight') + Sum(Case(
+                When(token__in=terms, then=F('weight')), default=Value(0),
+                output_field=IntegerField()
+            )),
+        ).order_by('-matched', '-score', 'objectId')
+
+        return [x['objectId'] for x in results[:getResultLimit(limit)]]
+
+    def search_queryset(self, queryset, q, limit=None):
+        '''
+        Filter the passed queryset to the objects that match the query, in
+        order of their rank.
+        '''
+        ids = self.search(queryset.model, q, limit)
+        if not ids:
+            return queryset.none()
+        return queryset.filter(pk__in=ids).order_by(Case(
+            *[When(pk=x, then=Value(i)) for i, x in enumerate(ids)],
+            output_field=IntegerField()
+        ))
+
+
+def getEventChildLinks():
+    '''
+    Return the names of the reverse one-to-one relations from Event to each
+    of the models that directly inherit from it (e.g. Series, PublicEvent).
+    '''
+    Event = apps.get_model('core', 'Event')
+    links = []
+    for model in apps.get_models():
+        parent_link = model._meta.parents.get(Event)
+        if parent_link:
+            links.append(parent_link.remote_field.get_accessor_name())
+    return links
+
+
+class ReferralStartManager(models.Manager):
+    '''
+    Counts the registrations begun through each referral marketing ID on
+    each day.  Counters are incremented in the database, so concurrent
+    registrations are not lost.
+    '''
+
+    def record(self, marketingId, dateTime=None):
+        date = timezone.localtime(dateTime or timezone.now()).date()
+        if self.filter(marketingId=marketingId, date=date).update(started=F('started') + 1):
+            return
+        try:
+            with transaction.atomic():
+                self.create(marketingId=marketingId, date=date, started=1)
+        except IntegrityError:
+            # Another registration created the counter first.
+            self.filter(marketingId=marketingId, date=date).update(started=F('started') + 1)
+
+
+class EventListingIterable(ModelIterable):
+    '''
+    Yields each event of a listing queryset as an instance of its own class.
+    The child instance is the one that select_related() built from the same
+    row, and it is given the related objects and annotations that were
+    loaded for the event, so that no further queries are needed.
+    '''
+
+    def __iter__(self):
+        links = getEventChildLinks()
+        query = self.queryset.query
+        annotations = list(query.annotation_select) + list(query.extra_select)
+
+        for event in super().__iter__():
+            fields_cache = event._state.fields_cache
+            child = next((fields_cache[x] for x in links if fields_cache.get(x)), None)
+            if child is None:
+                yield event
+                continue
+
+            child._state.fields_cache.update({
+                k: v for k, v in fields_cache.items() if k not in links
+            })
+            for name in annotations:
+                setattr(child, name, getattr(event, name))
+            yield child
+
+
+class EventQuerySet(PolymorphicQuerySet):
+
+    def listing(self, *related):
+        '''
+        Return a queryset for listing events that loads each event, along
+        with the columns of its child class (e.g. Series or PublicEvent) and
+        the related objects that are used by names, URLs and display colors,
+        in a single query.  Iterating over the queryset yields instances of
+        each event's own class, without the additional query for each child
+        class that polymorphic querysets require.  Additional relations to
+        load may be passed.
+        '''
+        queryset = self.non_polymorphic().select_related(
+            'location', 'room', 'session', 'series__classDescription__danceTypeLevel',
+            'publicevent__category', *getEventChildLinks(), *related
+        )
+        queryset._iterable_class = EventListingIterable
+        return queryset
+
+
+class EventManager(PolymorphicManager):
+    '''
+    Adds set-based updating of registration status and sort keys for events
+    of all types, so that scheduled tasks do not need to save each event
+    individually, and a listing() queryset that avoids polymorphic queries for
+    each event type.
+    '''
+    queryset_class = EventQuerySet
+
+    def listing(self, *related):
+        return self.get_queryset().listing(*related)
+
+    def get_pricing_tier_lookups(self):
+        '''
+        Pricing tiers are defined on the individual event types (e.g. Series,
+        PublicEvent, PrivateLessonEvent), so return the lookups from Event to
+        each of them.
+        '''
+        Event = apps.get_model('core', 'Event')
+        lookups = []
+        for model in apps.get_models():
+            parent_link = model._meta.parents.get(Event)
+            if parent_link and 'pricingTier' in [
+                f.name for f in model._meta.local_fields
+            ]:
+                lookups.append('%s__pricingTier' % parent_link.related_query_name())
+        return lookups
+
+    def get_status_values(self, events=None):
+        '''
+        Return a values queryset with the information needed to determine the
+        registration status of each of the passed events (or all events if
+        None is passed).
+        '''
+        Event = apps.get_model('core', 'Event')
+        EventOccurrence = apps.get_model('core', 'EventOccurrence')
+
+        queryset = Event.objects.non_polymorphic()
+        if self.model is not Event:
+            queryset = queryset.filter(id__in=self.get_queryset().values('id'))
+        if events is not None:
+            queryset = queryset.filter(id__in=(
+                events.values('id') if isinstance(events, models.QuerySet)
+                else [getattr(x, 'id', x) for x in events]
+            ))
+
+        occurrences = EventOccurrence.objects.filter(event=OuterRef('pk'))
+
+        return queryset.order_by().annotate(
+            firstStartTime=Coalesce('startTime', Subquery(
+                occurrences.order_by('startTime').values('startTime')[:1]
+            )),
+            lastEndTime=Coalesce('endTime', Subquery(
+                occurrences.order_by('-endTime').values('endTime')[:1]
+            )),
+        ).values(
+            'id', 'location', 'status', 'registrationOpen', 'closeAfterDays',
+            'firstStartTime', 'lastEndTime', *self.get_pricing_tier_lookups()
+        )
+
+    def updateRegistrationStatus(self, events=None, batch_size=500):
+        '''
+        Open or close registration for the passed events (or all events if
+        None is passed) using the same rules as
+        Event.updateRegistrationStatus(), but with one query to determine the
+        new status and one update to apply the changes.  Because this does not
+        call save(), the times and sessions of events are not recomputed, but
+        the cached data of the events that have changed is invalidated.
+        Returns a dictionary summarizing the changes that were made.
+        '''
+        # Imported here because the invalidation module imports the models.
+        from danceschool.core.invalidation import invalidateEventData
+
+        Event = apps.get_model('core', 'Event')
+        now = timezone.now()
+        tier_lookups = self.get_pricing_tier_lookups()
+
+        checked = 0
+        opened = []
+        closed = []
+        locations = set()
+
+        for row in self.get_status_values(events).iterator():
+            checked += 1
+            modified, open = Event.getRegistrationStatus(
+                row['status'], row['registrationOpen'],
+                any(row[x] for x in tier_lookups),
+                row['firstStartTime'], row['lastEndTime'],
+                row['closeAfterDays'], now=now
+            )
+            if modified and open:
+                opened.append(row['id'])
+            elif modified:
+                closed.append(row['id'])
+            if modified:
+                locations.add(row['location'])
+
+        changed = opened + closed
+        opened_set = set(opened)
+        for i in range(0, len(changed), batch_size):
+            batch = changed[i:i + batch_size]
+            Event.objects.non_polymorphic().filter(id__in=batch).update(
+                registrationOpen=Case(
+                    When(id__in=[x for x in batch if x in opened_set], then=Value(True)),
+                    default=Value(False), output_field=BooleanField()
+                ),
+                modified=now,
+            )
+
+        if changed:
+            invalidateEventData(events=changed, locations=locations)
+
+        return {'checked': checked, 'opened': opened, 'closed': closed}
+
+    def updateSortKeys(self, events=None, rule=None, batch_size=500):
+        '''
+        Recompute the stored sort keys of the passed events (or all events if
+        None is passed) for the passed organization rule (by default, the
+        registration__orgRule preference), and save those that have changed.
+        Returns the number of events updated.
+        '''
+        Event = apps.get_model('core', 'Event')
+        rule = rule or getConstant('registration__orgRule')
+
+        queryset = Event.objects.non_polymorphic().order_by()
+        if events is not None:
+            queryset = queryset.filter(id__in=(
+                events.values('id') if isinstance(events, models.QuerySet)
+                else [getattr(x, 'id', x) for x in events]
+            ))
+
+        changed = []
+        for row in queryset.values_list(
+            'id', 'session__startTime', 'session__name', 'year', 'month',
+            'startTime', 'sortGroup', 'sortPrimary', 'sortSecondary',
+        ).iterator():
+            keys = getSortKeys(rule, *row[1:6])
+            if keys != row[6:]:
+                changed.append(Event(
+                    id=row[0], sortGroup=keys[0], sortPrimary=keys[1], sortSecondary=keys[2]
+                ))
+
+        Event.objects.non_polymorphic().bulk_update(
+            changed, ['sortGroup', 'sortPrimary', 'sortSecondary'], batch_size=batch_size
+        )
+        return len(changed)
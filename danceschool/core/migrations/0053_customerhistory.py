@@ -0,0 +1,35 @@
+# Generated by Django 3.1.14 on 2026-10-19 04:09
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0052_auto_20210324_0009'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CustomerHistory',
+            fields=[
+                ('customer', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='history', serialize=False, to='core.customer', verbose_name='Customer')),
+                ('numEventRegistrations', models.PositiveIntegerField(default=0, verbose_name='# Events/series registered')),
+                ('numClassSeries', models.PositiveIntegerField(default=0, verbose_name='# Series registered')),
+                ('numPublicEvents', models.PositiveIntegerField(default=0, verbose_name='# Public events registered')),
+                ('numDropIns', models.PositiveIntegerField(default=0, verbose_name='# Drop-ins registered')),
+                ('firstSeriesDate', models.DateTimeField(blank=True, null=True, verbose_name="Customer's first series date")),
+                ('lastSeriesDate', models.DateTimeField(blank=True, null=True, verbose_name="Customer's most recent series date")),
+                ('totalSpent', models.FloatField(default=0, verbose_name='Lifetime spending')),
+                ('lastRegistrationDate', models.DateTimeField(blank=True, null=True, verbose_name='Most recent registration date')),
+                ('modifiedDate', models.DateTimeField(auto_now=True, verbose_name='Last updated')),
+                ('firstSeries', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='core.event', verbose_name="Customer's first series")),
+                ('lastSeries', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='core.event', verbose_name="Customer's most recent series")),
+            ],
+            options={
+                'verbose_name': 'Customer registration history',
+                'verbose_name_plural': 'Customer registration histories',
+            },
+        ),
+    ]
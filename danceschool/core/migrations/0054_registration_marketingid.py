@@ -0,0 +1,45 @@
+# Generated by Django 3.1.14 on 2026-10-19 04:46
+
+from django.db import migrations, models
+from django.db.models import Q
+
+
+def set_marketingid(apps, schema_editor):
+    '''
+    Marketing IDs were previously stored in the data of the registration, or
+    in the data of its invoice.
+    '''
+    Registration = apps.get_model("core", "Registration")
+    db_alias = schema_editor.connection.alias
+
+    to_update = []
+    for reg in Registration.objects.using(db_alias).filter(
+        Q(data__has_key='marketing_id') | Q(invoice__data__has_key='marketing_id')
+    ).select_related('invoice').iterator():
+        marketing_id = (
+            (reg.data if isinstance(reg.data, dict) else {}).get('marketing_id') or
+            (reg.invoice.data if isinstance(reg.invoice.data, dict) else {}).get('marketing_id')
+        )
+        if marketing_id:
+            reg.marketingId = str(marketing_id)[:100]
+            to_update.append(reg)
+
+    Registration.objects.using(db_alias).bulk_update(
+        to_update, ['marketingId'], batch_size=500
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0053_customerhistory'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='registration',
+            name='marketingId',
+            field=models.CharField(blank=True, db_index=True, max_length=100, null=True, verbose_name='Marketing ID'),
+        ),
+        migrations.RunPython(set_marketingid, migrations.RunPython.noop),
+    ]
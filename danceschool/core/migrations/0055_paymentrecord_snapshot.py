@@ -0,0 +1,23 @@
+# Generated by Django 3.1.14 on 2026-10-19 04:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0054_registration_marketingid'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='paymentrecord',
+            name='snapshot',
+            field=models.JSONField(blank=True, default=dict, editable=False, verbose_name='Payment processor data'),
+        ),
+        migrations.AddField(
+            model_name='paymentrecord',
+            name='snapshotDate',
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name='Payment processor data last updated'),
+        ),
+    ]
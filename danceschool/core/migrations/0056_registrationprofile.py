@@ -0,0 +1,38 @@
+# Generated by Django 3.1.14 on 2026-10-19 04:53
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0055_paymentrecord_snapshot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RegistrationProfile',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('step', models.CharField(max_length=100, verbose_name='Registration step')),
+                ('path', models.CharField(max_length=255, verbose_name='Path')),
+                ('method', models.CharField(max_length=10, verbose_name='Method')),
+                ('statusCode', models.PositiveSmallIntegerField(blank=True, null=True, verbose_name='Response status code')),
+                ('dateTime', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Date/time')),
+                ('duration', models.FloatField(verbose_name='Duration (ms)')),
+                ('queryCount', models.PositiveIntegerField(verbose_name='Number of queries')),
+                ('queryTime', models.FloatField(verbose_name='Query time (ms)')),
+                ('receivers', models.JSONField(blank=True, default=list, verbose_name='Signal receivers')),
+            ],
+            options={
+                'verbose_name': 'Registration profile',
+                'verbose_name_plural': 'Registration profiles',
+                'ordering': ('-dateTime',),
+            },
+        ),
+        migrations.AddIndex(
+            model_name='registrationprofile',
+            index=models.Index(fields=['step', 'dateTime'], name='core_regist_step_5b2832_idx'),
+        ),
+    ]
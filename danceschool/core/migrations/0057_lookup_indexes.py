@@ -0,0 +1,29 @@
+# Generated by Django 3.1.14 on 2026-10-19 04:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0056_registrationprofile'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='customer',
+            index=models.Index(fields=['email'], name='core_custom_email_899d12_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='eventoccurrence',
+            index=models.Index(fields=['event', 'startTime'], name='core_evento_event_i_c5a78d_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='eventregistration',
+            index=models.Index(fields=['event', 'cancelled', 'dropIn', 'role'], name='core_eventr_event_i_f7f88b_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['status', 'expirationDate'], name='core_invoic_status_0237dd_idx'),
+        ),
+    ]
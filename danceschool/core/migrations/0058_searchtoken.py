@@ -0,0 +1,69 @@
+# Generated by Django 3.1.14 on 2026-10-19 07:02
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+from danceschool.core.search import SEARCH_FIELDS, getInstanceTokens
+
+
+def buildSearchIndex(apps, schema_editor):
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    SearchToken = apps.get_model('core', 'SearchToken')
+    db_alias = schema_editor.connection.alias
+
+    for label, fields in SEARCH_FIELDS.items():
+        model = apps.get_model(label)
+        queryset = model.objects.using(db_alias).order_by('pk')
+        if not queryset.exists():
+            continue
+        app_label, model_name = label.split('.')
+        ct = ContentType.objects.using(db_alias).get_or_create(
+            app_label=app_label, model=model_name
+        )[0]
+
+        tokens = []
+        for instance in queryset.iterator():
+            tokens += [
+                SearchToken(contentType=ct, objectId=instance.pk, token=token, weight=weight)
+                for token, weight in getInstanceTokens(instance, fields).items()
+            ]
+            if len(tokens) >= 1000:
+                SearchToken.objects.using(db_alias).bulk_create(tokens)
+                tokens = []
+        SearchToken.objects.using(db_alias).bulk_create(tokens)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('core', '0057_lookup_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchToken',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('objectId', models.PositiveIntegerField(verbose_name='Object ID')),
+                ('token', models.CharField(max_length=50, verbose_name='Token')),
+                ('weight', models.PositiveSmallIntegerField(default=1, verbose_name='Weight')),
+                ('contentType', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='contenttypes.contenttype', verbose_name='Content type')),
+            ],
+            options={
+                'verbose_name': 'Search token',
+                'verbose_name_plural': 'Search tokens',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='searchtoken',
+            index=models.Index(fields=['contentType', 'token'], name='core_search_content_81ebdf_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='searchtoken',
+            index=models.Index(fields=['contentType', 'objectId'], name='core_search_content_1a5706_idx'),
+        ),
+        migrations.RunPython(buildSearchIndex, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 3.1.14 on 2026-10-19 11:24
+
+from django.db import migrations, models
+
+from danceschool.core.ordering import getSortKeys
+
+
+def computeSortKeys(apps, schema_editor):
+    Event = apps.get_model('core', 'Event')
+    GlobalPreferenceModel = apps.get_model('dynamic_preferences', 'GlobalPreferenceModel')
+    db_alias = schema_editor.connection.alias
+
+    rule = GlobalPreferenceModel.objects.using(db_alias).filter(
+        section='registration', name='orgRule'
+    ).values_list('raw_value', flat=True).first() or 'SessionFirst'
+
+    events = []
+    for row in Event.objects.using(db_alias).values_list(
+        'id', 'session__startTime', 'session__name', 'year', 'month', 'startTime'
+    ).iterator():
+        keys = getSortKeys(rule, *row[1:])
+        events.append(Event(
+            id=row[0], sortGroup=keys[0], sortPrimary=keys[1], sortSecondary=keys[2]
+        ))
+    Event.objects.using(db_alias).bulk_update(
+        events, ['sortGroup', 'sortPrimary', 'sortSecondary'], batch_size=500
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dynamic_preferences', '0001_initial'),
+        ('core', '0058_searchtoken'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='sortGroup',
+            field=models.PositiveSmallIntegerField(blank=True, editable=False, null=True, verbose_name='Sort group'),
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='sortPrimary',
+            field=models.CharField(blank=True, editable=False, max_length=100, null=True, verbose_name='Primary sort key'),
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='sortSecondary',
+            field=models.CharField(blank=True, editable=False, max_length=100, null=True, verbose_name='Secondary sort key'),
+        ),
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(fields=['sortGroup', 'sortPrimary', 'sortSecondary', 'startTime'], name='core_event_sortGro_5e6e6a_idx'),
+        ),
+        migrations.RunPython(computeSortKeys, migrations.RunPython.noop),
+    ]
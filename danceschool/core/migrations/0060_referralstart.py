@@ -0,0 +1,52 @@
+# Generated by Django 3.1.14 on 2026-10-19 14:12
+
+from django.db import migrations, models
+from django.utils import timezone
+
+from collections import Counter
+
+
+def countReferralStarts(apps, schema_editor):
+    '''
+    Registrations that were begun and never completed may already have been
+    deleted, so the counts are seeded from the registrations that remain.
+    '''
+    Registration = apps.get_model('core', 'Registration')
+    ReferralStart = apps.get_model('core', 'ReferralStart')
+    db_alias = schema_editor.connection.alias
+
+    counts = Counter(
+        (marketingId, timezone.localtime(dateTime).date())
+        for marketingId, dateTime in Registration.objects.using(db_alias).filter(
+            marketingId__isnull=False
+        ).exclude(marketingId='').values_list('marketingId', 'dateTime').iterator()
+    )
+    ReferralStart.objects.using(db_alias).bulk_create([
+        ReferralStart(marketingId=k[0], date=k[1], started=v)
+        for k, v in counts.items()
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0059_event_sort_keys'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReferralStart',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('marketingId', models.CharField(max_length=100, verbose_name='Marketing ID')),
+                ('date', models.DateField(verbose_name='Date')),
+                ('started', models.PositiveIntegerField(default=0, verbose_name='Registrations started')),
+            ],
+            options={
+                'verbose_name': 'Referral registrations started',
+                'verbose_name_plural': 'Referral registrations started',
+                'unique_together': {('marketingId', 'date')},
+            },
+        ),
+        migrations.RunPython(countReferralStarts, migrations.RunPython.noop),
+    ]
@@ -1,6 +1,8 @@
 from django.db import models
+from django.conf import settings
 from django.contrib.auth.models import User, Group
 from django.contrib.sites.models import Site
+from django.contrib.contenttypes.models import ContentType
 from django.urls import reverse
 from django.core.exceptions import ValidationError, ObjectDoesNotExist
 from django.db.models import Q, Sum, F, Case, When, Value, Count
@@ -35,9 +37,11 @@ from .signals import (
 from .mixins import EmailRecipientMixin
 from .utils.emails import get_text_for_html
 from .utils.timezone import ensure_localtime
+from .ordering import SORT_KEY_LENGTH, getSortKeys
 from .managers import (
     InvoiceManager, SeriesTeacherManager, SubstituteTeacherManager,
-    EventDJManager, SeriesStaffManager
+    EventDJManager, SeriesStaffManager, CustomerHistoryManager, EventManager,
+    SearchTokenManager, ReferralStartManager
 )
 
 
@@ -708,6 +712,9 @@ class EventSession(models.Model):
 
         super().save(*args, **kwargs)
 
+        # The sort keys of the session's events depend on its name and times.
+        Event.objects.updateSortKeys(events=self.event_set.all())
+
     def __str__(self):
         return self.name
 
@@ -879,6 +886,23 @@ class Event(EmailRecipientMixin, PolymorphicModel):
 
     data = models.JSONField(_('Additional data'), default=dict, blank=True)
 
+    # These sort keys implement the registration__orgRule preference (see
+    # ordering.py).  They are updated on save, and for all events when the
+    # preference is changed.
+    sortGroup = models.PositiveSmallIntegerField(
+        _('Sort group'), null=True, blank=True, editable=False
+    )
+    sortPrimary = models.CharField(
+        _('Primary sort key'), max_length=SORT_KEY_LENGTH, null=True, blank=True,
+        editable=False
+    )
+    sortSecondary = models.CharField(
+        _('Secondary sort key'), max_length=SORT_KEY_LENGTH, null=True, blank=True,
+        editable=False
+    )
+
+    objects = EventManager()
+
     @property
     def localStartTime(self):
         return ensure_localtime(self.startTime)
@@ -1121,13 +1145,29 @@ class Event(EmailRecipientMixin, PolymorphicModel):
 
         return (None, None)
 
+    def getPrefetchedOccurrences(self):
+        '''
+        Return the occurrences of this event in order if they have been
+        prefetched (e.g. by plugin_cache.prefetchEventListData()), and
+        otherwise None.
+        '''
+        occurrences = getattr(self, '_prefetched_objects_cache', {}).get('eventoccurrence_set')
+        if occurrences is not None:
+            return sorted(occurrences, key=lambda x: x.startTime)
+
     @property
     def numOccurrences(self):
+        occurrences = self.getPrefetchedOccurrences()
+        if occurrences is not None:
+            return len(occurrences)
         return self.eventoccurrence_set.count()
     numOccurrences.fget.short_description = _('# Occurrences')
 
     @property
     def firstOccurrence(self):
+        occurrences = self.getPrefetchedOccurrences()
+        if occurrences is not None:
+            return occurrences[0] if occurrences else None
         return self.eventoccurrence_set.order_by('startTime').first()
     firstOccurrence.fget.short_description = _('First occurrence')
 
@@ -1182,6 +1222,9 @@ class Event(EmailRecipientMixin, PolymorphicModel):
 
     @property
     def lastOccurrence(self):
+        occurrences = self.getPrefetchedOccurrences()
+        if occurrences is not None:
+            return occurrences[-1] if occurrences else None
         return self.eventoccurrence_set.order_by('startTime').last()
     lastOccurrence.fget.short_description = _('Last occurrence')
 
@@ -1258,6 +1301,9 @@ class Event(EmailRecipientMixin, PolymorphicModel):
 
     @property
     def numRegistered(self):
+        # Listings may count the registrations of many events at once.
+        if getattr(self, '_numRegistered', None) is not None:
+            return self._numRegistered
         return self.getNumRegistered()
     numRegistered.fget.short_description = _('# Registered')
 
@@ -1399,80 +1445,111 @@ class Event(EmailRecipientMixin, PolymorphicModel):
         if changed and not saveMethod:
             self.save()
 
-    def updateRegistrationStatus(self, saveMethod=False):
+    def getSortKeys(self, rule=None):
         '''
-        If called via cron job or otherwise, then update the registrationOpen
-        property for this series to reflect any manual override and/or the automatic
-        closing of this series for registration.
+        Return the sort keys of this event for the passed organization rule
+        (by default, the registration__orgRule preference).
         '''
-        logger.debug('Beginning update registration status.  saveMethod=%s' % saveMethod)
+        return getSortKeys(
+            rule or getConstant('registration__orgRule'),
+            getattr(self.session, 'startTime', None), getattr(self.session, 'name', None),
+            self.year, self.month, self.startTime
+        )
 
-        modified = False
-        open = self.registrationOpen
+    @classmethod
+    def getRegistrationStatus(
+        cls, status, registrationOpen, pricingTier, startTime, endTime,
+        closeAfterDays, now=None
+    ):
+        '''
+        Determine whether registration should be open for an event with the
+        passed status, pricing tier, times and closeAfterDays value.  This is
+        used both by updateRegistrationStatus() for individual events and by
+        Event.objects.updateRegistrationStatus() for all events at once.
+        Returns a tuple of (modified, open).
+        '''
+        now = now or timezone.now()
 
-        startTime = (
-            ensure_localtime(self.startTime) or
-            getattr(self.eventoccurrence_set.order_by('startTime').first(), 'startTime', None)
-        )
-        endTime = (
-            ensure_localtime(self.endTime) or
-            getattr(self.eventoccurrence_set.order_by('-endTime').first(), 'endTime', None)
-        )
+        modified = False
+        open = registrationOpen
 
         # If set to these codes, then registration will be held closed
         force_closed_codes = [
-            self.RegStatus.disabled,
-            self.RegStatus.heldClosed,
-            self.RegStatus.regHidden,
-            self.RegStatus.hidden
+            cls.RegStatus.disabled,
+            cls.RegStatus.heldClosed,
+            cls.RegStatus.regHidden,
+            cls.RegStatus.hidden
         ]
         # If set to these codes, then registration will be held open
         force_open_codes = [
-            self.RegStatus.heldOpen,
+            cls.RegStatus.heldOpen,
         ]
 
         # If set to these codes, then registration will be open or closed
         # automatically depending on the value of closeAfterDays
         automatic_codes = [
-            self.RegStatus.enabled,
-            self.RegStatus.linkOnly,
+            cls.RegStatus.enabled,
+            cls.RegStatus.linkOnly,
         ]
 
-        if (self.status in force_closed_codes or not self.pricingTier) and open is True:
+        if (status in force_closed_codes or not pricingTier) and open is True:
             open = False
             modified = True
-        elif not self.pricingTier:
+        elif not pricingTier:
             open = False
             modified = False
-        elif (self.status in force_open_codes and self.pricingTier) and open is False:
+        elif (status in force_open_codes and pricingTier) and open is False:
             open = True
             modified = True
         elif (
-            startTime and self.status in automatic_codes and
+            startTime and status in automatic_codes and
             (
                 (
-                    self.closeAfterDays and
-                    timezone.now() > startTime + timedelta(days=self.closeAfterDays)
+                    closeAfterDays and
+                    now > startTime + timedelta(days=closeAfterDays)
                 ) or
-                timezone.now() > endTime
+                (endTime is not None and now > endTime)
             ) and
             open is True
         ):
             open = False
             modified = True
         elif (
-            startTime and self.status in automatic_codes and
+            startTime and status in automatic_codes and
             (
-                (timezone.now() < endTime and not self.closeAfterDays) or
+                (endTime is not None and now < endTime and not closeAfterDays) or
                 (
-                    self.closeAfterDays and
-                    timezone.now() < startTime + timedelta(days=self.closeAfterDays)
+                    closeAfterDays and
+                    now < startTime + timedelta(days=closeAfterDays)
                 )
             ) and
             open is False
         ):
             open = True
             modified = True
+        return (modified, open)
+
+    def updateRegistrationStatus(self, saveMethod=False):
+        '''
+        If called via cron job or otherwise, then update the registrationOpen
+        property for this series to reflect any manual override and/or the automatic
+        closing of this series for registration.
+        '''
+        logger.debug('Beginning update registration status.  saveMethod=%s' % saveMethod)
+
+        startTime = (
+            ensure_localtime(self.startTime) or
+            getattr(self.eventoccurrence_set.order_by('startTime').first(), 'startTime', None)
+        )
+        endTime = (
+            ensure_localtime(self.endTime) or
+            getattr(self.eventoccurrence_set.order_by('-endTime').first(), 'endTime', None)
+        )
+
+        modified, open = self.getRegistrationStatus(
+            self.status, self.registrationOpen, getattr(self, 'pricingTier_id', None),
+            startTime, endTime, self.closeAfterDays
+        )
 
         # Save if something has changed, otherwise, do nothing
         if modified and not saveMethod:
@@ -1521,6 +1598,7 @@ class Event(EmailRecipientMixin, PolymorphicModel):
             logger.debug(
                 'Finished checking status and ready for super call. Value is %s' % self.registrationOpen
             )
+        self.sortGroup, self.sortPrimary, self.sortSecondary = self.getSortKeys()
         super().save(*args, **kwargs)
 
         # Update start time and end time for associated event session.
@@ -1531,6 +1609,9 @@ class Event(EmailRecipientMixin, PolymorphicModel):
         return str(_('Event: %s' % self.name))
 
     class Meta:
+        indexes = [
+            models.Index(fields=['sortGroup', 'sortPrimary', 'sortSecondary', 'startTime']),
+        ]
         verbose_name = _('Series/Event')
         verbose_name_plural = _('All Series/Events')
         ordering = ('-startTime',)
@@ -1641,6 +1722,9 @@ class EventOccurrence(models.Model):
         verbose_name = _('Event occurrence')
         verbose_name_plural = _('Event occurrences')
         ordering = ('event', 'startTime')
+        indexes = [
+            models.Index(fields=['event', 'startTime']),
+        ]
         constraints = [
             models.CheckConstraint(
                 check=Q(endTime__gte=F('startTime')),
@@ -1767,8 +1851,21 @@ class Series(Event):
     )
 
     def getTeachers(self, includeSubstitutes=False):
-        seriesTeachers = SeriesTeacher.objects.filter(event=self)
-        seriesTeachers = set([t.staffMember for t in seriesTeachers])
+        staff = getattr(self, '_prefetched_objects_cache', {}).get('eventstaffmember_set')
+        if staff is not None:
+            # Listings look up the instructor category once for all events.
+            if hasattr(self, '_instructorCategoryId'):
+                category_id = self._instructorCategoryId
+            else:
+                category_id = getattr(
+                    getConstant('general__eventStaffCategoryInstructor'), 'id', None
+                )
+            seriesTeachers = set([
+                t.staffMember for t in staff if t.category_id == category_id
+            ])
+        else:
+            seriesTeachers = SeriesTeacher.objects.filter(event=self)
+            seriesTeachers = set([t.staffMember for t in seriesTeachers])
 
         if includeSubstitutes:
             for c in self.eventoccurrence_set:
@@ -1858,7 +1955,8 @@ class Series(Event):
 
     @property
     def url(self):
-        orgRule = getConstant('registration__orgRule')
+        # Listings look up the rule once for all of their events.
+        orgRule = getattr(self, '_orgRule', None) or getConstant('registration__orgRule')
 
         if self.status in [self.RegStatus.hidden, self.RegStatus.linkOnly]:
             return None
@@ -2116,7 +2214,8 @@ class PublicEvent(Event):
 
     @property
     def url(self):
-        orgRule = getConstant('registration__orgRule')
+        # Listings look up the rule once for all of their events.
+        orgRule = getattr(self, '_orgRule', None) or getConstant('registration__orgRule')
 
         if self.status in [self.RegStatus.hidden, self.RegStatus.linkOnly]:
             return None
@@ -2207,69 +2306,56 @@ class Customer(EmailRecipientMixin, models.Model):
         return ' '.join([self.first_name or '', self.last_name or ''])
     fullName.fget.short_description = _('Name')
 
+    def getHistory(self):
+        '''
+        Return the stored registration history summary for this customer,
+        computing and storing it first if it does not yet exist.
+        '''
+        try:
+            return self.history
+        except ObjectDoesNotExist:
+            CustomerHistory.objects.refresh([self.id, ])
+            self.history = CustomerHistory.objects.get(customer=self)
+            return self.history
+
     @property
     def numEventRegistrations(self):
-        return EventRegistration.objects.filter(
-            customer=self, dropIn=False, cancelled=False,
-            registration__final=True
-        ).count()
+        return self.getHistory().numEventRegistrations
     numEventRegistrations.fget.short_description = _('# Events/series registered')
 
     @property
     def numClassSeries(self):
-        return EventRegistration.objects.filter(
-            customer=self, event__series__isnull=False,
-            dropIn=False, cancelled=False, registration__final=True
-        ).count()
+        return self.getHistory().numClassSeries
     numClassSeries.fget.short_description = _('# Series registered')
 
     @property
     def numPublicEvents(self):
-        return EventRegistration.objects.filter(
-            customer=self, event__publicevent__isnull=False,
-            dropIn=False, cancelled=False,
-            registration__final=True
-        ).count()
+        return self.getHistory().numPublicEvents
     numPublicEvents.fget.short_description = _('# Public events registered')
 
     @property
     def numDropIns(self):
-        return EventRegistration.objects.filter(
-            customer=self, dropIn=True, cancelled=False,
-            registration__final=True
-        ).count()
-    numPublicEvents.fget.short_description = _('# Drop-ins registered')
+        return self.getHistory().numDropIns
+    numDropIns.fget.short_description = _('# Drop-ins registered')
 
     @property
     def firstSeries(self):
-        return EventRegistration.objects.filter(
-            customer=self, event__series__isnull=False,
-            dropIn=False, cancelled=False, registration__final=True
-        ).order_by('event__startTime').first().event
+        return self.getHistory().firstSeries
     firstSeries.fget.short_description = _('Customer\'s first series')
 
     @property
     def firstSeriesDate(self):
-        return EventRegistration.objects.filter(
-            customer=self, event__series__isnull=False,
-            dropIn=False, cancelled=False, registration__final=True
-        ).order_by('event__startTime').first().event.startTime
+        return self.getHistory().firstSeriesDate
     firstSeriesDate.fget.short_description = _('Customer\'s first series date')
 
     @property
     def lastSeries(self):
-        return EventRegistration.objects.filter(
-            customer=self, event__series__isnull=False,
-            dropIn=False, cancelled=False, registration__final=True
-        ).order_by('-event__startTime').first().event
+        return self.getHistory().lastSeries
     lastSeries.fget.short_description = _('Customer\'s most recent series')
 
     @property
     def lastSeriesDate(self):
-        return EventRegistration.objects.filter(
-            customer=self, event__series__isnull=False,
-            dropIn=False, cancelled=False, registration__final=True
-        ).order_by('-event__startTime').first().event.startTime
+        return self.getHistory().lastSeriesDate
     lastSeriesDate.fget.short_description = _('Customer\'s most recent series date')
 
     def getSeriesRegistered(self, q_filter=Q(), distinct=True, counter=False, **kwargs):
@@ -2316,7 +2402,11 @@ class Customer(EmailRecipientMixin, models.Model):
         return '%s: %s' % (self.fullName, self.email)
 
     class Meta:
+        # The unique constraint also serves lookups by name and email.
         unique_together = ('last_name', 'first_name', 'email')
+        indexes = [
+            models.Index(fields=['email']),
+        ]
         ordering = ('last_name', 'first_name')
         permissions = (
             (
@@ -2329,6 +2419,87 @@ class Customer(EmailRecipientMixin, models.Model):
         verbose_name_plural = _('Customers')
 
 
+class CustomerHistory(models.Model):
+    '''
+    A denormalized summary of each customer's registration history.  Counting
+    a customer's registrations requires several queries, and these counts are
+    needed repeatedly during the registration process (e.g. to check for new
+    customer discounts and vouchers), so they are stored here and refreshed
+    whenever a registration is finalized or cancelled.  The
+    rebuild_customer_history management command recomputes all records.
+    '''
+    customer = models.OneToOneField(
+        Customer, primary_key=True, related_name='history',
+        verbose_name=_('Customer'), on_delete=models.CASCADE
+    )
+
+    numEventRegistrations = models.PositiveIntegerField(
+        _('# Events/series registered'), default=0
+    )
+    numClassSeries = models.PositiveIntegerField(_('# Series registered'), default=0)
+    numPublicEvents = models.PositiveIntegerField(_('# Public events registered'), default=0)
+    numDropIns = models.PositiveIntegerField(_('# Drop-ins registered'), default=0)
+
+    firstSeries = models.ForeignKey(
+        Event, null=True, blank=True, related_name='+',
+        verbose_name=_('Customer\'s first series'), on_delete=models.SET_NULL
+    )
+    firstSeriesDate = models.DateTimeField(
+        _('Customer\'s first series date'), null=True, blank=True
+    )
+    lastSeries = models.ForeignKey(
+        Event, null=True, blank=True, related_name='+',
+        verbose_name=_('Customer\'s most recent series'), on_delete=models.SET_NULL
+    )
+    lastSeriesDate = models.DateTimeField(
+        _('Customer\'s most recent series date'), null=True, blank=True
+    )
+
+    totalSpent = models.FloatField(_('Lifetime spending'), default=0)
+    lastRegistrationDate = models.DateTimeField(
+        _('Most recent registration date'), null=True, blank=True
+    )
+
+    modifiedDate = models.DateTimeField(_('Last updated'), auto_now=True)
+
+    objects = CustomerHistoryManager()
+
+    def __str__(self):
+        return '%s: %s' % (_('Registration history'), self.customer.fullName)
+
+    class Meta:
+        verbose_name = _('Customer registration history')
+        verbose_name_plural = _('Customer registration histories')
+
+
+class SearchToken(models.Model):
+    '''
+    A normalized word from one of the searchable fields of a user, customer,
+    staff member or class description, used by the autocomplete views.
+    Tokens are updated whenever a searchable object is saved, and the
+    rebuild_search_index management command recreates all of them.
+    '''
+    contentType = models.ForeignKey(
+        ContentType, verbose_name=_('Content type'), on_delete=models.CASCADE
+    )
+    objectId = models.PositiveIntegerField(_('Object ID'))
+    token = models.CharField(_('Token'), max_length=50)
+    weight = models.PositiveSmallIntegerField(_('Weight'), default=1)
+
+    objects = SearchTokenManager()
+
+    def __str__(self):
+        return '%s %s: %s' % (self.contentType, self.objectId, self.token)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['contentType', 'token']),
+            models.Index(fields=['contentType', 'objectId']),
+        ]
+        verbose_name = _('Search token')
+        verbose_name_plural = _('Search tokens')
+
+
 class Invoice(EmailRecipientMixin, models.Model):
 
     class PaymentStatus(models.TextChoices):
@@ -3000,6 +3171,9 @@ class Invoice(EmailRecipientMixin, models.Model):
 
     class Meta:
         ordering = ('-modifiedDate',)
+        indexes = [
+            models.Index(fields=['status', 'expirationDate']),
+        ]
         verbose_name = _('Invoice')
         verbose_name_plural = _('Invoices')
         permissions = (
@@ -3152,6 +3326,14 @@ class Registration(EmailRecipientMixin, models.Model):
 
     comments = models.TextField(_('Comments'), default='', blank=True, null=True)
 
+    # When a user accesses the registration page through a referral URL, the
+    # marketing ID in that URL is recorded here so that referrals can be
+    # counted without reading the data of each registration.
+    marketingId = models.CharField(
+        _('Marketing ID'), max_length=100, null=True, blank=True,
+        db_index=True,
+    )
+
     invoice = models.OneToOneField(
         Invoice, verbose_name=_('Invoice'),
         related_name='registration',
@@ -3582,6 +3764,28 @@ class Registration(EmailRecipientMixin, models.Model):
         )
 
 
+class ReferralStart(models.Model):
+    '''
+    The number of registrations begun through each referral marketing ID on
+    each day.  Registrations that are never completed are deleted along with
+    their expired invoices, so these counts are kept separately in order to
+    report the share of begun registrations that were completed.
+    '''
+    marketingId = models.CharField(_('Marketing ID'), max_length=100)
+    date = models.DateField(_('Date'))
+    started = models.PositiveIntegerField(_('Registrations started'), default=0)
+
+    objects = ReferralStartManager()
+
+    def __str__(self):
+        return '%s %s: %s' % (self.marketingId, self.date, self.started)
+
+    class Meta:
+        unique_together = ('marketingId', 'date')
+        verbose_name = _('Referral registrations started')
+        verbose_name_plural = _('Referral registrations started')
+
+
 class EventRegistration(EmailRecipientMixin, models.Model):
     '''
     An EventRegistration is associated with a Registration and records
@@ -3645,28 +3849,28 @@ class EventRegistration(EmailRecipientMixin, models.Model):
         these conditions and indicates if anything is amiss so that the template need not
         check each of these conditions individually repeatedly.
         '''
-        if not hasattr(self, 'invoiceitem'):
+        if not getattr(self, 'invoiceItem', None):
             return True
         if apps.is_installed('danceschool.financial'):
             '''
             If the financial app is installed, then we can also check additional
             properties set by that app to ensure that there are no inconsistencies
             '''
-            if self.invoiceitem.revenueNotYetReceived != 0 or self.invoiceitem.revenueMismatch:
+            if self.invoiceItem.revenueNotYetReceived != 0 or self.invoiceItem.revenueMismatch:
                 return True
         return (
-            self.invoiceitem.invoice.unpaid or self.invoiceitem.invoice.outstandingBalance != 0
+            self.invoiceItem.invoice.unpaid or self.invoiceItem.invoice.outstandingBalance != 0
         )
     warningFlag.fget.short_description = _('Issue with event registration')
 
     @property
     def refundFlag(self):
         if (
-            not hasattr(self, 'invoiceitem') or
-            self.invoiceitem.invoice.adjustments != 0 or
+            not getattr(self, 'invoiceItem', None) or
+            self.invoiceItem.invoice.adjustments != 0 or
             (
                 apps.is_installed('danceschool.financial') and
-                self.invoiceitem.revenueRefundsReported != 0
+                self.invoiceItem.revenueRefundsReported != 0
             )
         ):
             return True
@@ -3715,6 +3919,11 @@ class EventRegistration(EmailRecipientMixin, models.Model):
 
         return self.eventcheckin_set.filter(filters).exists()
 
+    def __init__(self, *args, **kwargs):
+        ''' Keep track of initial cancellation status to detect changes. '''
+        super().__init__(*args, **kwargs)
+        self.__initial_cancelled = self.cancelled
+
     def link_invoice_item(self, **kwargs):
         '''
         If an invoice item does not already exist for this event registration,
@@ -3777,6 +3986,15 @@ class EventRegistration(EmailRecipientMixin, models.Model):
         self.invoiceItem = self.link_invoice_item(**link_kwargs)
         super().save(*args, **kwargs)
 
+        # Cancelling (or un-cancelling) a finalized registration changes the
+        # customer's stored registration history.
+        if (
+            self.cancelled != self.__initial_cancelled and self.customer_id and
+            getattr(self.registration, 'final', False)
+        ):
+            CustomerHistory.objects.refresh([self.customer_id, ])
+        self.__initial_cancelled = self.cancelled
+
     def delete(self, *args, **kwargs):
         '''
         Only allow EventRegistrations to be deleted if the Registration is not
@@ -3800,6 +4018,9 @@ class EventRegistration(EmailRecipientMixin, models.Model):
         return str(self.customer) + " " + str(self.event)
 
     class Meta:
+        indexes = [
+            models.Index(fields=['event', 'cancelled', 'dropIn', 'role']),
+        ]
         verbose_name = _('Event registration')
         verbose_name_plural = _('Event registrations')
 
@@ -4009,6 +4230,18 @@ class PaymentRecord(PolymorphicModel):
         related_name='payments_submitted', on_delete=models.SET_NULL
     )
 
+    # Payment methods that look up amounts, fees, etc. from a payment processor
+    # keep the most recent response in normalized form here, so that each
+    # page or refund that needs these values does not need to call the
+    # payment processor again.
+    snapshot = models.JSONField(
+        _('Payment processor data'), default=dict, blank=True, editable=False
+    )
+    snapshotDate = models.DateTimeField(
+        _('Payment processor data last updated'), null=True, blank=True,
+        editable=False
+    )
+
     @property
     def refundable(self):
         '''
@@ -4049,6 +4282,59 @@ class PaymentRecord(PolymorphicModel):
         '''
         return False
 
+    def getSnapshotData(self):
+        '''
+        Payment methods that keep a snapshot should override this to retrieve
+        the payment from the payment processor and return a dictionary of
+        normalized values, or None if the payment could not be retrieved.
+        '''
+        return None
+
+    def setSnapshot(self, data):
+        '''
+        Store a snapshot of the payment processor data for this record.  Only
+        the snapshot fields are updated, so that this does not overwrite other
+        changes to the record.
+        '''
+        self.snapshot = data
+        self.snapshotDate = timezone.now()
+        if self.pk:
+            PaymentRecord.objects.filter(pk=self.pk).update(
+                snapshot=self.snapshot, snapshotDate=self.snapshotDate
+            )
+        return self.snapshot
+
+    def getSnapshot(self, refresh=False):
+        '''
+        Return the snapshot of the payment processor data for this record,
+        retrieving it again if it has expired or if refresh is True.  If the
+        payment cannot be retrieved, then the last snapshot is returned.
+        '''
+        timeout = getattr(settings, 'PAYMENT_SNAPSHOT_TIMEOUT', 900)
+        if (
+            refresh or not self.snapshotDate or
+            self.snapshotDate + timedelta(seconds=timeout) < timezone.now()
+        ):
+            data = self.getSnapshotData()
+            if data is not None:
+                return self.setSnapshot(data)
+        return self.snapshot
+
+    def refreshSnapshot(self):
+        return self.getSnapshot(refresh=True)
+
+    def getCurrentSnapshot(self):
+        '''
+        Retrieve and store the current snapshot of the payment processor data
+        for this record.  Unlike getSnapshot(), this returns None rather than
+        the last snapshot if the payment cannot be retrieved, for use where
+        stale data must not be relied upon, such as when processing refunds.
+        '''
+        data = self.getSnapshotData()
+        if data is not None:
+            return self.setSnapshot(data)
+        return None
+
     class Meta:
         ordering = ('-modifiedDate',)
         verbose_name = _('Payment record')
@@ -4124,6 +4410,40 @@ class CashPaymentRecord(PaymentRecord):
         verbose_name_plural = _('Cash payment records')
 
 
+class RegistrationProfile(models.Model):
+    '''
+    When the RegistrationProfilingMiddleware is enabled, each request to a
+    step of the registration process is recorded here, along with the time
+    and database queries used by the request and by each signal receiver
+    called during the request.
+    '''
+
+    step = models.CharField(_('Registration step'), max_length=100)
+    path = models.CharField(_('Path'), max_length=255)
+    method = models.CharField(_('Method'), max_length=10)
+    statusCode = models.PositiveSmallIntegerField(_('Response status code'), null=True, blank=True)
+    dateTime = models.DateTimeField(_('Date/time'), default=timezone.now)
+
+    duration = models.FloatField(_('Duration (ms)'))
+    queryCount = models.PositiveIntegerField(_('Number of queries'))
+    queryTime = models.FloatField(_('Query time (ms)'))
+
+    # A list of dictionaries with the signal, receiver, duration, query count
+    # and query time for each receiver called during the request.
+    receivers = models.JSONField(_('Signal receivers'), default=list, blank=True)
+
+    def __str__(self):
+        return '%s: %s (%.0f ms)' % (self.dateTime, self.step, self.duration)
+
+    class Meta:
+        ordering = ('-dateTime',)
+        indexes = [
+            models.Index(fields=['step', 'dateTime']),
+        ]
+        verbose_name = _('Registration profile')
+        verbose_name_plural = _('Registration profiles')
+
+
 class StaffMemberPluginModel(CMSPlugin):
     ''' Views on an individual staff member or instructor use this model for configuration. '''
     staffMember = models.ForeignKey(
@@ -0,0 +1,77 @@
+'''
+Sort keys for ordering events according to the registration__orgRule
+preference (e.g. by session, by month, the combination of the two, or by
+weekday).  These were previously computed in each listing query with
+annotations, which prevented the ordering from using an index.  Instead, the
+keys are stored on each Event and kept up to date when events and sessions
+are saved, and for all events when the preference changes.
+
+Each event has three keys: a group that sorts events whose other keys are
+missing last, and primary and secondary keys.  Keys are stored as strings,
+so that session names, dates and numbers can share the same columns.
+Numbers are zero-padded and datetimes are stored in UTC, so that the
+strings sort in the same order as the values.
+'''
+from datetime import datetime
+import pytz
+
+from .utils.timezone import ensure_localtime
+
+
+# The length of the stored primary and secondary keys.  This matches the
+# maximum length of session names.
+SORT_KEY_LENGTH = 100
+
+
+def getSortValue(value):
+    ''' Convert a number, datetime or string into a string sort key. '''
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(pytz.utc)
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    if isinstance(value, int):
+        return '%010d' % value
+    return str(value)[:SORT_KEY_LENGTH]
+
+
+def getSortKeys(rule, sessionStartTime, sessionName, year, month, startTime):
+    '''
+    Return a tuple of the (group, primary, secondary) sort keys of an event
+    with the passed session start time and name, year, month and start time,
+    for the passed registration__orgRule.
+    '''
+    monthKey = 12 * year + month if year is not None and month is not None else None
+
+    # Django numbers weekdays from Sunday (1) to Saturday (7).
+    weekday = ensure_localtime(startTime).isoweekday() % 7 + 1 if startTime else None
+
+    group, primary, secondary = None, None, None
+
+    if rule in ['SessionFirst', 'SessionAlphaFirst']:
+        session = sessionStartTime if rule == 'SessionFirst' else sessionName
+        group = 0 if session is not None else (1 if month is not None else 2)
+        primary, secondary = session, monthKey
+    elif rule == 'Month':
+        group = 0 if month is not None else 1
+        primary = monthKey
+    elif rule in ['Session', 'SessionAlpha']:
+        session = sessionStartTime if rule == 'Session' else sessionName
+        group = 0 if session is not None else 1
+        primary = session
+    elif rule in ['SessionMonth', 'SessionAlphaMonth']:
+        session = sessionStartTime if rule == 'SessionMonth' else sessionName
+        if month is not None:
+            group = 0 if session is not None else 1
+        else:
+            group = 2 if session is not None else 3
+        primary, secondary = monthKey, session
+    elif rule == 'Weekday':
+        group = 0 if weekday is not None else 1
+        primary = weekday
+    elif rule == 'MonthWeekday':
+        group = 0 if month is not None and weekday is not None else 1
+        primary, secondary = monthKey, weekday
+
+    return group, getSortValue(primary), getSortValue(secondary)
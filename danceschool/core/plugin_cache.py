@@ -0,0 +1,140 @@
+'''
+Caching of the data displayed by the list plugins.  Public pages often
+contain several lists of events, staff members or locations, and each of
+these previously ran its listing query, followed by additional queries for
+each event, on every page view.  Instead, each plugin caches its listing,
+with the per-event data that templates use already loaded.  Cache keys
+include the versions of the invalidation scopes that a listing depends upon
+(see invalidation.py), so listings are recomputed whenever that data changes.
+Plugins whose filters are relative to the current time are computed as of
+the start of a time bucket, which is also part of the key.
+'''
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Prefetch, prefetch_related_objects
+from django.utils import timezone
+
+from datetime import timedelta
+
+from .constants import getConstant
+from .invalidation import getVersions
+from .models import Series, PublicEvent, EventRegistration, EventStaffMember
+
+
+# The number of seconds for which the data of a list plugin is cached.  This
+# may be overridden with the PLUGIN_CACHE_TIMEOUT setting.
+PLUGIN_CACHE_TIMEOUT = 3600
+
+# Plugins that list items relative to the current time (e.g. events that
+# begin within the next 30 days) are computed as of the start of a bucket of
+# this many seconds.  This may be overridden with the PLUGIN_CACHE_BUCKET
+# setting.
+PLUGIN_CACHE_BUCKET = 300
+
+
+def getTimeBucket():
+    '''
+    Return the start of the current time bucket, and the number of seconds
+    remaining until the next one.
+    '''
+    size = getattr(settings, 'PLUGIN_CACHE_BUCKET', PLUGIN_CACHE_BUCKET)
+    now = timezone.now()
+    offset = now.timestamp() % size
+    return now - timedelta(seconds=offset), size - offset
+
+
+def getCachedPluginData(instance, func, scopes, timeRelative=False):
+    '''
+    Return the cached result of func(now) for the passed plugin instance, where
+    now is the start of the current time bucket if timeRelative is True, and
+    otherwise the current time.  The result is recomputed when the plugin is
+    edited or when the version of any of the passed scopes changes.
+    '''
+    now, remaining = getTimeBucket()
+    key = 'pluginCache:%s:%s:%s:%s:%s' % (
+        instance.plugin_type, instance.pk,
+        instance.changed_date.timestamp() if instance.changed_date else '',
+        ':'.join(str(x) for x in getVersions(scopes)),
+        int(now.timestamp()) if timeRelative else '',
+    )
+    result = cache.get(key)
+    if result is None:
+        if not timeRelative:
+            now = timezone.now()
+        result = func(now)
+        timeout = getattr(settings, 'PLUGIN_CACHE_TIMEOUT', PLUGIN_CACHE_TIMEOUT)
+        cache.set(key, result, min(timeout, remaining) if timeRelative else timeout)
+    return result
+
+
+def prefetchEventListData(events):
+    '''
+    Load the occurrences, staff, registration counts and related objects of
+    each of the passed events, so that templates can use properties such as
+    name, url, organizer, firstOccurrence, teachers and soldOut without
+    further queries.  The preferences upon which URLs and instructors depend
+    are also looked up once for all of the events.  Returns the events as a
+    list.
+    '''
+    events = list(events)
+
+    prefetch_related_objects(
+        events, 'location', 'room', 'session', 'eventoccurrence_set',
+        Prefetch(
+            'eventstaffmember_set',
+            queryset=EventStaffMember.objects.select_related('staffMember', 'category')
+        ),
+    )
+    prefetch_related_objects(
+        [x for x in events if isinstance(x, Series)],
+        'classDescription__danceTypeLevel__danceType', 'pricingTier',
+    )
+    prefetch_related_objects(
+        [x for x in events if isinstance(x, PublicEvent)], 'category', 'pricingTier',
+    )
+
+    counts = dict(EventRegistration.objects.filter(
+        event__in=[x.id for x in events], cancelled=False, dropIn=False,
+        registration__final=True,
+    ).order_by().values('event').annotate(count=Count('id')).values_list('event', 'count'))
+
+    orgRule = getConstant('registration__orgRule')
+    instructorCategory = getConstant('general__eventStaffCategoryInstructor')
+
+    for event in events:
+        event._numRegistered = counts.get(event.id, 0)
+        event._orgRule = orgRule
+        event._instructorCategoryId = getattr(instructorCategory, 'id', None)
+    return events
+
+
+class PluginCacheMixin(object):
+    '''
+    This mixin is for list plugin classes, to cache the listing that each
+    plugin instance displays.  Plugins define get_listing(), which is passed
+    the plugin instance and the time as of which to compute the listing, the
+    invalidation scopes upon which listings depend, and whether the listing of a
+    given instance depends upon the current time.
+    '''
+    cache_scopes = []
+
+    def isTimeRelative(self, instance):
+        return False
+
+    def get_listing(self, instance, now):
+        raise NotImplementedError
+
+    def get_cached_listing(self, instance):
+        return getCachedPluginData(
+            instance, lambda now: self.get_listing(instance, now),
+            self.cache_scopes, timeRelative=self.isTimeRelative(instance),
+        )
+
+    def get_cache_expiration(self, request, instance, placeholder):
+        '''
+        Ensure that django CMS does not cache the rendered plugin beyond the
+        end of the current time bucket.
+        '''
+        if self.isTimeRelative(instance):
+            return max(int(getTimeBucket()[1]), 1)
+        return super().get_cache_expiration(request, instance, placeholder)
@@ -0,0 +1,192 @@
+'''
+Opt-in profiling of the registration process.  To enable it, add
+'danceschool.core.profiling.RegistrationProfilingMiddleware' to MIDDLEWARE.
+Each request to a step of the registration process is then timed, along with
+its database queries and each receiver of the core app's signals that is
+called during the request.  Profiles are logged as JSON and stored as
+RegistrationProfile records, which are summarized in the admin.
+'''
+from django.apps import apps
+from django.conf import settings
+from django.db import connection
+from django.urls import resolve, Resolver404
+
+from collections import defaultdict
+from contextlib import contextmanager
+import json
+import logging
+from math import ceil
+import threading
+import time
+
+
+# Define logger for this file
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+# The URL names of the steps of the registration process that are profiled.
+# These may be overridden with the REGISTRATION_PROFILING_URLS setting.
+REGISTRATION_PROFILING_URLS = [
+    'registration', 'registrationWithMarketingId', 'registrationWithVoucher',
+    'singleClassRegistration', 'singleClassReferralRegistration',
+    'ajaxRegistration', 'getStudentInfo', 'multiRegNameInfo',
+    'partnerRequiredForm', 'showRegSummary', 'createPaypalPayment',
+    'executePaypalPayment', 'stripeHandler', 'processSquarePayment',
+    'processSquarePointOfSale', 'doorWillPayHandler', 'doorPaymentHandler',
+]
+
+PERCENTILES = [50, 90, 95, 99]
+
+
+def getCurrentProfile():
+    ''' Return the profile of the current request, if it is being profiled. '''
+    return getattr(_local, 'profile', None)
+
+
+def percentile(values, pct):
+    ''' Return the nearest-rank percentile of a sorted list of values. '''
+    if not values:
+        return None
+    return values[min(max(ceil(pct / 100 * len(values)) - 1, 0), len(values) - 1)]
+
+
+class RequestProfile(object):
+    '''
+    Keeps track of the time and database queries used by a request and by
+    each signal receiver called during the request.  It is installed as a
+    database execute wrapper for the duration of the request.
+    '''
+
+    def __init__(self, step):
+        self.step = step
+        self.queryCount = 0
+        self.queryTime = 0
+        self.receivers = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queryCount += 1
+            self.queryTime += time.perf_counter() - start
+
+    def callReceiver(self, signal, receiver, **kwargs):
+        queryCount = self.queryCount
+        queryTime = self.queryTime
+        start = time.perf_counter()
+        try:
+            return receiver(signal=signal, **kwargs)
+        finally:
+            self.receivers.append({
+                'signal': signal.name or repr(signal),
+                'receiver': '%s.%s' % (
+                    getattr(receiver, '__module__', ''),
+                    getattr(receiver, '__qualname__', repr(receiver))
+                ),
+                'duration': 1000 * (time.perf_counter() - start),
+                'queryCount': self.queryCount - queryCount,
+                'queryTime': 1000 * (self.queryTime - queryTime),
+            })
+
+
+@contextmanager
+def profileRequest(step):
+    '''
+    Profile the database queries and signal receivers within this block,
+    which should not be nested within another profile.
+    '''
+    profile = RequestProfile(step)
+    _local.profile = profile
+    try:
+        with connection.execute_wrapper(profile):
+            yield profile
+    finally:
+        _local.profile = None
+
+
+class RegistrationProfilingMiddleware(object):
+    '''
+    Profile requests to the steps of the registration process.  Profiling
+    adds a query to each profiled request to store the profile.
+    '''
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.urls = set(getattr(
+            settings, 'REGISTRATION_PROFILING_URLS', REGISTRATION_PROFILING_URLS
+        ))
+
+    def get_step(self, request):
+        try:
+            return resolve(request.path_info).url_name
+        except Resolver404:
+            return None
+
+    def __call__(self, request):
+        step = self.get_step(request)
+        if step not in self.urls or getCurrentProfile() is not None:
+            return self.get_response(request)
+
+        start = time.perf_counter()
+        with profileRequest(step) as profile:
+            response = self.get_response(request)
+        duration = 1000 * (time.perf_counter() - start)
+
+        data = {
+            'step': step,
+            'path': request.path[:255],
+            'method': request.method,
+            'statusCode': response.status_code,
+            'duration': duration,
+            'queryCount': profile.queryCount,
+            'queryTime': 1000 * profile.queryTime,
+            'receivers': profile.receivers,
+        }
+        logger.info(
+            'Registration profile: %s' % json.dumps(data),
+            extra={'registration_profile': data}
+        )
+
+        RegistrationProfile = apps.get_model('core', 'RegistrationProfile')
+        RegistrationProfile.objects.create(**data)
+        return response
+
+
+def getProfileSummary(profiles):
+    '''
+    Given a queryset of RegistrationProfiles, return the number of profiles
+    and the percentiles of their duration, query count and query time, for
+    each step and for each signal receiver.
+    '''
+    metrics = ['duration', 'queryCount', 'queryTime']
+    steps = defaultdict(lambda: defaultdict(list))
+    receivers = defaultdict(lambda: defaultdict(list))
+
+    for profile in profiles.values('step', 'receivers', *metrics).iterator():
+        for metric in metrics:
+            steps[profile['step']][metric].append(profile[metric])
+        for receiver in profile['receivers'] or []:
+            this_receiver = receivers[(receiver['signal'], receiver['receiver'])]
+            for metric in metrics:
+                this_receiver[metric].append(receiver[metric])
+
+    def summarize(values):
+        result = {'count': len(values['duration'])}
+        for metric in metrics:
+            this_values = sorted(values[metric])
+            result[metric] = [percentile(this_values, p) for p in PERCENTILES] + [this_values[-1]]
+        return result
+
+    return {
+        'percentiles': PERCENTILES,
+        'steps': sorted(
+            [dict(step=k, **summarize(v)) for k, v in steps.items()],
+            key=lambda x: x['duration'][0], reverse=True
+        ),
+        'receivers': sorted(
+            [dict(signal=k[0], receiver=k[1], **summarize(v)) for k, v in receivers.items()],
+            key=lambda x: x['duration'][0], reverse=True
+        ),
+    }
@@ -0,0 +1,258 @@
+'''
+Batched deletion of expired preliminary invoices.  Deleting a large set of
+invoices with a single QuerySet.delete() loads every dependent object into
+memory, sends pre_delete and post_delete signals for each of them, and holds
+locks on all of the affected tables for the whole deletion.  Instead, expired
+invoices are deleted here in bounded batches, each in its own transaction.
+Within a batch, the dependents of the invoices are deleted (or have their
+references cleared) with one bulk query per relation, children before
+parents.  Models that have delete signal receivers, multi-table parents, or
+generic relations are deleted in the usual way, so that nothing that relies
+on those signals or cascades is skipped.  The exception is the receivers that
+bump cache invalidation versions, since the purge bumps the versions of each
+batch itself.
+'''
+from django.apps import apps
+from django.conf import settings
+from django.contrib.contenttypes.fields import GenericRelation
+from django.db import connection, models, transaction
+from django.db.models import signals
+from django.utils import timezone
+
+from collections import OrderedDict
+from datetime import timedelta
+from importlib import import_module
+import logging
+import time
+
+from .constants import REG_VALIDATION_STR
+from .invalidation import invalidateRegistrations
+
+
+# Define logger for this file
+logger = logging.getLogger(__name__)
+
+# The number of invoices that are deleted in each transaction.  This may be
+# overridden with the INVOICE_PURGE_BATCH_SIZE setting.
+INVOICE_PURGE_BATCH_SIZE = 200
+
+# Sessions that have expired within this many hours are checked for expired
+# registration data.  This may be overridden with the
+# REGISTRATION_SESSION_PURGE_HOURS setting.
+REGISTRATION_SESSION_PURGE_HOURS = 2
+
+# Session engines that store sessions in the database.  Other engines expire
+# their sessions on their own.
+DATABASE_SESSION_ENGINES = [
+    'django.contrib.sessions.backends.db',
+    'django.contrib.sessions.backends.cached_db',
+]
+
+
+def hasDeleteReceivers(signal, model):
+    '''
+    Whether any receivers of a delete signal are connected for a model, other
+    than those marked with invalidation.bulkDeleteSafe, whose invalidation
+    the purge performs itself for each batch.
+    '''
+    return any(
+        not getattr(x, 'bulkDeleteSafe', False) for x in signal._live_receivers(model)
+    )
+
+
+def canBulkDelete(model):
+    '''
+    Rows of a model may be deleted without loading them only if nothing
+    depends upon the signals or cascades that Django's collector provides.
+    '''
+    return not (
+        hasDeleteReceivers(signals.pre_delete, model) or
+        hasDeleteReceivers(signals.post_delete, model) or
+        model._meta.parents or
+        any(
+            isinstance(f, GenericRelation) for f in model._meta.private_fields
+        )
+    )
+
+
+def _relationsToDelete(model):
+    ''' The reverse relations that Django's collector also follows. '''
+    return [
+        f for f in model._meta.get_fields(include_hidden=True)
+        if f.auto_created and not f.concrete and (f.one_to_one or f.one_to_many)
+    ]
+
+
+def getPurgePlan(model=None, path='', stack=None):
+    '''
+    Return an ordered list of the steps needed to delete instances of a model
+    (by default, Invoice) and everything that depends upon them.  Each step is
+    a tuple of (action, model, lookup, field), where lookup leads from the model
+    to the id of the invoice.  Dependents are listed before the models that
+    they refer to, so the steps may be run in order.  Models that cannot be
+    safely deleted in bulk end their branch with a 'collect' step, which
+    deletes the rows and all of their dependents using the collector.
+    '''
+    if model is None:
+        model = apps.get_model('core', 'Invoice')
+    lookup = path or 'pk'
+    stack = (stack or []) + [model]
+
+    if not canBulkDelete(model):
+        return [('collect', model, lookup, None)]
+
+    steps = []
+    for related in _relationsToDelete(model):
+        field = related.field
+        child = related.related_model
+        on_delete = field.remote_field.on_delete
+        childPath = '%s__%s' % (field.name, path) if path else field.name
+
+        if on_delete == models.DO_NOTHING:
+            continue
+        elif on_delete == models.SET_NULL:
+            steps.append(('clear', child, childPath, field.name))
+        elif on_delete == models.CASCADE and child not in stack:
+            steps += getPurgePlan(child, childPath, stack)
+        else:
+            # Protected relations, other on_delete handlers, and cycles are
+            # left to the collector.
+            return [('collect', model, lookup, None)]
+
+    steps.append(('delete', model, lookup, None))
+    return steps
+
+
+def _runStep(step, ids, rows):
+    ''' Run a single step of a purge plan for a batch of invoice ids. '''
+    action, model, lookup, field = step
+    queryset = model._base_manager.using(connection.alias).filter(
+        **{'%s__in' % lookup: ids}
+    )
+    label = model._meta.label
+
+    if action == 'clear':
+        count = queryset.exclude(**{'%s__isnull' % field: True}).update(
+            **{field: None}
+        )
+    elif action == 'delete':
+        count = queryset._raw_delete(connection.alias)
+    else:
+        # Use the QuerySet.delete() of the base class, since custom querysets
+        # may refuse to delete some rows or send additional signals.
+        count = models.QuerySet.delete(queryset.order_by())[0]
+
+    if count:
+        key = '%s (%s)' % (label, 'cleared') if action == 'clear' else label
+        rows[key] = rows.get(key, 0) + count
+
+
+def purgeExpiredInvoices(cutoff=None, batchSize=None, maxBatches=None, plan=None):
+    '''
+    Delete preliminary invoices that expired before the cutoff (by default,
+    one minute ago), in batches of at most batchSize invoices.  Invoices that
+    are locked by another transaction are skipped if the database permits it.
+    Returns a dictionary of metrics for the run.
+    '''
+    Invoice = apps.get_model('core', 'Invoice')
+
+    if cutoff is None:
+        cutoff = timezone.now() - timedelta(minutes=1)
+    if batchSize is None:
+        batchSize = getattr(settings, 'INVOICE_PURGE_BATCH_SIZE', INVOICE_PURGE_BATCH_SIZE)
+    if plan is None:
+        plan = getPurgePlan(Invoice)
+
+    expired = Invoice._base_manager.filter(
+        status=Invoice.PaymentStatus.preliminary,
+        expirationDate__lte=cutoff,
+    ).order_by('expirationDate', 'id')
+
+    lock_kwargs = {}
+    if connection.features.has_select_for_update_skip_locked:
+        lock_kwargs['skip_locked'] = True
+
+    metrics = {
+        'invoices': 0, 'batches': 0, 'rows': OrderedDict(),
+        'maxBatchSeconds': 0, 'seconds': 0,
+    }
+    start = time.monotonic()
+
+    while maxBatches is None or metrics['batches'] < maxBatches:
+        batchStart = time.monotonic()
+        with transaction.atomic():
+            ids = list(expired.select_for_update(**lock_kwargs).values_list(
+                'id', flat=True
+            )[:batchSize])
+            if not ids:
+                break
+            invalidateRegistrations(registration__invoice__in=ids)
+            for step in plan:
+                _runStep(step, ids, metrics['rows'])
+
+        metrics['invoices'] += len(ids)
+        metrics['batches'] += 1
+        metrics['maxBatchSeconds'] = max(
+            metrics['maxBatchSeconds'], time.monotonic() - batchStart
+        )
+        if len(ids) < batchSize:
+            break
+
+    metrics['seconds'] = time.monotonic() - start
+    return metrics
+
+
+def purgeRegistrationSessions(hours=None, batchSize=None):
+    '''
+    Delete database sessions that have expired within the last few hours and
+    that contain registration data.  Other expired sessions are left for the
+    clearsessions command.  Returns the number of sessions deleted.
+    '''
+    if settings.SESSION_ENGINE not in DATABASE_SESSION_ENGINES:
+        return 0
+
+    if hours is None:
+        hours = getattr(
+            settings, 'REGISTRATION_SESSION_PURGE_HOURS',
+            REGISTRATION_SESSION_PURGE_HOURS
+        )
+    if batchSize is None:
+        batchSize = getattr(settings, 'INVOICE_PURGE_BATCH_SIZE', INVOICE_PURGE_BATCH_SIZE)
+
+    store = import_module(settings.SESSION_ENGINE).SessionStore()
+    Session = store.get_model_class()
+
+    now = timezone.now()
+    expired = Session.objects.filter(
+        expire_date__lt=now, expire_date__gte=now - timedelta(hours=hours)
+    ).order_by('session_key')
+
+    deleted = 0
+    last = None
+    while True:
+        page = expired.filter(session_key__gt=last) if last else expired
+        page = list(page.values_list('session_key', 'session_data')[:batchSize])
+        if not page:
+            break
+        keys = [k for k, data in page if REG_VALIDATION_STR in store.decode(data)]
+        if keys:
+            deleted += Session.objects.filter(session_key__in=keys).delete()[0]
+        last = page[-1][0]
+        if len(page) < batchSize:
+            break
+    return deleted
+
+
+def formatPurgeMetrics(metrics):
+    ''' Summarize the metrics of a purge as a single line of text. '''
+    text = 'Deleted %s expired invoices in %s batches (%.2fs, longest batch %.2fs).' % (
+        metrics['invoices'], metrics['batches'], metrics['seconds'],
+        metrics['maxBatchSeconds'],
+    )
+    if metrics['rows']:
+        text += ' Rows: %s.' % ', '.join(
+            '%s: %s' % (k, v) for k, v in metrics['rows'].items()
+        )
+    if 'sessions' in metrics:
+        text += ' Registration sessions deleted: %s.' % metrics['sessions']
+    return text
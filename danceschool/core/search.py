@@ -0,0 +1,97 @@
+'''
+Normalization of names, email addresses and descriptions into search tokens.
+The admin and door register autocompletes previously filtered on
+case-insensitive prefixes of several columns at once, which cannot use an
+index.  Instead, the searchable fields of each model are split into
+lower-cased, unaccented words that are stored in the SearchToken table, so
+that each word of a query becomes an indexed range lookup on that table.
+'''
+from django.conf import settings
+from django.utils.html import strip_tags
+
+import re
+import unicodedata
+
+
+# The fields that are indexed for each searchable model, with the weight that
+# a match on that field contributes to the rank of a result.
+SEARCH_FIELDS = {
+    'auth.user': (('first_name', 3), ('last_name', 3), ('email', 2)),
+    'core.customer': (('first_name', 3), ('last_name', 3), ('email', 2)),
+    'core.staffmember': (('firstName', 3), ('lastName', 3), ('publicEmail', 2)),
+    'core.classdescription': (
+        ('title', 3), ('shortDescription', 1), ('description', 1)
+    ),
+}
+
+# The maximum number of results returned by a search.  This may be overridden
+# with the SEARCH_RESULT_LIMIT setting.
+SEARCH_RESULT_LIMIT = 50
+
+# Only the first few words of a query are used.
+SEARCH_MAX_TERMS = 5
+
+# Tokens are truncated to the length of SearchToken.token.
+SEARCH_TOKEN_LENGTH = 50
+
+# Matches runs of letters and digits in any script.
+WORD_RE = re.compile(r'[^\W_]+')
+
+
+def normalize(text):
+    ''' Lower-case the passed text and remove any accents. '''
+    text = unicodedata.normalize('NFKD', str(text or ''))
+    return ''.join(x for x in text if not unicodedata.combining(x)).casefold()
+
+
+def getWords(text):
+    ''' Split text into a list of normalized words. '''
+    return [x[:SEARCH_TOKEN_LENGTH] for x in WORD_RE.findall(normalize(text))]
+
+
+def getEmailWords(email):
+    '''
+    Index the local part of an email address both as a whole and as separate
+    words, so that "jsmith" and "smith" both match "j.smith@example.com".
+    The domain is not indexed, since many customers share the same domain.
+    '''
+    local = (email or '').split('@')[0]
+    words = getWords(local)
+    if len(words) > 1:
+        words.insert(0, ''.join(words)[:SEARCH_TOKEN_LENGTH])
+    return words
+
+
+def getSearchFields(model):
+    return SEARCH_FIELDS.get(model._meta.label_lower)
+
+
+def getInstanceTokens(instance, fields=None):
+    '''
+    Return a dictionary mapping each token of the passed instance to the
+    weight of the highest-weighted field in which it appears.
+    '''
+    tokens = {}
+    for field, weight in (fields or getSearchFields(instance.__class__)):
+        value = getattr(instance, field, None)
+        if 'email' in field.lower():
+            words = getEmailWords(value)
+        else:
+            words = getWords(strip_tags(value or ''))
+        for word in words:
+            if tokens.get(word, 0) < weight:
+                tokens[word] = weight
+    return tokens
+
+
+def getQueryTerms(q):
+    ''' Split a query into at most SEARCH_MAX_TERMS distinct normalized words. '''
+    terms = []
+    for word in getWords(q):
+        if word not in terms:
+            terms.append(word)
+    return terms[:SEARCH_MAX_TERMS]
+
+
+def getResultLimit(limit=None):
+    return limit or getattr(settings, 'SEARCH_RESULT_LIMIT', SEARCH_RESULT_LIMIT)
@@ -1,10 +1,10 @@
-from django.dispatch import Signal
+from .dispatch import TimedSignal
 
 # Fires during the clean process of the StudentInfoView form or the
 # MultiRegCustomerNameForm, allowing hooked in apps to validate the form data
 # and raise ValidationErrors or send warnings (messages) to the user by adding
 # them to the request.
-check_student_info = Signal(
+check_student_info = TimedSignal(
     ''' ['instance', 'data', 'request', 'eventRegs', 'registration', 'invoice'] '''
 )
 
@@ -14,21 +14,21 @@ check_student_info = Signal(
 # this signal can be used to modify the temporary Registration itself (be sure to save changes),
 # and it can be used to make related changes in other apps (such as creating VoucherUse
 # records in the vouchers app
-post_student_info = Signal(''' ['invoice', 'registration'] ''')
+post_student_info = TimedSignal(''' ['invoice', 'registration'] ''')
 
 # Fires at the point when automatically-applied discounts may be applied to
 # a preliminary registration.  Any handler that attaches to this signal should
 # return an object that describes the discount (in the case of the discounts app,)
 # a DiscountCombo object, as well as the discounted price to be applied to the _entire_
 # cart, in tuple form as (object, discounted_price).
-request_discounts = Signal(''' ['invoice', 'registration'] ''')
+request_discounts = TimedSignal(''' ['invoice', 'registration'] ''')
 
 # Fires in the AjaxClassRegistrationView to check the validity of a voucher code
 # if it is passed.  Unlike the vouchers handler for check_student_info, the vouchers
 # app handler for this signal does not raise ValidationErrors, but instead returns
 # a JSON object that indicates if the voucher is invalid as well as the max.
 # amount that it can be used for.
-check_voucher = Signal(
+check_voucher = TimedSignal(
     ''' ['invoice', 'registration', 'voucherId', 'customer', 'validateCustomer'] '''
 )
 
@@ -37,7 +37,7 @@ check_voucher = Signal(
 # app by default records the discounted price of a registration, net of all discounts
 # and also of all voucher uses, but it does not itself record information on the
 # discounts or vouchers actually applied.
-apply_discount = Signal(
+apply_discount = TimedSignal(
     ''' ['invoice', 'registration', 'discount', 'discount_amount'] '''
 )
 
@@ -46,33 +46,39 @@ apply_discount = Signal(
 # to a registration or any other object at present.
 # Any handler that attaches to this signal should return a list with the names of
 # the addons.
-apply_addons = Signal(''' ['invoice', 'registration'] ''')
+apply_addons = TimedSignal(''' ['invoice', 'registration'] ''')
 
 # Fires when vouchers or any other direct price adjustments are ready to be applied.
 # Any handler that attaches to this signal should return a name/description of the
 # adjustment as well as the amount of the adjustment, in tuple form as (name, amount).
-apply_price_adjustments = Signal(
+apply_price_adjustments = TimedSignal(
     ''' ['invoice', 'registration', 'invoice', 'initial_price'] '''
 )
 
 # Fires after a Registration is created.
-post_registration = Signal(''' ['invoice', registration'] ''')
+post_registration = TimedSignal(''' ['invoice', registration'] ''')
 
 # Fires in AjaxClassRegistrationView so that items related to invoices can be
 # created or updated at the same time as the invoice.
-get_invoice_related = Signal(''' ['invoice', 'post_data', 'prior_response', 'request'] ''')
-get_invoice_item_related = Signal(''' ['item', 'item_data', 'post_data', 'prior_response', 'request'] ''')
+get_invoice_related = TimedSignal(''' ['invoice', 'post_data', 'prior_response', 'request'] ''')
+get_invoice_item_related = TimedSignal(''' ['item', 'item_data', 'post_data', 'prior_response', 'request'] ''')
 
 # Fires whenever an invoice is finalized.
-invoice_finalized = Signal(''' ['invoice'] ''')
+invoice_finalized = TimedSignal(''' ['invoice'] ''')
 
 # Fires whenever an invoice is cancelled.
-invoice_cancelled = Signal(''' ['invoice'] ''')
+invoice_cancelled = TimedSignal(''' ['invoice'] ''')
 
 # Fires on the customer profile page to collect customer information from other apps
 # without overriding the CustomerStatsView.
-get_customer_data = Signal(''' ['customer'] ''')
+get_customer_data = TimedSignal(''' ['customer'] ''')
 
 # Fires when viewing prior EventRegistrations to collect information from other apps
 # such as discounts or vouchers that were applied to the Registrations.
-get_eventregistration_data = Signal(''' ['eventregistrations'] ''')
+get_eventregistration_data = TimedSignal(''' ['eventregistrations'] ''')
+
+# Name each signal so that it can be identified in profiles.
+for name, signal in list(globals().items()):
+    if isinstance(signal, TimedSignal):
+        signal.name = name
+del name, signal
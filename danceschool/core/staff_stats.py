@@ -0,0 +1,148 @@
+'''
+Summary statistics for the events that a staff member has worked, computed
+with a fixed number of grouped queries rather than one query per event.
+Results are cached per staff member.  Rather than tracking every cached key,
+the cache key includes the version of the staff member's invalidation scope,
+and invalidateStaffStats() bumps that version whenever the staff member's
+events, occurrences, registrations or expenses change.  Since events move
+from upcoming to prior as time passes, cached results also expire after
+STAFF_STATS_CACHE_TIMEOUT seconds.
+'''
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, OuterRef, Subquery, IntegerField
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from calendar import month_name
+from collections import OrderedDict
+
+from .constants import getConstant
+from .invalidation import STAFF, bumpVersions, getVersionedKey
+from .models import Event, EventStaffMember, EventRegistration
+from .utils.timezone import ensure_localtime
+
+
+# The number of seconds for which staff member statistics are cached.  This
+# may be overridden with the STAFF_STATS_CACHE_TIMEOUT setting.
+STAFF_STATS_CACHE_TIMEOUT = 3600
+
+
+def invalidateStaffStats(staffMember_ids):
+    ''' Discard the cached statistics for the passed staff member ids. '''
+    bumpVersions([(STAFF, x) for x in set(staffMember_ids) if x])
+
+
+def cachedStaffStats(name, staffMember_id, func, *args):
+    '''
+    Return the cached result of func(staffMember_id, *args) under the passed
+    name.  Any additional arguments must be simple values, since they are
+    part of the cache key.
+    '''
+    key = getVersionedKey(
+        'staffStats:%s' % name, [(STAFF, staffMember_id), ], staffMember_id, *args
+    )
+    result = cache.get(key)
+    if result is None:
+        result = func(staffMember_id, *args)
+        cache.set(
+            key, result,
+            getattr(settings, 'STAFF_STATS_CACHE_TIMEOUT', STAFF_STATS_CACHE_TIMEOUT)
+        )
+    return result
+
+
+def getStaffMemberEvents(staffMember_id):
+    '''
+    Return a list of the events worked by the staff member, most recent first.
+    Each event is a dictionary that includes the number of students
+    registered and the names of the other instructors.
+    '''
+    registrations = EventRegistration.objects.filter(
+        event=OuterRef('pk'), cancelled=False, dropIn=False,
+        registration__final=True,
+    ).order_by().values('event').annotate(count=Count('id')).values('count')
+
+    events = list(Event.objects.non_polymorphic().filter(
+        eventstaffmember__staffMember=staffMember_id
+    ).annotate(
+        title=Coalesce('series__classDescription__title', 'publicevent__title'),
+        registrationCount=Coalesce(
+            Subquery(registrations, output_field=IntegerField()), 0
+        ),
+    ).values(
+        'id', 'month', 'year', 'startTime', 'endTime', 'title',
+        'location__name', 'room__name', 'registrationCount',
+    ).distinct().order_by('-startTime'))
+
+    partners = {}
+    for event_id, firstName, lastName in EventStaffMember.objects.filter(
+        event__in=[x['id'] for x in events],
+        category=getConstant('general__eventStaffCategoryInstructor'),
+    ).exclude(staffMember=staffMember_id).order_by(
+        'staffMember__lastName', 'staffMember__firstName'
+    ).values_list('event', 'staffMember__firstName', 'staffMember__lastName'):
+        partners.setdefault(event_id, []).append(
+            ' '.join([firstName or '', lastName or ''])
+        )
+
+    for event in events:
+        event['locationName'] = event.pop('location__name')
+        event['roomName'] = event.pop('room__name')
+        event['partners'] = partners.get(event['id'], [])
+    return events
+
+
+def getStaffMemberHours(staffMember_id):
+    '''
+    Return an ordered dictionary of the hours worked by the staff member in
+    each year, based on the specified hours of each of their event staff
+    records, or otherwise on the duration of their assigned occurrences.
+    '''
+    staff = EventStaffMember.objects.filter(staffMember=staffMember_id)
+    specified = staff.filter(specifiedHours__isnull=False)
+
+    hours = {}
+    for year, specifiedHours in specified.values_list('event__year', 'specifiedHours'):
+        hours[year] = hours.get(year, 0) + specifiedHours
+
+    for startTime, endTime in EventStaffMember.occurrences.through.objects.filter(
+        eventstaffmember__in=staff.filter(specifiedHours__isnull=True),
+        eventoccurrence__cancelled=False,
+    ).values_list('eventoccurrence__startTime', 'eventoccurrence__endTime'):
+        year = ensure_localtime(startTime).year
+        hours[year] = hours.get(year, 0) + (endTime - startTime).total_seconds() / 3600
+
+    return OrderedDict(
+        (k, round(v, 2)) for k, v in sorted(hours.items(), key=lambda x: x[0] or 0)
+    )
+
+
+def getInstructorStats(staffMember):
+    '''
+    Return the context used by the instructor stats view: the staff member's
+    prior and upcoming events, the total number of events and of students
+    taught, the first event taught, and the hours taught in each year.
+    '''
+    def computeStats(staffMember_id):
+        now = timezone.now()
+        events = getStaffMemberEvents(staffMember_id)
+        prior = [x for x in events if x['startTime'] and x['startTime'] <= now]
+        upcoming = [x for x in events if x['startTime'] and x['startTime'] > now]
+
+        stats = {
+            'prior_series': prior,
+            'upcoming_series': upcoming,
+            'series_count': len(prior) + len(upcoming),
+            'hours_by_year': getStaffMemberHours(staffMember_id),
+        }
+        if prior:
+            first = prior[-1]
+            stats.update({
+                'first_series': first,
+                'teaching_since': '%s %s' % (month_name[first['month'] or 0], first['year']),
+                'student_count': sum(x['registrationCount'] for x in prior),
+            })
+        return stats
+
+    return cachedStaffStats('instructor', staffMember.id, computeStats)
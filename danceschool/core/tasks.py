@@ -1,11 +1,9 @@
 from django.conf import settings
 from django.core.mail import get_connection, EmailMultiAlternatives
-from django.utils import timezone
 from django.core.management import call_command
 
 from huey import crontab
 from huey.contrib.djhuey import task, db_periodic_task
-from datetime import timedelta
 
 import logging
 
@@ -18,40 +16,58 @@ logger = logging.getLogger(__name__)
 @db_periodic_task(crontab(minute='*/60'))
 def updateSeriesRegistrationStatus():
     '''
-    Every hour, check if the series that are currently open for registration
-    should be closed.
+    Every hour, check if the series and other events that are currently open
+    for registration should be closed (or vice versa).
     '''
-    from .models import Series
+    from .models import Event
 
     if not getConstant('general__enableCronTasks'):
         return
 
-    logger.info('Checking status of Series that are open for registration.')
+    logger.info('Checking registration status of all events.')
 
-    open_series = Series.objects.filter().filter(**{'registrationOpen': True})
+    summary = Event.objects.updateRegistrationStatus()
 
-    for series in open_series:
-        series.updateRegistrationStatus()
+    logger.info(
+        'Checked %s events: opened %s, closed %s.' % (
+            summary['checked'], len(summary['opened']), len(summary['closed'])
+        )
+    )
 
 
 @db_periodic_task(crontab(minute='*/60'))
 def clearExpiredInvoices():
     '''
-    Every hour, look for unfinished invoices that have expired and delete them.
+    Every hour, look for unfinished invoices that have expired and delete them,
+    along with the expired sessions that held their registration data.
     To ensure that there are no issues that arise from slight differences between
     session expiration dates and invoice expiration dates, only
-    delete instances that have been expired for one minute.
+    delete instances that have been expired for one minute.  Invoices are
+    deleted in batches so that tables are not locked for long periods.
     '''
-    from .models import Invoice
+    from .purge import (
+        purgeExpiredInvoices, purgeRegistrationSessions, formatPurgeMetrics
+    )
 
     if not getConstant('general__enableCronTasks'):
         return
 
     if getConstant('registration__deleteExpiredInvoices'):
-        Invoice.objects.filter(
-            status=Invoice.PaymentStatus.preliminary,
-            expirationDate__lte=timezone.now() - timedelta(minutes=1)
-        ).delete()
+        metrics = purgeExpiredInvoices()
+        metrics['sessions'] = purgeRegistrationSessions()
+        logger.info(formatPurgeMetrics(metrics))
+
+
+@db_periodic_task(crontab(hour='4', minute='30'))
+def clearExpiredSessions():
+    '''
+    Once a day, clear all expired sessions.  Registration sessions are already
+    cleared every hour along with their invoices.
+    '''
+    if not getConstant('general__enableCronTasks'):
+        return
+
+    if getConstant('registration__deleteExpiredInvoices'):
         call_command('clearsessions')
 
 
@@ -3,18 +3,51 @@ This file contains basic tests for the core app.
 """
 
 from django.urls import reverse
-from django.utils import timezone
-from django.test import TestCase
+from django.utils import timezone, translation
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.conf import settings
+from django.core.cache import cache
 from django.contrib.auth.models import User
 
-from datetime import timedelta
+from datetime import datetime, timedelta
+from io import StringIO
+import json
+import os
+import tempfile
+import threading
+import time
+from unittest import mock
 from calendar import month_name
 import dateutil.parser
 from itertools import chain
 
-from .models import EventOccurrence, Event, Registration, Invoice
-from .constants import getConstant, REG_VALIDATION_STR
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.db.models import Count, F, Q
+from django.test.utils import CaptureQueriesContext
+from django.test.client import RequestFactory
+
+from cms.api import add_plugin
+from cms.models import Placeholder
+
+from .models import (
+    EventOccurrence, Event, Registration, Invoice, Customer, CustomerHistory,
+    EventRegistration, EventCheckIn, PublicEvent, EventRole, DanceRole,
+    RegistrationProfile, Series, SearchToken, EventSession
+)
+from .forms import ClassChoiceForm
+from .cms_plugins import EventListPlugin
+from . import invalidation
+from .views import AccountProfileView
+from .benchmark import createRegistrations
+from .dispatch import writing_receiver
+from .profiling import profileRequest, getProfileSummary
+from .signals import post_registration, get_customer_data
+from .constants import getConstant, updateConstant, REG_VALIDATION_STR
 from .utils.tests import DefaultSchoolTestCase
+from .utils.timezone import ensure_localtime
 
 
 class RegistrationTest(DefaultSchoolTestCase):
@@ -232,6 +265,877 @@ class RegistrationTest(DefaultSchoolTestCase):
         self.assertEqual(response.context_data.get('total_discount_amount'), 0)
 
 
+class CustomerHistoryTest(DefaultSchoolTestCase):
+
+    def test_history_updated_on_registration(self):
+        '''
+        Check that the stored customer history reflects finalized registrations
+        and cancellations, and that it matches a full rebuild.
+        '''
+        first = self.create_series(startTime=timezone.now() + timedelta(days=1))
+        second = self.create_series(startTime=timezone.now() + timedelta(days=8))
+        customer = Customer.objects.create(
+            first_name='Norma', last_name='Miller', email='norma@miller.com'
+        )
+
+        self.assertEqual(customer.numEventRegistrations, 0)
+        self.assertIsNone(customer.firstSeries)
+
+        # Preliminary registrations are not counted.
+        self.create_registration(events=[first, ], customer=customer, final=False)
+        customer = Customer.objects.get(id=customer.id)
+        self.assertEqual(customer.numEventRegistrations, 0)
+
+        self.create_registration(events=[first, second], customer=customer)
+        customer = Customer.objects.get(id=customer.id)
+        self.assertEqual(customer.numEventRegistrations, 2)
+        self.assertEqual(customer.numClassSeries, 2)
+        self.assertEqual(customer.numPublicEvents, 0)
+        self.assertEqual(customer.numDropIns, 0)
+        self.assertEqual(customer.firstSeries.id, first.id)
+        self.assertEqual(customer.lastSeries.id, second.id)
+        self.assertEqual(customer.lastSeriesDate, second.startTime)
+        self.assertEqual(customer.history.totalSpent, 2 * first.getBasePrice())
+
+        # Cancelling an event registration updates the history.
+        er = customer.eventregistration_set.get(event=second, registration__final=True)
+        er.cancelled = True
+        er.save()
+        customer = Customer.objects.get(id=customer.id)
+        self.assertEqual(customer.numClassSeries, 1)
+        self.assertEqual(customer.lastSeries.id, first.id)
+
+        stored = CustomerHistory.objects.values().get(customer=customer)
+        call_command('rebuild_customer_history', stdout=StringIO())
+        rebuilt = CustomerHistory.objects.values().get(customer=customer)
+        stored.pop('modifiedDate')
+        rebuilt.pop('modifiedDate')
+        self.assertEqual(stored, rebuilt)
+
+
+class SearchTokenTest(DefaultSchoolTestCase):
+
+    def test_customer_search(self):
+        '''
+        Check that customer tokens are maintained on save and delete, that
+        matches are ranked by the number of query words matched, and that
+        the autocomplete view uses the ranked results.
+        '''
+        norma = Customer.objects.create(
+            first_name='Norma', last_name='Miller', email='norma.m@example.com'
+        )
+        frankie = Customer.objects.create(
+            first_name='Frankie', last_name='Manning', email='frankie@example.com'
+        )
+        noemi = Customer.objects.create(
+            first_name='Noémi', last_name='Manning', email='nm@example.com'
+        )
+
+        self.assertEqual(
+            SearchToken.objects.search(Customer, 'Manning'), [frankie.id, noemi.id]
+        )
+        self.assertEqual(SearchToken.objects.search(Customer, 'norma mil'), [norma.id])
+        self.assertEqual(
+            SearchToken.objects.search(Customer, 'no man'), [noemi.id, norma.id, frankie.id]
+        )
+        self.assertEqual(SearchToken.objects.search(Customer, 'normam'), [norma.id])
+        self.assertEqual(SearchToken.objects.search(Customer, 'example'), [])
+        self.assertEqual(SearchToken.objects.search(Customer, 'man', limit=1), [frankie.id])
+
+        norma.last_name = 'Powers'
+        norma.save()
+        self.assertEqual(SearchToken.objects.search(Customer, 'miller'), [])
+        self.assertEqual(SearchToken.objects.search(Customer, 'pow'), [norma.id])
+
+        frankie.delete()
+        self.assertEqual(SearchToken.objects.search(Customer, 'manning'), [noemi.id])
+
+        stored = set(SearchToken.objects.values_list('contentType', 'objectId', 'token', 'weight'))
+        call_command('rebuild_search_index', stdout=StringIO())
+        rebuilt = set(SearchToken.objects.values_list('contentType', 'objectId', 'token', 'weight'))
+        self.assertEqual(stored, rebuilt)
+
+        self.client.login(username=self.superuser.username, password='pass')
+        response = self.client.get(reverse('autocompleteCustomer'), {'q': 'no man'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [int(x['id']) for x in response.json()['results']], [noemi.id, norma.id]
+        )
+
+
+class InstructorStatsTest(DefaultSchoolTestCase):
+
+    def test_instructor_stats(self):
+        '''
+        Check the aggregated instructor stats, and check that cached stats are
+        discarded when a registration is finalized.
+        '''
+        cache.clear()
+        partner = self.create_instructor()
+        first = self.create_series(
+            startTime=timezone.now() - timedelta(days=60), occurrences=2,
+            instructors=[self.defaultInstructor, partner]
+        )
+        second = self.create_series(startTime=timezone.now() - timedelta(days=10))
+        upcoming = self.create_series(startTime=timezone.now() + timedelta(days=10))
+        self.create_registration(events=[first, second])
+        self.create_registration(
+            events=[first, ], customer=Customer.objects.create(
+                first_name='Norma', last_name='Miller', email='norma@miller.com'
+            )
+        )
+
+        self.client.login(username=self.superuser.username, password='pass')
+        response = self.client.get(reverse('staffMemberStats'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['series_count'], 3)
+        self.assertEqual(response.context['student_count'], 3)
+        self.assertEqual(response.context['first_series']['id'], first.id)
+        self.assertEqual(
+            [x['id'] for x in response.context['prior_series']], [second.id, first.id]
+        )
+        self.assertEqual([x['id'] for x in response.context['upcoming_series']], [upcoming.id])
+        self.assertEqual(response.context['prior_series'][1]['partners'], [partner.fullName])
+        self.assertEqual(response.context['prior_series'][1]['registrationCount'], 2)
+        self.assertEqual(sum(response.context['hours_by_year'].values()), 4)
+
+        with mock.patch('danceschool.core.staff_stats.getStaffMemberEvents') as getEvents:
+            self.client.get(reverse('staffMemberStats'))
+            getEvents.assert_not_called()
+
+        self.create_registration(
+            events=[second, ], customer=Customer.objects.create(
+                first_name='Dean', last_name='Collins', email='dean@collins.com'
+            )
+        )
+        response = self.client.get(reverse('staffMemberStats'))
+        self.assertEqual(response.context['student_count'], 4)
+
+
+class AccountProfileTest(DefaultSchoolTestCase):
+
+    def test_history_query_count(self):
+        '''
+        Check that the account profile page lists a customer's registrations
+        a page at a time, using the same number of queries for a customer with
+        500 registrations as for a customer with 5.
+        '''
+        customer = Customer.objects.create(
+            first_name='Frankie', last_name='Manning', email='admin@test.com',
+            user=self.superuser,
+        )
+        series = [
+            self.create_series(startTime=timezone.now() - timedelta(days=7 * i))
+            for i in range(1, 11)
+        ]
+
+        def register(number):
+            createRegistrations([{
+                'customer': customer, 'events': [series[k % len(series)], ],
+                'final': True, 'dateTime': timezone.now(), 'voucher': None,
+                'role': None, 'marketingId': None,
+            } for k in range(number)])
+            CustomerHistory.objects.refresh([customer, ])
+
+        self.client.login(username=self.superuser.username, password='pass')
+
+        register(5)
+
+        # The first request also performs the one-time setup of django CMS,
+        # which is not part of the comparison.
+        self.client.get(reverse('accountProfile'))
+
+        cache.clear()
+        with CaptureQueriesContext(connection) as small:
+            response = self.client.get(reverse('accountProfile'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['registration_history']), 5)
+
+        register(495)
+        cache.clear()
+        with CaptureQueriesContext(connection) as large:
+            response = self.client.get(reverse('accountProfile'))
+        self.assertEqual(response.status_code, 200)
+
+        page = response.context['history_page']
+        self.assertEqual(page.paginator.count, 500)
+        self.assertEqual(len(page.object_list), AccountProfileView.history_page_size)
+        self.assertEqual(page.object_list[0].event_id, series[0].id)
+        self.assertEqual(page.object_list[0].source, 'own')
+        self.assertEqual(page.object_list[0].eventName, series[0].name)
+        self.assertEqual(page.object_list[0].instructors, [self.defaultInstructor.fullName])
+        self.assertEqual(
+            response.context['customer_summary']['customerSince'], series[-1].startTime
+        )
+        self.assertEqual(len(large), len(small))
+
+
+class InvalidationTest(DefaultSchoolTestCase):
+
+    def test_versions(self):
+        '''
+        Check that registrations bump the scopes of their events, locations
+        and customers but not those of other events, that versioned cached
+        data is recomputed, and that the invoice purge can still delete event
+        registrations in bulk.
+        '''
+        cache.clear()
+        series = self.create_series()
+        other = self.create_series()
+
+        calls = []
+
+        @invalidation.versionedCache('test', lambda x: [(invalidation.EVENT, x), ])
+        def countCalls(event_id):
+            calls.append(event_id)
+            return len(calls)
+
+        self.assertEqual(countCalls(series.id), 1)
+        self.assertEqual(countCalls(series.id), 1)
+        self.assertEqual(countCalls(other.id), 2)
+
+        scopes = [
+            invalidation.GLOBAL, (invalidation.EVENT, series.id),
+            (invalidation.EVENT, other.id), (invalidation.LOCATION, series.location_id),
+        ]
+        before = invalidation.getVersions(scopes)
+        registration = self.create_registration(events=[series, ])
+        after = invalidation.getVersions(scopes)
+        customer = registration.eventregistration_set.first().customer
+
+        self.assertGreater(after[0], before[0])
+        self.assertGreater(after[1], before[1])
+        self.assertEqual(after[2], before[2])
+        self.assertGreater(after[3], before[3])
+        self.assertEqual(countCalls(series.id), 3)
+        self.assertEqual(countCalls(other.id), 2)
+
+        before = invalidation.getVersion((invalidation.CUSTOMER, customer.id))
+        eventRegistration = registration.eventregistration_set.first()
+        eventRegistration.cancelled = True
+        eventRegistration.save()
+        self.assertGreater(
+            invalidation.getVersion((invalidation.CUSTOMER, customer.id)), before
+        )
+
+        from .purge import getPurgePlan
+        self.assertIn(
+            ('delete', EventRegistration, 'registration__invoice', None), getPurgePlan()
+        )
+
+
+class EventListPluginTest(DefaultSchoolTestCase):
+
+    def test_cached_event_list(self):
+        '''
+        Check that the event list plugin caches its listing with the data that
+        templates use already loaded, and that the listing is recomputed when
+        a registration is finalized.
+        '''
+        cache.clear()
+        series = [
+            self.create_series(startTime=timezone.now() + timedelta(days=i), occurrences=2)
+            for i in range(1, 6)
+        ]
+        self.create_registration(events=[series[0], ])
+
+        placeholder = Placeholder.objects.create(slot='test')
+        instance = add_plugin(placeholder, 'EventListPlugin', 'en', daysStart=0, daysEnd=30)
+        plugin = EventListPlugin()
+
+        def render():
+            return plugin.render(
+                {'request': RequestFactory().get('/')}, instance, placeholder
+            )['event_list']
+
+        events = render()
+        self.assertEqual([x.id for x in events], [x.id for x in series])
+
+        with self.assertNumQueries(0):
+            for event in events:
+                event.name, event.url, event.firstOccurrence, event.teachers
+            self.assertEqual([x.numRegistered for x in events], [1, 0, 0, 0, 0])
+            self.assertEqual(render()[0].id, series[0].id)
+
+        self.create_registration(events=[series[0], ])
+        self.assertEqual(render()[0].numRegistered, 2)
+
+
+class EventRegistrationJsonTest(DefaultSchoolTestCase):
+    '''
+    Check that the door registration listing matches a listing built by
+    walking the model attributes of each registration, and that the number
+    of queries does not depend on the number of registrations.
+    '''
+
+    attributeList = [
+        'id', 'dropIn', 'refundFlag', 'warningFlag',
+        'checkedIn', 'occurrenceId', 'occurrenceStartTime', 'student',
+        ('customer', ['id', 'fullName', 'email', 'numClassSeries']),
+        ('event', ['id', 'name', 'url', ]),
+        ('registration', [
+            'id', 'refundFlag', 'grossTotal', 'total', 'discounted', 'url',
+            ('invoice', [
+                'id', 'grossTotal', 'total', 'adjustments', 'taxes', 'fees',
+                'outstandingBalance', 'statusLabel', 'url'
+            ]),
+        ]),
+        ('invoiceItem', [
+            'id', 'grossTotal', 'total', 'adjustments', 'taxes', 'fees',
+            'revenueMismatch', 'revenueNotYetReceived', 'revenueReceived',
+            'revenueReported'
+        ]),
+        ('role', ['id', 'name']),
+    ]
+
+    def reference_listing(self, post_data):
+        ''' Build the listing from model attributes, one registration at a time. '''
+
+        def recurse_listing(listing, obj, startTime=None, checkInType='O'):
+            this_dict = {}
+            for item in listing:
+                if item == 'checkedIn':
+                    kwargs = {'checkInType': checkInType}
+                    if isinstance(startTime, datetime):
+                        kwargs['date'] = startTime.date()
+                    this_dict[item] = obj.checkedIn(**kwargs)
+                elif isinstance(item, str):
+                    this_dict[item] = getattr(obj, item, None)
+                else:
+                    this_item = getattr(obj, item[0], None)
+                    if item[0] == 'event':
+                        this_item = getattr(this_item, this_item.polymorphic_ctype.model, None)
+                    this_dict[item[0]] = recurse_listing(
+                        item[1], this_item, startTime=startTime, checkInType=checkInType
+                    )
+            return this_dict
+
+        filters = Q(cancelled=False)
+        startTime = None
+        if post_data.get('date'):
+            startTime = ensure_localtime(datetime.strptime(post_data['date'], '%Y-%m-%d'))
+            filters &= Q(
+                event__eventoccurrence__endTime__gte=startTime,
+                event__eventoccurrence__startTime__lte=startTime + timedelta(days=1)
+            )
+        if post_data.get('id'):
+            filters &= Q(customer__id=post_data['id'])
+
+        queryset = EventRegistration.objects.filter(filters).annotate(
+            occurrenceId=F('event__eventoccurrence__id'),
+            occurrenceStartTime=F('event__eventoccurrence__startTime'),
+        ).filter(
+            Q(dropIn=False) | (Q(dropIn=True) & Q(occurrences__id=F('occurrenceId')))
+        ).order_by('registration__firstName', 'registration__lastName')
+
+        return [
+            recurse_listing(
+                self.attributeList, x, startTime=startTime,
+                checkInType=post_data.get('checkInType', 'O')
+            ) for x in queryset
+        ]
+
+    def get_listing(self, post_data):
+        response = self.client.post(
+            reverse('viewregistrations_json'), json.dumps(post_data),
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200)
+        listing = response.json()
+        for x in listing:
+            x.pop('extras', None)
+        return listing
+
+    def test_identical_output(self):
+        s = self.create_series(occurrences=2)
+        first_occurrence = s.eventoccurrence_set.order_by('startTime').first()
+        customer = Customer.objects.create(
+            first_name='Norma', last_name='Miller', email='norma@miller.com'
+        )
+
+        reg = self.create_registration(
+            events=[s, ], customer=customer, role=self.defaultDanceRoles.first()
+        )
+        self.create_registration(events=[s, ])
+        self.create_registration(events=[s, ], dropIn=True)
+        EventCheckIn.objects.create(
+            event=s, occurrence=first_occurrence, checkInType='O',
+            eventRegistration=reg.eventregistration_set.first(), cancelled=False,
+        )
+
+        self.client.login(username=self.superuser.username, password='pass')
+        date = ensure_localtime(first_occurrence.startTime).strftime('%Y-%m-%d')
+
+        for post_data in [
+            {}, {'date': date}, {'date': date, 'checkInType': 'E'},
+            {'id': customer.id},
+        ]:
+            expected = json.loads(json.dumps(
+                self.reference_listing(post_data), cls=DjangoJSONEncoder
+            ))
+            listing = self.get_listing(post_data)
+            self.assertNotEqual(listing, [])
+            self.assertEqual(listing, expected)
+
+        # Check-in status is reported for the date requested.
+        checked_in = [
+            x['checkedIn'] for x in self.get_listing({'date': date})
+            if x['customer']['id'] == customer.id
+        ]
+        self.assertEqual(checked_in, [True, ])
+
+    def test_query_count(self):
+        s = self.create_series()
+        self.client.login(username=self.superuser.username, password='pass')
+
+        self.create_registration(events=[s, ])
+        self.get_listing({})
+        with CaptureQueriesContext(connection) as one_registration:
+            self.get_listing({})
+
+        for i in range(5):
+            self.create_registration(events=[s, ])
+        self.get_listing({})
+        with CaptureQueriesContext(connection) as many_registrations:
+            self.get_listing({})
+
+        self.assertEqual(len(one_registration), len(many_registrations))
+
+
+class EventListingTest(DefaultSchoolTestCase):
+
+    def test_listing_queryset(self):
+        '''
+        Check that listing querysets return instances of each event's own
+        class with the data used by templates, in a single query.
+        '''
+        series = self.create_series()
+        public = PublicEvent.objects.create(
+            title='Test Public Event', slug='test-public-event',
+            pricingTier=self.defaultPricing, location=self.defaultLocation,
+            status=Event.RegStatus.enabled,
+        )
+        EventOccurrence.objects.create(
+            event=public, startTime=timezone.now() + timedelta(days=2),
+            endTime=timezone.now() + timedelta(days=2, hours=3),
+        )
+        public.refresh_from_db()
+        expected = [
+            (Series, series.name, series.displayColor, 1),
+            (PublicEvent, public.name, public.displayColor, 1),
+        ]
+
+        with self.assertNumQueries(1):
+            events = list(Event.objects.listing().filter(
+                id__in=[series.id, public.id]
+            ).annotate(occurrenceCount=Count('eventoccurrence')).order_by('id'))
+            self.assertEqual([
+                (type(x), x.name, x.displayColor, x.occurrenceCount)
+                for x in events
+            ], expected)
+            self.assertEqual(events[1].location, self.defaultLocation)
+
+        # URLs also depend on the organization rule preference.
+        self.assertEqual([x.url for x in events], [series.url, public.url])
+
+
+class EventOrderTest(DefaultSchoolTestCase):
+
+    def test_sort_keys(self):
+        '''
+        Check that events store the sort keys of the current organization
+        rule, and that changing the rule recomputes the keys of every event.
+        '''
+        later = self.create_series(startTime=timezone.now() + timedelta(days=40))
+        earlier = self.create_series(startTime=timezone.now() + timedelta(days=5))
+        session = EventSession.objects.create(name='Test Session', slug='test-session')
+        later.session = session
+        later.save()
+        session.save()
+
+        def ordering():
+            return list(Event.objects.filter(
+                id__in=[later.id, earlier.id]
+            ).order_by('sortGroup', 'sortPrimary', 'sortSecondary', 'startTime'))
+
+        updateConstant('registration__orgRule', 'SessionFirst')
+        later.refresh_from_db()
+        self.assertEqual(later.sortGroup, 0)
+        self.assertEqual(ordering(), [later, earlier])
+
+        updateConstant('registration__orgRule', 'Month')
+        later.refresh_from_db()
+        self.assertEqual(
+            (later.sortGroup, later.sortPrimary, later.sortSecondary),
+            later.getSortKeys('Month'),
+        )
+        self.assertEqual(ordering(), [earlier, later])
+
+
+class RegistrationStatusTest(DefaultSchoolTestCase):
+
+    def test_update_all_events(self):
+        '''
+        Check that the set-based updater opens and closes registration for
+        series and public events in the same way as saving each event would.
+        '''
+        past = self.create_series(startTime=timezone.now() - timedelta(days=10))
+        future = self.create_series(occurrences=4)
+        held_closed = self.create_series(status=Event.RegStatus.heldClosed)
+        public = PublicEvent.objects.create(
+            title='Test Public Event', pricingTier=self.defaultPricing,
+            location=self.defaultLocation, status=Event.RegStatus.enabled,
+        )
+        EventOccurrence.objects.create(
+            event=public, startTime=timezone.now() + timedelta(days=2),
+            endTime=timezone.now() + timedelta(days=2, hours=3),
+        )
+
+        # Put every event in the wrong state without calling save().
+        Event.objects.filter(id__in=[past.id, held_closed.id]).update(
+            registrationOpen=True
+        )
+        Event.objects.filter(id__in=[future.id, public.id]).update(
+            registrationOpen=False
+        )
+
+        with self.assertNumQueries(2):
+            summary = Event.objects.updateRegistrationStatus()
+
+        self.assertEqual(summary['checked'], 4)
+        self.assertEqual(set(summary['opened']), {future.id, public.id})
+        self.assertEqual(set(summary['closed']), {past.id, held_closed.id})
+
+        for event in Event.objects.all():
+            self.assertEqual(event.updateRegistrationStatus(saveMethod=True)[0], False)
+
+        # Running again changes nothing.
+        summary = Event.objects.updateRegistrationStatus()
+        self.assertEqual(summary['opened'] + summary['closed'], [])
+
+    def test_update_invalidates_cached_listings(self):
+        '''
+        Check that cached event listings are recomputed when the set-based
+        updater opens registration, even though it does not call save().
+        '''
+        cache.clear()
+        series = self.create_series(startTime=timezone.now() + timedelta(days=1))
+        Event.objects.filter(id=series.id).update(registrationOpen=False)
+
+        placeholder = Placeholder.objects.create(slot='test')
+        instance = add_plugin(
+            placeholder, 'EventListPlugin', 'en', daysStart=0, daysEnd=30,
+            limitToOpenRegistration=True,
+        )
+        plugin = EventListPlugin()
+
+        def render():
+            return [x.id for x in plugin.render(
+                {'request': RequestFactory().get('/')}, instance, placeholder
+            )['event_list']]
+
+        self.assertEqual(render(), [])
+
+        summary = Event.objects.updateRegistrationStatus()
+        self.assertEqual(summary['opened'], [series.id, ])
+        self.assertEqual(render(), [series.id, ])
+
+
+class ExpiredInvoicePurgeTest(DefaultSchoolTestCase):
+
+    def test_purge_expired_invoices(self):
+        '''
+        Check that expired preliminary invoices and their dependents are
+        deleted in batches, and that other invoices are left alone.
+        '''
+        series = self.create_series()
+        expired = [
+            self.create_registration(events=[series, ], final=False)
+            for i in range(3)
+        ]
+        current = self.create_registration(events=[series, ], final=False)
+        paid = self.create_registration(events=[series, ])
+
+        Invoice.objects.filter(registration__in=expired).update(
+            expirationDate=timezone.now() - timedelta(hours=1)
+        )
+        Invoice.objects.filter(registration__in=[current, paid]).update(
+            expirationDate=timezone.now() + timedelta(hours=1)
+        )
+
+        from .purge import purgeExpiredInvoices
+        metrics = purgeExpiredInvoices(batchSize=2)
+
+        self.assertEqual(metrics['invoices'], 3)
+        self.assertEqual(metrics['batches'], 2)
+        self.assertEqual(metrics['rows']['core.Invoice'], 3)
+        self.assertEqual(metrics['rows']['core.Registration'], 3)
+        self.assertEqual(metrics['rows']['core.EventRegistration'], 3)
+        self.assertFalse(Registration.objects.filter(id__in=[x.id for x in expired]).exists())
+        self.assertTrue(Registration.objects.filter(id=current.id).exists())
+        self.assertTrue(Registration.objects.filter(id=paid.id).exists())
+        self.assertEqual(EventRegistration.objects.filter(event=series).count(), 2)
+
+        out = StringIO()
+        with mock.patch('danceschool.core.management.commands.clear_expired_data.call_command') as clear:
+            call_command('clear_expired_data', stdout=out)
+            self.assertIn('Deleted 0 expired invoices', out.getvalue())
+            clear.assert_called_once_with('clearsessions')
+
+            clear.reset_mock()
+            call_command('clear_expired_data', registrationSessionsOnly=True, stdout=StringIO())
+            clear.assert_not_called()
+
+
+class ClassChoiceFormTest(DefaultSchoolTestCase):
+
+    def get_form(self):
+        return ClassChoiceForm(
+            openEvents=Event.objects.filter(registrationOpen=True),
+            closedEvents=Event.objects.filter(registrationOpen=False),
+        )
+
+    def test_choice_data(self):
+        '''
+        Check that the choices for each event match the values computed by
+        the Event model methods, and that the number of queries needed to
+        build the form does not depend on the number of events.
+        '''
+        s = self.create_series(occurrences=2)
+        s.allowDropins = True
+        s.save()
+        self.create_registration(events=[s, ], role=self.defaultDanceRoles.first())
+
+        with CaptureQueriesContext(connection) as one_event:
+            self.get_form()
+
+        custom = self.create_series()
+        custom.capacity = 10
+        custom.save()
+        EventRole.objects.create(
+            event=custom, role=DanceRole.objects.get(name='Lead'), capacity=3
+        )
+        self.create_registration(events=[custom, ], role=DanceRole.objects.get(name='Lead'))
+        for i in range(4):
+            self.create_series()
+
+        with CaptureQueriesContext(connection) as many_events:
+            form = self.get_form()
+
+        self.assertEqual(len(one_event), len(many_events))
+
+        for event in Event.objects.filter(registrationOpen=True):
+            field = form.fields['series_%s' % event.id]
+            roles = event.availableRoles
+            self.assertEqual(
+                [x['value'] for x in field.field_choices],
+                ['role_%s' % x.id for x in roles]
+            )
+            for role, choice in zip(roles, field.field_choices):
+                self.assertEqual(
+                    choice['data-num-registered'], event.numRegisteredForRole(role)
+                )
+                self.assertEqual(choice['data-capacity'], event.capacityForRole(role))
+                self.assertEqual(
+                    choice.get('data-sold-out', False), event.soldOutForRole(role)
+                )
+
+
+def profiledReceiver(sender, **kwargs):
+    return Customer.objects.count()
+
+
+class RegistrationProfilingTest(DefaultSchoolTestCase):
+
+    def test_receiver_profile(self):
+        post_registration.connect(profiledReceiver, dispatch_uid='profiledReceiver')
+        try:
+            with profileRequest('test') as profile:
+                response = post_registration.send(
+                    sender=Registration, invoice=None, registration=None
+                )
+        finally:
+            post_registration.disconnect(dispatch_uid='profiledReceiver')
+
+        self.assertIn((profiledReceiver, Customer.objects.count()), response)
+        receivers = [x for x in profile.receivers if x['receiver'].endswith('.profiledReceiver')]
+        self.assertEqual(len(receivers), 1)
+        self.assertEqual(receivers[0]['signal'], 'post_registration')
+        self.assertEqual(receivers[0]['queryCount'], 1)
+        self.assertGreaterEqual(profile.queryCount, 1)
+
+    def test_middleware(self):
+        self.create_series()
+        middleware = settings.MIDDLEWARE + [
+            'danceschool.core.profiling.RegistrationProfilingMiddleware'
+        ]
+        with override_settings(MIDDLEWARE=middleware):
+            for i in range(3):
+                response = self.client.get(reverse('registration'))
+                self.assertEqual(response.status_code, 200)
+
+            # Other pages are not profiled.
+            self.client.get('/')
+
+        profiles = RegistrationProfile.objects.all()
+        self.assertEqual(profiles.count(), 3)
+        self.assertEqual(profiles[0].step, 'registration')
+        self.assertGreater(profiles[0].queryCount, 0)
+
+        summary = getProfileSummary(profiles)
+        self.assertEqual(summary['steps'][0]['step'], 'registration')
+        self.assertEqual(summary['steps'][0]['count'], 3)
+        self.assertEqual(len(summary['steps'][0]['duration']), len(summary['percentiles']) + 1)
+
+        self.client.login(username=self.superuser.username, password='pass')
+        response = self.client.get(reverse('admin:core_registrationprofile_summary'))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'registration')
+
+
+def slowCustomerData(sender, **kwargs):
+    time.sleep(0.2)
+    return {'slow': kwargs['customer'].id}
+
+
+def failingCustomerData(sender, **kwargs):
+    raise ValueError('Receiver error')
+
+
+def localeCustomerData(sender, **kwargs):
+    return (translation.get_language(), timezone.get_current_timezone_name())
+
+
+@writing_receiver
+def writingCustomerData(sender, **kwargs):
+    return threading.current_thread()
+
+
+class TimedSignalTest(TransactionTestCase):
+
+    def setUp(self):
+        self.customer = Customer.objects.create(
+            first_name='Frankie', last_name='Manning', email='frankie@example.com'
+        )
+        for i, receiver in enumerate([
+            slowCustomerData, failingCustomerData, slowCustomerData, writingCustomerData
+        ]):
+            get_customer_data.connect(receiver, dispatch_uid='timedSignalTest%s' % i)
+
+    def tearDown(self):
+        for i in range(4):
+            get_customer_data.disconnect(dispatch_uid='timedSignalTest%s' % i)
+        cache.clear()
+
+    def test_send_concurrent(self):
+        '''
+        Receivers are called concurrently outside of a transaction, and their
+        responses are returned in order, including any exceptions.
+        '''
+        start = time.perf_counter()
+        response = get_customer_data.send_concurrent(sender=None, customer=self.customer)
+        elapsed = time.perf_counter() - start
+
+        self.assertLess(elapsed, 0.4)
+        receivers = [x[0] for x in response]
+        self.assertEqual(
+            receivers[-4:],
+            [slowCustomerData, failingCustomerData, slowCustomerData, writingCustomerData]
+        )
+        self.assertIsInstance(response[-3][1], ValueError)
+        self.assertEqual(response[-4][1], {'slow': self.customer.id})
+
+        # Receivers that write data are called in this thread.
+        self.assertEqual(response[-1][1], threading.current_thread())
+
+        # Inside of a transaction, the receivers are called in this thread.
+        with transaction.atomic():
+            response = get_customer_data.send_concurrent(sender=None, customer=self.customer)
+        self.assertIsInstance(response[-3][1], ValueError)
+
+        # Outside of send_concurrent(), exceptions are raised as usual.
+        with self.assertRaises(ValueError):
+            get_customer_data.send(sender=None, customer=self.customer)
+
+    def test_send_concurrent_locale(self):
+        '''
+        Receivers called in the thread pool use the language and time zone
+        of the thread that sent the signal.
+        '''
+        get_customer_data.connect(localeCustomerData, dispatch_uid='timedSignalTestLocale')
+        try:
+            with translation.override('de'), timezone.override('America/Chicago'):
+                response = get_customer_data.send_concurrent(sender=None, customer=self.customer)
+        finally:
+            get_customer_data.disconnect(dispatch_uid='timedSignalTestLocale')
+        self.assertEqual(response[-1][1], ('de', 'America/Chicago'))
+
+
+class QueryPlanAuditTest(TestCase):
+
+    def test_audit_query_plans(self):
+        ''' None of the frequently used lookups require a table scan. '''
+        out = StringIO()
+        call_command('audit_query_plans', fail_on_scan=True, verbose=True, stdout=out)
+        self.assertIn('0 of', out.getvalue())
+        self.assertNotIn(': SCAN', out.getvalue())
+
+
+class BenchmarkTest(DefaultSchoolTestCase):
+
+    def test_generate_and_run_benchmarks(self):
+        '''
+        Generate a small synthetic school, run each benchmark operation
+        against it, and check that a regression from a baseline is reported.
+        '''
+        call_command(
+            'generate_benchmark_school', years=1, customers=40, seriesPerMonth=2,
+            vouchers=5, discounts=2, interactive=False, stdout=StringIO()
+        )
+        self.assertEqual(Series.objects.count(), 26)
+        self.assertEqual(Customer.objects.filter(email__startswith='student').count(), 40)
+
+        with tempfile.TemporaryDirectory() as folder:
+            output = os.path.join(folder, 'results.json')
+            call_command(
+                'run_benchmarks', repeat=1, output=output, no_baseline=True,
+                stdout=StringIO()
+            )
+            with open(output) as f:
+                results = json.load(f)
+
+            self.assertEqual(results['records']['customers'], Customer.objects.count())
+            self.assertEqual(results['skipped'], [])
+            for name, result in results['operations'].items():
+                self.assertIn(result['status'], [200, None], name)
+                self.assertGreater(result['queries'], 0, name)
+
+            results['operations']['registration_page']['queries'] -= 1
+            with open(output, 'w') as f:
+                json.dump(results, f)
+            out = StringIO()
+            with self.assertRaises(CommandError):
+                call_command(
+                    'run_benchmarks', repeat=1, baseline=output, threshold=100,
+                    fail_on_regression=True, operations=['registration_page'],
+                    stdout=out
+                )
+            self.assertIn('Regression in registration_page queries', out.getvalue())
+
+        with self.assertRaises(CommandError):
+            call_command('run_benchmarks', repeat=0, no_baseline=True, stdout=StringIO())
+
+        # Operations that need a series open for registration are skipped
+        # when there is none.
+        Series.objects.update(registrationOpen=False)
+        out = StringIO()
+        call_command(
+            'run_benchmarks', repeat=1, operations=['checkout'], no_baseline=True,
+            stdout=out
+        )
+        self.assertIn('skipped', out.getvalue())
+
+
 class CalendarTest(DefaultSchoolTestCase):
 
     def test_calendar_page(self):
@@ -4,11 +4,14 @@ from django.utils import timezone
 
 from datetime import timedelta
 from dynamic_preferences.registries import global_preferences_registry
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import threading
 
 from danceschool.core.models import (
     DanceRole, DanceType, DanceTypeLevel, ClassDescription, PricingTier,
     Location, StaffMember, Instructor, Event, Series, EventStaffMember,
-    EventOccurrence
+    EventOccurrence, Customer, Invoice, Registration, EventRegistration
 )
 from danceschool.core.constants import getConstant
 
@@ -180,3 +183,94 @@ class DefaultSchoolTestCase(TestCase):
         )
 
         return staffMember
+
+    def create_registration(self, **kwargs):
+        '''
+        This method creates a registration for one or more events for a
+        customer (a default test customer unless one is passed).  By default,
+        the registration is paid and finalized, so that it is treated in the
+        same way as a registration completed through the registration process.
+        '''
+        events = kwargs.get('events', [])
+        customer = kwargs.get('customer', None)
+        role = kwargs.get('role', None)
+        dropIn = kwargs.get('dropIn', False)
+        final = kwargs.get('final', True)
+        dateTime = kwargs.get('dateTime', timezone.now())
+
+        if not customer:
+            customer, created = Customer.objects.get_or_create(
+                first_name='Test', last_name='Customer', email='test@customer.com'
+            )
+
+        registration = Registration(dateTime=dateTime)
+        registration.save()
+
+        for event in events:
+            EventRegistration.objects.create(
+                registration=registration, event=event, customer=customer,
+                role=role, dropIn=dropIn,
+            )
+
+        if final:
+            invoice = registration.invoice
+            invoice.refresh_from_db()
+            invoice.status = Invoice.PaymentStatus.paid
+            invoice.amountPaid = invoice.total
+            invoice.save()
+            registration.finalize(dateTime=dateTime)
+
+        return registration
+
+
+class FakePaymentProcessor(object):
+    '''
+    A local HTTP server that stands in for a payment processor's REST API in
+    tests.  Responses are looked up in the routes dictionary by method and
+    path, and may be callables that are passed the parsed request body.  Each
+    request is recorded so that tests can check which calls were made.
+    '''
+
+    def __init__(self, routes=None):
+        self.routes = routes or {}
+        self.requests = []
+
+    def __enter__(self):
+        processor = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def handle_request(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = json.loads(self.rfile.read(length) or 'null')
+                path = self.path.split('?')[0]
+                processor.requests.append((self.command, path, body))
+
+                response = processor.routes.get((self.command, path))
+                if callable(response):
+                    response = response(body)
+                status, data = response or (404, {'errors': ['Not found']})
+
+                content = json.dumps(data).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            do_GET = do_POST = handle_request
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:%s' % self.server.server_port
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def count(self, method, path):
+        return len([x for x in self.requests if x[0] == method and x[1] == path])
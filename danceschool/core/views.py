@@ -1,14 +1,21 @@
 from django.http import HttpResponseRedirect, Http404, HttpResponseBadRequest, HttpResponse
 from django.shortcuts import get_object_or_404
 from django.conf import settings
+from django.core.cache import cache
 from django.core.exceptions import ObjectDoesNotExist
+from django.core.paginator import Paginator
 from django.urls import reverse
 from django.core.serializers.json import DjangoJSONEncoder
 from django.views.generic import (
     FormView, CreateView, UpdateView, DetailView, TemplateView, ListView,
     RedirectView
 )
-from django.db.models import Min, Q, Count, F, Case, When, BooleanField
+from django.db.models import (
+    Min, Q, Count, F, Case, When, BooleanField, Exists, OuterRef, Subquery,
+    Sum, Value, FloatField, CharField
+)
+from django.db.models.functions import Coalesce
+from django.apps import apps
 from django.utils.translation import gettext_lazy as _
 from django.utils import timezone
 from django.contrib.auth.models import User
@@ -16,7 +23,7 @@ from django.contrib import messages
 from django.contrib.messages.views import SuccessMessageMixin
 from django.contrib.auth.mixins import AccessMixin
 from django.contrib.contenttypes.models import ContentType
-from django.utils import timezone
+from django.contrib.sites.models import Site
 
 from calendar import month_name
 from datetime import datetime, timedelta
@@ -32,7 +39,8 @@ import json
 
 from .models import (
     ClassDescription, Event, Series, PublicEvent, EventOccurrence, EventRole, EventRegistration,
-    StaffMember, Instructor, Invoice, Customer, EventCheckIn
+    StaffMember, Instructor, Invoice, InvoiceItem, Customer, CustomerHistory, EventCheckIn,
+    EventStaffMember
 )
 from .forms import (
     SubstituteReportingForm, StaffMemberBioChangeForm, RefundForm, EmailContactForm,
@@ -47,6 +55,7 @@ from .mixins import (
 from .signals import get_customer_data, get_eventregistration_data
 from .utils.requests import getIntFromGet
 from .utils.timezone import ensure_timezone, ensure_localtime
+from .staff_stats import getInstructorStats, cachedStaffStats, getStaffMemberEvents
 
 
 # Define logger for this file
@@ -121,10 +130,10 @@ class EventRegistrationSummaryView(PermissionRequiredMixin, SiteHistoryMixin, De
         extras_dict = {x: [] for x in registrations.values_list('id', flat=True)}
 
         if registrations:
-            extras = get_eventregistration_data.send(
+            extras = get_eventregistration_data.send_concurrent(
                 sender=EventRegistrationSummaryView, eventregistrations=registrations
             )
-            for k, v in chain.from_iterable([x.items() for x in [y[1] for y in extras if y[1]]]):
+            for k, v in chain.from_iterable([x.items() for x in [y[1] for y in extras if isinstance(y[1], dict)]]):
                 extras_dict[k].extend(v)
 
         context = {
@@ -139,66 +148,15 @@ class EventRegistrationSummaryView(PermissionRequiredMixin, SiteHistoryMixin, De
 class EventRegistrationJsonView(PermissionRequiredMixin, ListView):
     '''
     This view is used to access a list of event registrations for a particular date.
+    Everything needed for the response is loaded in a single annotated query
+    (plus a fixed number of queries for the associated events), and the
+    response is then built directly from the loaded rows.
     '''
     permission_required = 'core.view_registration_summary'
 
     def post(self, request, *args, **kwargs):
         ''' Parse the date and customer information that is passed. '''
 
-        def recurse_listing(listing, obj, extras=None, startTime=None, checkInType='O'):
-            '''
-            Recursively go through a list of model attributes, including attributes that
-            are of linked models.
-            '''
-
-            this_dict = {}
-            if not isinstance(listing, list):
-                raise ValueError('Invalid listing for recursion.')
-
-            for item in listing:
-                if isinstance(item, str):
-                    # Handle a couple of special cases
-                    if item == 'checkedIn':
-                        kwargs = {'checkInType': checkInType}
-                        if isinstance(startTime, datetime):
-                            kwargs['date'] = startTime.date()
-                        this_dict[item] = getattr(obj, item, None)(**kwargs)
-                    elif item == 'getNextOccurrenceForDate':
-                        # This view always uses the beginning of the current day
-                        # when searching for the next EventOccurrence, to avoid
-                        # unexpected behavior when using it for at-the-door
-                        # registration.
-                        this_dict[item] = getattr(
-                            getattr(obj, item, None)(startTime),
-                            'id', None
-                        )
-                    else:
-                        this_dict[item] = getattr(obj, item, None)
-
-                elif isinstance(item, tuple) and len(item) == 2 and isinstance(item[0], str):
-                    this_item = getattr(obj, item[0], None)
-
-                    # Added because of issues with polymorphic queries; we need
-                    # to ensure we have the child model.
-                    if item[0] == 'event':
-                        this_item = getattr(
-                            this_item, this_item.polymorphic_ctype.model, None
-                        )
-
-                    this_dict[item[0]] = recurse_listing(
-                        item[1], this_item, startTime=startTime,
-                        checkInType=checkInType
-                    )
-
-            if (
-                isinstance(obj, EventRegistration) and
-                extras_dict is not None and
-                extras_dict.get(obj.id, None)
-            ):
-                this_dict['extras'] = extras_dict[obj.id]
-
-            return this_dict
-
         try:
             post_data = json.loads(self.request.body)
         except json.decoder.JSONDecodeError:
@@ -235,46 +193,136 @@ class EventRegistrationJsonView(PermissionRequiredMixin, ListView):
         if post_data.get('eventList'):
             queryset = queryset.filter(event__id__in=post_data.get('eventList'))
 
-        # These are all the various attributes that we want to be populated in the response JSON
-        attributeList = [
-            'id', 'dropIn', 'refundFlag', 'warningFlag',
-            'checkedIn', 'occurrenceId', 'occurrenceStartTime', 'student',
-            ('customer', ['id', 'fullName', 'email', 'numClassSeries']),
-            ('event', ['id', 'name', 'url',]),
-            ('registration', [
-                'id', 'refundFlag', 'grossTotal', 'total', 'discounted', 'url',
-                ('invoice', [
-                    'id', 'grossTotal', 'total', 'adjustments', 'taxes', 'fees',
-                    'outstandingBalance', 'statusLabel', 'url'
-                ]),
-            ]),
-            ('invoiceItem', [
-                'id', 'grossTotal', 'total', 'adjustments', 'taxes', 'fees',
-                'revenueMismatch', 'revenueNotYetReceived', 'revenueReceived',
-                'revenueReported'
-            ]),
-            ('role', ['id', 'name']),
-        ]
+        data = json.dumps(self.get_listing(queryset), cls=DjangoJSONEncoder)
+        return HttpResponse(data, content_type='application/json')
+
+    def get_listing(self, queryset):
+        '''
+        Return the serialized listing of the registrations in the passed
+        queryset, including any extra data provided by other apps.
+        '''
+        registrations = list(queryset)
 
         extras_dict = {}
 
-        if queryset:
-            extras = get_eventregistration_data.send(sender=EventRegistrationJsonView, eventregistrations=queryset)
-            extras_dict = {x: [] for x in queryset.values_list('id', flat=True)}
+        if registrations:
+            extras = get_eventregistration_data.send_concurrent(
+                sender=EventRegistrationJsonView, eventregistrations=queryset
+            )
+            extras_dict = {x.id: [] for x in registrations}
             for k, v in chain.from_iterable([x.items() for x in [y[1] for y in extras if isinstance(y[1], dict)]]):
                 extras_dict[k].extend(v)
 
-        this_listing = [
-            recurse_listing(
-                attributeList, q, extras=extras_dict,
-                startTime=getattr(self, 'startTime', None),
-                checkInType=getattr(self, 'checkInType', 'O')
-            )
-            for q in queryset
+        return self.serialize(registrations, extras_dict)
+
+    def get_events(self, registrations):
+        '''
+        Return a dictionary of the (child class) events for the passed
+        registrations, with the related objects needed for their names and URLs
+        loaded in the same query.
+        '''
+        return Event.objects.listing().in_bulk(set([x.event_id for x in registrations]))
+
+    def serialize(self, registrations, extras_dict=None):
+        '''
+        Build the listing of event registrations from the annotated queryset
+        rows.  Values are taken from fields that were loaded with the query and
+        from the annotations added in get_queryset(), so that no additional
+        queries are needed for each registration.
+        '''
+        if extras_dict is None:
+            extras_dict = {}
+        events = self.get_events(registrations)
+        financial_fields = [
+            'revenueMismatch', 'revenueNotYetReceived', 'revenueReceived',
+            'revenueReported',
         ]
 
-        data = json.dumps(this_listing, cls=DjangoJSONEncoder)
-        return HttpResponse(data, content_type='application/json')
+        # Event and invoice URLs depend on site-wide preferences, so look
+        # them up once rather than once per registration.
+        event_dicts = {
+            k: {'id': v.id, 'name': v.name, 'url': v.url}
+            for k, v in events.items()
+        }
+        invoice_url_prefix = '%s://%s' % (
+            getConstant('email__linkProtocol'),
+            Site.objects.get_current().domain,
+        )
+
+        listing = []
+
+        for er in registrations:
+            customer = er.customer
+            registration = er.registration
+            invoice = registration.invoice
+            item = er.invoiceItem
+
+            if customer and er.customerNumClassSeries is None:
+                # No stored history yet, so compute it.
+                er.customerNumClassSeries = customer.numClassSeries
+
+            this_dict = {
+                'id': er.id,
+                'dropIn': er.dropIn,
+                'refundFlag': er.refundFlag,
+                'warningFlag': er.warningFlag,
+                'checkedIn': er.isCheckedIn,
+                'occurrenceId': er.occurrenceId,
+                'occurrenceStartTime': er.occurrenceStartTime,
+                'student': er.student,
+                'customer': {
+                    'id': getattr(customer, 'id', None),
+                    'fullName': getattr(customer, 'fullName', None),
+                    'email': getattr(customer, 'email', None),
+                    'numClassSeries': er.customerNumClassSeries,
+                },
+                'event': dict(event_dicts[er.event_id]),
+                'registration': {
+                    'id': registration.id,
+                    'refundFlag': (
+                        invoice.adjustments != 0 or
+                        (er.invoiceRefundsReported or 0) != 0
+                    ),
+                    'grossTotal': er.registrationGrossTotal,
+                    'total': er.registrationTotal,
+                    'discounted': er.registrationGrossTotal != er.registrationTotal,
+                    'url': registration.url,
+                    'invoice': {
+                        'id': invoice.id,
+                        'grossTotal': invoice.grossTotal,
+                        'total': invoice.total,
+                        'adjustments': invoice.adjustments,
+                        'taxes': invoice.taxes,
+                        'fees': invoice.fees,
+                        'outstandingBalance': invoice.outstandingBalance,
+                        'statusLabel': invoice.statusLabel,
+                        'url': invoice_url_prefix + reverse(
+                            'viewInvoice', args=[invoice.id, ]
+                        ),
+                    },
+                },
+                'invoiceItem': {
+                    'id': item.id,
+                    'grossTotal': item.grossTotal,
+                    'total': item.total,
+                    'adjustments': item.adjustments,
+                    'taxes': item.taxes,
+                    'fees': item.fees,
+                },
+                'role': {
+                    'id': getattr(er.role, 'id', None),
+                    'name': getattr(er.role, 'name', None),
+                },
+            }
+            this_dict['invoiceItem'].update({
+                k: getattr(item, k, None) for k in financial_fields
+            })
+
+            if extras_dict.get(er.id, None):
+                this_dict['extras'] = extras_dict[er.id]
+
+            listing.append(this_dict)
+        return listing
 
     def get_queryset(self):
         filters = {'cancelled': False}
@@ -287,14 +335,68 @@ class EventRegistrationJsonView(PermissionRequiredMixin, ListView):
 
         dropInFilters = Q(dropIn=False) | (Q(dropIn=True) & Q(occurrences__id=F('occurrenceId')))
 
+        # Check-ins for occurrences are for the next occurrence of the event
+        # beginning on the requested date.
+        checkInType = getattr(self, 'checkInType', 'O')
+        checkin_filters = Q(
+            eventRegistration=OuterRef('pk'), cancelled=False,
+            checkInType=checkInType
+        )
+        if isinstance(getattr(self, 'startTime', None), datetime) and checkInType == 'O':
+            this_date = self.startTime.date()
+            checkin_filters &= Q(occurrence=Subquery(
+                EventOccurrence.objects.filter(
+                    event=OuterRef(OuterRef('event')),
+                    startTime__gte=ensure_localtime(
+                        datetime(this_date.year, this_date.month, this_date.day)
+                    ),
+                ).order_by('startTime').values('id')[:1]
+            ))
+
+        reg_items = InvoiceItem.objects.filter(
+            eventRegistration__registration=OuterRef('registration')
+        ).order_by().values('eventRegistration__registration')
+
+        related = [
+            'registration', 'event', 'customer', 'role', 'registration__invoice',
+            'invoiceItem', 'invoiceItem__invoice',
+        ]
+        annotations = {
+            'occurrenceId': F('event__eventoccurrence__id'),
+            'occurrenceStartTime': F('event__eventoccurrence__startTime'),
+            'isCheckedIn': Exists(EventCheckIn.objects.filter(checkin_filters)),
+            'customerNumClassSeries': Subquery(
+                CustomerHistory.objects.filter(
+                    customer=OuterRef('customer')
+                ).values('numClassSeries')[:1]
+            ),
+            'registrationGrossTotal': Coalesce(
+                Subquery(reg_items.annotate(x=Sum('grossTotal')).values('x')), 0
+            ),
+            'registrationTotal': Coalesce(
+                Subquery(reg_items.annotate(x=Sum('total')).values('x')), 0
+            ),
+            'invoiceRefundsReported': Value(0, output_field=FloatField()),
+        }
+
+        if apps.is_installed('danceschool.financial'):
+            RevenueItem = apps.get_model('financial', 'RevenueItem')
+            related.append('invoiceItem__revenueitem')
+            annotations['invoiceRefundsReported'] = Subquery(
+                RevenueItem.objects.filter(
+                    invoiceItem__invoice=OuterRef('registration__invoice')
+                ).order_by().values('invoiceItem__invoice').annotate(
+                    x=-1 * Sum('adjustments')
+                ).values('x')
+            )
+
         registrations = EventRegistration.objects.filter(
             **filters
         ).annotate(
-            occurrenceId=F('event__eventoccurrence__id'),
-            occurrenceStartTime=F('event__eventoccurrence__startTime'),
-        ).filter(dropInFilters).select_related(
-            'registration', 'event', 'customer',
-            'invoiceItem', 'role', 'registration__invoice',
+            occurrenceId=annotations.pop('occurrenceId'),
+            occurrenceStartTime=annotations.pop('occurrenceStartTime'),
+        ).filter(dropInFilters).annotate(**annotations).select_related(
+            *related
         ).order_by('registration__firstName', 'registration__lastName')
         return registrations
 
@@ -919,54 +1021,142 @@ class AccountProfileView(LoginRequiredMixin, DetailView):
     model = User
     template_name = 'core/account_profile.html'
 
+    # The number of registrations shown on each page of the history.
+    history_page_size = 25
+
     def get_object(self, queryset=None):
         return self.request.user
 
+    def get_registration_history(self, customer, verified_emails):
+        '''
+        Return a single queryset of the event registrations to show in the
+        history: those of the user's own customer record, those of customers
+        with one of the user's verified email addresses, and those on invoices
+        submitted by the current user (other than at the door).  Each
+        registration is annotated with the source that it came from.
+        '''
+        own = Q(customer=customer) if customer else Q(pk__in=[])
+        verified = Q(customer__email__in=verified_emails)
+        submitted = Q(
+            registration__invoice__submissionUser=self.request.user,
+            registration__payAtDoor=False
+        )
+
+        return EventRegistration.objects.filter(own | verified | submitted).annotate(
+            source=Case(
+                When(own, then=Value('own')),
+                When(verified, then=Value('verified')),
+                default=Value('submitted'),
+                output_field=CharField(),
+            ),
+            eventName=Coalesce(
+                'event__series__classDescription__title', 'event__publicevent__title'
+            ),
+        ).select_related(
+            'event', 'event__location', 'event__room', 'customer', 'role',
+        ).order_by('-event__startTime', '-id')
+
+    def add_event_details(self, eventregs):
+        '''
+        Add the event name and the names of the instructors to each of the
+        passed registrations, using one query for all of their events.
+        '''
+        event_ids = set(x.event_id for x in eventregs)
+        instructors = {}
+        for event_id, firstName, lastName in EventStaffMember.objects.filter(
+            event__in=event_ids,
+            category=getConstant('general__eventStaffCategoryInstructor'),
+        ).order_by('staffMember__lastName', 'staffMember__firstName').values_list(
+            'event', 'staffMember__firstName', 'staffMember__lastName'
+        ):
+            instructors.setdefault(event_id, []).append(
+                ' '.join([firstName or '', lastName or ''])
+            )
+
+        # Events of other types are named by their own subclasses.
+        other_names = {
+            x.id: x.name for x in Event.objects.filter(
+                id__in=[x.event_id for x in eventregs if x.eventName is None]
+            )
+        } if any(x.eventName is None for x in eventregs) else {}
+
+        for eventreg in eventregs:
+            if eventreg.eventName is None:
+                eventreg.eventName = other_names.get(eventreg.event_id, '')
+            eventreg.instructors = instructors.get(eventreg.event_id, [])
+
+    def get_customer_summary(self, customer):
+        '''
+        The summary of a customer's registrations is cached until their stored
+        registration history changes.
+        '''
+        history = customer.getHistory()
+        key = 'accountProfile:summary:%s:%s' % (
+            customer.id, history.modifiedDate.timestamp() if history.modifiedDate else None
+        )
+        summary = cache.get(key)
+        if summary is None:
+            summary = EventRegistration.objects.filter(
+                customer=customer, cancelled=False, registration__final=True,
+            ).aggregate(customerSince=Min('event__startTime'))
+            summary.update({
+                'numClassSeries': history.numClassSeries,
+                'numPublicEvents': history.numPublicEvents,
+                'numDropIns': history.numDropIns,
+            })
+            cache.set(key, summary, 86400)
+        return summary
+
     def get_context_data(self, **kwargs):
         context = {}
         user = self.get_object()
 
+        emails = list(user.emailaddress_set.all())
+        verified_emails = [x for x in emails if x.verified]
         context.update({
-            'primary_email': user.emailaddress_set.filter(primary=True).first(),
-            'verified_emails': user.emailaddress_set.filter(verified=True),
-            'unverified_emails': user.emailaddress_set.filter(verified=False),
+            'primary_email': next((x for x in emails if x.primary), None),
+            'verified_emails': verified_emails,
+            'unverified_emails': [x for x in emails if not x.verified],
         })
 
-        if hasattr(user, 'customer'):
+        customer = getattr(user, 'customer', None)
+        if customer:
             context.update({
-                'customer': user.customer,
-                'customer_verified': user.emailaddress_set.filter(email=user.customer.email, verified=True).exists(),
+                'customer': customer,
+                'customer_verified': customer.email in [x.email for x in verified_emails],
+                'customer_summary': self.get_customer_summary(customer),
             })
-            context['customer_eventregs'] = EventRegistration.objects.filter(customer=user.customer)
 
-        context['verified_eventregs'] = EventRegistration.objects.filter(
-            customer__email__in=[x.email for x in context['verified_emails']]
-        ).exclude(
-            id__in=[x.id for x in context.get('customer_eventregs', [])]
+        history = self.get_registration_history(
+            customer, [x.email for x in verified_emails]
         )
-        context['submitted_eventregs'] = EventRegistration.objects.filter(
-            registration__invoice__submissionUser=self.request.user, registration__payAtDoor=False
-        ).exclude(
-            id__in=[x.id for x in context.get('customer_eventregs', [])]
-        ).exclude(
-            id__in=[x.id for x in context.get('verified_eventregs', [])]
+        page = Paginator(history, self.history_page_size).get_page(
+            self.request.GET.get('page')
         )
+        page.object_list = list(page.object_list)
+        self.add_event_details(page.object_list)
+        context.update({
+            'history_page': page,
+            'registration_history': page.object_list,
+        })
 
         if hasattr(user, 'staffmember'):
-            upcoming_events = Event.objects.filter(
-                endTime__gt=timezone.now(),
-                eventstaffmember__staffMember=user.staffmember).distinct().order_by('-startTime')
+            now = timezone.now()
             context.update({
                 'staffmember': user.staffmember,
-                'upcoming_events': upcoming_events,
+                'upcoming_events': [
+                    x for x in cachedStaffStats(
+                        'events', user.staffmember.id, getStaffMemberEvents
+                    ) if x['endTime'] and x['endTime'] > now
+                ],
             })
 
         # Get any extra context data passed by other apps.  These data require unique keys, so when writing
         # a handler for this signal, be sure to provide unique context keys.
-        if hasattr(user, 'customer'):
-            extra_customer_data = get_customer_data.send(
+        if customer:
+            extra_customer_data = get_customer_data.send_concurrent(
                 sender=AccountProfileView,
-                customer=user.customer,
+                customer=customer,
             )
             for item in extra_customer_data:
                 if len(item) > 1 and isinstance(item[1], dict):
@@ -994,25 +1184,9 @@ class InstructorStatsView(StaffMemberObjectMixin, PermissionRequiredMixin, Detai
 
     def get_context_data(self, **kwargs):
         instructor = self.object
-        context = {}
-
-        context.update({
-            'instructor': instructor,
-            'prior_series': Event.objects.filter(
-                startTime__lte=timezone.now(),
-                eventstaffmember__staffMember=instructor).order_by('-startTime'),
-            'upcoming_series': Event.objects.filter(
-                startTime__gt=timezone.now(),
-                eventstaffmember__staffMember=instructor).order_by('-startTime'),
-        })
-
-        if context['prior_series']:
-            context.update({'first_series': context['prior_series'].last(), })
-            context.update({
-                'teaching_since': month_name[context['first_series'].month] + ' ' + str(context['first_series'].year),
-                'student_count': sum([x.numRegistered for x in context['prior_series']]),
-            })
-        context.update({'series_count': len(context['prior_series']) + len(context['upcoming_series'])})
+        context = {'instructor': instructor}
+        if instructor:
+            context.update(getInstructorStats(instructor))
 
         # Note: This get the detailview's context, not all the mixins.  Supering itself led to an infinite loop.
         return super(DetailView, self).get_context_data(**context)
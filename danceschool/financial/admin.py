@@ -1,4 +1,4 @@
-from django.contrib import admin
+from django.contrib import admin, messages
 from django.contrib.auth.models import User
 from django.contrib.contenttypes.models import ContentType
 from django.urls import reverse
@@ -21,7 +21,8 @@ from danceschool.core.models import Location, Room, StaffMember, EventStaffCateg
 from .models import (
     ExpenseItem, ExpenseCategory, RevenueItem, RevenueCategory,
     RepeatedExpenseRule, LocationRentalInfo, RoomRentalInfo, StaffDefaultWage,
-    StaffMemberWageInfo, GenericRepeatedExpense, TransactionParty
+    StaffMemberWageInfo, GenericRepeatedExpense, TransactionParty,
+    ExpenseGenerationRun
 )
 from .forms import ExpenseCategoryWidget
 from .autocomplete_light_registry import get_method_list, get_approval_status_list
@@ -505,7 +506,7 @@ updateStaffCompensationInfo.short_description = _('Update compensation rules')
 class RepeatedExpenseRuleChildAdmin(PolymorphicChildModelAdmin):
     """ Base admin class for all child models """
     base_model = RepeatedExpenseRule
-    readonly_fields = ('lastRun', )
+    readonly_fields = ('lastRun', 'lastErrorTime', 'lastError')
 
     # By using these `base_...` attributes instead of the regular ModelAdmin
     # form` and `fieldsets`, the additional fields of the child models
@@ -514,6 +515,10 @@ class RepeatedExpenseRuleChildAdmin(PolymorphicChildModelAdmin):
         (None, {
             'fields': ('rentalRate', 'applyRateRule', 'disabled', 'lastRun')
         }),
+        (_('Errors'), {
+            'fields': ('lastErrorTime', 'lastError'),
+            'classes': ('collapse', )
+        }),
         (_('Generation rules'), {
             'fields': (
                 'dayStarts', 'weekStarts', 'monthStarts',
@@ -661,21 +666,53 @@ class RepeatedExpenseRuleAdmin(PolymorphicParentModelAdmin):
     def generateExpenses(self, request, queryset):
         rule_count = len(queryset)
         generate_count = 0
+        failed_count = 0
         for q in queryset:
-            generate_count += q.generateExpenses(request=request)
+            count = q.runGeneration(request=request)
+            if count is None:
+                failed_count += 1
+            else:
+                generate_count += count
         message_bit = 'Successfully generated %s expense item%s from %s rule%s.' % (
             generate_count,
             's' if generate_count != 1 else '',
-            rule_count,
-            's' if rule_count != 1 else ''
+            rule_count - failed_count,
+            's' if rule_count - failed_count != 1 else ''
         )
         self.message_user(request, message_bit)
+        if failed_count:
+            self.message_user(
+                request,
+                '%s rule%s failed.  See the last error of each rule for details.' % (
+                    failed_count, 's' if failed_count != 1 else ''
+                ),
+                level=messages.ERROR
+            )
 
     generateExpenses.short_description = _(
         'Generate expenses for selected repeated expense rules'
     )
 
 
+@admin.register(ExpenseGenerationRun)
+class ExpenseGenerationRunAdmin(admin.ModelAdmin):
+    '''
+    Runs are recorded when expenses are generated, so they cannot be added
+    or changed.
+    '''
+    list_display = (
+        'startTime', 'endTime', 'parallel', 'rulesTotal', 'rulesCompleted',
+        'rulesFailed', 'itemsCreated'
+    )
+    list_filter = ('parallel', 'startTime')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
 admin.site.register(ExpenseCategory)
 admin.site.register(RevenueCategory)
 
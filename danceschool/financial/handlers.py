@@ -1,7 +1,7 @@
 from django.dispatch import receiver
 from django.db.models import Q, Value, CharField, F
 from django.db.models.query import QuerySet
-from django.db.models.signals import post_save, m2m_changed
+from django.db.models.signals import post_save, post_delete, m2m_changed
 from django.utils.translation import gettext_lazy as _
 from django.contrib.auth.models import User
 
@@ -14,8 +14,9 @@ from danceschool.core.models import (
 )
 from danceschool.core.constants import getConstant
 from danceschool.core.signals import get_eventregistration_data
+from danceschool.core.staff_stats import invalidateStaffStats
 
-from .models import ExpenseItem, RevenueItem, RepeatedExpenseRule
+from .models import ExpenseItem, RevenueItem, RepeatedExpenseRule, TransactionParty
 
 
 # Define logger for this file
@@ -99,6 +100,30 @@ def modifyExistingExpenseItemsForSeriesClass(sender, instance, **kwargs):
             expense.save()
 
 
+@receiver(post_delete, sender=ExpenseItem)
+def rebuildCoverageForDeletedExpenseItem(sender, instance, **kwargs):
+    '''
+    When an expense item generated for a period is deleted, the coverage of
+    its rule is rebuilt so that the period may be generated again.
+    '''
+    if not (instance.expenseRule_id and instance.periodStart and instance.periodEnd):
+        return
+
+    logger.debug('Rebuilding coverage for expense rule %s.' % instance.expenseRule_id)
+    for rule in RepeatedExpenseRule.objects.filter(id=instance.expenseRule_id):
+        rule.rebuildCoverage()
+
+
+@receiver(post_save, sender=ExpenseItem)
+@receiver(post_delete, sender=ExpenseItem)
+def invalidateStaffStatsForExpenseItem(sender, instance, **kwargs):
+    ''' Discard the cached payment totals of the staff member who is paid. '''
+    if instance.payTo_id:
+        invalidateStaffStats(TransactionParty.objects.filter(
+            id=instance.payTo_id
+        ).values_list('staffMember', flat=True))
+
+
 @receiver(post_save, sender=InvoiceItem)
 def createRevenueItemForInvoiceItem(sender, instance, **kwargs):
     if 'loaddata' in sys.argv or ('raw' in kwargs and kwargs['raw']):
@@ -1,5 +1,5 @@
 from django.conf import settings
-from django.db.models import Sum, Count, Q
+from django.db.models import Sum, Count, Q, Exists, OuterRef
 from django.db.models.functions import TruncDate, TruncMonth
 from django.http import HttpResponse
 from django.utils import timezone
@@ -16,10 +16,48 @@ from danceschool.core.constants import getConstant
 from danceschool.core.models import (
     Registration, Event, EventOccurrence, EventStaffMember, InvoiceItem, Room, StaffMember
 )
+from danceschool.core.staff_stats import cachedStaffStats
 from danceschool.core.utils.timezone import ensure_timezone
 
 from .constants import EXPENSE_BASES
-from .models import ExpenseItem, RevenueItem, RepeatedExpenseRule, RoomRentalInfo, TransactionParty
+from .models import (
+    ExpenseItem, RevenueItem, RepeatedExpenseRule, RoomRentalInfo, TransactionParty,
+    ExpenseRuleCoverage
+)
+
+
+def getStaffMemberPaymentTotals(staffMember, year=None):
+    '''
+    Return the totals shown on a staff member's payment history page, computed
+    in a single aggregate query and cached per staff member.  If a year is
+    passed, then only expenses accrued, paid or submitted in that year are
+    included, and the totals for "this year" are for that year.
+    '''
+    def computeTotals(staffMember_id, year):
+        items = ExpenseItem.objects.filter(payTo__staffMember=staffMember_id)
+        if year:
+            items = items.filter(
+                Q(accrualDate__year=year) | Q(paymentDate__year=year) |
+                Q(submissionDate__year=year)
+            )
+
+        this_year = year or timezone.now().year
+        in_year = Q(
+            paymentDate__gte=ensure_timezone(datetime(this_year, 1, 1, 0, 0)),
+            paymentDate__lt=ensure_timezone(datetime(this_year + 1, 1, 1, 0, 0)),
+        )
+        paid = Q(paid=True, reimbursement=False)
+        totals = items.aggregate(
+            total_paid_alltime=Sum('total', filter=paid),
+            total_awaiting_payment=Sum('total', filter=Q(paid=False)),
+            total_paid_this_year=Sum('total', filter=paid & in_year),
+            total_reimbursements=Sum(
+                'total', filter=Q(paid=True, reimbursement=True) & in_year
+            ),
+        )
+        return {k: v or 0 for k, v in totals.items()}
+
+    return cachedStaffStats('payments', staffMember.id, computeTotals, year)
 
 
 def getExpenseItemsCSV(queryset, scope='instructor'):
@@ -125,6 +163,27 @@ def getRevenueItemsCSV(queryset):
     return response
 
 
+def getUncoveredOccurrences(rule, events):
+    '''
+    Return the occurrences of the passed events for which non-hourly expenses
+    may still need to be generated under a rule.  Once a rule has been run,
+    occurrences that lie entirely within periods already covered by the rule's
+    expense items are skipped, so that each run only processes occurrences
+    that were created or changed since the rule's coverage was last updated.
+    If the rule has never been run, or its expense items or settings have been
+    changed since its last run, all occurrences are returned.
+    '''
+    occurrences = EventOccurrence.objects.filter(event__in=events)
+    if rule.lastRun:
+        occurrences = occurrences.filter(~Exists(
+            ExpenseRuleCoverage.objects.filter(
+                rule=rule, periodStart__lte=OuterRef('startTime'),
+                periodEnd__gte=OuterRef('endTime'),
+            )
+        ))
+    return occurrences
+
+
 def createExpenseItemsForVenueRental(request=None, datetimeTuple=None, rule=None, event=None):
     '''
     For each Location or Room-related Repeated Expense Rule, look for Events
@@ -263,7 +322,7 @@ def createExpenseItemsForVenueRental(request=None, datetimeTuple=None, rule=None
             # of intervals for which to construct expenses
             intervals = [
                 (x.localStartTime, x.localEndTime) for x in
-                EventOccurrence.objects.filter(event__in=events)
+                getUncoveredOccurrences(rule, events)
             ]
             remaining_intervals = rule.getWindowsAndTotals(intervals)
 
@@ -490,7 +549,7 @@ def createExpenseItemsForEvents(request=None, datetimeTuple=None, rule=None, eve
 
                 intervals = [
                     (x.localStartTime, x.localEndTime) for x in
-                    EventOccurrence.objects.filter(event__in=events)
+                    getUncoveredOccurrences(rule, events)
                 ]
                 remaining_intervals = rule.getWindowsAndTotals(intervals)
 
@@ -661,14 +720,14 @@ def createRevenueItemsForRegistrations(request=None, datetimeTuple=None):
             ] = timezone.now() - relativedelta(months=c)
 
     for item in InvoiceItem.objects.filter(**filters_events).distinct():
-        if item.invoice.registration.paidOnline:
+        if item.invoice.paidOnline:
             received = True
         else:
             received = False
 
         revenue_description = _('Event Registration ') + \
             str(item.eventRegistration.id) + ': ' + \
-            item.invoice.registration.fullName
+            item.invoice.fullName
         RevenueItem.objects.create(
             invoiceItem=item,
             category=this_category,
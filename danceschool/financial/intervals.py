@@ -0,0 +1,62 @@
+'''
+Set operations on sorted lists of (start, end) intervals, used to find the
+periods for which repeated expenses still need to be generated.  These work
+on the whole list of intervals in a single pass, rather than rebuilding an
+interval tree and modifying it one interval or one slice time at a time.
+Their results match those of the corresponding IntervalTree operations.
+'''
+from bisect import bisect_right
+
+
+def mergeIntervals(intervals, strict=True):
+    '''
+    Merge overlapping intervals, dropping empty ones.  If strict is True, then
+    intervals that only touch are kept separate, as with
+    IntervalTree.merge_overlaps().
+    '''
+    merged = []
+    for begin, end in sorted(x for x in intervals if x[0] < x[1]):
+        if merged and (begin < merged[-1][1] or (not strict and begin == merged[-1][1])):
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((begin, end))
+    return merged
+
+
+def chopIntervals(intervals, removed):
+    '''
+    Remove the parts of a sorted list of disjoint intervals that are covered
+    by a second sorted list of disjoint intervals.
+    '''
+    result = []
+    j = 0
+    for begin, end in intervals:
+        # Skip removed intervals that end before this interval begins.
+        while j < len(removed) and removed[j][1] <= begin:
+            j += 1
+        k = j
+        while begin < end and k < len(removed) and removed[k][0] < end:
+            if removed[k][0] > begin:
+                result.append((begin, removed[k][0]))
+            begin = max(begin, removed[k][1])
+            k += 1
+        if begin < end:
+            result.append((begin, end))
+    return result
+
+
+def sliceIntervals(intervals, times):
+    '''
+    Split each interval at every time that falls strictly within it.
+    '''
+    times = sorted(set(times))
+    result = []
+    for begin, end in intervals:
+        i = bisect_right(times, begin)
+        while i < len(times) and times[i] < end:
+            result.append((begin, times[i]))
+            begin = times[i]
+            i += 1
+        result.append((begin, end))
+    return result
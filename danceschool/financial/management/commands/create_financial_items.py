@@ -1,28 +1,62 @@
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 
-from danceschool.financial.helpers import (
-    createExpenseItemsForEvents, createExpenseItemsForVenueRental, createRevenueItemsForRegistrations
-)
+from danceschool.financial.helpers import createRevenueItemsForRegistrations
+from danceschool.financial.models import RepeatedExpenseRule
+from danceschool.financial.tasks import generateExpenses, getRulesToGenerate
 from danceschool.core.constants import getConstant
 
 
 class Command(BaseCommand):
     help = 'Create expense items for recurring expenses and generate revenue items for registrations'
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--parallel', action='store_true',
+            help='Queue a separate task for each expense rule instead of running them here.',
+        )
+        parser.add_argument(
+            '--rule', dest='rules', type=int, action='append',
+            help=(
+                'Only generate expenses for the repeated expense rule with this ID. ' +
+                'May be repeated.  Revenue items are not generated.'
+            ),
+        )
+
     def handle(self, *args, **options):
-        if getConstant('financial__autoGenerateExpensesEventStaff'):
-            self.stdout.write('Generating expense items for event staff...')
-            createExpenseItemsForEvents()
-            self.stdout.write('...done.')
+        rule_ids = options.get('rules')
+        parallel = options.get('parallel', False)
+
+        if rule_ids:
+            rules = RepeatedExpenseRule.objects.filter(id__in=rule_ids)
+            missing = set(rule_ids) - set(rules.values_list('id', flat=True))
+            if missing:
+                raise CommandError(
+                    'Repeated expense rules not found: %s' %
+                    ', '.join(str(x) for x in sorted(missing))
+                )
         else:
-            self.stdout.write('Generation of expense items for event staff is not enabled.')
+            if not getConstant('financial__autoGenerateExpensesEventStaff'):
+                self.stdout.write('Generation of expense items for event staff is not enabled.')
+            if not getConstant('financial__autoGenerateExpensesVenueRental'):
+                self.stdout.write('Generation of expense items for venue rental is not enabled.')
+            rules = getRulesToGenerate()
 
-        if getConstant('financial__autoGenerateExpensesVenueRental'):
-            self.stdout.write('Generating expense items for venue rentals...')
-            createExpenseItemsForVenueRental()
-            self.stdout.write('...done.')
+        self.stdout.write('Generating expense items...')
+        run = generateExpenses(rules=rules, parallel=parallel)
+        if parallel:
+            self.stdout.write(
+                'Queued %s rules as expense generation run %s.' % (run.rulesTotal, run.id)
+            )
         else:
-            self.stdout.write('Generation of expense items for venue rental is not enabled.')
+            self.stdout.write(str(run))
+            for rule in RepeatedExpenseRule.objects.filter(
+                id__in=rules.values('id'), lastErrorTime__gte=run.startTime
+            ):
+                self.stderr.write('Rule %s failed: %s' % (rule.id, rule.lastError))
+        self.stdout.write('...done.')
+
+        if rule_ids:
+            return
 
         if getConstant('financial__autoGenerateRevenueRegistrations'):
             self.stdout.write('Generating revenue items for registrations...')
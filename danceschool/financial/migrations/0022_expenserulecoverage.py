@@ -0,0 +1,53 @@
+# Generated by Django 3.1.14 on 2026-10-19 06:10
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+from danceschool.financial.intervals import mergeIntervals
+
+
+def buildCoverage(apps, schema_editor):
+    ExpenseItem = apps.get_model('financial', 'ExpenseItem')
+    ExpenseRuleCoverage = apps.get_model('financial', 'ExpenseRuleCoverage')
+    db_alias = schema_editor.connection.alias
+
+    periods = {}
+    for rule_id, start, end in ExpenseItem.objects.using(db_alias).filter(
+        expenseRule__isnull=False, periodStart__isnull=False, periodEnd__isnull=False,
+    ).values_list('expenseRule', 'periodStart', 'periodEnd'):
+        periods.setdefault(rule_id, []).append((start, end))
+
+    ExpenseRuleCoverage.objects.using(db_alias).bulk_create([
+        ExpenseRuleCoverage(rule_id=rule_id, periodStart=x[0], periodEnd=x[1])
+        for rule_id, rule_periods in periods.items()
+        for x in mergeIntervals(rule_periods, strict=False)
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('financial', '0021_auto_20210127_2052'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExpenseRuleCoverage',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('periodStart', models.DateTimeField(verbose_name='Covered period start')),
+                ('periodEnd', models.DateTimeField(verbose_name='Covered period end')),
+                ('rule', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='coverage', to='financial.repeatedexpenserule', verbose_name='Expense generation rule')),
+            ],
+            options={
+                'verbose_name': 'Expense rule coverage',
+                'verbose_name_plural': 'Expense rule coverage',
+                'ordering': ['rule', 'periodStart'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='expenserulecoverage',
+            index=models.Index(fields=['rule', 'periodStart', 'periodEnd'], name='financial_e_rule_id_724738_idx'),
+        ),
+        migrations.RunPython(buildCoverage, migrations.RunPython.noop),
+    ]
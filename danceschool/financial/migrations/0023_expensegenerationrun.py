@@ -0,0 +1,41 @@
+# Generated by Django 3.1.14 on 2026-10-19 06:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('financial', '0022_expenserulecoverage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExpenseGenerationRun',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('startTime', models.DateTimeField(auto_now_add=True, verbose_name='Started')),
+                ('endTime', models.DateTimeField(blank=True, null=True, verbose_name='Finished')),
+                ('parallel', models.BooleanField(default=False, verbose_name='Run in parallel')),
+                ('rulesTotal', models.PositiveIntegerField(default=0, verbose_name='Rules to run')),
+                ('rulesCompleted', models.PositiveIntegerField(default=0, verbose_name='Rules completed')),
+                ('rulesFailed', models.PositiveIntegerField(default=0, verbose_name='Rules failed')),
+                ('itemsCreated', models.PositiveIntegerField(default=0, verbose_name='Expense items created')),
+            ],
+            options={
+                'verbose_name': 'Expense generation run',
+                'verbose_name_plural': 'Expense generation runs',
+                'ordering': ['-startTime'],
+            },
+        ),
+        migrations.AddField(
+            model_name='repeatedexpenserule',
+            name='lastError',
+            field=models.TextField(blank=True, null=True, verbose_name='Last error'),
+        ),
+        migrations.AddField(
+            model_name='repeatedexpenserule',
+            name='lastErrorTime',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Last error time'),
+        ),
+    ]
@@ -1,4 +1,5 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError, ObjectDoesNotExist
 from django.core.validators import MinValueValidator, MaxValueValidator
@@ -12,13 +13,20 @@ import math
 from calendar import day_name
 from datetime import time, timedelta
 from dateutil.relativedelta import relativedelta
-from intervaltree import IntervalTree
+import logging
+import traceback
 
 from danceschool.core.models import (
     StaffMember, EventStaffCategory, Event, InvoiceItem, Location, Room
 )
 from danceschool.core.constants import getConstant
 
+from .intervals import mergeIntervals, chopIntervals, sliceIntervals
+
+
+# Define logger for this file
+logger = logging.getLogger(__name__)
+
 
 def ordinal(n):
     ''' This is just used to populate ordinal day of the month choices '''
@@ -276,6 +284,9 @@ class RepeatedExpenseRule(PolymorphicModel):
 
     lastRun = models.DateTimeField(_('Last run time'), null=True, blank=True)
 
+    lastError = models.TextField(_('Last error'), null=True, blank=True)
+    lastErrorTime = models.DateTimeField(_('Last error time'), null=True, blank=True)
+
     def generateExpenses(self, request=None, datetimeTuple=None):
         '''
         Child classes that define this method can have their expense rule run
@@ -283,6 +294,33 @@ class RepeatedExpenseRule(PolymorphicModel):
         '''
         pass
 
+    def runGeneration(self, request=None, datetimeTuple=None, run=None):
+        '''
+        Generate expenses for this rule alone in a single transaction, so that
+        a failure leaves neither partial expenses nor an updated last run time.
+        Errors are recorded on the rule rather than raised, so that one failing
+        rule does not prevent other rules from being run.  Returns the number
+        of expense items created, or None if generation failed.
+        '''
+        try:
+            with transaction.atomic():
+                count = self.generateExpenses(
+                    request=request, datetimeTuple=datetimeTuple
+                ) or 0
+                RepeatedExpenseRule.objects.filter(id=self.id).update(
+                    lastRun=timezone.now(), lastError=None, lastErrorTime=None
+                )
+        except Exception:
+            logger.exception('Error generating expenses for rule %s.' % self.id)
+            RepeatedExpenseRule.objects.filter(id=self.id).update(
+                lastError=traceback.format_exc(), lastErrorTime=timezone.now()
+            )
+            count = None
+
+        if run:
+            run.recordRule(count)
+        return count
+
     def timeAtThreshold(self, dateTime):
         '''
         A convenience method for checking when a time is on the start/end boundary
@@ -306,13 +344,18 @@ class RepeatedExpenseRule(PolymorphicModel):
         # Everything else is nonsensical, so False.
         return False
 
-    def getWindowsAndTotals(self, intervals):
+    def getWindows(self, intervals):
+        '''
+        For a list of (startTime, endTime) intervals, return the sorted list of
+        non-overlapping day, week, or month windows that contain them under
+        this rule, along with the set of times at which the windows need to be
+        sliced (i.e. the start of each new week or month period).
+        '''
 
         # Ensure that the intervals are passed with startTime and endTime in order, and reduce
         # the intervals down to non-overlapping intervals.
-        intervals = [sorted(x) for x in intervals]
-        tree = IntervalTree.from_tuples(intervals)
-        tree.merge_overlaps()
+        intervals = mergeIntervals([tuple(sorted(x)) for x in intervals])
+        windows = []
 
         # This is the set of times at which weekly or monthly intervals need to be sliced
         # (i.e. the start of each new week or month period).
@@ -320,13 +363,16 @@ class RepeatedExpenseRule(PolymorphicModel):
 
         # Using the set of passed intervals, construct the set of day,
         # week, or monthly intervals specified by the expense rule.
-        for startTime, endTime in [(x.begin, x.end) for x in tree]:
+        for startTime, endTime in intervals:
 
             if self.applyRateRule == self.RateRuleChoices.daily:
-                # Period is the date or dates of the occurrence
+                # Period is the date or dates of the occurrence.  Occurrences
+                # that begin before the day starts belong to the previous day.
                 this_window_start = startTime.replace(
                     hour=self.dayStarts, minute=0, second=0, microsecond=0
                 )
+                if this_window_start > startTime:
+                    this_window_start -= timedelta(days=1)
                 this_window_end = (
                     (endTime + timedelta(days=1)).replace(
                         hour=self.dayStarts, minute=0, second=0, microsecond=0
@@ -375,6 +421,10 @@ class RepeatedExpenseRule(PolymorphicModel):
                     this_window_start = (startTime + relativedelta(months=-1)).replace(
                         day=startDay, hour=self.dayStarts, minute=0, second=0, microsecond=0
                     )
+                # Occurrences that begin on the start day of the month, but
+                # before the day starts, belong to the previous month.
+                if this_window_start > startTime:
+                    this_window_start += relativedelta(months=-1)
                 if (
                     endTime.day > startDay or
                     (endTime.day == startDay and not self.timeAtThreshold(endTime))
@@ -393,39 +443,37 @@ class RepeatedExpenseRule(PolymorphicModel):
                     slice_times.add(t0)
                     t0 = t0 + relativedelta(months=1)
 
-            # Add the newly constructed interval to the tree of intervals
-            tree.addi(this_window_start, this_window_end)
+            windows.append((this_window_start, this_window_end))
 
-        # Remove all overlapping intervals and also chop out any intervals for
-        # which there is already an expense item existing.  (we will split again
-        # by week or month afterward.)
-        tree.merge_overlaps()
+        return mergeIntervals(intervals + windows), slice_times
 
-        startTime = tree.begin()
-        endTime = tree.end()
-
-        if startTime and endTime:
-            overlapping = self.expenseitem_set.filter(
-                (models.Q(periodStart__lte=endTime) & models.Q(periodStart__gte=startTime)) |
-                (models.Q(periodEnd__gte=startTime) & models.Q(periodEnd__lte=endTime)) |
-                (models.Q(periodStart__lte=startTime) & models.Q(periodEnd__gte=endTime))
-            )
-        else:
-            overlapping = self.expenseitem_set.none()
+    def getWindowsAndTotals(self, intervals, covered=None):
+        '''
+        Yield the start, end, total and description of each period for which
+        an expense should be generated under this rule for the passed
+        intervals.  Periods that are already covered by expense items under
+        this rule are excluded.  The covered periods may be passed as a list
+        of (start, end) tuples; otherwise, they are taken from the stored
+        coverage of this rule.
+        '''
+        periods, slice_times = self.getWindows(intervals)
 
-        for item in overlapping:
-            tree.chop(item.periodStart, item.periodEnd)
+        if not periods:
+            return
 
-        # Now merge the intervals again, and split at the split times if needed
-        tree.merge_overlaps()
-        for slice_time in slice_times:
-            tree.slice(slice_time)
+        # Remove all intervals for which there is already an expense item
+        # existing, then split by week or month.
+        if covered is None:
+            covered = self.getCoverage(periods[0][0], periods[-1][1])
+        periods = mergeIntervals(chopIntervals(periods, mergeIntervals(covered, strict=False)))
+        periods = sliceIntervals(periods, slice_times)
+        startDay = self.monthStarts
 
-        # Now, loop through the items of the finalized tree and yield the times,
+        # Now, loop through the remaining periods and yield the times,
         # a description and total expense for the interval allocated by the fraction
         # of a full week/month interval contained in the interval so that new
         # ExpenseItems may be created.
-        for startTime, endTime in [(x.begin, x.end) for x in tree]:
+        for startTime, endTime in periods:
 
             # Default description is overridden below as appropriate
             description = str(_('%(start)s to %(end)s' % {
@@ -473,6 +521,63 @@ class RepeatedExpenseRule(PolymorphicModel):
             # Yield the information for this interval
             yield (startTime, endTime, total, description)
 
+    def getCoverage(self, startTime, endTime):
+        '''
+        Return the stored periods that are already covered by expense items
+        under this rule and that overlap the passed window.
+        '''
+        return list(self.coverage.filter(
+            periodStart__lte=endTime, periodEnd__gte=startTime
+        ).values_list('periodStart', 'periodEnd'))
+
+    def addCoverage(self, periodStart, periodEnd):
+        '''
+        Merge the period of a newly created expense item into the stored
+        coverage for this rule.
+        '''
+        with transaction.atomic():
+            existing = list(self.coverage.select_for_update().filter(
+                periodStart__lte=periodEnd, periodEnd__gte=periodStart
+            ))
+            for x in existing:
+                periodStart = min(periodStart, x.periodStart)
+                periodEnd = max(periodEnd, x.periodEnd)
+            self.coverage.filter(id__in=[x.id for x in existing]).delete()
+            ExpenseRuleCoverage.objects.create(
+                rule=self, periodStart=periodStart, periodEnd=periodEnd
+            )
+
+    def rebuildCoverage(self):
+        '''
+        Rebuild the stored coverage for this rule from its expense items, and
+        clear the last run time so that the next run checks all events rather
+        than only those that are not yet covered.  This is needed when expense
+        items are edited or deleted, or when the rule itself is changed.
+        '''
+        periods = mergeIntervals(
+            self.expenseitem_set.filter(
+                periodStart__isnull=False, periodEnd__isnull=False
+            ).values_list('periodStart', 'periodEnd'),
+            strict=False
+        )
+        with transaction.atomic():
+            self.coverage.all().delete()
+            ExpenseRuleCoverage.objects.bulk_create([
+                ExpenseRuleCoverage(rule=self, periodStart=x[0], periodEnd=x[1])
+                for x in periods
+            ])
+            RepeatedExpenseRule.objects.filter(id=self.id).update(lastRun=None)
+        self.lastRun = None
+
+    def save(self, *args, **kwargs):
+        '''
+        Changes to a rule may change the periods for which expenses are
+        needed, so the next run after a change checks all events.
+        '''
+        if self.pk:
+            self.lastRun = None
+        super().save(*args, **kwargs)
+
     @property
     def ruleName(self):
         ''' This should be overridden for child classes '''
@@ -702,6 +807,96 @@ class GenericRepeatedExpense(RepeatedExpenseRule):
         verbose_name_plural = _('Other repeated expenses')
 
 
+class ExpenseRuleCoverage(models.Model):
+    '''
+    The merged set of periods for which expense items already exist under a
+    repeated expense rule.  This is maintained as expense items are created,
+    changed and deleted, so that expense generation can quickly exclude
+    events and periods for which expenses have already been generated.
+    '''
+    rule = models.ForeignKey(
+        RepeatedExpenseRule, verbose_name=_('Expense generation rule'),
+        related_name='coverage', on_delete=models.CASCADE,
+    )
+    periodStart = models.DateTimeField(_('Covered period start'))
+    periodEnd = models.DateTimeField(_('Covered period end'))
+
+    def __str__(self):
+        return '%s: %s - %s' % (self.rule_id, self.periodStart, self.periodEnd)
+
+    class Meta:
+        ordering = ['rule', 'periodStart']
+        indexes = [
+            models.Index(fields=['rule', 'periodStart', 'periodEnd']),
+        ]
+        verbose_name = _('Expense rule coverage')
+        verbose_name_plural = _('Expense rule coverage')
+
+
+class ExpenseGenerationRun(models.Model):
+    '''
+    Records the progress of a run of expense generation over a set of
+    repeated expense rules.  When rules are run in parallel as separate tasks,
+    each task adds its result here, and the run is marked as finished when
+    the last rule has been processed.
+    '''
+    startTime = models.DateTimeField(_('Started'), auto_now_add=True)
+    endTime = models.DateTimeField(_('Finished'), null=True, blank=True)
+    parallel = models.BooleanField(_('Run in parallel'), default=False)
+
+    rulesTotal = models.PositiveIntegerField(_('Rules to run'), default=0)
+    rulesCompleted = models.PositiveIntegerField(_('Rules completed'), default=0)
+    rulesFailed = models.PositiveIntegerField(_('Rules failed'), default=0)
+    itemsCreated = models.PositiveIntegerField(_('Expense items created'), default=0)
+
+    @property
+    def progress(self):
+        ''' The fraction of rules that have been processed. '''
+        if not self.rulesTotal:
+            return 1
+        return (self.rulesCompleted + self.rulesFailed) / self.rulesTotal
+    progress.fget.short_description = _('Progress')
+
+    def recordRule(self, count):
+        '''
+        Record the result of running one rule, where a count of None indicates
+        that the rule failed.  The counters are updated in the database, since
+        rules may be run concurrently.
+        '''
+        if count is None:
+            updates = {'rulesFailed': F('rulesFailed') + 1}
+        else:
+            updates = {
+                'rulesCompleted': F('rulesCompleted') + 1,
+                'itemsCreated': F('itemsCreated') + count,
+            }
+        ExpenseGenerationRun.objects.filter(id=self.id).update(**updates)
+
+        finished = ExpenseGenerationRun.objects.filter(
+            id=self.id, endTime__isnull=True,
+            rulesTotal__lte=F('rulesCompleted') + F('rulesFailed'),
+        ).update(endTime=timezone.now())
+
+        self.refresh_from_db()
+        if finished:
+            logger.info(str(self))
+
+    def __str__(self):
+        return str(_(
+            'Expense generation run %(id)s: %(done)s of %(total)s rules, ' +
+            '%(failed)s failed, %(items)s items created'
+        ) % {
+            'id': self.id, 'done': self.rulesCompleted + self.rulesFailed,
+            'total': self.rulesTotal, 'failed': self.rulesFailed,
+            'items': self.itemsCreated,
+        })
+
+    class Meta:
+        ordering = ['-startTime', ]
+        verbose_name = _('Expense generation run')
+        verbose_name_plural = _('Expense generation runs')
+
+
 class ExpenseItem(models.Model):
     '''
     Expenses may be associated with EventStaff or with Events, or they may be associated with nothing
@@ -907,12 +1102,25 @@ class ExpenseItem(models.Model):
         if self.hours and self.wageRate and not self.total:
             self.total = self.hours * self.wageRate
 
+        created = self._state.adding
         super().save(*args, **kwargs)
         self.__approved = self.approved
         self.__paid = self.paid
         self.__approvalDate = self.approvalDate
         self.__paymentDate = self.paymentDate
 
+        # Keep the coverage of the expense rule up to date.  New periods are
+        # merged in, while changed periods require the coverage to be rebuilt.
+        period = (self.expenseRule_id, self.periodStart, self.periodEnd)
+        if created and self.expenseRule and self.periodStart and self.periodEnd:
+            self.expenseRule.addCoverage(self.periodStart, self.periodEnd)
+        elif not created and period != self.__period:
+            for rule in RepeatedExpenseRule.objects.filter(
+                id__in=[period[0], self.__period[0]]
+            ):
+                rule.rebuildCoverage()
+        self.__period = period
+
         # If a file is attached, ensure that it is not public, and that it is
         # saved in the 'Expense Receipts' folder
         if self.attachment:
@@ -946,6 +1154,7 @@ class ExpenseItem(models.Model):
         self.__paid = self.paid
         self.__approvalDate = self.approvalDate
         self.__paymentDate = self.paymentDate
+        self.__period = (self.expenseRule_id, self.periodStart, self.periodEnd)
 
     class Meta:
         ordering = ['-accrualDate', ]
@@ -1,33 +1,99 @@
+from django.db.models import Q
+
 from huey import crontab
-from huey.contrib.djhuey import db_periodic_task
+from huey.contrib.djhuey import db_periodic_task, db_task
 import logging
 
 from danceschool.core.constants import getConstant
 
-from .helpers import (
-    createExpenseItemsForEvents, createExpenseItemsForVenueRental,
-    createRevenueItemsForRegistrations
-)
+from .helpers import createRevenueItemsForRegistrations
+from .models import RepeatedExpenseRule, ExpenseGenerationRun
 
 
 # Define logger for this file
 logger = logging.getLogger(__name__)
 
 
+def getRulesToGenerate():
+    '''
+    Return the enabled repeated expense rules for which expenses are
+    automatically generated, based on the site settings.
+    '''
+    rule_types = Q()
+    if getConstant('financial__autoGenerateExpensesEventStaff'):
+        rule_types |= Q(staffmemberwageinfo__isnull=False) | Q(staffdefaultwage__isnull=False)
+    if getConstant('financial__autoGenerateExpensesVenueRental'):
+        rule_types |= Q(locationrentalinfo__isnull=False) | Q(roomrentalinfo__isnull=False)
+
+    if not rule_types:
+        return RepeatedExpenseRule.objects.none()
+    return RepeatedExpenseRule.objects.filter(
+        rule_types, disabled=False, rentalRate__gt=0
+    ).distinct()
+
+
+@db_task()
+def generateExpensesForRule(rule_id, run_id=None):
+    '''
+    Generate expenses for a single repeated expense rule, and add the result
+    to the progress of the run that scheduled it.
+    '''
+    rule = RepeatedExpenseRule.objects.filter(id=rule_id).first()
+    run = ExpenseGenerationRun.objects.filter(id=run_id).first() if run_id else None
+
+    if not rule:
+        logger.warning('Repeated expense rule %s no longer exists.' % rule_id)
+        if run:
+            run.recordRule(None)
+        return None
+    return rule.runGeneration(run=run)
+
+
+def generateExpenses(rules=None, parallel=False):
+    '''
+    Generate expenses for each of the passed rules (by default, all rules that
+    are automatically generated).  Each rule is run in its own transaction.
+    If parallel is True, then each rule is queued as a separate task, so that
+    one slow rule does not delay the others.  Returns the ExpenseGenerationRun
+    that records the progress of the run.
+    '''
+    if rules is None:
+        rules = getRulesToGenerate()
+    rule_ids = list(rules.values_list('id', flat=True))
+
+    run = ExpenseGenerationRun.objects.create(
+        rulesTotal=len(rule_ids), parallel=parallel
+    )
+    logger.info(
+        'Generating expenses for %s rules (run %s).' % (len(rule_ids), run.id)
+    )
+    if not rule_ids:
+        ExpenseGenerationRun.objects.filter(id=run.id).update(endTime=run.startTime)
+        run.refresh_from_db()
+        return run
+
+    for rule_id in rule_ids:
+        if parallel:
+            generateExpensesForRule(rule_id, run.id)
+        else:
+            generateExpensesForRule.call_local(rule_id, run.id)
+
+    run.refresh_from_db()
+    return run
+
+
 @db_periodic_task(crontab(minute='*/60'))
 def updateFinancialItems():
     '''
     Every hour, create any necessary revenue items and expense items for
-    activities that need them.
+    activities that need them.  Expense generation for each rule is run as a
+    separate task.
     '''
     if not getConstant('general__enableCronTasks'):
         return
 
     logger.info('Creating automatically-generated financial items.')
 
-    if getConstant('financial__autoGenerateExpensesEventStaff'):
-        createExpenseItemsForEvents()
-    if getConstant('financial__autoGenerateExpensesVenueRental'):
-        createExpenseItemsForVenueRental()
+    generateExpenses(parallel=True)
     if getConstant('financial__autoGenerateRevenueRegistrations'):
         createRevenueItemsForRegistrations()
@@ -4,14 +4,148 @@ This file contains basic tests for the core app.
 
 from django.urls import reverse
 from django.conf import settings
+from django.test import TestCase
 from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+
+from django.core.management import call_command
 
 from datetime import timedelta
+from dateutil.relativedelta import relativedelta
+from intervaltree import IntervalTree
+from io import StringIO
+import random
+from unittest import mock
 
+from danceschool.core.models import Location
 from danceschool.core.utils.tests import DefaultSchoolTestCase
 from danceschool.core.utils.timezone import ensure_localtime
 
-from .models import ExpenseItem, ExpenseCategory, RevenueItem, RevenueCategory, TransactionParty
+from .helpers import (
+    createExpenseItemsForVenueRental, createRevenueItemsForRegistrations
+)
+from .intervals import mergeIntervals
+from .models import (
+    ExpenseItem, ExpenseCategory, RevenueItem, RevenueCategory, TransactionParty,
+    RepeatedExpenseRule, LocationRentalInfo, ExpenseGenerationRun
+)
+from .tasks import generateExpenses
+
+
+def referenceWindowsAndTotals(rule, intervals, covered):
+    '''
+    The previous implementation of RepeatedExpenseRule.getWindowsAndTotals(),
+    which built an IntervalTree and chopped out each covered period.  This is
+    kept as a reference for the equivalence test below.
+    '''
+    intervals = [sorted(x) for x in intervals]
+    tree = IntervalTree.from_tuples(intervals)
+    tree.merge_overlaps()
+    slice_times = set()
+
+    for startTime, endTime in [(x.begin, x.end) for x in tree]:
+        if rule.applyRateRule == rule.RateRuleChoices.daily:
+            this_window_start = startTime.replace(
+                hour=rule.dayStarts, minute=0, second=0, microsecond=0
+            )
+            this_window_end = (
+                (endTime + timedelta(days=1)).replace(
+                    hour=rule.dayStarts, minute=0, second=0, microsecond=0
+                )
+                if not rule.timeAtThreshold(endTime) else endTime
+            )
+        elif rule.applyRateRule == rule.RateRuleChoices.weekly:
+            if startTime.weekday() > rule.weekStarts:
+                start_offset = rule.weekStarts - startTime.weekday()
+            else:
+                start_offset = rule.weekStarts - startTime.weekday() - 7
+            if (
+                endTime.weekday() > rule.weekStarts or
+                (endTime.weekday() == rule.weekStarts and not rule.timeAtThreshold(endTime))
+            ):
+                end_offset = 7 + rule.weekStarts - endTime.weekday()
+            else:
+                end_offset = rule.weekStarts - endTime.weekday()
+            this_window_start = (startTime + timedelta(days=start_offset)).replace(
+                hour=rule.dayStarts, minute=0, second=0, microsecond=0
+            )
+            this_window_end = (endTime + timedelta(days=end_offset)).replace(
+                hour=rule.dayStarts, minute=0, second=0, microsecond=0
+            )
+            t0 = this_window_start
+            while t0 <= this_window_end:
+                slice_times.add(t0)
+                t0 = t0 + timedelta(days=7)
+        elif rule.applyRateRule == rule.RateRuleChoices.monthly:
+            startDay = rule.monthStarts
+            if startTime.day >= startDay:
+                this_window_start = startTime.replace(
+                    day=startDay, hour=rule.dayStarts, minute=0, second=0, microsecond=0
+                )
+            else:
+                this_window_start = (startTime + relativedelta(months=-1)).replace(
+                    day=startDay, hour=rule.dayStarts, minute=0, second=0, microsecond=0
+                )
+            if (
+                endTime.day > startDay or
+                (endTime.day == startDay and not rule.timeAtThreshold(endTime))
+            ):
+                this_window_end = (endTime + relativedelta(months=1)).replace(
+                    day=startDay, hour=rule.dayStarts, minute=0, second=0, microsecond=0
+                )
+            else:
+                this_window_end = endTime.replace(
+                    day=startDay, hour=rule.dayStarts, minute=0, second=0, microsecond=0
+                )
+            t0 = this_window_start
+            while t0 <= this_window_end:
+                slice_times.add(t0)
+                t0 = t0 + relativedelta(months=1)
+        tree.addi(this_window_start, this_window_end)
+
+    tree.merge_overlaps()
+    for begin, end in covered:
+        tree.chop(begin, end)
+    tree.merge_overlaps()
+    for slice_time in slice_times:
+        tree.slice(slice_time)
+
+    startDay = rule.monthStarts
+    for startTime, endTime in [(x.begin, x.end) for x in tree]:
+        description = str(_('%(start)s to %(end)s' % {
+            'start': startTime.strftime('%Y-%m-%d'),
+            'end': (endTime - timedelta(hours=rule.dayStarts, minutes=1)).strftime('%Y-%m-%d')
+        }))
+        if rule.applyRateRule == rule.RateRuleChoices.daily:
+            num_days = (endTime - startTime).days
+            total = rule.rentalRate * num_days
+            if num_days == 1:
+                description = startTime.strftime('%Y-%m-%d')
+        elif rule.applyRateRule == rule.RateRuleChoices.weekly:
+            num_days = (endTime - startTime).days
+            total = rule.rentalRate * (num_days / 7)
+            if num_days == 7:
+                description = str(_('week of %(start)s to %(end)s' % {
+                    'start': startTime.strftime('%Y-%m-%d'),
+                    'end': (endTime - timedelta(hours=rule.dayStarts, minutes=1)).strftime('%Y-%m-%d')
+                }))
+        elif rule.applyRateRule == rule.RateRuleChoices.monthly:
+            num_days = (endTime - startTime).days
+            month_startDate = startTime.replace(
+                day=startDay, hour=rule.dayStarts, minute=0, second=0, microsecond=0
+            )
+            month_startDate = (
+                month_startDate - relativedelta(months=1) if
+                month_startDate > startTime else month_startDate
+            )
+            days_in_month = (month_startDate + relativedelta(months=1) - month_startDate).days
+            total = rule.rentalRate * (num_days / days_in_month)
+            if num_days == days_in_month:
+                description = str(_('month of %(start)s to %(end)s' % {
+                    'start': startTime.strftime('%Y-%m-%d'),
+                    'end': (endTime - timedelta(hours=rule.dayStarts, minutes=1)).strftime('%Y-%m-%d')
+                }))
+        yield (startTime, endTime, total, description)
 
 
 class RevenueTest(DefaultSchoolTestCase):
@@ -97,7 +231,20 @@ class RevenueTest(DefaultSchoolTestCase):
         associated RevenueItem is created that links to the Registration's
         Invoice.
         """
-        pass
+        s = self.create_series()
+        registration = self.create_registration(events=[s, ])
+        invoice = registration.invoice
+        invoice.refresh_from_db()
+
+        # Revenue items are created when invoices are saved, so remove them to
+        # check that they are generated for registrations that lack them.
+        RevenueItem.objects.filter(invoiceItem__invoice=invoice).delete()
+        createRevenueItemsForRegistrations()
+
+        ri = RevenueItem.objects.get(invoiceItem__invoice=invoice)
+        self.assertEqual(ri.received, invoice.paidOnline)
+        self.assertTrue(ri.description.endswith(invoice.fullName))
+        self.assertEqual(ri.total, invoice.total)
 
 
 class ExpensesTest(DefaultSchoolTestCase):
@@ -199,6 +346,188 @@ class ExpensesTest(DefaultSchoolTestCase):
         pass
 
 
+class ExpenseWindowsTest(TestCase):
+
+    def test_windows_match_reference(self):
+        '''
+        Check that the periods and totals generated for random sets of
+        occurrences and existing expense periods match those of the previous
+        IntervalTree implementation, for each rate rule and a range of day,
+        week and month start settings.  The previous implementation placed
+        occurrences that begin before the day starts in the wrong period (and
+        sometimes failed on them), so those inputs are not compared.
+        '''
+        rng = random.Random(41)
+        base = ensure_localtime(timezone.now()).replace(
+            hour=0, minute=0, second=0, microsecond=0
+        )
+
+        def randomInterval():
+            start = base + timedelta(
+                days=rng.randint(-60, 60), hours=rng.randint(0, 23),
+                minutes=rng.choice([0, 30])
+            )
+            return (start, start + timedelta(hours=rng.randint(1, 72)))
+
+        def startsBeforeDay(rule, intervals):
+            return any(
+                x[0].hour < rule.dayStarts and (
+                    rule.applyRateRule == rule.RateRuleChoices.daily or (
+                        rule.applyRateRule == rule.RateRuleChoices.monthly and
+                        x[0].day == rule.monthStarts
+                    )
+                ) for x in mergeIntervals(intervals)
+            )
+
+        skipped = 0
+        for i in range(300):
+            rule = RepeatedExpenseRule(
+                rentalRate=rng.choice([10, 25.5, 100]),
+                applyRateRule=rng.choice([
+                    RepeatedExpenseRule.RateRuleChoices.daily,
+                    RepeatedExpenseRule.RateRuleChoices.weekly,
+                    RepeatedExpenseRule.RateRuleChoices.monthly,
+                ]),
+                dayStarts=rng.choice([0, 4, 23]),
+                weekStarts=rng.randint(0, 6),
+                monthStarts=rng.choice([1, 15, 28]),
+            )
+            intervals = [randomInterval() for j in range(rng.randint(1, 8))]
+            covered = [randomInterval() for j in range(rng.randint(0, 4))]
+
+            if startsBeforeDay(rule, intervals):
+                skipped += 1
+                continue
+
+            self.assertEqual(
+                sorted(rule.getWindowsAndTotals(intervals, covered=covered)),
+                sorted(referenceWindowsAndTotals(rule, intervals, covered)),
+                msg='Rule %s, intervals %s, covered %s' % (
+                    rule.get_applyRateRule_display(), intervals, covered
+                )
+            )
+        self.assertLess(skipped, 100)
+
+    def test_occurrence_before_day_starts(self):
+        '''
+        An occurrence that begins and ends before the day starts is charged
+        to the previous day.
+        '''
+        rule = RepeatedExpenseRule(
+            rentalRate=100, applyRateRule=RepeatedExpenseRule.RateRuleChoices.daily,
+            dayStarts=4,
+        )
+        start = ensure_localtime(timezone.now()).replace(
+            hour=2, minute=0, second=0, microsecond=0
+        )
+        dayStart = (start - timedelta(days=1)).replace(hour=4)
+        self.assertEqual(
+            list(rule.getWindowsAndTotals([(start, start + timedelta(hours=2))], covered=[])),
+            [(dayStart, dayStart + timedelta(days=1), 100, dayStart.strftime('%Y-%m-%d'))]
+        )
+
+
+class ExpenseRuleCoverageTest(DefaultSchoolTestCase):
+
+    def test_incremental_venue_expenses(self):
+        '''
+        Check that generated periods are recorded as covered, that later runs
+        only generate expenses for new occurrences, and that deleting an
+        expense item allows its period to be generated again.
+        '''
+        rule = LocationRentalInfo.objects.create(
+            location=self.defaultLocation, rentalRate=100,
+            applyRateRule=RepeatedExpenseRule.RateRuleChoices.daily,
+        )
+        noon = ensure_localtime(timezone.now()).replace(
+            hour=12, minute=0, second=0, microsecond=0
+        )
+        self.create_series(startTime=noon + timedelta(days=1), occurrences=2)
+
+        self.assertEqual(createExpenseItemsForVenueRental(rule=rule), 2)
+        rule.refresh_from_db()
+        self.assertIsNotNone(rule.lastRun)
+        self.assertEqual(rule.coverage.count(), 1)
+        first = ExpenseItem.objects.filter(expenseRule=rule).order_by('periodStart').first()
+        self.assertEqual(first.total, 100)
+
+        # Nothing new is generated once all occurrences are covered.
+        self.assertEqual(createExpenseItemsForVenueRental(rule=rule), 0)
+
+        self.create_series(startTime=noon + timedelta(days=10))
+        self.assertEqual(createExpenseItemsForVenueRental(rule=rule), 1)
+        self.assertEqual(rule.coverage.count(), 2)
+
+        first.delete()
+        rule.refresh_from_db()
+        self.assertIsNone(rule.lastRun)
+        self.assertEqual(rule.coverage.count(), 2)
+        self.assertEqual(createExpenseItemsForVenueRental(rule=rule), 1)
+        self.assertEqual(ExpenseItem.objects.filter(expenseRule=rule).count(), 3)
+        self.assertEqual(rule.coverage.count(), 2)
+
+
+class ExpenseGenerationTest(DefaultSchoolTestCase):
+
+    def test_rules_run_independently(self):
+        '''
+        Check that each rule is run in its own transaction, that a failing
+        rule records its error without affecting the others, and that the
+        run records the progress of all rules.
+        '''
+        second_location = Location.objects.create(
+            name='Second Location', status=Location.StatusChoices.active,
+            defaultCapacity=50,
+        )
+        good_rule = LocationRentalInfo.objects.create(
+            location=self.defaultLocation, rentalRate=100,
+            applyRateRule=RepeatedExpenseRule.RateRuleChoices.daily,
+        )
+        bad_rule = LocationRentalInfo.objects.create(
+            location=second_location, rentalRate=100,
+            applyRateRule=RepeatedExpenseRule.RateRuleChoices.daily,
+        )
+        self.create_series()
+        self.create_series(location=second_location)
+
+        original = LocationRentalInfo.generateExpenses
+
+        def generateExpenses_or_fail(rule, **kwargs):
+            created = original(rule, **kwargs)
+            if rule.location == second_location:
+                raise ValueError('Test failure')
+            return created
+
+        with mock.patch.object(LocationRentalInfo, 'generateExpenses', generateExpenses_or_fail):
+            run = generateExpenses(rules=RepeatedExpenseRule.objects.filter(
+                id__in=[good_rule.id, bad_rule.id]
+            ))
+
+        self.assertEqual(run.rulesTotal, 2)
+        self.assertEqual(run.rulesCompleted, 1)
+        self.assertEqual(run.rulesFailed, 1)
+        self.assertEqual(run.itemsCreated, 1)
+        self.assertIsNotNone(run.endTime)
+        self.assertEqual(run.progress, 1)
+
+        good_rule.refresh_from_db()
+        bad_rule.refresh_from_db()
+        self.assertIsNotNone(good_rule.lastRun)
+        self.assertIsNone(good_rule.lastError)
+        self.assertIsNone(bad_rule.lastRun)
+        self.assertIn('Test failure', bad_rule.lastError)
+
+        # The failed rule's expenses were rolled back, so running it again
+        # alone creates them.
+        self.assertFalse(ExpenseItem.objects.filter(expenseRule=bad_rule).exists())
+        out = StringIO()
+        call_command('create_financial_items', rules=[bad_rule.id], stdout=out)
+        self.assertEqual(ExpenseItem.objects.filter(expenseRule=bad_rule).count(), 1)
+        self.assertEqual(ExpenseGenerationRun.objects.count(), 2)
+        bad_rule.refresh_from_db()
+        self.assertIsNone(bad_rule.lastError)
+
+
 class FinancialSummariesTest(DefaultSchoolTestCase):
 
     def create_initial_items(self):
@@ -32,7 +32,7 @@ from .models import ExpenseItem, RevenueItem, ExpenseCategory, RevenueCategory,
 from .helpers import (
     prepareFinancialStatement, getExpenseItemsCSV, getRevenueItemsCSV, prepareStatementByPeriod,
     prepareStatementByEvent, createExpenseItemsForEvents, createExpenseItemsForVenueRental, createGenericExpenseItems,
-    createRevenueItemsForRegistrations
+    createRevenueItemsForRegistrations, getStaffMemberPaymentTotals
 )
 from .forms import (
     ExpenseReportingForm, RevenueReportingForm, CompensationRuleUpdateForm,
@@ -91,12 +91,9 @@ class StaffMemberPaymentsView(StaffMemberObjectMixin, PermissionRequiredMixin, D
 
         # These will be passed to the template
         year = self.kwargs.get('year')
-        eligible_years = list(set([
-            x.year for x in ExpenseItem.objects.values_list(
-                'accrualDate', flat=True
-            ).distinct()
-        ]))
-        eligible_years.sort(reverse=True)
+        eligible_years = [
+            x.year for x in ExpenseItem.objects.datetimes('accrualDate', 'year', order='DESC')
+        ]
 
         if not year or year == 'all':
             int_year = None
@@ -121,10 +118,10 @@ class StaffMemberPaymentsView(StaffMemberObjectMixin, PermissionRequiredMixin, D
             return super(DetailView, self).get_context_data(staff_member=staff_member)
 
         all_payments = getattr(
-            getattr(staff_member, 'transactionparty'),
+            getattr(staff_member, 'transactionparty', None),
             'expenseitem_set',
             ExpenseItem.objects.none()
-        ).filter(query_filter).order_by('-submissionDate')
+        ).filter(query_filter).select_related('category').order_by('-submissionDate')
 
         paid_items = all_payments.filter(
             paid=True, reimbursement=False
@@ -164,11 +161,8 @@ class StaffMemberPaymentsView(StaffMemberObjectMixin, PermissionRequiredMixin, D
             'paid_this_year': paid_this_year,
             'accrued_paid_this_year': accrued_paid_this_year,
             'reimbursements_this_year': reimbursements_this_year,
-            'total_paid_alltime': sum(filter(None, [x.total for x in paid_items])),
-            'total_awaiting_payment': sum(filter(None, [x.total for x in unpaid_items])),
-            'total_paid_this_year': sum(filter(None, [x.total for x in paid_this_year])),
-            'total_reimbursements': sum(filter(None, [x.total for x in reimbursements_this_year])),
         })
+        context.update(getStaffMemberPaymentTotals(staff_member, int_year))
 
         # Note: This get the detailview's context, not all the mixins.  Supering itself led to an infinite loop.
         return super(DetailView, self).get_context_data(**context)
@@ -881,7 +875,10 @@ class CompensationRuleResetView(CompensationActionView):
             for this_cat in cats:
                 this_default = model_to_dict(
                     this_cat.defaultwage,
-                    exclude=('category', 'id', 'repeatedexpenserule_ptr', 'lastRun')
+                    exclude=(
+                        'category', 'id', 'repeatedexpenserule_ptr', 'lastRun',
+                        'lastError', 'lastErrorTime'
+                    )
                 )
 
                 for staffmember in self.queryset:
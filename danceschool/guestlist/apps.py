@@ -7,6 +7,9 @@ class GuestListAppConfig(AppConfig):
     verbose_name = _('Guest Lists')
 
     def ready(self):
+        # Ensure that signal handlers are loaded
+        from . import handlers
+
         from danceschool.core.models import Event
         from .models import GuestList
 
@@ -0,0 +1,21 @@
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from danceschool.core.invalidation import GUESTLIST, bumpVersions
+
+from .models import GuestList, GuestListName, GuestListComponent
+
+
+@receiver(post_save, sender=GuestList)
+@receiver(post_save, sender=GuestListName)
+@receiver(post_save, sender=GuestListComponent)
+@receiver(post_delete, sender=GuestList)
+@receiver(post_delete, sender=GuestListName)
+@receiver(post_delete, sender=GuestListComponent)
+@receiver(m2m_changed, sender=GuestList.seriesCategories.through)
+@receiver(m2m_changed, sender=GuestList.eventCategories.through)
+@receiver(m2m_changed, sender=GuestList.eventSessions.through)
+@receiver(m2m_changed, sender=GuestList.individualEvents.through)
+def invalidateGuestLists(sender, **kwargs):
+    ''' Bump the invalidation scope of guest lists whenever any list changes. '''
+    bumpVersions([GUESTLIST, ])
@@ -1,6 +1,6 @@
 from django.utils.translation import gettext_lazy as _
 from django.dispatch import receiver
-from django.core.exceptions import ObjectDoesNotExist
+from django.core.exceptions import ObjectDoesNotExist, ValidationError
 
 from collections import Counter
 import logging
@@ -249,7 +249,18 @@ def processFinalizedInvoice(sender, **kwargs):
             order.status = order.OrderStatus.fulfilled
         else:
             order.status = order.OrderStatus.submitted
-        order.save()
+
+        try:
+            order.save()
+        except ValidationError as e:
+            # Another order has taken the remaining inventory since this
+            # order's items were checked, so the order cannot be submitted.
+            logger.error(
+                (
+                    'Merchandise order {} for invoice {} could not be ' +
+                    'submitted: {}'
+                ).format(order.id, invoice.id, '; '.join(e.messages))
+            )
 
 
 @receiver(invoice_cancelled)
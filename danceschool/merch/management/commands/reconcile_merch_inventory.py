@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from danceschool.merch.models import MerchItemVariant
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare the stored inventory of each merchandise item variant with ' +
+        'the inventory calculated from inventory records, and fix any differences'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true', dest='dry_run',
+            help='Report differences without fixing them'
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write('Reconciling merchandise inventory...')
+
+        fixed = 0
+        with transaction.atomic():
+            variants = MerchItemVariant.objects.withCalculatedInventory().select_for_update()
+            for variant in variants:
+                if variant.currentInventory == variant.calculatedInventory:
+                    continue
+
+                self.stdout.write('%s: stored inventory %s, calculated inventory %s' % (
+                    variant, variant.currentInventory, variant.calculatedInventory
+                ))
+                if not options.get('dry_run'):
+                    MerchItemVariant.objects.filter(id=variant.id).update(
+                        currentInventory=variant.calculatedInventory,
+                        soldOut=variant.calculatedInventory <= 0,
+                    )
+                fixed += 1
+
+        if options.get('dry_run'):
+            self.stdout.write('...done. Found %s variants with incorrect inventory.' % fixed)
+        else:
+            self.stdout.write('...done. Fixed inventory for %s variants.' % fixed)
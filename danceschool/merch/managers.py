@@ -1,7 +1,12 @@
 '''
-This file contains custom managers and querysets for the MerchOrder model
+This file contains custom managers and querysets for the merch models
 '''
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F, Sum, Case, When, Value, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.core.exceptions import ValidationError
+from django.apps import apps
+from django.utils.translation import gettext_lazy as _
 
 from danceschool.core.models import Invoice
 
@@ -12,11 +17,24 @@ class MerchOrderQuerySet(models.QuerySet):
     '''
 
     def delete(self):
-        self.exclude(models.Q(invoice__status__in=[
+        MerchItemVariant = apps.get_model('merch', 'MerchItemVariant')
+
+        to_cancel = self.exclude(models.Q(invoice__status__in=[
             Invoice.PaymentStatus.needsCollection, Invoice.PaymentStatus.cancelled
-        ]) | models.Q(status=self.model.OrderStatus.unsubmitted)).update(
-            status=self.model.OrderStatus.cancelled
-        )
+        ]) | models.Q(status=self.model.OrderStatus.unsubmitted))
+
+        with transaction.atomic():
+            # Return the items in orders that are being cancelled to inventory.
+            restored = to_cancel.exclude(
+                status__in=self.model.uncountedStatuses
+            ).filter(items__isnull=False).values('items__item').annotate(
+                quantity=Sum('items__quantity')
+            )
+            MerchItemVariant.objects.adjustInventory({
+                x['items__item']: x['quantity'] for x in restored
+            })
+            to_cancel.update(status=self.model.OrderStatus.cancelled)
+
         filtered_query = self.__deepcopy__({}).filter(
             status=self.model.OrderStatus.unsubmitted
         )
@@ -27,3 +45,65 @@ class MerchOrderManager(models.Manager):
     ''' Use MerchOrderQuerySet to allow deletion only of unsubmitted orders. '''
     def get_queryset(self):
         return MerchOrderQuerySet(self.model, using=self._db)
+
+
+class MerchItemVariantManager(models.Manager):
+    '''
+    The current inventory of each variant is only changed using F()
+    expressions, so that simultaneous orders and inventory adjustments cannot
+    overwrite each other's changes.
+    '''
+
+    def adjustInventory(self, changes, restrict=False):
+        '''
+        Apply changes in inventory, passed as a dictionary of
+        {variant id: change in quantity}.  If restrict is True, then a
+        ValidationError is raised (and no changes are applied) unless every
+        variant has enough inventory available for the requested reduction.
+        '''
+        changes = {k: v for k, v in changes.items() if v}
+        if not changes:
+            return
+
+        with transaction.atomic():
+            # Variants are updated in a consistent order to avoid deadlocks.
+            for variant_id, change in sorted(changes.items()):
+                queryset = self.filter(id=variant_id)
+                if restrict and change < 0:
+                    queryset = queryset.filter(currentInventory__gte=-change)
+                if not queryset.update(currentInventory=F('currentInventory') + change):
+                    raise ValidationError(
+                        _('Item "{}" does not have {} units available.').format(
+                            self.filter(id=variant_id).first(), -change
+                        ),
+                        code='insufficient_inventory'
+                    )
+            self.filter(id__in=changes.keys()).update(soldOut=Case(
+                When(currentInventory__lte=0, then=Value(True)),
+                default=Value(False), output_field=models.BooleanField()
+            ))
+
+    def withCalculatedInventory(self):
+        '''
+        Annotate each variant with its inventory as calculated from the
+        original quantity, inventory adjustments, and submitted orders.  This
+        is used to reconcile the stored inventory counts.
+        '''
+        MerchQuantityAdjustment = apps.get_model('merch', 'MerchQuantityAdjustment')
+        MerchOrder = apps.get_model('merch', 'MerchOrder')
+        MerchOrderItem = apps.get_model('merch', 'MerchOrderItem')
+
+        adjustments = MerchQuantityAdjustment.objects.filter(
+            variant=OuterRef('pk')
+        ).order_by().values('variant').annotate(total=Sum('amount')).values('total')
+        ordered = MerchOrderItem.objects.filter(item=OuterRef('pk')).exclude(
+            order__status__in=MerchOrder.uncountedStatuses
+        ).order_by().values('item').annotate(total=Sum('quantity')).values('total')
+
+        return self.annotate(
+            calculatedInventory=(
+                Coalesce(F('originalQuantity'), 0) +
+                Coalesce(Subquery(adjustments), 0) -
+                Coalesce(Subquery(ordered), 0)
+            )
+        )
@@ -0,0 +1,42 @@
+# Generated by Django 3.1.14 on 2026-10-19 04:28
+
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def set_current_inventory(apps, schema_editor):
+    '''
+    Store the current inventory of each item variant, as calculated from its
+    original quantity, inventory adjustments, and submitted orders.
+    '''
+    MerchItemVariant = apps.get_model("merch", "MerchItemVariant")
+    db_alias = schema_editor.connection.alias
+
+    for variant in MerchItemVariant.objects.using(db_alias).all():
+        variant.currentInventory = (
+            (variant.originalQuantity or 0) +
+            (variant.quantity_adjustments.aggregate(total=Sum('amount')).get('total') or 0) -
+            (
+                variant.orders.exclude(order__status__in=['UN', 'C']).aggregate(
+                    total=Sum('quantity')
+                ).get('total') or 0
+            )
+        )
+        variant.soldOut = variant.currentInventory <= 0
+        variant.save(update_fields=['currentInventory', 'soldOut'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('merch', '0006_auto_20210220_0101'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='merchitemvariant',
+            name='currentInventory',
+            field=models.IntegerField(default=0, editable=False, verbose_name='Current inventory'),
+        ),
+        migrations.RunPython(set_current_inventory, migrations.RunPython.noop),
+    ]
@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import models, transaction
 from django.db.models import Q, F, Sum, Case, When, ExpressionWrapper
 from django.db.models.functions import Coalesce
 from django.core.validators import MinValueValidator, RegexValidator
@@ -14,7 +14,7 @@ from danceschool.core.models import Invoice, InvoiceItem
 from danceschool.core.constants import getConstant
 from danceschool.register.models import RegisterPaymentMethod
 
-from .managers import MerchOrderManager
+from .managers import MerchOrderManager, MerchItemVariantManager
 
 
 def get_defaultSalesTaxRate():
@@ -172,12 +172,22 @@ class MerchItemVariant(models.Model):
     # property.
     soldOut = models.BooleanField(_('Sold out'), default=False)
 
+    # The current inventory is also stored, and it is updated atomically when
+    # orders are submitted or cancelled and when inventory is adjusted, so
+    # that simultaneous orders cannot both purchase the last unit of an item.
+    # The reconcile_merch_inventory command recalculates it if needed.
+    currentInventory = models.IntegerField(
+        _('Current inventory'), default=0, editable=False
+    )
+
+    objects = MerchItemVariantManager()
+
     @property
     def fullName(self):
         return '{}: {}'.format(self.item.name, self.name)
 
-    @property
-    def currentInventory(self):
+    def calculateInventory(self):
+        ''' Calculate the current inventory from inventory records. '''
         return (
             (self.originalQuantity or 0) +
             (self.quantity_adjustments.aggregate(total=Sum('amount')).get('total', 0) or 0) -
@@ -190,7 +200,6 @@ class MerchItemVariant(models.Model):
                 ).aggregate(total=Sum('quantity')).get('total', 0) or 0
             )
         )
-    currentInventory.fget.short_description = _('Current inventory')
 
     def getPrice(self):
         if self.price is not None:
@@ -199,8 +208,9 @@ class MerchItemVariant(models.Model):
 
     def updateSoldOut(self, commit=True):
         '''
-        This should be called whenever an order is completed or inventory is
-        adjusted.
+        Update the sold out status to reflect the stored current inventory.
+        Inventory adjustments made through
+        MerchItemVariant.objects.adjustInventory() do this automatically.
         '''
 
         changed = False
@@ -212,12 +222,38 @@ class MerchItemVariant(models.Model):
             changed = True
 
         if commit and changed:
-            self.save()
+            MerchItemVariant.objects.filter(id=self.id).update(soldOut=self.soldOut)
 
     def save(self, *args, **kwargs):
-        ''' Update the sold out status of the item variant. '''
-        self.updateSoldOut(commit=False)
-        super().save(*args, **kwargs)
+        '''
+        The current inventory and sold out status are only set here when the
+        variant is created.  After that, they are never written by save(),
+        because this instance may have stale values for them.  Changes to the
+        original quantity are instead applied as atomic adjustments.
+        '''
+        if self._state.adding:
+            self.currentInventory = self.originalQuantity or 0
+            self.updateSoldOut(commit=False)
+            super().save(*args, **kwargs)
+        else:
+            if not kwargs.get('update_fields'):
+                kwargs['update_fields'] = [
+                    f.name for f in self._meta.concrete_fields
+                    if not f.primary_key and
+                    f.name not in ['currentInventory', 'soldOut']
+                ]
+            with transaction.atomic():
+                super().save(*args, **kwargs)
+                change = (self.originalQuantity or 0) - (self.__initial_quantity or 0)
+                if change:
+                    MerchItemVariant.objects.adjustInventory({self.id: change})
+                    self.refresh_from_db(fields=['currentInventory', 'soldOut'])
+        self.__initial_quantity = self.originalQuantity
+
+    def __init__(self, *args, **kwargs):
+        ''' Keep track of the original quantity to detect changes. '''
+        super().__init__(*args, **kwargs)
+        self.__initial_quantity = self.originalQuantity
 
     def __str__(self):
         return '{} ({})'.format(self.fullName, self.sku)
@@ -242,9 +278,13 @@ class MerchQuantityAdjustment(models.Model):
     submissionDate = models.DateTimeField(_('Submission Date'), auto_now_add=True)
 
     def save(self, *args, **kwargs):
-        ''' Update the sold out status of the associated item variant. '''
-        super().save(*args, **kwargs)
-        self.variant.updateSoldOut()
+        ''' Update the current inventory of the associated item variant. '''
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            MerchItemVariant.objects.adjustInventory({
+                self.variant_id: self.amount - self.__initial_amount
+            })
+        self.__initial_amount = self.amount
 
     def delete(self, *args, **kwargs):
         '''
@@ -256,6 +296,11 @@ class MerchQuantityAdjustment(models.Model):
         )
         new_adjustment.save()
 
+    def __init__(self, *args, **kwargs):
+        ''' Keep track of the initial amount to detect changes. '''
+        super().__init__(*args, **kwargs)
+        self.__initial_amount = self.amount if self.pk else 0
+
     def __str__(self):
         return str(_('Inventory adjustment for {itemName}, {submissionDate}'.format(
             itemName=self.variant.fullName, submissionDate=self.submissionDate)
@@ -272,6 +317,9 @@ class MerchOrder(models.Model):
         cancelled = ('C', _('Cancelled'))
         fullRefund = ('R', _('Refunded in full'))
 
+    # Items in orders with these statuses do not count against inventory.
+    uncountedStatuses = [OrderStatus.unsubmitted, OrderStatus.cancelled]
+
     status = models.CharField(
         _('Order status'), max_length=2, choices=OrderStatus.choices,
         default=OrderStatus.unsubmitted,
@@ -433,18 +481,27 @@ class MerchOrder(models.Model):
             'update': kwargs.pop('updateInvoice', True),
         }
 
-        self.invoice = self.link_invoice(**link_kwargs)
-        super().save(*args, **kwargs)
+        counted = self.status not in self.uncountedStatuses
+        initial_counted = self.__initial_status not in self.uncountedStatuses
+
+        with transaction.atomic():
+            self.invoice = self.link_invoice(**link_kwargs)
+
+            # Remove items from inventory when the order is submitted, and
+            # return them when it is cancelled.  If there is not enough
+            # inventory, then a ValidationError is raised and the order is
+            # not saved.
+            if self.pk and counted != initial_counted:
+                changes = {}
+                for item in self.items.all():
+                    changes[item.item_id] = (
+                        changes.get(item.item_id, 0) +
+                        (-1 if counted else 1) * item.quantity
+                    )
+                MerchItemVariant.objects.adjustInventory(changes, restrict=counted)
 
-        # Update the sold out status of the associated item variants if needed.
-        if (
-            self.status not in [
-                self.OrderStatus.unsubmitted, self.OrderStatus.cancelled
-            ] and self.status != self.__initial_status
-        ):
-            variants = [x.item for x in self.items.all()]
-            for variant in variants:
-                variant.updateSoldOut()
+            super().save(*args, **kwargs)
+        self.__initial_status = self.status
 
     def delete(self, *args, **kwargs):
         '''
@@ -500,6 +557,22 @@ class MerchOrderItem(models.Model):
     def grossTotal(self):
         return self.quantity * self.item.getPrice()
 
+    def updateInventory(self):
+        '''
+        Items are normally removed from inventory when their order is
+        submitted.  If an item in an order that has already been submitted
+        is changed, then update inventory accordingly.
+        '''
+        if self.order.status in MerchOrder.uncountedStatuses:
+            return
+
+        changes = {self.item_id: -self.quantity}
+        if not self._state.adding:
+            changes[self.__initial_item_id] = (
+                changes.get(self.__initial_item_id, 0) + self.__initial_quantity
+            )
+        MerchItemVariant.objects.adjustInventory(changes, restrict=True)
+
     def link_invoice_item(self, update=True, **kwargs):
         '''
         If an order's contents are created or modified, this method ensures that
@@ -543,15 +616,30 @@ class MerchOrderItem(models.Model):
     def save(self, *args, **kwargs):
         restrictStatus = kwargs.pop('restrictStatus', True)
         if self.order.itemsEditable or not restrictStatus:
-            self.invoiceItem = self.link_invoice_item(
-                update=kwargs.pop('updateInvoiceItem', True)
-            )
-            super().save(*args, **kwargs)
+            with transaction.atomic():
+                self.invoiceItem = self.link_invoice_item(
+                    update=kwargs.pop('updateInvoiceItem', True)
+                )
+                self.updateInventory()
+                super().save(*args, **kwargs)
+            self.__initial_item_id = self.item_id
+            self.__initial_quantity = self.quantity
 
     def delete(self, *args, **kwargs):
         restrictStatus = kwargs.pop('restrictStatus', True)
         if self.order.itemsEditable or not restrictStatus:
-            super().delete(*args, **kwargs)
+            with transaction.atomic():
+                if self.order.status not in MerchOrder.uncountedStatuses:
+                    MerchItemVariant.objects.adjustInventory({
+                        self.__initial_item_id: self.__initial_quantity
+                    })
+                super().delete(*args, **kwargs)
+
+    def __init__(self, *args, **kwargs):
+        ''' Keep track of the initial item and quantity to detect changes. '''
+        super().__init__(*args, **kwargs)
+        self.__initial_item_id = self.item_id
+        self.__initial_quantity = self.quantity
 
     class Meta:
         verbose_name = _('Merchandise order item')
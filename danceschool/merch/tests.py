@@ -1,3 +1,95 @@
-from django.test import TestCase
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
 
-# Create your tests here.
+from io import StringIO
+
+from danceschool.core.models import Invoice, InvoiceItem
+from danceschool.core.utils.tests import DefaultSchoolTestCase
+from .handlers import processFinalizedInvoice
+from .models import (
+    MerchItem, MerchItemVariant, MerchOrder, MerchOrderItem,
+    MerchQuantityAdjustment
+)
+
+
+class MerchInventoryTest(DefaultSchoolTestCase):
+
+    def setUp(self):
+        item = MerchItem.objects.create(name='T-Shirt', defaultPrice=20)
+        self.variant = MerchItemVariant.objects.create(
+            item=item, sku='TSHIRT-M', name='Medium', originalQuantity=1
+        )
+
+    def create_order(self, quantity=1):
+        order = MerchOrder(status=MerchOrder.OrderStatus.unsubmitted)
+        order.save()
+        invoiceItem = InvoiceItem.objects.create(
+            invoice=order.invoice, grossTotal=20, total=20
+        )
+        MerchOrderItem.objects.create(
+            order=order, item=self.variant, invoiceItem=invoiceItem,
+            quantity=quantity
+        )
+        return order
+
+    def test_simultaneous_orders(self):
+        '''
+        Two orders for the last unit are both created while the unit is
+        available.  Only the first order to be submitted can succeed.
+        '''
+        self.assertEqual(self.variant.currentInventory, 1)
+        first = self.create_order()
+        second = self.create_order()
+
+        first.status = MerchOrder.OrderStatus.submitted
+        first.save()
+
+        second.status = MerchOrder.OrderStatus.submitted
+        with self.assertRaises(ValidationError):
+            second.save()
+
+        self.variant.refresh_from_db()
+        self.assertEqual(self.variant.currentInventory, 0)
+        self.assertTrue(self.variant.soldOut)
+        self.assertEqual(
+            MerchOrder.objects.get(id=second.id).status,
+            MerchOrder.OrderStatus.unsubmitted
+        )
+
+        # Finalizing the invoice for the second order leaves it unsubmitted.
+        invoice = Invoice.objects.get(id=second.invoice.id)
+        processFinalizedInvoice(sender=Invoice, invoice=invoice)
+        self.assertEqual(
+            MerchOrder.objects.get(id=second.id).status,
+            MerchOrder.OrderStatus.unsubmitted
+        )
+
+        # Cancelling the first order returns the unit to inventory.
+        first.status = MerchOrder.OrderStatus.cancelled
+        first.save()
+        self.variant.refresh_from_db()
+        self.assertEqual(self.variant.currentInventory, 1)
+        self.assertFalse(self.variant.soldOut)
+
+    def test_adjustments_and_reconciliation(self):
+        MerchQuantityAdjustment.objects.create(variant=self.variant, amount=4)
+        order = self.create_order(quantity=2)
+        order.status = MerchOrder.OrderStatus.submitted
+        order.save()
+
+        self.variant.refresh_from_db()
+        self.assertEqual(self.variant.currentInventory, 3)
+        self.assertEqual(self.variant.calculateInventory(), 3)
+
+        # Saving a stale instance does not overwrite the inventory count.
+        stale = MerchItemVariant.objects.get(id=self.variant.id)
+        MerchQuantityAdjustment.objects.create(variant=self.variant, amount=-1)
+        stale.name = 'Size Medium'
+        stale.save()
+        self.variant.refresh_from_db()
+        self.assertEqual(self.variant.currentInventory, 2)
+
+        MerchItemVariant.objects.filter(id=self.variant.id).update(currentInventory=10)
+        call_command('reconcile_merch_inventory', stdout=StringIO())
+        self.variant.refresh_from_db()
+        self.assertEqual(self.variant.currentInventory, 2)
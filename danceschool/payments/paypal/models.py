@@ -6,6 +6,7 @@ from cms.models.fields import PageField
 
 import logging
 from paypalrestsdk import Payment, Sale
+from paypalrestsdk.exceptions import ConnectionError as PaypalConnectionError
 
 from danceschool.core.models import PaymentRecord
 from danceschool.core.constants import getConstant
@@ -43,47 +44,88 @@ class PaypalPaymentRecord(PaymentRecord):
     def getPayment(self):
         return Payment.find(self.paymentId)
 
-    def getSaleIds(self):
-        ids = []
-        payment = self.getPayment()
+    @staticmethod
+    def getPaymentSnapshot(payment):
+        '''
+        Return the normalized amounts, fees, sales and refunds for a Paypal
+        Payment, for use as the snapshot of a record.
+        '''
+        sales = []
+        refunds = []
         for t in payment.transactions:
             for r in t.related_resources:
                 if hasattr(r, 'sale') and r.sale:
-                    ids.append(r.sale.id)
-        return ids
+                    sales.append({
+                        'id': r.sale.id,
+                        'amount': float(r.sale.amount.total),
+                        'fees': float(getattr(getattr(r.sale, 'transaction_fee', None), 'value', 0)),
+                    })
+                if hasattr(r, 'refund') and r.refund:
+                    refunds.append({
+                        'id': r.refund.id,
+                        'saleId': getattr(r.refund, 'sale_id', None),
+                        'amount': float(r.refund.amount.total),
+                    })
+
+        payer_info = getattr(getattr(payment, 'payer', None), 'payer_info', None)
+
+        return {
+            'status': getattr(payment, 'state', None),
+            'payerEmail': getattr(payer_info, 'email', None),
+            'netAmountPaid': sum([float(t.amount.total) for t in payment.transactions]),
+            'netFees': sum([x['fees'] for x in sales]),
+            'sales': sales,
+            'refunds': refunds,
+        }
+
+    def getSnapshotData(self):
+        try:
+            return self.getPaymentSnapshot(self.getPayment())
+        except PaypalConnectionError as e:
+            logger.error('Unable to retrieve Paypal payment from record: %s' % e)
+            return None
+
+    def getSaleIds(self):
+        return [x['id'] for x in self.getSnapshot().get('sales', [])]
 
     def getRefundIds(self):
-        ids = []
-        payment = self.getPayment()
-        for t in payment.transactions:
-            for r in t.related_resources:
-                if hasattr(r, 'refund') and r.refund:
-                    ids.append(r.refund.id)
-        return ids
+        return [x['id'] for x in self.getSnapshot().get('refunds', [])]
 
     @property
     def netAmountPaid(self):
-        payment = self.getPayment()
-        return sum([float(t.amount.total) for t in payment.transactions])
+        return self.getSnapshot().get('netAmountPaid')
+
+    @property
+    def netFees(self):
+        return self.getSnapshot().get('netFees')
 
     def getPayerEmail(self):
-        payment = self.getPayment
-        return payment.payer.email
+        return self.getSnapshot().get('payerEmail')
 
     def refund(self, amount=None):
-        saleIds = self.getSaleIds()
+        # Refunds are always based on the current state of the payment, never
+        # on a cached snapshot.
+        snapshot = self.getCurrentSnapshot()
+        if snapshot is None:
+            logger.error('Unable to retrieve Paypal payment, so no refund was processed.')
+            return [{
+                'status': 'error',
+                'errors': _('Unable to retrieve the current state of the payment.'),
+            }]
+
+        sales = snapshot.get('sales', [])
         refundData = []
 
         leftToRefund = amount or 0
-        for this_id in saleIds:
+        for this_sale_data in sales:
             # No need to continue if the full amount requested has been refunded
             if amount is not None and leftToRefund <= 0:
                 break
 
-            this_sale = Sale.find(this_id)
+            this_sale = Sale({'id': this_sale_data['id']})
 
             if amount is not None:
-                this_amount = min(float(this_sale.amount.total), leftToRefund)
+                this_amount = min(this_sale_data['amount'], leftToRefund)
 
                 refund = this_sale.refund({
                     'amount': {
@@ -107,15 +149,19 @@ class PaypalPaymentRecord(PaymentRecord):
                     # not yet report fees in the event of a refund.  Hopefully this can be removed
                     # soon.
                     'fees': -1 * (
-                        (float(this_sale.transaction_fee.value) - getConstant('paypal__fixedTransactionFee')) *
-                        (float(refund.amount.total) / float(this_sale.amount.total))
+                        (this_sale_data['fees'] - getConstant('paypal__fixedTransactionFee')) *
+                        (float(refund.amount.total) / this_sale_data['amount'])
                     ),
                 })
-                leftToRefund -= this_amount
+                leftToRefund -= float(refund.amount.total)
             else:
                 logger.error('Error processing refund.')
                 refundData.append({'status': 'error', 'errors': refund.error})
 
+        # The amounts and refunds for this payment have changed.
+        if refundData:
+            self.refreshSnapshot()
+
         return refundData
 
     class Meta:
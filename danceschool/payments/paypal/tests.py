@@ -1,3 +1,111 @@
-from django.test import TestCase
+from django.test import override_settings
+from django.utils import timezone
 
-# Create your tests here.
+from datetime import timedelta
+import paypalrestsdk
+
+from danceschool.core.utils.tests import DefaultSchoolTestCase, FakePaymentProcessor
+from .models import PaypalPaymentRecord
+
+
+class PaypalSnapshotTest(DefaultSchoolTestCase):
+
+    payment_path = '/v1/payments/payment/PAY-1'
+    refund_path = '/v1/payments/sale/SALE-1/refund'
+
+    def setUp(self):
+        self.refunds = []
+        self.processor = FakePaymentProcessor({
+            ('GET', self.payment_path): lambda body: (200, self.get_payment()),
+            ('POST', self.refund_path): self.create_refund,
+        }).__enter__()
+
+        self.default_api = paypalrestsdk.api.__api__
+        paypalrestsdk.configure({
+            'mode': 'sandbox', 'client_id': 'id', 'client_secret': 'secret',
+            'endpoint': self.processor.url, 'token': 'token',
+        })
+
+        registration = self.create_registration(events=[self.create_series(), ])
+        self.record = PaypalPaymentRecord.objects.create(
+            invoice=registration.invoice, paymentId='PAY-1', status='approved'
+        )
+
+    def tearDown(self):
+        paypalrestsdk.api.__api__ = self.default_api
+        self.processor.__exit__()
+
+    def get_payment(self):
+        return {
+            'id': 'PAY-1', 'state': 'approved',
+            'payer': {'payer_info': {'email': 'payer@example.com'}},
+            'transactions': [{
+                'amount': {'total': '50.00', 'currency': 'USD'},
+                'related_resources': [
+                    {'sale': {
+                        'id': 'SALE-1', 'amount': {'total': '50.00', 'currency': 'USD'},
+                        'transaction_fee': {'value': '1.75', 'currency': 'USD'},
+                    }},
+                ] + [{'refund': x} for x in self.refunds],
+            }],
+        }
+
+    def create_refund(self, body):
+        refund = {
+            'id': 'REFUND-%s' % (len(self.refunds) + 1), 'state': 'completed',
+            'sale_id': 'SALE-1', 'amount': body['amount'],
+        }
+        self.refunds.append(refund)
+        return (201, refund)
+
+    def test_snapshot(self):
+        '''
+        Looking up amounts, fees, sales and refunds only retrieves the payment
+        once until the snapshot expires.
+        '''
+        self.assertEqual(self.record.netAmountPaid, 50)
+        self.assertEqual(self.record.netFees, 1.75)
+        self.assertEqual(self.record.getSaleIds(), ['SALE-1'])
+        self.assertEqual(self.record.getRefundIds(), [])
+        self.assertEqual(self.record.getPayerEmail(), 'payer@example.com')
+
+        record = PaypalPaymentRecord.objects.get(id=self.record.id)
+        self.assertEqual(record.netAmountPaid, 50)
+        self.assertEqual(self.processor.count('GET', self.payment_path), 1)
+
+        PaypalPaymentRecord.objects.filter(id=record.id).update(
+            snapshotDate=timezone.now() - timedelta(hours=1)
+        )
+        record = PaypalPaymentRecord.objects.get(id=self.record.id)
+        self.assertEqual(record.netAmountPaid, 50)
+        self.assertEqual(self.processor.count('GET', self.payment_path), 2)
+
+        with override_settings(PAYMENT_SNAPSHOT_TIMEOUT=0):
+            record.netAmountPaid
+        self.assertEqual(self.processor.count('GET', self.payment_path), 3)
+
+    def test_refund(self):
+        self.assertEqual(self.record.netAmountPaid, 50)
+
+        response = self.record.refund(20)
+        self.assertEqual(response[0]['status'], 'success')
+        self.assertEqual(response[0]['refundAmount'], 20)
+        self.assertEqual(self.processor.count('POST', self.refund_path), 1)
+
+        # One lookup for the snapshot, one before the refund even though the
+        # snapshot has not expired, and one after the refund.
+        self.assertEqual(self.processor.count('GET', self.payment_path), 3)
+        self.assertEqual(
+            PaypalPaymentRecord.objects.get(id=self.record.id).getRefundIds(),
+            ['REFUND-1']
+        )
+        self.assertEqual(self.processor.count('GET', self.payment_path), 3)
+
+    def test_refund_without_payment(self):
+        ''' No refund is processed if the payment cannot be retrieved. '''
+        self.assertEqual(self.record.netAmountPaid, 50)
+        del self.processor.routes[('GET', self.payment_path)]
+
+        response = self.record.refund(20)
+        self.assertEqual(response[0]['status'], 'error')
+        self.assertEqual(self.processor.count('POST', self.refund_path), 0)
@@ -219,6 +219,7 @@ def executePaypalPayment(request):
         payment_record.status = payment.state
         payment_record.payerId = payerId
         payment_record.save()
+        payment_record.setSnapshot(payment_record.getPaymentSnapshot(payment))
 
         this_invoice.processPayment(
             amount=float(payment.transactions[0].amount.total),
@@ -43,21 +43,62 @@ class SquarePaymentRecord(PaymentRecord):
         '''
         return self.transactionId
 
+    def getApiInstance(self):
+        api_instance = TransactionsApi()
+        api_instance.api_client.configuration.access_token = getattr(settings, 'SQUARE_ACCESS_TOKEN', '')
+        if getattr(settings, 'SQUARE_API_HOST', None):
+            api_instance.api_client.configuration.host = settings.SQUARE_API_HOST
+        return api_instance
+
+    @staticmethod
+    def getTransactionSnapshot(transaction):
+        '''
+        Return the normalized amounts, fees, tenders and refunds for a Square
+        Transaction, for use as the snapshot of a record.
+        '''
+        def money(x, attr):
+            return (getattr(getattr(x, attr, None), 'amount', None) or 0) / 100
+
+        tenders = [
+            {
+                'id': x.id, 'amount': money(x, 'amount_money'),
+                'currency': x.amount_money.currency,
+                'fees': money(x, 'processing_fee_money'),
+            } for x in transaction.tenders or []
+        ]
+        refunds = [
+            {
+                'id': x.id, 'tenderId': x.tender_id,
+                'amount': money(x, 'amount_money'),
+                'fees': money(x, 'processing_fee_money'),
+            } for x in transaction.refunds or []
+        ]
+
+        return {
+            'netAmountPaid': (
+                sum([x['amount'] for x in tenders]) - sum([x['amount'] for x in refunds])
+            ),
+            'netFees': sum([x['fees'] for x in tenders]) - sum([x['fees'] for x in refunds]),
+            'tenders': tenders,
+            'refunds': refunds,
+        }
+
+    def getSnapshotData(self):
+        transaction = self.getPayment()
+        if transaction is None:
+            return None
+        return self.getTransactionSnapshot(transaction)
+
     @property
     def netAmountPaid(self):
-        payment = self.getPayment()
-        return sum([x.amount_money.amount / 100 for x in payment.tenders or []]) - \
-            sum([x.amount_money.amount / 100 for x in payment.refunds or []])
+        return self.getSnapshot().get('netAmountPaid')
 
     @property
     def netFees(self):
-        payment = self.getPayment()
-        return sum([x.processing_fee_money.amount / 100 for x in payment.tenders or []]) - \
-            sum([x.processing_fee_money.amount / 100 for x in payment.refunds or []])
+        return self.getSnapshot().get('netFees')
 
     def getPayment(self):
-        api_instance = TransactionsApi()
-        api_instance.api_client.configuration.access_token = getattr(settings, 'SQUARE_ACCESS_TOKEN', '')
+        api_instance = self.getApiInstance()
 
         try:
             response = api_instance.retrieve_transaction(
@@ -76,37 +117,48 @@ class SquarePaymentRecord(PaymentRecord):
         return self.payerEmail
 
     def refund(self, amount=None):
-        api_instance = TransactionsApi()
-        api_instance.api_client.configuration.access_token = getattr(settings, 'SQUARE_ACCESS_TOKEN', '')
-        transaction = self.getPayment()
+        api_instance = self.getApiInstance()
+
+        # Refunds are always based on the current state of the transaction,
+        # never on a cached snapshot.
+        snapshot = self.getCurrentSnapshot()
+        if snapshot is None:
+            logger.error('Unable to retrieve Square transaction, so no refund was processed.')
+            return [{
+                'status': 'error',
+                'errors': _('Unable to retrieve the current state of the transaction.'),
+            }]
+        tenders = snapshot.get('tenders', [])
 
         # For both partial and full refunds, we loop through the tenders and refund
         # them as much as possible until we've refunded all that we want to refund.
         if not amount:
-            amount = sum([x.amount_money.amount / 100 for x in transaction.tenders or []]) - \
-                sum([x.amount_money.amount / 100 for x in transaction.refunds or []])
+            amount = snapshot.get('netAmountPaid', 0)
 
         refundData = []
 
         remains_to_refund = amount
         tender_index = 0
-        while remains_to_refund > 0:
+        while remains_to_refund > 0 and tender_index < len(tenders):
             idempotency_key = str(uuid.uuid1())
 
-            this_tender = transaction.tenders[tender_index]
+            this_tender = tenders[tender_index]
             this_tender_refundamount = sum([
-                x.amount_money.amount / 100 for x in transaction.refunds or [] if x.tender_id == this_tender.id
+                x['amount'] for x in snapshot.get('refunds', []) if x['tenderId'] == this_tender['id']
             ])
 
             to_refund = min(
-                this_tender.amount_money.amount - this_tender_refundamount,
+                this_tender['amount'] - this_tender_refundamount,
                 remains_to_refund
             )
+            if to_refund <= 0:
+                tender_index += 1
+                continue
 
             body = {
                 'idempotency_key': idempotency_key,
-                'tender_id': this_tender.id,
-                'amount_money': {'amount': int(to_refund * 100), 'currency': this_tender.amount_money.currency}
+                'tender_id': this_tender['id'],
+                'amount_money': {'amount': int(round(to_refund * 100)), 'currency': this_tender['currency']}
             }
 
             try:
@@ -139,6 +191,10 @@ class SquarePaymentRecord(PaymentRecord):
             # in the future.
             updateSquareFees.schedule(args=(self, ), delay=60)
 
+        # The amounts and refunds for this payment have changed.
+        if refundData:
+            self.refreshSnapshot()
+
         return refundData
 
     class Meta:
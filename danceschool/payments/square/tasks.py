@@ -9,7 +9,7 @@ def updateSquareFees(paymentRecord):
     any Invoice or ExpenseItem associated with this transaction also remains accurate.
     '''
 
-    fees=paymentRecord.netFees
+    fees = paymentRecord.refreshSnapshot().get('netFees')
     invoice = paymentRecord.invoice
     invoice.updateTotals(save=True, allocateAmounts={'fees': fees})
     return fees
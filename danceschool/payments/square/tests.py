@@ -1,3 +1,89 @@
-from django.test import TestCase
+from django.test import override_settings
 
-# Create your tests here.
+from danceschool.core.utils.tests import DefaultSchoolTestCase, FakePaymentProcessor
+from .models import SquarePaymentRecord
+
+
+class SquareSnapshotTest(DefaultSchoolTestCase):
+
+    transaction_path = '/v2/locations/LOCATION-1/transactions/TRANSACTION-1'
+    refund_path = transaction_path + '/refund'
+
+    def setUp(self):
+        self.refunds = []
+        self.processor = FakePaymentProcessor({
+            ('GET', self.transaction_path): lambda body: (200, {
+                'transaction': self.get_transaction()
+            }),
+            ('POST', self.refund_path): self.create_refund,
+        }).__enter__()
+
+        registration = self.create_registration(events=[self.create_series(), ])
+        self.record = SquarePaymentRecord.objects.create(
+            invoice=registration.invoice, transactionId='TRANSACTION-1',
+            locationId='LOCATION-1',
+        )
+
+    def tearDown(self):
+        self.processor.__exit__()
+
+    def get_transaction(self):
+        return {
+            'id': 'TRANSACTION-1', 'location_id': 'LOCATION-1',
+            'tenders': [
+                {
+                    'id': 'TENDER-1', 'type': 'CARD',
+                    'amount_money': {'amount': 3000, 'currency': 'USD'},
+                    'processing_fee_money': {'amount': 117, 'currency': 'USD'},
+                },
+                {
+                    'id': 'TENDER-2', 'type': 'CARD',
+                    'amount_money': {'amount': 2000, 'currency': 'USD'},
+                    'processing_fee_money': {'amount': 88, 'currency': 'USD'},
+                },
+            ],
+            'refunds': self.refunds,
+        }
+
+    def create_refund(self, body):
+        refund = {
+            'id': 'REFUND-%s' % (len(self.refunds) + 1), 'location_id': 'LOCATION-1',
+            'transaction_id': 'TRANSACTION-1', 'tender_id': body['tender_id'],
+            'reason': '', 'status': 'PENDING', 'amount_money': body['amount_money'],
+        }
+        self.refunds.append(refund)
+        return (200, {'refund': refund})
+
+    def test_snapshot(self):
+        with override_settings(SQUARE_API_HOST=self.processor.url):
+            self.assertEqual(self.record.netAmountPaid, 50)
+            self.assertEqual(self.record.netFees, 2.05)
+            self.assertEqual(
+                SquarePaymentRecord.objects.get(id=self.record.id).netAmountPaid, 50
+            )
+        self.assertEqual(self.processor.count('GET', self.transaction_path), 1)
+
+    def test_refund(self):
+        with override_settings(SQUARE_API_HOST=self.processor.url):
+            response = self.record.refund(40)
+            self.assertEqual([x['refundAmount'] for x in response], [30, 10])
+            self.assertEqual(self.record.netAmountPaid, 10)
+
+            # A later refund only refunds what remains of each tender.
+            response = self.record.refund(15)
+            self.assertEqual([x['refundAmount'] for x in response], [10])
+
+        self.assertEqual(
+            [x[2]['tender_id'] for x in self.processor.requests if x[0] == 'POST'],
+            ['TENDER-1', 'TENDER-2', 'TENDER-2']
+        )
+        # One lookup before and one after each refund.
+        self.assertEqual(self.processor.count('GET', self.transaction_path), 4)
+
+    def test_refund_without_transaction(self):
+        ''' No refund is processed if the transaction cannot be retrieved. '''
+        del self.processor.routes[('GET', self.transaction_path)]
+        with override_settings(SQUARE_API_HOST=self.processor.url):
+            response = self.record.refund(40)
+        self.assertEqual(response[0]['status'], 'error')
+        self.assertEqual(self.processor.count('POST', self.refund_path), 0)
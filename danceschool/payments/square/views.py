@@ -188,6 +188,7 @@ def processSquarePayment(request):
         transactionId=transaction.id,
         locationId=transaction.location_id,
     )
+    paymentRecord.setSnapshot(SquarePaymentRecord.getTransactionSnapshot(transaction))
 
     # We process the payment now, and enqueue the job to retrieve the
     # transaction again once fees have been calculated by Square
@@ -410,6 +411,7 @@ def processPointOfSalePayment(request):
         locationId=transaction.location_id,
         defaults={'invoice': this_invoice, }
     )
+    paymentRecord.setSnapshot(SquarePaymentRecord.getTransactionSnapshot(transaction))
     if created:
         # We process the payment now, and enqueue the job to retrieve the
         # transaction again once fees have been calculated by Square
@@ -0,0 +1,17 @@
+# Generated by Django 3.1.14 on 2026-10-19 05:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('private_lessons', '0002_instructoravailabilityslot_room'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='instructoravailabilityslot',
+            index=models.Index(fields=['instructor', 'startTime'], name='private_les_instruc_d9e8b0_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.1.14 on 2026-10-19 06:02
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('private_lessons', '0003_instructoravailabilityslot_lookup_index'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='instructoravailabilityslot',
+            options={'ordering': ('-startTime', 'instructor__staffMember__lastName', 'instructor__staffMember__firstName'), 'permissions': (('edit_own_availability', "Can edit one's own private lesson availability."), ('edit_others_availability', "Can edit other instructors' private lesson availability.")), 'verbose_name': 'Private lesson availability slot', 'verbose_name_plural': 'Private lesson availability slots'},
+        ),
+    ]
@@ -343,7 +343,10 @@ class InstructorAvailabilitySlot(models.Model):
         return str(self.name)
 
     class Meta:
-        ordering = ('-startTime', 'instructor__lastName', 'instructor__firstName')
+        ordering = ('-startTime', 'instructor__staffMember__lastName', 'instructor__staffMember__firstName')
+        indexes = [
+            models.Index(fields=['instructor', 'startTime']),
+        ]
         verbose_name = _('Private lesson availability slot')
         verbose_name_plural = _('Private lesson availability slots')
 
@@ -1,3 +1,30 @@
-from django.test import TestCase
+from django.utils import timezone
 
-# Create your tests here.
+from datetime import timedelta
+
+from danceschool.core.models import Registration
+from danceschool.core.utils.tests import DefaultSchoolTestCase
+
+from .models import InstructorAvailabilitySlot
+
+
+class InstructorAvailabilitySlotTest(DefaultSchoolTestCase):
+
+    def test_invoice_cascade_delete(self):
+        '''
+        Deleting an invoice deletes its event registrations, and releases any
+        availability slots that were linked to them.
+        '''
+        series = self.create_series()
+        registration = self.create_registration(events=[series, ], final=False)
+        slot = InstructorAvailabilitySlot.objects.create(
+            instructor=self.defaultInstructor.instructor,
+            startTime=timezone.now() + timedelta(days=1),
+            eventRegistration=registration.eventregistration_set.first(),
+        )
+
+        registration.invoice.delete()
+
+        self.assertFalse(Registration.objects.filter(id=registration.id).exists())
+        slot.refresh_from_db()
+        self.assertIsNone(slot.eventRegistration)
@@ -5,3 +5,7 @@ from django.utils.translation import gettext_lazy as _
 class RegisterAppConfig(AppConfig):
     name = 'danceschool.register'
     verbose_name = _('Registration and check-in')
+
+    def ready(self):
+        # Ensure that signal handlers are loaded
+        from . import handlers
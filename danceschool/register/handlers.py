@@ -0,0 +1,26 @@
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from danceschool.core.invalidation import REGISTER, bumpVersions
+
+from .models import RegisterEventPluginModel, RegisterGuestSearchPluginModel
+
+
+@receiver(post_save, sender=RegisterEventPluginModel)
+@receiver(post_save, sender=RegisterGuestSearchPluginModel)
+@receiver(post_delete, sender=RegisterEventPluginModel)
+@receiver(post_delete, sender=RegisterGuestSearchPluginModel)
+@receiver(m2m_changed, sender=RegisterEventPluginModel.location.through)
+@receiver(m2m_changed, sender=RegisterEventPluginModel.eventCategories.through)
+@receiver(m2m_changed, sender=RegisterEventPluginModel.seriesCategories.through)
+@receiver(m2m_changed, sender=RegisterEventPluginModel.levels.through)
+@receiver(m2m_changed, sender=RegisterGuestSearchPluginModel.location.through)
+@receiver(m2m_changed, sender=RegisterGuestSearchPluginModel.eventCategories.through)
+@receiver(m2m_changed, sender=RegisterGuestSearchPluginModel.seriesCategories.through)
+@receiver(m2m_changed, sender=RegisterGuestSearchPluginModel.levels.through)
+def invalidateRegisterEvents(sender, **kwargs):
+    '''
+    The events of a door register depend on the filters of its plugins, so
+    changing them invalidates the cached events of door snapshots.
+    '''
+    bumpVersions([REGISTER, ])
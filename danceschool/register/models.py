@@ -231,7 +231,7 @@ class RegisterEventLimitedModel(CMSPlugin):
         if initial and isinstance(initial, QuerySet):
             listing = initial
         else:
-            listing = Event.objects.all()
+            listing = Event.objects.listing()
 
         # Filter on event type (Series vs. PublicEvent)
         if self.eventType == 'S':
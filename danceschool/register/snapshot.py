@@ -0,0 +1,247 @@
+'''
+Door snapshots: a single versioned document with the events, registrations,
+check-ins and guest lists of an at-the-door register on a given date.  Door
+tablets previously polled several JSON views, each of which recomputed its
+response on every poll.  Instead, the version of a snapshot is derived from
+the invalidation scopes (see danceschool.core.invalidation) of the
+register's events, so that checking for changes requires only cache reads,
+and each version of the document is computed once and cached for all of the
+tablets that request it.  Clients that pass the version that they already
+have receive only the items that have changed since that version.
+
+Snapshots do not depend on the global scope, which changes with every
+registration at the school.  Instead, the list of events of a register is
+recomputed when the register's plugins change and at the start of each time
+bucket (see danceschool.core.plugin_cache), which is also part of the
+version, so that data that is not covered by the scopes of the register's
+events (such as guests who are staff members of other events) is refreshed
+at least once per bucket.
+'''
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+
+from datetime import datetime, timedelta
+import hashlib
+import time
+
+from danceschool.core.ajax import serializeCheckIn
+from danceschool.core.invalidation import (
+    EVENT, STAFF, GUESTLIST, REGISTER, getVersions, getVersionedKey
+)
+from danceschool.core.models import Event, EventCheckIn
+from danceschool.core.plugin_cache import getTimeBucket
+from danceschool.core.utils.timezone import ensure_localtime
+from danceschool.core.views import EventRegistrationJsonView
+
+from .models import Register, RegisterEventPluginModel, RegisterGuestSearchPluginModel
+
+
+# The number of seconds for which each version of a snapshot is cached.  This
+# may be overridden with the DOOR_SNAPSHOT_CACHE_TIMEOUT setting.
+DOOR_SNAPSHOT_CACHE_TIMEOUT = 3600
+
+# The number of seconds after which the lock held while computing a snapshot
+# expires, in case the request that holds it fails.  This may be overridden
+# with the DOOR_SNAPSHOT_LOCK_TIMEOUT setting.
+DOOR_SNAPSHOT_LOCK_TIMEOUT = 30
+
+# Clients may ask to wait for a new version, which holds a worker for the
+# duration of the wait.  These are the maximum number of seconds for which a
+# request may wait, and the number of seconds between checks for a new
+# version.  These may be overridden with the DOOR_SNAPSHOT_MAX_WAIT and
+# DOOR_SNAPSHOT_POLL_INTERVAL settings.
+DOOR_SNAPSHOT_MAX_WAIT = 5
+DOOR_SNAPSHOT_POLL_INTERVAL = 1
+
+# The sections of a snapshot.  Each item of each section has a key that
+# identifies it between versions.
+SNAPSHOT_SECTIONS = ['events', 'registrations', 'checkins', 'guests']
+
+
+def getDayStart(date):
+    ''' Return the start of the passed date string (YYYY-MM-DD), in local time. '''
+    return ensure_localtime(datetime.strptime(date, '%Y-%m-%d'))
+
+
+def getRegisterEventIds(register_id, date, bucketStart):
+    '''
+    Return the sorted ids of the events that are listed by the event and
+    guest search plugins of the register on the passed date, as of the start
+    of the passed time bucket.  The list is cached until the end of the
+    bucket, or until the plugins of any register are changed.
+    '''
+    key = getVersionedKey(
+        'doorSnapshotEvents', [REGISTER, ], register_id, date,
+        int(bucketStart.timestamp())
+    )
+    event_ids = cache.get(key)
+    if event_ids is None:
+        event_ids = computeRegisterEventIds(register_id, date)
+        cache.set(key, event_ids, getTimeBucket()[1])
+    return event_ids
+
+
+def computeRegisterEventIds(register_id, date):
+    ''' Compute the event ids for getRegisterEventIds(). '''
+    from .views import RegisterView
+
+    dayStart = getDayStart(date)
+    allEvents = RegisterView().get_allEvents()
+    placeholder = Register.objects.filter(id=register_id).values('placeholder')
+
+    event_ids = set()
+    for model in [RegisterEventPluginModel, RegisterGuestSearchPluginModel]:
+        for plugin in model.objects.filter(placeholder__in=placeholder):
+            event_ids.update(plugin.getEvents(
+                dateTime=dayStart, initial=allEvents
+            ).values_list('id', flat=True))
+    return sorted(event_ids)
+
+
+def getSnapshotVersion(register_id, date):
+    '''
+    Return the event ids and the current version of the snapshot for the
+    passed register and date.  This requires only cache reads, except when
+    the list of events must be recomputed.  The version changes when the
+    data of the register's events, staff members, guest lists or register
+    plugins change, and at the start of each time bucket.
+    '''
+    bucketStart = getTimeBucket()[0]
+    event_ids = getRegisterEventIds(register_id, date, bucketStart)
+    versions = getVersions(
+        [STAFF, GUESTLIST, REGISTER] + [(EVENT, x) for x in event_ids]
+    )
+    version = hashlib.md5(('%s:%s:%s:%s:%s' % (
+        register_id, date, int(bucketStart.timestamp()), event_ids, versions
+    )).encode()).hexdigest()[:16]
+    return event_ids, version
+
+
+def buildSnapshot(event_ids, date):
+    ''' Compute the snapshot document for the passed events and date. '''
+    dayStart = getDayStart(date)
+    dayEnd = dayStart + timedelta(days=1)
+
+    events = Event.objects.listing().in_bulk(event_ids)
+
+    registrationView = EventRegistrationJsonView()
+    registrationView.startTime = dayStart
+    registrationView.endTime = dayEnd
+    registrations = registrationView.get_listing(
+        registrationView.get_queryset().filter(event__id__in=event_ids)
+    )
+    for item in registrations:
+        item['key'] = '%s-%s' % (item['id'], item['occurrenceId'])
+
+    checkins = []
+    for checkin in EventCheckIn.objects.filter(
+        Q(checkInType='E') |
+        Q(occurrence__startTime__lte=dayEnd, occurrence__endTime__gte=dayStart),
+        event__in=event_ids,
+    ).order_by('id'):
+        item = serializeCheckIn(checkin)
+        item['key'] = str(checkin.id)
+        checkins.append(item)
+
+    guests = []
+    if apps.is_installed('danceschool.guestlist'):
+        for event in events.values():
+            for guestList in event.guestLists.distinct():
+                for guest in guestList.getListForEvent(event):
+                    guest = dict(guest, eventId=event.id, guestType=str(guest['guestType']))
+                    guest['key'] = '%s-%s-%s-%s' % (
+                        event.id, guest['guestListId'], guest['modelType'], guest['id']
+                    )
+                    guests.append(guest)
+
+    return {
+        'events': [
+            {
+                'key': str(x.id), 'id': x.id, 'name': x.name, 'url': x.url,
+                'startTime': x.startTime, 'endTime': x.endTime,
+            } for x in [events[y] for y in event_ids if y in events]
+        ],
+        'registrations': registrations,
+        'checkins': checkins,
+        'guests': guests,
+    }
+
+
+def getSnapshot(register_id, date):
+    '''
+    Return the current snapshot for the passed register and date.  Each
+    version is computed by only one request at a time, while other requests
+    for the same version wait for it to be cached.
+    '''
+    event_ids, version = getSnapshotVersion(register_id, date)
+    key = 'doorSnapshot:%s' % version
+    snapshot = cache.get(key)
+
+    while snapshot is None:
+        # The lock expires in case the request that holds it fails.
+        if cache.add(key + ':lock', True, getattr(
+            settings, 'DOOR_SNAPSHOT_LOCK_TIMEOUT', DOOR_SNAPSHOT_LOCK_TIMEOUT
+        )):
+            try:
+                snapshot = buildSnapshot(event_ids, date)
+                snapshot['version'] = version
+                cache.set(key, snapshot, getattr(
+                    settings, 'DOOR_SNAPSHOT_CACHE_TIMEOUT', DOOR_SNAPSHOT_CACHE_TIMEOUT
+                ))
+            finally:
+                cache.delete(key + ':lock')
+        else:
+            time.sleep(0.1)
+            snapshot = cache.get(key)
+    return snapshot
+
+
+def getSnapshotDelta(since, snapshot):
+    '''
+    Return the items of the passed snapshot that have been added or changed
+    since the version passed, along with the keys of the items that have been
+    removed.  If the earlier version is no longer cached, then the full
+    snapshot is returned instead.
+    '''
+    if since == snapshot['version']:
+        return {
+            'version': since, 'since': since, 'full': False,
+            'removed': {x: [] for x in SNAPSHOT_SECTIONS},
+            **{x: [] for x in SNAPSHOT_SECTIONS},
+        }
+
+    old = cache.get('doorSnapshot:%s' % since) if since else None
+    if old is None:
+        return dict(snapshot, full=True)
+
+    delta = {'version': snapshot['version'], 'since': since, 'full': False, 'removed': {}}
+    for section in SNAPSHOT_SECTIONS:
+        oldItems = {x['key']: x for x in old[section]}
+        newKeys = set(x['key'] for x in snapshot[section])
+        delta[section] = [x for x in snapshot[section] if oldItems.get(x['key']) != x]
+        delta['removed'][section] = [x for x in oldItems if x not in newKeys]
+    return delta
+
+
+def waitForSnapshot(register_id, date, since, wait):
+    '''
+    Wait up to the passed number of seconds (limited by DOOR_SNAPSHOT_MAX_WAIT)
+    for the version of the snapshot to differ from the version passed, and
+    then return the changes since that version.  By default, clients do not
+    wait.  Waiting only reads versions from the cache, but it holds the
+    worker that serves the request for the duration of the wait.
+    '''
+    wait = min(max(wait or 0, 0), getattr(settings, 'DOOR_SNAPSHOT_MAX_WAIT', DOOR_SNAPSHOT_MAX_WAIT))
+    interval = getattr(settings, 'DOOR_SNAPSHOT_POLL_INTERVAL', DOOR_SNAPSHOT_POLL_INTERVAL)
+    deadline = time.time() + wait
+
+    version = getSnapshotVersion(register_id, date)[1]
+    while since == version and time.time() < deadline:
+        time.sleep(interval)
+        version = getSnapshotVersion(register_id, date)[1]
+
+    if since == version:
+        return getSnapshotDelta(since, {'version': version})
+    return getSnapshotDelta(since, getSnapshot(register_id, date))
@@ -609,4 +609,82 @@ document.addEventListener("DOMContentLoaded", function(event) {
             }
 	    });
     });
+
+    // Keep the check-in status of displayed customers and guests up to date
+    // with check-ins made on other devices.  The snapshot view is polled at
+    // an interval, and it returns only the changes since the version passed.
+    // Setting regParams.snapshotWait asks the view to hold each request open
+    // for up to that many seconds until a new version is available.
+    var doorSnapshot = {version: null, checkins: {}};
+    var snapshotInterval = regParams.snapshotInterval || 5000;
+
+    function isCheckedIn(filter) {
+        var found = false;
+        $.each(doorSnapshot.checkins, function() {
+            if (this.checkInType == "O" && !this.cancelled && filter(this)) {
+                found = true;
+                return false;
+            }
+        });
+        return found;
+    }
+
+    function updateCheckIns() {
+        $(".customerCheckIn:not(:disabled)").each(function() {
+            var checkbox = $(this);
+            if (checkbox.hasClass("registrationCheckIn")) {
+                checkbox.prop("checked", isCheckedIn(function(x) {
+                    return (
+                        x.eventRegistration == checkbox.attr("value") &&
+                        x.occurrence == checkbox.data("occurrenceId")
+                    );
+                }));
+            }
+            else if (checkbox.hasClass("guestCheckIn")) {
+                checkbox.prop("checked", isCheckedIn(function(x) {
+                    return (
+                        x.eventRegistration === null &&
+                        x.event == checkbox.data("eventId") &&
+                        x.occurrence == checkbox.data("occurrenceId") &&
+                        x.firstName == checkbox.data("firstName") &&
+                        x.lastName == checkbox.data("lastName")
+                    );
+                }));
+            }
+        });
+    }
+
+    function pollSnapshot() {
+        $.ajax({
+            url: regParams.snapshotUrl,
+            type: "GET",
+            data: {
+                since: doorSnapshot.version || "",
+                wait: doorSnapshot.version ? (regParams.snapshotWait || 0) : 0
+            },
+            success: function(data) {
+                if (data.checkins === undefined) {
+                    // This user cannot view check-ins.
+                    return;
+                }
+                if (data.full) {
+                    doorSnapshot.checkins = {};
+                }
+                $.each(data.checkins, function() {
+                    doorSnapshot.checkins[this.key] = this;
+                });
+                $.each((data.removed || {}).checkins || [], function(index, key) {
+                    delete doorSnapshot.checkins[key];
+                });
+                doorSnapshot.version = data.version;
+                updateCheckIns();
+                setTimeout(pollSnapshot, snapshotInterval);
+            },
+            error: function() {
+                setTimeout(pollSnapshot, snapshotInterval);
+            },
+        });
+    }
+
+    pollSnapshot();
 });
@@ -0,0 +1,109 @@
+from django.urls import reverse
+
+from cms.api import add_plugin
+from datetime import timedelta
+from unittest import mock
+
+from danceschool.core import invalidation
+from danceschool.core.models import EventCheckIn
+from danceschool.core.utils.tests import DefaultSchoolTestCase
+from danceschool.core.utils.timezone import ensure_localtime
+from . import snapshot
+from .models import Register
+
+
+class RegisterSnapshotTest(DefaultSchoolTestCase):
+
+    def setUp(self):
+        self.series = self.create_series()
+        self.occurrence = self.series.eventoccurrence_set.first()
+        self.registration = self.create_registration(events=[self.series, ])
+
+        register = Register.objects.create(title='Door Register', slug='door')
+        self.plugin = add_plugin(register.placeholder, 'RegisterGuestSearchPlugin', 'en')
+
+        date = ensure_localtime(self.occurrence.startTime)
+        self.register_id = register.id
+        self.date = date.strftime('%Y-%m-%d')
+
+        # Keep the time bucket fixed, so that versions change only with data.
+        bucket = mock.patch.object(
+            snapshot, 'getTimeBucket', return_value=(date.replace(second=0), 300)
+        )
+        bucket.start()
+        self.addCleanup(bucket.stop)
+        self.url = reverse('registerSnapshot', kwargs={
+            'slug': register.slug, 'year': date.year, 'month': date.month,
+            'day': date.day,
+        })
+        self.client.login(username=self.superuser.username, password='pass')
+
+    def get_snapshot(self, since=''):
+        return self.client.get(self.url, {'since': since}).json()
+
+    def test_snapshot_versions(self):
+        '''
+        Check that a snapshot is computed once for each version, and that
+        clients passing an earlier version receive only the changes.
+        '''
+        with mock.patch.object(
+            snapshot, 'buildSnapshot', wraps=snapshot.buildSnapshot
+        ) as build:
+            first = self.get_snapshot()
+            self.assertEqual(self.get_snapshot(), first)
+            self.assertEqual(build.call_count, 1)
+
+        self.assertTrue(first['full'])
+        self.assertEqual([x['id'] for x in first['events']], [self.series.id, ])
+        self.assertEqual(len(first['registrations']), 1)
+        self.assertEqual(first['checkins'], [])
+
+        unchanged = self.get_snapshot(first['version'])
+        self.assertFalse(unchanged['full'])
+        self.assertEqual(unchanged['version'], first['version'])
+        self.assertEqual(unchanged['checkins'], [])
+
+        eventRegistration = self.registration.eventregistration_set.first()
+        EventCheckIn.objects.create(
+            event=self.series, occurrence=self.occurrence, checkInType='O',
+            eventRegistration=eventRegistration, cancelled=False,
+        )
+
+        delta = self.get_snapshot(first['version'])
+        self.assertFalse(delta['full'])
+        self.assertNotEqual(delta['version'], first['version'])
+        self.assertEqual(delta['events'], [])
+        self.assertEqual(
+            [x['eventRegistration'] for x in delta['checkins']],
+            [eventRegistration.id, ]
+        )
+        self.assertEqual(
+            [x['checkedIn'] for x in delta['registrations']], [True, ]
+        )
+
+    def test_snapshot_scopes(self):
+        '''
+        Check that the version of a snapshot does not change with event data
+        that the register does not display, but changes when the register's
+        plugins change.
+        '''
+        version = snapshot.getSnapshotVersion(self.register_id, self.date)[1]
+
+        other = self.create_series(
+            startTime=self.occurrence.startTime + timedelta(days=60)
+        )
+        globalVersion = invalidation.getVersion(invalidation.GLOBAL)
+        self.create_registration(events=[other, ])
+        self.assertGreater(invalidation.getVersion(invalidation.GLOBAL), globalVersion)
+        self.assertEqual(
+            snapshot.getSnapshotVersion(self.register_id, self.date)[1], version
+        )
+
+        with mock.patch.object(
+            snapshot, 'computeRegisterEventIds', wraps=snapshot.computeRegisterEventIds
+        ) as compute:
+            self.plugin.save()
+            self.assertNotEqual(
+                snapshot.getSnapshotVersion(self.register_id, self.date)[1], version
+            )
+            self.assertEqual(compute.call_count, 1)
@@ -1,7 +1,7 @@
 from django.urls import path
 
 from danceschool.core.classreg import ClassRegistrationView
-from .views import RegisterView
+from .views import RegisterView, RegisterSnapshotView
 from .autocomplete_light_registry import RegisterAutoComplete
 
 urlpatterns = [
@@ -10,5 +10,10 @@ urlpatterns = [
 
     path('autocomplete/', RegisterAutoComplete.as_view(), name='registerAutocomplete'),
     path('<slug:slug>/<int:year>/<int:month>/<int:day>/', RegisterView.as_view(), name='registerView'),
+    path(
+        '<slug:slug>/<int:year>/<int:month>/<int:day>/snapshot/',
+        RegisterSnapshotView.as_view(), name='registerSnapshot'
+    ),
+    path('<slug:slug>/snapshot/', RegisterSnapshotView.as_view(), name='registerSnapshot'),
     path('<slug:slug>/', RegisterView.as_view(today=True), name='registerView'),
 ]
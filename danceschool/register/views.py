@@ -1,13 +1,16 @@
 from django.utils.translation import gettext_lazy as _
-from django.http import Http404
+from django.http import Http404, HttpResponse
 from django.db.models import Q
 from django.core.exceptions import ObjectDoesNotExist
-from django.views.generic import TemplateView
+from django.core.serializers.json import DjangoJSONEncoder
+from django.views.generic import TemplateView, View
 
 from braces.views import PermissionRequiredMixin
 from datetime import datetime
+import json
 
 from danceschool.core.constants import getConstant, REG_VALIDATION_STR
+from danceschool.core.utils.requests import getIntFromGet
 from danceschool.core.utils.timezone import ensure_localtime
 from danceschool.core.models import Event, Series, PublicEvent
 from danceschool.core.mixins import (
@@ -16,6 +19,7 @@ from danceschool.core.mixins import (
 
 from .forms import CustomerGuestAutocompleteForm
 from .models import Register
+from .snapshot import waitForSnapshot
 
 
 class RegisterView(
@@ -90,3 +94,60 @@ class RegisterView(
         self.set_return_page('registerView', pageName=_('Registration'), **self.kwargs)
 
         return super().get_context_data(**context)
+
+
+class RegisterSnapshotView(PermissionRequiredMixin, View):
+    '''
+    Return the door snapshot (see snapshot.py) of a register for a given date
+    or for today.  If the client passes the version that it already has as
+    "since", then only the changes since that version are returned.  Checking
+    for a new version requires only cache reads, so clients are expected to
+    poll this view at an interval.  Sections are only included if the user
+    has permission to view them.
+
+    Clients may also pass "wait" to hold the request open for up to that many
+    seconds (limited by the DOOR_SNAPSHOT_MAX_WAIT setting, 5 seconds by
+    default) until a new version is available.  A waiting request occupies a
+    worker process or thread for the whole wait, so waiting should only be
+    used where the server runs enough threaded or asynchronous workers for
+    each door device to hold one, in addition to those needed for ordinary
+    requests.
+    '''
+    permission_required = 'core.accept_door_payments'
+
+    section_permissions = {
+        'registrations': 'core.view_registration_summary',
+        'checkins': 'core.checkin_customers',
+        'guests': 'guestlist.view_guestlist',
+    }
+
+    def get(self, request, *args, **kwargs):
+        register = Register.objects.filter(
+            slug=self.kwargs.get('slug'), enabled=True
+        ).first()
+        if not register:
+            raise Http404(_('Invalid register.'))
+
+        if self.kwargs.get('year'):
+            try:
+                date = datetime(
+                    self.kwargs.get('year'), self.kwargs.get('month'),
+                    self.kwargs.get('day')
+                )
+            except (TypeError, ValueError):
+                raise Http404(_('Invalid date.'))
+        else:
+            date = ensure_localtime(datetime.now())
+
+        snapshot = waitForSnapshot(
+            register.id, date.strftime('%Y-%m-%d'),
+            request.GET.get('since') or None, getIntFromGet(request, 'wait'),
+        )
+
+        for section, permission in self.section_permissions.items():
+            if not request.user.has_perm(permission):
+                snapshot.pop(section, None)
+                snapshot.get('removed', {}).pop(section, None)
+
+        data = json.dumps(snapshot, cls=DjangoJSONEncoder)
+        return HttpResponse(data, content_type='application/json')
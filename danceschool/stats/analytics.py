@@ -0,0 +1,75 @@
+'''
+Helpers for computing distributions of per-customer and per-registration
+values.  Each value is computed for each row using a subquery, and rows are
+then grouped by value in the database, so that only one row is returned for
+each distinct value rather than one row for each customer or registration.
+'''
+from django.db.models import Count, Subquery, Min, Sum
+from django.db.models.functions import Coalesce
+
+
+def getValueCounts(queryset, expression):
+    '''
+    Return a sorted list of (value, count) tuples giving the number of rows
+    of the queryset for which the expression takes each value.  The
+    expression must not be an aggregate over the rows of the queryset itself
+    (use a Subquery instead), so that the database can group by it.
+    '''
+    rows = queryset.annotate(value=expression).order_by().values('value').annotate(
+        count=Count('pk')
+    )
+    return sorted(
+        [(x['value'], x['count']) for x in rows],
+        key=lambda x: (x[0] is not None, x[0])
+    )
+
+
+def countSubquery(queryset, field):
+    '''
+    Return a subquery counting the rows of the passed queryset for each value
+    of field, which should be filtered using OuterRef('pk').
+    '''
+    return Coalesce(Subquery(
+        queryset.order_by().values(field).annotate(count=Count('pk')).values('count')
+    ), 0)
+
+
+def sumSubquery(queryset, field, sum_field):
+    return Subquery(
+        queryset.order_by().values(field).annotate(total=Sum(sum_field)).values('total')
+    )
+
+
+def minSubquery(queryset, field, min_field):
+    return Subquery(
+        queryset.order_by().values(field).annotate(first=Min(min_field)).values('first')
+    )
+
+
+def getHistogram(value_counts, bins):
+    '''
+    Given (value, count) tuples, return the total count within each of the
+    passed bins, which are inclusive (min, max) tuples.
+    '''
+    return [
+        sum(count for value, count in value_counts if value is not None and low <= value <= high)
+        for low, high in bins
+    ]
+
+
+def getCumulativeDistribution(value_counts, key='value'):
+    '''
+    Given sorted (value, count) tuples, return a list of dictionaries with
+    the count, cumulative count, and percentages for each value.
+    '''
+    results_list = []
+    cumulative = 0
+    total = sum([x[1] for x in value_counts])
+
+    for value, count in value_counts:
+        cumulative += count
+        results_list.append({
+            key: value, 'count': count, 'cumulative': cumulative,
+            'pct': 100 * (count / total), 'cumulative_pct': 100 * (cumulative / total)
+        })
+    return results_list
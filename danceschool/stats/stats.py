@@ -1,4 +1,7 @@
-from django.db.models import Count, Avg, Sum, IntegerField, Case, When, Q, Min, FloatField, F
+from django.db.models import (
+    Count, Avg, Sum, IntegerField, Case, When, Q, Min, FloatField, F, OuterRef,
+    ExpressionWrapper, DurationField
+)
 from django.db.models.functions import TruncDate
 from django.contrib.admin.views.decorators import staff_member_required
 from django.http import HttpResponse, JsonResponse
@@ -8,16 +11,20 @@ from django.utils import timezone
 from dateutil.relativedelta import relativedelta
 import unicodecsv as csv
 from collections import Counter, OrderedDict
-from bisect import bisect
 from calendar import month_name
-from datetime import datetime
+from datetime import datetime, timedelta
 
 from danceschool.core.models import (
     Customer, Series, EventOccurrence, Registration, EventRegistration,
-    DanceTypeLevel, Location, DanceRole, SeriesTeacher, Instructor
+    DanceTypeLevel, Location, DanceRole, SeriesTeacher, Instructor,
+    ReferralStart
 )
 from danceschool.core.utils.requests import getDateTimeFromGet
 from danceschool.core.utils.timezone import ensure_timezone
+from .analytics import (
+    getValueCounts, countSubquery, sumSubquery, minSubquery, getHistogram,
+    getCumulativeDistribution
+)
 
 
 def getAveragesByClassType(startDate=None, endDate=None):
@@ -212,18 +219,23 @@ def getClassTypeMonthlyData(year=None, series=None, typeLimit=None):
             output_field=FloatField()
         ))
 
-    series_counts = Series.objects.filter(year=year).annotate(**annotations).annotate(
+    # Get one row per series with its month, level, and the requested
+    # statistic, and then build the month-by-type table from these rows in
+    # memory rather than querying for each cell.
+    series_rows = list(Series.objects.filter(year=year).annotate(**annotations).annotate(
         studenthours=F('duration') * F('registrations')
-    ).select_related(
-        'classDescription__danceTypeLevel__danceType', 'classDescription__danceTypeLevel'
+    ).values('month', 'classDescription__danceTypeLevel', series))
+
+    levels = DanceTypeLevel.objects.select_related('danceType').in_bulk(
+        [x['classDescription__danceTypeLevel'] for x in series_rows]
     )
 
     # If no limit specified on number of types, then do not aggregate dance types.
     # Otherwise, report the typeLimit most common types individually, and report all
     # others as other.  This gets tuples of names and counts
     dance_type_counts = [
-        (dance_type, count) for dance_type, count in
-        Counter([x.classDescription.danceTypeLevel for x in series_counts]).items()
+        (level_id, count) for level_id, count in
+        Counter([x['classDescription__danceTypeLevel'] for x in series_rows]).items()
     ]
     dance_type_counts.sort(key=lambda k: k[1], reverse=True)
 
@@ -232,48 +244,36 @@ def getClassTypeMonthlyData(year=None, series=None, typeLimit=None):
     else:
         dance_types = [x[0] for x in dance_type_counts]
 
+    # Sum the statistic by month and level.  As with a database aggregate,
+    # the sum is None if there are no non-null values.
+    def add(total, value):
+        if value is None:
+            return total
+        return (total or 0) + value
+
+    cells = {}
+    for row in series_rows:
+        level_id = row['classDescription__danceTypeLevel']
+        key = level_id if level_id in dance_types else 'Other'
+        for month in [row['month'], 'Totals']:
+            cells[(month, key)] = add(cells.get((month, key)), row[series])
+
     results = []
 
-    # Month by month, calculate the result data
-    for month in range(1, 13):
+    # Month by month, report the result data, followed by the totals.
+    for month in list(range(1, 13)) + ['Totals']:
         this_month_result = {
             'month': month,
-            'month_name': month_name[month],
+            'month_name': month_name[month] if month != 'Totals' else 'totals',
         }
-        for dance_type in dance_types:
-            this_month_result[dance_type.__str__()] = \
-                series_counts.filter(
-                    classDescription__danceTypeLevel=dance_type, month=month
-                ).aggregate(Sum(series))['%s__sum' % series]
+        for level_id in dance_types:
+            this_month_result[str(levels.get(level_id))] = cells.get((month, level_id))
 
         if typeLimit:
-            this_month_result['Other'] = \
-                series_counts.filter(month=month).exclude(
-                    classDescription__danceTypeLevel__in=dance_types
-                ).aggregate(Sum(series))['%s__sum' % series]
+            this_month_result['Other'] = cells.get((month, 'Other'))
 
         results.append(this_month_result)
 
-    # Now get totals
-    totals_result = {
-        'month': 'Totals',
-        'month_name': 'totals',
-    }
-
-    for dance_type in dance_types:
-        totals_result[dance_type.__str__()] = \
-            series_counts.filter(classDescription__danceTypeLevel=dance_type).aggregate(
-                Sum(series)
-            )['%s__sum' % series]
-
-    if typeLimit:
-        totals_result['Other'] = \
-            series_counts.exclude(classDescription__danceTypeLevel__in=dance_types).aggregate(
-                Sum(series)
-            )['%s__sum' % series]
-
-    results.append(totals_result)
-
     return results
 
 
@@ -311,65 +311,54 @@ def getClassCountHistogramData(cohortStart=None, cohortEnd=None):
         (16, 20),
         (21, 99999)]
 
-    when_all = {
-        'eventregistration__dropIn': False,
-        'eventregistration__cancelled': False,
-        'eventregistration__registration__final': True,
-    }
-
-    cohortFilters = {}
     roleFilters = {}
+    customers = Customer.objects.all()
 
+    if cohortStart or cohortEnd:
+        customers = customers.annotate(firstStartTime=minSubquery(
+            EventRegistration.objects.filter(customer=OuterRef('pk')),
+            'customer', 'event__startTime'
+        ))
     if cohortStart:
-        cohortFilters['eventregistration__event__startTime__min__gte'] = cohortStart
+        customers = customers.filter(firstStartTime__gte=cohortStart)
         roleFilters['eventregistration__event__startTime__gte'] = cohortStart
-
     if cohortEnd:
-        cohortFilters['eventregistration__event__startTime__min__lte'] = cohortEnd
+        customers = customers.filter(firstStartTime__lte=cohortEnd)
         roleFilters['eventregistration__event__startTime__lte'] = cohortEnd
 
     role_list = DanceRole.objects.filter(**roleFilters).distinct()
 
-    annotations = {
-        'eventregistration__event__startTime__min': Min('eventregistration__event__startTime'),
-        'registrations': Sum(Case(When(Q(**when_all), then=1), default=0, output_field=IntegerField())),
+    # Count each customer's registrations by role in the database, and then
+    # count the number of customers with each number of classes.
+    registration_counts = EventRegistration.objects.filter(
+        dropIn=False, cancelled=False, registration__final=True,
+        customer__in=customers.values('pk'),
+    ).order_by().values_list('customer', 'role').annotate(count=Count('pk'))
+
+    customerCounts = Counter()
+    customerRoleCounts = {this_role.id: Counter() for this_role in role_list}
+    for customer, role, count in registration_counts:
+        customerCounts[customer] += count
+        if role in customerRoleCounts:
+            customerRoleCounts[role][customer] += count
+
+    countsAll = list(Counter(customerCounts.values()).items())
+    countsByRole = {
+        this_role.pluralName: list(Counter(customerRoleCounts[this_role.id].values()).items())
+        for this_role in role_list
     }
-    for this_role in role_list:
-        annotations[this_role.pluralName] = Sum(Case(
-            When(
-                Q(Q(**when_all) & Q(eventregistration__role=this_role)),
-                then=1
-            ),
-            default=0,
-            output_field=IntegerField()
-        ))
-
-    customers = Customer.objects.annotate(**annotations).filter(**cohortFilters).distinct()
 
-    totalCustomers = customers.filter(registrations__gt=0).count()
-    totalClasses = [x.registrations for x in customers if x.registrations]
-    totalClasses.sort()
+    totalCustomers = sum([x[1] for x in countsAll if x[0]])
+    totalsByRole = {
+        k: sum([x[1] for x in v if x[0]]) for k, v in countsByRole.items()
+    }
 
-    totalsByRole = {}
-
-    for this_role in role_list:
-        totalsByRole[this_role.pluralName] = {
-            'customers': customers.filter(**{this_role.pluralName + '__gt': 0}).count(),
-            'classes': [
-                getattr(x, this_role.pluralName, None) for x in customers if
-                getattr(x, this_role.pluralName, None)
-            ],
-        }
-        totalsByRole[this_role.pluralName]['classes'].sort()
+    histogramAll = getHistogram(countsAll, bins)
+    histogramByRole = {k: getHistogram(v, bins) for k, v in countsByRole.items()}
 
     results = {}
-    lastAll = 0
-    lastByRole = {this_role.pluralName: 0 for this_role in role_list}
-    iByRole = {}
-
-    for this_bin in bins:
-        range_max = this_bin[1]
 
+    for i, this_bin in enumerate(bins):
         if this_bin[0] == this_bin[1]:
             this_label = '%s' % this_bin[0]
         elif this_bin[1] == 99999:
@@ -377,38 +366,24 @@ def getClassCountHistogramData(cohortStart=None, cohortEnd=None):
         else:
             this_label = '%s-%s' % this_bin
 
-        i_all = bisect(totalClasses, range_max, lastAll)
-        iByRole = {
-            this_role.pluralName: bisect(
-                totalsByRole[this_role.pluralName]['classes'],
-                range_max, lastByRole[this_role.pluralName]
-            )
-            for this_role in role_list
-        }
-
         # Note: These are not translated because the chart Javascript looks for these keys
         results.update({
             this_label:
             {
-                str(_('# Students')): (i_all - lastAll),
-                str(_('Percentage')): 100 * (i_all - lastAll) / (float(totalCustomers) or 1),
+                str(_('# Students')): histogramAll[i],
+                str(_('Percentage')): 100 * histogramAll[i] / (float(totalCustomers) or 1),
                 'bin': this_bin,
             },
         })
         for this_role in role_list:
             results[this_label].update({
-                '# ' + this_role.pluralName: (
-                    iByRole[this_role.pluralName] - lastByRole[this_role.pluralName]
-                ),
+                '# ' + this_role.pluralName: histogramByRole[this_role.pluralName][i],
                 'Percentage ' + this_role.pluralName: 100 * (
-                    iByRole[this_role.pluralName] - lastByRole[this_role.pluralName]
+                    histogramByRole[this_role.pluralName][i]
                 ) /
-                (float(totalsByRole[this_role.pluralName]['customers']) or 1),
+                (float(totalsByRole[this_role.pluralName]) or 1),
             })
 
-        lastAll = i_all
-        lastByRole = {this_role.pluralName: iByRole[this_role.pluralName] for this_role in role_list}
-
     return results
 
 
@@ -753,26 +728,54 @@ def RegistrationTypeAveragesJSON(request):
 def getRegistrationReferralCounts(startDate, endDate):
     '''
     When a user accesses the class registration page through a
-    referral URL, the marketing_id gets saved in the extra JSON
-    data associated with that registration.  This just returns
-    counts associated with how often given referral terms appear
-    in a specified time window (i.e. how many people signed up
-    by clicking through a referral button).
+    referral URL, the marketing_id gets saved as the marketingId of
+    that registration.  This just returns counts associated with how
+    often given referral terms appear in a specified time window (i.e.
+    how many people signed up by clicking through a referral button),
+    along with the revenue from those registrations.  Registrations that
+    are never completed are deleted along with their expired invoices, so
+    the number of registrations started with each code, and the percentage
+    of those that were completed, are taken from the daily counts that are
+    recorded when each registration begins.
     '''
 
     timeFilters = {'final': True}
+    startFilters = {}
     if startDate:
         timeFilters['dateTime__gte'] = startDate
+        startFilters['date__gte'] = timezone.localtime(startDate).date()
     if endDate:
         timeFilters['dateTime__lt'] = endDate
-
-    regs = Registration.objects.filter(**timeFilters)
-    counter = Counter(
-        [x.data.get('marketing_id', None) for x in regs if isinstance(x.data, dict)] +
-        [None for x in regs if not isinstance(x.data, dict)]
+        # Starts are counted by day, and the end of the window is exclusive.
+        startFilters['date__lte'] = timezone.localtime(
+            endDate - timedelta(microseconds=1)
+        ).date()
+
+    codes = Registration.objects.filter(**timeFilters).order_by().values(
+        'marketingId'
+    ).annotate(
+        count=Count('pk'),
+        revenue=Sum('invoice__total'),
+    )
+    started = dict(
+        ReferralStart.objects.filter(**startFilters).order_by().values(
+            'marketingId'
+        ).annotate(started=Sum('started')).values_list('marketingId', 'started')
     )
 
-    results = [{'code': k or _('None'), 'count': v} for k, v in counter.items()]
+    counts = {x['marketingId']: x for x in codes}
+    for code in started:
+        counts.setdefault(code, {'count': 0, 'revenue': 0})
+
+    results = []
+    for code, x in sorted(counts.items(), key=lambda y: (-y[1]['count'], y[0] or '')):
+        this_started = started.get(code) if code else None
+        results.append({
+            'code': code or _('None'), 'count': x['count'],
+            'started': this_started,
+            'conversion': 100 * x['count'] / this_started if this_started else None,
+            'revenue': x['revenue'] or 0,
+        })
     return results
 
 
@@ -784,98 +787,67 @@ def RegistrationReferralCountsJSON(request):
     return JsonResponse(results, safe=False)
 
 
-@staff_member_required
-def MultiRegistrationJSON(request):
-    startDate = getDateTimeFromGet(request, 'startDate')
-    endDate = getDateTimeFromGet(request, 'endDate')
-
+def getRegistrationTimeFilters(startDate=None, endDate=None):
     timeFilters = {'final': True}
 
     if startDate:
         timeFilters['dateTime__gte'] = startDate
     if endDate:
         timeFilters['dateTime__lte'] = endDate
+    return timeFilters
 
-    er_counter_sorted = sorted(Counter(
-        Registration.objects.filter(**timeFilters).annotate(
-            er_count=Count('eventregistration')).values_list('er_count', flat=True)
-    ).items())
 
-    results_list = []
-    cumulative = 0
-    total = sum([x[1] for x in er_counter_sorted])
+def getMultiRegistrationData(startDate=None, endDate=None):
+    return getCumulativeDistribution(getValueCounts(
+        Registration.objects.filter(**getRegistrationTimeFilters(startDate, endDate)),
+        countSubquery(
+            EventRegistration.objects.filter(registration=OuterRef('pk')),
+            'registration'
+        )
+    ), key='items')
 
-    for x in er_counter_sorted:
-        cumulative += x[1]
-        results_list.append({
-            'items': x[0], 'count': x[1], 'cumulative': cumulative,
-            'pct': 100 * (x[1] / total), 'cumulative_pct': 100 * (cumulative / total)
-        })
-    return JsonResponse(results_list, safe=False)
 
+def getRegistrationHoursData(startDate=None, endDate=None):
+    return getCumulativeDistribution(getValueCounts(
+        Registration.objects.filter(**getRegistrationTimeFilters(startDate, endDate)),
+        sumSubquery(
+            EventRegistration.objects.filter(registration=OuterRef('pk')),
+            'registration', 'event__duration'
+        )
+    ), key='hours')
 
-@staff_member_required
-def RegistrationHoursJSON(request):
-    startDate = getDateTimeFromGet(request, 'startDate')
-    endDate = getDateTimeFromGet(request, 'endDate')
 
-    timeFilters = {'final': True}
+def getAdvanceRegistrationDaysData(startDate=None, endDate=None):
+    return getCumulativeDistribution(getValueCounts(
+        Registration.objects.filter(**getRegistrationTimeFilters(startDate, endDate)),
+        ExpressionWrapper(
+            TruncDate('dateTime') - TruncDate(minSubquery(
+                EventRegistration.objects.filter(registration=OuterRef('pk')),
+                'registration', 'event__startTime'
+            )), output_field=DurationField()
+        )
+    ), key='days')
 
-    if startDate:
-        timeFilters['dateTime__gte'] = startDate
-    if endDate:
-        timeFilters['dateTime__lte'] = endDate
 
-    hours_counter_sorted = sorted(Counter(
-        Registration.objects.filter(**timeFilters).annotate(
-            er_sum=Sum('eventregistration__event__duration')).values_list('er_sum', flat=True)
-    ).items())
+@staff_member_required
+def MultiRegistrationJSON(request):
+    startDate = getDateTimeFromGet(request, 'startDate')
+    endDate = getDateTimeFromGet(request, 'endDate')
+    return JsonResponse(getMultiRegistrationData(startDate, endDate), safe=False)
 
-    results_list = []
-    cumulative = 0
-    total = sum([x[1] for x in hours_counter_sorted])
 
-    for x in hours_counter_sorted:
-        cumulative += x[1]
-        results_list.append({
-            'hours': x[0], 'count': x[1], 'cumulative': cumulative,
-            'pct': 100 * (x[1] / total), 'cumulative_pct': 100 * (cumulative / total)
-        })
-    return JsonResponse(results_list, safe=False)
+@staff_member_required
+def RegistrationHoursJSON(request):
+    startDate = getDateTimeFromGet(request, 'startDate')
+    endDate = getDateTimeFromGet(request, 'endDate')
+    return JsonResponse(getRegistrationHoursData(startDate, endDate), safe=False)
 
 
 @staff_member_required
 def AdvanceRegistrationDaysJSON(request):
     startDate = getDateTimeFromGet(request, 'startDate')
     endDate = getDateTimeFromGet(request, 'endDate')
-
-    timeFilters = {'final': True}
-
-    if startDate:
-        timeFilters['dateTime__gte'] = startDate
-    if endDate:
-        timeFilters['dateTime__lte'] = endDate
-
-    advance_days_sorted = sorted(Counter(
-        Registration.objects.filter(**timeFilters).annotate(
-            min_start=Min('eventregistration__event__startTime')
-        ).annotate(
-            advance=(TruncDate('dateTime') - TruncDate('min_start'))
-        ).values_list(
-            'advance', flat=True)
-    ).items())
-
-    results_list = []
-    cumulative = 0
-    total = sum([x[1] for x in advance_days_sorted])
-
-    for x in advance_days_sorted:
-        cumulative += x[1]
-        results_list.append({
-            'days': x[0], 'count': x[1], 'cumulative': cumulative,
-            'pct': 100 * (x[1] / total), 'cumulative_pct': 100 * (cumulative / total)
-        })
-    return JsonResponse(results_list, safe=False)
+    return JsonResponse(getAdvanceRegistrationDaysData(startDate, endDate), safe=False)
 
 
 @staff_member_required
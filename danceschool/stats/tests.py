@@ -1,3 +1,465 @@
-from django.test import TestCase
+from django.db import connection
+from django.db.models import (
+    Sum, Case, When, Q, FloatField, F, Count, Min, IntegerField, ExpressionWrapper,
+    DurationField
+)
+from django.db.models.functions import TruncDate
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
 
-# Create your tests here.
+from bisect import bisect
+from calendar import month_name
+from collections import Counter
+from datetime import datetime, timedelta
+import os
+import time
+import unittest
+
+from danceschool.core.models import (
+    Series, DanceRole, Customer, Registration, Invoice, ReferralStart
+)
+from danceschool.core.utils.tests import DefaultSchoolTestCase
+from .stats import (
+    getClassTypeMonthlyData, getClassCountHistogramData,
+    getMultiRegistrationData, getRegistrationHoursData,
+    getAdvanceRegistrationDaysData, getRegistrationReferralCounts
+)
+
+
+def legacyClassTypeMonthlyData(year=None, series=None, typeLimit=None):
+    '''
+    The previous implementation of getClassTypeMonthlyData(), which runs
+    separate aggregate queries for each cell of the table.  It is kept here
+    as a reference for the output of the current implementation.
+    '''
+    if not year:
+        year = timezone.now().year
+
+    role_list = DanceRole.objects.distinct()
+
+    if (
+        series not in ['registrations', 'studenthours'] and
+        series not in [x.pluralName for x in role_list]
+    ):
+        series = 'registrations'
+
+    when_all = {
+        'eventregistration__dropIn': False,
+        'eventregistration__cancelled': False,
+        'eventregistration__registration__final': True,
+    }
+
+    annotations = {'registrations': Sum(Case(When(Q(**when_all), then=1), output_field=FloatField()))}
+
+    for this_role in role_list:
+        annotations[this_role.pluralName] = Sum(Case(
+            When(
+                Q(Q(**when_all) & Q(eventregistration__role=this_role)),
+                then=1
+            ),
+            output_field=FloatField()
+        ))
+
+    series_counts = Series.objects.filter(year=year).annotate(**annotations).annotate(
+        studenthours=F('duration') * F('registrations')
+    ).select_related(
+        'classDescription__danceTypeLevel__danceType', 'classDescription__danceTypeLevel'
+    )
+
+    dance_type_counts = [
+        (dance_type, count) for dance_type, count in
+        Counter([x.classDescription.danceTypeLevel for x in series_counts]).items()
+    ]
+    dance_type_counts.sort(key=lambda k: k[1], reverse=True)
+
+    if typeLimit:
+        dance_types = [x[0] for x in dance_type_counts[:typeLimit]]
+    else:
+        dance_types = [x[0] for x in dance_type_counts]
+
+    results = []
+
+    for month in range(1, 13):
+        this_month_result = {
+            'month': month,
+            'month_name': month_name[month],
+        }
+        for dance_type in dance_types:
+            this_month_result[dance_type.__str__()] = \
+                series_counts.filter(
+                    classDescription__danceTypeLevel=dance_type, month=month
+                ).aggregate(Sum(series))['%s__sum' % series]
+
+        if typeLimit:
+            this_month_result['Other'] = \
+                series_counts.filter(month=month).exclude(
+                    classDescription__danceTypeLevel__in=dance_types
+                ).aggregate(Sum(series))['%s__sum' % series]
+
+        results.append(this_month_result)
+
+    totals_result = {
+        'month': 'Totals',
+        'month_name': 'totals',
+    }
+
+    for dance_type in dance_types:
+        totals_result[dance_type.__str__()] = \
+            series_counts.filter(classDescription__danceTypeLevel=dance_type).aggregate(
+                Sum(series)
+            )['%s__sum' % series]
+
+    if typeLimit:
+        totals_result['Other'] = \
+            series_counts.exclude(classDescription__danceTypeLevel__in=dance_types).aggregate(
+                Sum(series)
+            )['%s__sum' % series]
+
+    results.append(totals_result)
+
+    return results
+
+
+def legacyClassCountHistogramData(cohortStart=None, cohortEnd=None):
+    '''
+    The previous implementation of getClassCountHistogramData(), which loads
+    every customer with their registration counts and bins them in Python.
+    '''
+    bins = [
+        (1, 1), (2, 2), (3, 3), (4, 4), (5, 5), (6, 6), (7, 7), (8, 8), (9, 9),
+        (10, 15), (16, 20), (21, 99999)
+    ]
+
+    when_all = {
+        'eventregistration__dropIn': False,
+        'eventregistration__cancelled': False,
+        'eventregistration__registration__final': True,
+    }
+
+    cohortFilters = {}
+    roleFilters = {}
+
+    if cohortStart:
+        cohortFilters['eventregistration__event__startTime__min__gte'] = cohortStart
+        roleFilters['eventregistration__event__startTime__gte'] = cohortStart
+
+    if cohortEnd:
+        cohortFilters['eventregistration__event__startTime__min__lte'] = cohortEnd
+        roleFilters['eventregistration__event__startTime__lte'] = cohortEnd
+
+    role_list = DanceRole.objects.filter(**roleFilters).distinct()
+
+    annotations = {
+        'eventregistration__event__startTime__min': Min('eventregistration__event__startTime'),
+        'registrations': Sum(Case(When(Q(**when_all), then=1), default=0, output_field=IntegerField())),
+    }
+    for this_role in role_list:
+        annotations[this_role.pluralName] = Sum(Case(
+            When(
+                Q(Q(**when_all) & Q(eventregistration__role=this_role)),
+                then=1
+            ),
+            default=0,
+            output_field=IntegerField()
+        ))
+
+    customers = Customer.objects.annotate(**annotations).filter(**cohortFilters).distinct()
+
+    totalCustomers = customers.filter(registrations__gt=0).count()
+    totalClasses = [x.registrations for x in customers if x.registrations]
+    totalClasses.sort()
+
+    totalsByRole = {}
+
+    for this_role in role_list:
+        totalsByRole[this_role.pluralName] = {
+            'customers': customers.filter(**{this_role.pluralName + '__gt': 0}).count(),
+            'classes': [
+                getattr(x, this_role.pluralName, None) for x in customers if
+                getattr(x, this_role.pluralName, None)
+            ],
+        }
+        totalsByRole[this_role.pluralName]['classes'].sort()
+
+    results = {}
+    lastAll = 0
+    lastByRole = {this_role.pluralName: 0 for this_role in role_list}
+    iByRole = {}
+
+    for this_bin in bins:
+        range_max = this_bin[1]
+
+        if this_bin[0] == this_bin[1]:
+            this_label = '%s' % this_bin[0]
+        elif this_bin[1] == 99999:
+            this_label = str(_('%s or more' % this_bin[0]))
+        else:
+            this_label = '%s-%s' % this_bin
+
+        i_all = bisect(totalClasses, range_max, lastAll)
+        iByRole = {
+            this_role.pluralName: bisect(
+                totalsByRole[this_role.pluralName]['classes'],
+                range_max, lastByRole[this_role.pluralName]
+            )
+            for this_role in role_list
+        }
+
+        results.update({
+            this_label:
+            {
+                str(_('# Students')): (i_all - lastAll),
+                str(_('Percentage')): 100 * (i_all - lastAll) / (float(totalCustomers) or 1),
+                'bin': this_bin,
+            },
+        })
+        for this_role in role_list:
+            results[this_label].update({
+                '# ' + this_role.pluralName: (
+                    iByRole[this_role.pluralName] - lastByRole[this_role.pluralName]
+                ),
+                'Percentage ' + this_role.pluralName: 100 * (
+                    iByRole[this_role.pluralName] - lastByRole[this_role.pluralName]
+                ) /
+                (float(totalsByRole[this_role.pluralName]['customers']) or 1),
+            })
+        lastAll = i_all
+        lastByRole = {
+            this_role.pluralName: iByRole[this_role.pluralName]
+            for this_role in role_list
+        }
+
+    return results
+
+
+def legacyRegistrationDistribution(key, annotations, value):
+    '''
+    The previous implementation of the registration distribution views,
+    which load one value for each registration and count them in Python.
+    '''
+    counter_sorted = sorted(Counter(
+        Registration.objects.filter(final=True).annotate(**annotations).values_list(
+            value, flat=True
+        )
+    ).items())
+
+    results_list = []
+    cumulative = 0
+    total = sum([x[1] for x in counter_sorted])
+
+    for x in counter_sorted:
+        cumulative += x[1]
+        results_list.append({
+            key: x[0], 'count': x[1], 'cumulative': cumulative,
+            'pct': 100 * (x[1] / total), 'cumulative_pct': 100 * (cumulative / total)
+        })
+    return results_list
+
+
+def legacyMultiRegistrationData():
+    return legacyRegistrationDistribution(
+        'items', {'er_count': Count('eventregistration')}, 'er_count'
+    )
+
+
+def legacyRegistrationHoursData():
+    return legacyRegistrationDistribution(
+        'hours', {'er_sum': Sum('eventregistration__event__duration')}, 'er_sum'
+    )
+
+
+def legacyAdvanceRegistrationDaysData():
+    # The output field is given explicitly, because the difference of two
+    # dates is otherwise treated as a date, which fails on SQLite.
+    return legacyRegistrationDistribution(
+        'days', {'advance': ExpressionWrapper(
+            TruncDate('dateTime') - TruncDate(Min('eventregistration__event__startTime')),
+            output_field=DurationField()
+        )}, 'advance'
+    )
+
+
+class ClassTypeMonthlyDataTest(DefaultSchoolTestCase):
+
+    def create_year(self, year, perMonth=1, registrations=1):
+        lead = DanceRole.objects.get(name='Lead')
+        follow = DanceRole.objects.get(name='Follow')
+        for month in range(1, 13):
+            for i in range(perMonth):
+                for description in [
+                    self.levelOneClassDescription, self.levelTwoClassDescription
+                ]:
+                    # Leave some months without Level 2 classes.
+                    if description == self.levelTwoClassDescription and month % 3 == 0:
+                        continue
+                    s = self.create_series(
+                        startTime=timezone.make_aware(datetime(year, month, 10, 19)),
+                        classDescription=description, occurrences=2,
+                    )
+                    for j in range(registrations * (month % 4)):
+                        self.create_registration(
+                            events=[s, ], role=lead if j % 2 else follow
+                        )
+
+    def test_same_output(self):
+        self.create_year(2019)
+
+        for kwargs in [
+            {}, {'series': 'studenthours'}, {'series': 'Leads'}, {'typeLimit': 1},
+            {'series': 'Follows', 'typeLimit': 1}, {'typeLimit': 5},
+        ]:
+            kwargs['year'] = 2019
+            self.assertEqual(
+                getClassTypeMonthlyData(**kwargs), legacyClassTypeMonthlyData(**kwargs)
+            )
+
+        self.assertEqual(
+            getClassTypeMonthlyData(year=2018), legacyClassTypeMonthlyData(year=2018)
+        )
+
+    @unittest.skipUnless(
+        os.environ.get('DANCESCHOOL_BENCHMARK'),
+        'Set DANCESCHOOL_BENCHMARK to run stats benchmarks.'
+    )
+    def test_benchmark(self):
+        for year in [2017, 2018, 2019]:
+            self.create_year(year, perMonth=3, registrations=2)
+
+        print('\nClass type monthly data for 3 years of series:')
+        for name, func in [
+            ('legacy', legacyClassTypeMonthlyData),
+            ('current', getClassTypeMonthlyData),
+        ]:
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                for year in [2017, 2018, 2019]:
+                    func(year=year, typeLimit=1)
+                elapsed = time.perf_counter() - start
+            print('%s: %.3fs, %s queries' % (name, elapsed, len(queries)))
+
+
+class ReferralCountsTest(DefaultSchoolTestCase):
+
+    def test_referral_counts(self):
+        s = self.create_series()
+        for code, final, total in [
+            ('facebook', True, 50), ('facebook', True, 30), ('facebook', False, 40),
+            ('newsletter', False, 20), (None, True, 10),
+        ]:
+            reg = self.create_registration(events=[s, ], final=final)
+            Registration.objects.filter(id=reg.id).update(marketingId=code)
+            Invoice.objects.filter(id=reg.invoice.id).update(total=total)
+            if code:
+                ReferralStart.objects.record(code)
+
+        # Registrations that are not completed are deleted with their
+        # expired invoices, but the number started is still known.
+        Registration.objects.filter(final=False).delete()
+
+        with self.assertNumQueries(2):
+            results = getRegistrationReferralCounts(None, None)
+
+        self.assertEqual([str(x['code']) for x in results], ['facebook', 'None', 'newsletter'])
+        self.assertEqual(results[0]['count'], 2)
+        self.assertEqual(results[0]['started'], 3)
+        self.assertAlmostEqual(results[0]['conversion'], 200 / 3)
+        self.assertEqual(results[0]['revenue'], 80)
+        self.assertEqual(results[1]['count'], 1)
+        self.assertEqual(results[1]['revenue'], 10)
+        self.assertIsNone(results[1]['started'])
+        self.assertEqual(results[2]['count'], 0)
+        self.assertEqual(results[2]['started'], 1)
+        self.assertEqual(results[2]['conversion'], 0)
+
+        # Registrations outside the time window are not counted.
+        self.assertEqual(
+            getRegistrationReferralCounts(timezone.now() + timedelta(days=1), None), []
+        )
+
+    def test_referral_starts_recorded(self):
+        for code in ['facebook', 'facebook', None]:
+            Registration.objects.create(dateTime=timezone.now(), marketingId=code)
+        self.assertEqual(
+            list(ReferralStart.objects.values_list('marketingId', 'date', 'started')),
+            [('facebook', timezone.localdate(), 2)]
+        )
+
+
+class RegistrationDistributionTest(DefaultSchoolTestCase):
+
+    def create_customers(self, n=20):
+        lead = DanceRole.objects.get(name='Lead')
+        follow = DanceRole.objects.get(name='Follow')
+        start = timezone.now() - timedelta(days=400)
+        series = [
+            self.create_series(
+                startTime=start + timedelta(days=30 * i),
+                classDescription=(
+                    self.levelOneClassDescription if i % 2 else
+                    self.levelTwoClassDescription
+                ),
+                occurrences=1 + (i % 3),
+            ) for i in range(12)
+        ]
+        for i in range(n):
+            customer = Customer.objects.create(
+                first_name='Customer', last_name=str(i),
+                email='customer%s@example.com' % i
+            )
+            # Customers take between 0 and 11 classes, sometimes more than one
+            # per registration, and a few registrations are not final.
+            j = 0
+            while j < i % 12:
+                events = series[j:j + 1 + (i % 2)]
+                self.create_registration(
+                    events=events, customer=customer,
+                    role=lead if i % 3 else follow, final=bool(i % 7),
+                    dateTime=events[0].startTime - timedelta(days=i % 5),
+                )
+                j += len(events)
+        return series
+
+    def test_class_count_histogram(self):
+        series = self.create_customers()
+        self.assertEqual(getClassCountHistogramData(), legacyClassCountHistogramData())
+
+        cohortStart = series[3].startTime
+        cohortEnd = series[8].startTime
+        for kwargs in [
+            {'cohortStart': cohortStart}, {'cohortEnd': cohortEnd},
+            {'cohortStart': cohortStart, 'cohortEnd': cohortEnd},
+        ]:
+            self.assertEqual(
+                getClassCountHistogramData(**kwargs), legacyClassCountHistogramData(**kwargs)
+            )
+
+    def test_registration_distributions(self):
+        self.create_customers()
+        self.assertEqual(getMultiRegistrationData(), legacyMultiRegistrationData())
+        self.assertEqual(getRegistrationHoursData(), legacyRegistrationHoursData())
+        self.assertEqual(
+            getAdvanceRegistrationDaysData(), legacyAdvanceRegistrationDaysData()
+        )
+
+    @unittest.skipUnless(
+        os.environ.get('DANCESCHOOL_BENCHMARK'),
+        'Set DANCESCHOOL_BENCHMARK to run stats benchmarks.'
+    )
+    def test_benchmark(self):
+        self.create_customers(n=int(os.environ.get('DANCESCHOOL_BENCHMARK_SIZE', 500)))
+
+        print('\nRegistration distributions:')
+        for name, func in [
+            ('legacy histogram', legacyClassCountHistogramData),
+            ('current histogram', getClassCountHistogramData),
+            ('legacy multi-registration', legacyMultiRegistrationData),
+            ('current multi-registration', getMultiRegistrationData),
+            ('legacy advance days', legacyAdvanceRegistrationDaysData),
+            ('current advance days', getAdvanceRegistrationDaysData),
+        ]:
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                func()
+                elapsed = time.perf_counter() - start
+            print('%s: %.3fs, %s queries' % (name, elapsed, len(queries)))
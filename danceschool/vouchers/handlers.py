@@ -14,6 +14,7 @@ from danceschool.core.models import (
     Customer, EventRegistration, Event, Registration
 )
 from danceschool.core.constants import getConstant, REG_VALIDATION_STR
+from danceschool.core.dispatch import writing_receiver
 
 import logging
 
@@ -291,6 +292,7 @@ def applyVoucherCodesFinal(sender, **kwargs):
 
 
 @receiver(get_customer_data)
+@writing_receiver
 def provideCustomerReferralCode(sender, **kwargs):
     '''
     If the vouchers app is installed and referrals are enabled,